@@ -1,4 +1,6 @@
+var fs = require('fs');
 var path = require('path');
+var crypto = require('crypto');
 var sql = require('sqlite3');
 
 // Database and logged in rater
@@ -8,6 +10,12 @@ global.dbFile = null;
 global.imgBase = null;
 global.raterId = 0;
 
+// URL of tools/scoring-service.py given by the --server option of the app,
+// in which case the database and screenshots are accessed via this service,
+// and the access token of the service given by the --token option
+global.server = null;
+global.serverToken = '';
+
 // Evaluation Scores table entries
 global.evalScores = [];
 
@@ -31,6 +39,29 @@ global.compScreenshotId = {};
 global.evalROIScreenshotId = {};
 global.compROIScreenshotId = {};
 
+// Position of current screenshot in the RaterQueue of the active task, used
+// to advance the RaterQueueCursor when the score is saved, zero when the
+// current screenshot was not taken from the queue (e.g., after undo)
+global.evalQueueId = {};
+global.compQueueId = {};
+// Queued row of current screenshot of each task, which is shown without
+// querying the screenshot again when it was taken from the look-ahead buffer
+global.evalQueuedRow = {};
+global.compQueuedRow = {};
+
+// Look-ahead buffer of the next screenshots in the RaterQueue of each task,
+// whose images are loaded and decoded while the current screenshot is rated
+global.evalPrefetch = {};
+global.compPrefetch = {};
+global.prefetchSize = 4;
+
+// Scores and choices of the rater which were saved in the journal file, but
+// not yet written to the database. Pending entries are written in a single
+// transaction when the batch size is reached or the delay (ms) has passed.
+global.journal = { file: null, entries: [], flushing: [], callbacks: [], timer: null };
+global.journalBatchSize = 20;
+global.journalDelay = 5000;
+
 // When the comparison set contains just screenshots where only two colors
 // are used for the two overlaid surface contours, these two colors are used
 // for the two buttons of the respective choice. The buttons then never change
@@ -39,6 +70,11 @@ global.compROIScreenshotId = {};
 // the color of the respective contour, instead.
 global.compColors = [];
 
+// Total and remaining number of screenshots of each task shown in the summary,
+// and whether the task metadata of the logged in rater is still being loaded
+global.progress = {};
+global.loading = false;
+
 
 // ----------------------------------------------------------------------------
 // Common auxiliary functions
@@ -95,6 +131,47 @@ function escapeHtml(string) {
   });
 }
 
+// Call functions which take a callback argument concurrently, and the
+// given callback once all of these called theirs, or with the error passed
+// to the first callback which failed, in which case later ones are ignored
+function whenAllDone(functions, callback) {
+  var pending = functions.length;
+  if (pending == 0) {
+    callback(null);
+    return;
+  }
+  for (var i = 0; i < functions.length; i++) {
+    functions[i](function (err) {
+      if (pending == 0) return;
+      if (err) {
+        pending = 0;
+        callback(err);
+      } else {
+        pending -= 1;
+        if (pending == 0) callback(null);
+      }
+    });
+  }
+}
+
+// Split list of values concatenated by SQL group_concat
+function splitGroupConcat(values, parse) {
+  var list = [];
+  if (values !== null && values !== undefined && values !== '') {
+    var parts = String(values).split(',');
+    for (var i = 0; i < parts.length; i++) {
+      list.push(parse ? parse(parts[i]) : parts[i]);
+    }
+  }
+  return list;
+}
+
+// Hash of database file path or server URL used to name local files of a rater
+function getDatabaseHash() {
+  var name = (global.server ? global.server : path.resolve(global.dbFile));
+  return crypto.createHash('md5').update(name).digest('hex');
+}
+
 function sqlValueInSet(column, cond, values) {
   var code = undefined;
   if (values instanceof Array) {
@@ -182,24 +259,27 @@ function showPage(name) {
   $("html").off('keyup');
   $('#nav-undo').hide();
   $('#container').hide();
-  resetCompPage();
-  global.activeTask = 0;
-  if (name === "help") {
-    changeNavLink(name);
-    changeTemplate(name);
-    updateHelpPage();
-  } else if (name === "open") {
-    changeNavLink(name);
-    changeTemplate(name);
-    updateOpenPage();
-  } else if (name.substr(0, 5) === "eval-") {
-    changeTemplate("eval");
-    initEvalPage(name.split('-')[1]);
-  } else if (name.substr(0, 5) === "comp-") {
-    changeTemplate("comp");
-    initCompPage(name.split('-')[1]);
-  }
-  $('#container').show();
+  // write pending scores such that other pages show the current progress
+  flushScoreJournal(function () {
+    resetCompPage();
+    global.activeTask = 0;
+    if (name === "help") {
+      changeNavLink(name);
+      changeTemplate(name);
+      updateHelpPage();
+    } else if (name === "open") {
+      changeNavLink(name);
+      changeTemplate(name);
+      updateOpenPage();
+    } else if (name.substr(0, 5) === "eval-") {
+      changeTemplate("eval");
+      initEvalPage(name.split('-')[1]);
+    } else if (name.substr(0, 5) === "comp-") {
+      changeTemplate("comp");
+      initCompPage(name.split('-')[1]);
+    }
+    $('#container').show();
+  });
 }
 
 function activePage() {
@@ -232,7 +312,7 @@ function getMailToLink() {
   if (global.contactSubject) {
     href += "?subject=" + global.contactSubject;
   }
-  if (global.dbFile) {
+  if (global.dbFile && !global.server) {
     if (global.contactSubject) {
       href += "&";
     } else {
@@ -249,16 +329,48 @@ function supportsTemplate() {
   return 'content' in document.createElement('template');
 }
 
+// Parse command-line arguments of the app
+if (typeof nw !== 'undefined') {
+  for (var i = 0; i < nw.App.argv.length; i++) {
+    var arg = nw.App.argv[i];
+    if (arg == '--server' && i + 1 < nw.App.argv.length) {
+      global.server = nw.App.argv[++i];
+    } else if (arg.startsWith('--server=')) {
+      global.server = arg.substr(9);
+    } else if (arg == '--token' && i + 1 < nw.App.argv.length) {
+      global.serverToken = nw.App.argv[++i];
+    } else if (arg.startsWith('--token=')) {
+      global.serverToken = arg.substr(8);
+    }
+  }
+  if (global.server) {
+    global.server = global.server.replace(/\/+$/, '');
+  }
+}
+
 if (supportsTemplate()) {
   $(document).ready(function () {
     enableNavLink("help");
     enableNavLink("open");
+    if (global.server) {
+      openDatabase(global.server);
+    }
     showPage("open");
   });
 } else {
   showErrorMessage("template HTML tag not supported");
 }
 
+// Write pending scores before the app window is closed
+if (typeof nw !== 'undefined') {
+  nw.Window.get().on('close', function () {
+    var win = this;
+    flushScoreJournal(function (err) {
+      win.close(true);
+    });
+  });
+}
+
 // ----------------------------------------------------------------------------
 // Open database
 function chooseDatabase(input) {
@@ -271,30 +383,127 @@ function chooseDatabase(input) {
 }
 
 function openDatabase(db_file) {
-  global.raterId = 0;
-  global.dbFile = db_file;
-  global.imgBase = path.dirname(db_file);
-  global.dbPrev = global.db;
-  global.db = new sql.Database(db_file, function (err) {
-    if (err) {
-      showErrorMessage(err);
-    } else {
+  // write pending scores of logged in rater to previous database first,
+  // entries which could not be written are replayed on next log in
+  flushScoreJournal(function () {
+    global.journal = { file: null, entries: [], flushing: [], callbacks: [], timer: null };
+    global.raterId = 0;
+    global.progress = {};
+    global.dbFile = db_file;
+    global.dbPrev = global.db;
+    if (global.server) {
+      global.imgBase = null;
+      global.db = new ScoringService(global.server, global.serverToken);
       if (global.dbPrev) {
         global.dbPrev.close();
         global.dbPrev = null;
       }
       updateOpenPage();
+      return;
+    }
+    global.imgBase = path.dirname(db_file);
+    global.db = new sql.Database(db_file, function (err) {
+      if (err) {
+        showErrorMessage(err);
+      } else {
+        if (global.dbPrev) {
+          global.dbPrev.close();
+          global.dbPrev = null;
+        }
+        updateOpenPage();
+      }
+    });
+  });
+}
+
+// Database accessed via tools/scoring-service.py
+//
+// The service executes named operations of a rater with the given arguments,
+// e.g., to get the next screenshots of a task or to save scores, instead of
+// SQL statements sent by the app. Operations which write to the database are
+// executed by the service in a transaction together with those of other
+// raters, and the callback is called once these are committed. The session
+// token returned when the rater logs in identifies the rater of the requests.
+function ScoringService(url, token) {
+  this.url = url;
+  this.token = token;
+  this.session = null;
+}
+
+ScoringService.prototype.call = function (name, args, callback) {
+  var service = this;
+  var url = this.url + '/api/' + name;
+  var headers = { 'Authorization': 'Bearer ' + this.token };
+  if (this.session) headers['X-Rater-Session'] = this.session;
+  $.ajax({
+    type: 'POST',
+    url: url,
+    contentType: 'application/json',
+    headers: headers,
+    data: JSON.stringify(args),
+    dataType: 'json'
+  }).done(function (result) {
+    if (result.session) service.session = result.session;
+    if (result.error) {
+      callback(new Error(result.error), result);
+    } else {
+      callback(null, result);
     }
+  }).fail(function (xhr, status, error) {
+    var result = xhr.responseJSON || {};
+    callback(new Error(result.error || "Request to " + url + " failed: " + (error || status)), result);
   });
+};
+
+ScoringService.prototype.close = function (callback) {
+  if (callback) callback(null);
+};
+
+// Query a single row either by the named operation of the scoring service
+// with the given arguments, or by the given query of the database file
+function dbGet(name, args, query, params, callback) {
+  if (global.server) {
+    global.db.call(name, args, function (err, result) {
+      callback(err, err ? undefined : result.row || undefined);
+    });
+  } else {
+    global.db.get(query, params, callback);
+  }
+}
+
+// Query rows either by the named operation of the scoring service with the
+// given arguments, or by the given query of the database file
+function dbAll(name, args, query, params, callback) {
+  if (global.server) {
+    global.db.call(name, args, function (err, result) {
+      callback(err, err ? undefined : result.rows);
+    });
+  } else {
+    global.db.all(query, params, callback);
+  }
+}
+
+// Modify database either by the named operation of the scoring service with
+// the given arguments, or by executing the given statements in a transaction
+function dbExec(name, args, sql, callback) {
+  if (global.server) {
+    global.db.call(name, args, function (err, result) {
+      if (callback) callback(err);
+    });
+  } else {
+    global.db.exec("BEGIN;" + sql + "END;", function (err) {
+      if (err) global.db.exec('ROLLBACK;');
+      if (callback) callback(err);
+    });
+  }
 }
 
 function onLogIn(event) {
-  global.db.get(
+  var email = $('#raterEmail').val();
+  var password = $('#raterPassword').val();
+  dbGet('login', { email: email, password: password },
     "SELECT RaterId, ShowHelp FROM Raters WHERE Email = $email AND Password = $password",
-    {
-      $email: $('#raterEmail').val(),
-      $password: $('#raterPassword').val()
-    },
+    { $email: email, $password: password },
     function (err, row) {
       if (err) {
         showErrorMessage(err);
@@ -303,23 +512,45 @@ function onLogIn(event) {
       } else {
         clearErrors();
         global.raterId = row['RaterId'];
+        global.progress = {};
+        invalidatePrefetchBuffers();
         if (global.raterId) {
-          loadContactInfo(function () {
-          loadOverlayIds(function () {
-          loadEvaluationScores(function () {
-          loadEvaluationTasks(function () {
-          loadComparisonTasks(function () {
-            if (row['ShowHelp']) {
-              global.db.run("UPDATE Raters SET ShowHelp = 0 WHERE RaterId = ?", global.raterId, function (err) {
-                if (err) {
-                  showErrorMessage(err);
-                }
-              });
-              showPage("help");
-            } else {
+          // show summary of previous session while loading the current one
+          global.loading = true;
+          if (restoreSessionSnapshot()) {
+            updateOpenPage();
+          }
+          whenAllDone([
+            loadContactInfo,
+            loadOverlayIds,
+            loadEvaluationScores,
+            loadEvaluationTasks,
+            loadComparisonTasks,
+            replayScoreJournal
+          ], function (err) {
+            if (err) {
+              // error was shown by the function which failed
+              global.loading = false;
               updateOpenPage();
+              return;
             }
-          }) }) }) }) });
+            fillRaterQueues(function (err) {
+              global.loading = false;
+              if (err) {
+                updateOpenPage();
+              } else if (row['ShowHelp']) {
+                var update = "UPDATE Raters SET ShowHelp = 0 WHERE RaterId = " + global.raterId + ";";
+                dbExec('hide-help', {}, update, function (err) {
+                  if (err) {
+                    showErrorMessage(err);
+                  }
+                });
+                showPage("help");
+              } else {
+                updateOpenPage();
+              }
+            });
+          });
         } else {
           showError("Missing 'RaterId' column in 'Raters' table");
         }
@@ -332,9 +563,10 @@ function onLogIn(event) {
 }
 
 function loadContactInfo(callback) {
-  global.db.get("SELECT * FROM Contacts", function (err, row) {
+  dbGet('contact', {}, "SELECT * FROM Contacts", {}, function (err, row) {
     if (err) {
       showErrorMessage(err);
+      callback(err);
     } else if (!row) {
       global.contactName = "No Contact";
       global.contactEmail = "";
@@ -350,11 +582,14 @@ function loadContactInfo(callback) {
 }
 
 function loadOverlayIds(callback) {
-  global.db.get("SELECT OverlayId FROM Overlays WHERE Name = 'ROI Bounds'", function (err, row) {
+  var query = "SELECT OverlayId FROM Overlays WHERE Name = 'ROI Bounds'";
+  dbGet('roi-bounds-overlay', {}, query, {}, function (err, row) {
     if (err) {
       showErrorMessage(err);
+      callback(err);
     } else if (!row) {
       showErrorMessage("Missing 'ROI Bounds' overlay in Overlays table");
+      callback("Missing 'ROI Bounds' overlay in Overlays table");
     } else {
       global.bboxOverlayId = row['OverlayId'];
       callback();
@@ -363,9 +598,10 @@ function loadOverlayIds(callback) {
 }
 
 function loadEvaluationScores(callback) {
-  global.db.all("SELECT * FROM Scores ORDER BY Value", function (err, rows) {
+  dbAll('scores', {}, "SELECT * FROM Scores ORDER BY Value", {}, function (err, rows) {
     if (err) {
       showErrorMessage(err);
+      callback(err);
     } else {
       global.evalScores = [];
       for (var i = 0; i < rows.length; i++) {
@@ -390,47 +626,48 @@ function loadEvaluationScores(callback) {
 }
 
 function loadEvaluationTasks(callback) {
-  global.db.all("SELECT * FROM EvaluationTasks", function (err, rows) {
+  var query = `
+    SELECT T.EvaluationTaskId,
+      (SELECT group_concat(O.OverlayId) FROM EvaluationOverlays AS O
+       WHERE O.EvaluationTaskId = T.EvaluationTaskId) AS OverlayIds,
+      (SELECT group_concat(V.ViewId) FROM EvaluationViews AS V
+       WHERE V.EvaluationTaskId = T.EvaluationTaskId) AS ViewIds
+    FROM EvaluationTasks AS T
+  `;
+  dbAll('evaluation-tasks', {}, query, {}, function (err, rows) {
     if (err) {
       showErrorMessage(err);
+      callback(err);
     } else {
       global.evalTaskIds = [];
+      global.evalOverlayIds = {};
+      global.evalViewIds = {};
       for (var i = 0; i < rows.length; i++) {
         var taskId = rows[i]['EvaluationTaskId'];
         global.evalTaskIds.push(taskId);
-        global.evalOverlayIds[taskId] = [];
-        global.evalViewIds[taskId] = [];
+        global.evalOverlayIds[taskId] = splitGroupConcat(rows[i]['OverlayIds'], parseInt);
+        global.evalViewIds[taskId] = splitGroupConcat(rows[i]['ViewIds']);
       }
-      global.db.each("SELECT * FROM EvaluationOverlays", function (err, row) {
-        if (err) {
-          showErrorMessage(err);
-        } else {
-          global.evalOverlayIds[row['EvaluationTaskId']].push(row['OverlayId']);
-        }
-      }, function (err, nrows) {
-        if (err) {
-          showErrorMessage(err);
-        } else {
-          global.db.each("SELECT * FROM EvaluationViews", function (err, row) {
-            if (err) {
-              showErrorMessage(err);
-            } else {
-              global.evalViewIds[row['EvaluationTaskId']].push(row['ViewId']);
-            }
-          }, callback);
-        }
-      });
+      callback();
     }
   });
 }
 
 function loadComparisonTasks(callback) {
-  global.db.all("SELECT * FROM ComparisonTasks", function (err, rows) {
+  var query = `
+    SELECT T.ComparisonTaskId, T.OverlayId1, T.OverlayId2,
+      (SELECT group_concat(V.ViewId) FROM ComparisonViews AS V
+       WHERE V.ComparisonTaskId = T.ComparisonTaskId) AS ViewIds
+    FROM ComparisonTasks AS T
+  `;
+  dbAll('comparison-tasks', {}, query, {}, function (err, rows) {
     if (err) {
       showErrorMessage(err);
+      callback(err);
     } else {
       global.compTaskIds = [];
       global.compOverlayIds = {};
+      global.compViewIds = {};
       for (var i = 0; i < rows.length; i++) {
         var taskId = rows[i]['ComparisonTaskId'];
         global.compTaskIds.push(taskId);
@@ -438,15 +675,9 @@ function loadComparisonTasks(callback) {
           rows[i]['OverlayId1'],
           rows[i]['OverlayId2']
         ];
-        global.compViewIds[taskId] = [];
+        global.compViewIds[taskId] = splitGroupConcat(rows[i]['ViewIds']);
       }
-      global.db.each("SELECT * FROM ComparisonViews", function (err, row) {
-        if (err) {
-          showErrorMessage(err);
-        } else {
-          global.compViewIds[row['ComparisonTaskId']].push(row['ViewId']);
-        }
-      }, callback);
+      callback();
     }
   });
 }
@@ -490,16 +721,21 @@ function updateSummary() {
   $('#summary tbody').empty();
   if (global.raterId > 0) {
     for (var i = 0; i < global.evalTaskIds.length; i++) {
-      var task = global.evalTaskIds[i];
-      addEvalTask(task);
-      queryTotalNumberOfEvaluationSets(task);
-      queryRemainingNumberOfEvaluationSets(task);
+      addEvalTask(global.evalTaskIds[i]);
     }
     for (var i = 0; i < global.compTaskIds.length; i++) {
-      var task = global.compTaskIds[i];
-      addCompTask(task);
-      queryTotalNumberOfComparisonSets(task);
-      queryRemainingNumberOfComparisonSets(task);
+      addCompTask(global.compTaskIds[i]);
+    }
+    for (var taskName in global.progress) {
+      setTotalNumberOfScreenshots(taskName, global.progress[taskName].total);
+      setRemainingNumberOfScreenshots(taskName, global.progress[taskName].remaining);
+    }
+    if (global.loading) {
+      // tasks cannot be started before their queues are filled
+      $('#summary tbody button').prop('disabled', true);
+    } else {
+      queryRaterProgress('E', global.evalTaskIds);
+      queryRaterProgress('C', global.compTaskIds);
     }
     $("#summary").show();
   }
@@ -568,13 +804,77 @@ function updateHelpPage() {
   }
 }
 
+// ----------------------------------------------------------------------------
+// Snapshot of session metadata and progress of a rater
+//
+// The snapshot is stored in the local storage of the app when the progress
+// is updated. When the rater logs in again, the summary of the tasks is shown
+// with the snapshot while the metadata is loaded and the queues are filled.
+
+function getSessionSnapshotKey() {
+  return 'session-' + getDatabaseHash() + '-' + global.raterId;
+}
+
+function saveSessionSnapshot() {
+  if (global.loading || typeof localStorage === 'undefined') return;
+  try {
+    localStorage.setItem(getSessionSnapshotKey(), JSON.stringify({
+      contactName: global.contactName,
+      contactEmail: global.contactEmail,
+      contactSubject: global.contactSubject,
+      bboxOverlayId: global.bboxOverlayId,
+      evalScores: global.evalScores,
+      evalTaskIds: global.evalTaskIds,
+      evalOverlayIds: global.evalOverlayIds,
+      evalViewIds: global.evalViewIds,
+      compTaskIds: global.compTaskIds,
+      compOverlayIds: global.compOverlayIds,
+      compViewIds: global.compViewIds,
+      progress: global.progress
+    }));
+  } catch (e) {
+    // snapshot is only used to show the summary sooner
+  }
+}
+
+function restoreSessionSnapshot() {
+  if (typeof localStorage === 'undefined') return false;
+  var snapshot = null;
+  try {
+    snapshot = JSON.parse(localStorage.getItem(getSessionSnapshotKey()));
+  } catch (e) {
+    snapshot = null;
+  }
+  if (!snapshot) return false;
+  global.contactName = snapshot.contactName;
+  global.contactEmail = snapshot.contactEmail;
+  global.contactSubject = snapshot.contactSubject;
+  global.bboxOverlayId = snapshot.bboxOverlayId;
+  global.evalScores = snapshot.evalScores;
+  global.evalTaskIds = snapshot.evalTaskIds;
+  global.evalOverlayIds = snapshot.evalOverlayIds;
+  global.evalViewIds = snapshot.evalViewIds;
+  global.compTaskIds = snapshot.compTaskIds;
+  global.compOverlayIds = snapshot.compOverlayIds;
+  global.compViewIds = snapshot.compViewIds;
+  global.progress = snapshot.progress || {};
+  return true;
+}
+
 // ----------------------------------------------------------------------------
 // Auxiliaries for all task pages
+// URL of screenshot image file, whose path is relative to the database
+function screenshotUrl(fileName) {
+  if (global.server) {
+    return global.server + '/screenshots/' + encodeURI(fileName) + '?token=' + encodeURIComponent(global.serverToken);
+  }
+  return "file://" + path.join(global.imgBase, fileName);
+}
+
 function setScreenshot(element_id, screenshotId, fileName) {
   var img = $("#" + element_id + " > img");
-  var absPath = path.join(global.imgBase, fileName);
   img.attr("id", "screenshot-" + screenshotId);
-  img.attr("src", "file://" + absPath);
+  img.attr("src", screenshotUrl(fileName));
   img.attr("alt", "Image not found: " + fileName);
 }
 
@@ -611,116 +911,457 @@ function viewIdConstraint(viewIds) {
 }
 
 // ----------------------------------------------------------------------------
-// Progress for both summary and evaluation pages
-function queryTotalNumberOfEvaluationSets(task) {
-  var taskId = task;
-  if (!taskId) taskId = global.activeTask;
-  var query = `
-    SELECT COUNT(DISTINCT(ScreenshotId)) AS N
-    FROM EvaluationScreenshots AS S
-    LEFT JOIN ROIs AS R
-      ON S.ROI_Id = R.ROI_Id
-    WHERE ` + sqlValueInSet('OverlayId', 'IN', global.evalOverlayIds[taskId]) + `
-    AND ` + viewIdConstraint(global.evalViewIds[taskId]);
-  global.db.get(
-    query,
-    function (err, row) {
-      if (err) {
-        showErrorMessage(err);
-      } else {
-        setTotalNumberOfScreenshots("eval-" + taskId, row['N']);
-      }
+// Work queue of rater for each task
+
+// Append screenshots selected by the given query, which are not yet in the
+// queue of the rater, in random order to the queue of the specified task.
+// The scoring service selects the screenshots of the task by itself.
+function fillRaterQueue(taskType, taskId, query, callback) {
+  var raterId = global.raterId;
+  var sql = `
+    INSERT OR IGNORE INTO RaterQueueCursor (RaterId, TaskType, TaskId, Position)
+    VALUES (` + raterId + `, '` + taskType + `', ` + taskId + `, 0);
+  `;
+  sql += `
+    INSERT INTO RaterQueue (RaterId, TaskType, TaskId, ScreenshotId)
+    SELECT ` + raterId + `, '` + taskType + `', ` + taskId + `, ScreenshotId
+    FROM (` + query + `)
+    WHERE ScreenshotId NOT IN (
+      SELECT ScreenshotId FROM RaterQueue
+      WHERE RaterId = ` + raterId + ` AND TaskType = '` + taskType + `' AND TaskId = ` + taskId + `
+    )
+    ORDER BY random();
+  `;
+  var args = { taskType: taskType, taskId: taskId };
+  dbExec('fill-queue', args, sql, function (err) {
+    if (err) {
+      hideActivePage();
+      showErrorMessage(err);
     }
-  );
+    callback(err);
+  });
 }
 
-function queryRemainingNumberOfEvaluationSets(task) {
-  var taskId = task;
-  if (!taskId) taskId = global.activeTask;
-  var query = `
-    SELECT COUNT(DISTINCT(S.ScreenshotId)) AS N
-    FROM EvaluationScreenshots AS S
-    LEFT JOIN ROIs AS R
-      ON S.ROI_Id = R.ROI_Id
+// Query next screenshots in the queue after the cursor and the given position
+// which were not yet scored, including all columns needed to show them
+function queryQueuedScreenshots(taskType, taskId, after, limit, callback) {
+  var query = '';
+  if (taskType == 'E') {
+    query = `
+    SELECT Q.QueueId AS QueueId, Q.ScreenshotId AS ScreenshotId,
+      S.FileName AS FileName, R.ScreenshotId AS ROIScreenshotId, R.FileName AS ROIScreenshotName
+    FROM RaterQueue AS Q
+    INNER JOIN RaterQueueCursor AS K
+      ON K.RaterId = Q.RaterId AND K.TaskType = Q.TaskType AND K.TaskId = Q.TaskId
+    INNER JOIN Screenshots AS S
+      ON S.ScreenshotId = Q.ScreenshotId
+    LEFT JOIN ScreenshotTypes AS T
+      ON T.ScreenshotId = Q.ScreenshotId
+    LEFT JOIN Screenshots AS R
+      ON R.ScreenshotId = T.ROIScreenshotId
     LEFT JOIN EvaluationScores AS E
-      ON S.ScreenshotId = E.ScreenshotId AND RaterId = $raterId
-    WHERE Score IS NULL
-    AND ` + sqlValueInSet('OverlayId', 'IN', global.evalOverlayIds[taskId]) + `
-    AND ` + viewIdConstraint(global.evalViewIds[taskId]);
-  global.db.get(
-    query,
-    {
-      $raterId: global.raterId
-    },
-    function (err, row) {
-      if (err) {
-        showErrorMessage(err);
-      } else {
-        setRemainingNumberOfScreenshots("eval-" + taskId, row['N']);
+      ON E.ScreenshotId = Q.ScreenshotId AND E.RaterId = Q.RaterId
+    WHERE E.Score IS NULL`;
+  } else {
+    query = `
+    SELECT Q.QueueId AS QueueId, Q.ScreenshotId AS ScreenshotId,
+      F.FileName AS FileName, A.FileName AS FileName1, B.FileName AS FileName2,
+      R.FileName AS ROIScreenshotName, S.ROIScreenshotId AS ROIScreenshotId,
+      S.ScreenshotId1 AS ScreenshotId1, S.OverlayId1 AS OverlayId1, S.Color1 AS Color1,
+      S.ScreenshotId2 AS ScreenshotId2, S.OverlayId2 AS OverlayId2, S.Color2 AS Color2
+    FROM RaterQueue AS Q
+    INNER JOIN RaterQueueCursor AS K
+      ON K.RaterId = Q.RaterId AND K.TaskType = Q.TaskType AND K.TaskId = Q.TaskId
+    INNER JOIN ComparisonSets AS S
+      ON S.ScreenshotId = Q.ScreenshotId
+    INNER JOIN Screenshots AS F
+      ON F.ScreenshotId = S.ScreenshotId
+    INNER JOIN Screenshots AS A
+      ON A.ScreenshotId = S.ScreenshotId1
+    INNER JOIN Screenshots AS B
+      ON B.ScreenshotId = S.ScreenshotId2
+    INNER JOIN Screenshots AS R
+      ON R.ScreenshotId = S.ROIScreenshotId
+    LEFT JOIN ComparisonChoices AS C
+      ON C.ScreenshotId = Q.ScreenshotId AND C.RaterId = Q.RaterId
+    WHERE C.BestOverlayId IS NULL`;
+  }
+  query += `
+    AND Q.RaterId = $raterId AND Q.TaskType = $taskType AND Q.TaskId = $taskId
+    AND Q.QueueId > K.Position AND Q.QueueId > $after
+    ORDER BY Q.QueueId LIMIT $limit`;
+  var args = { taskType: taskType, taskId: taskId, after: after, limit: limit };
+  dbAll('next-screenshots', args, query, {
+    $raterId: global.raterId,
+    $taskType: taskType,
+    $taskId: taskId,
+    $after: after,
+    $limit: limit
+  }, function (err, rows) {
+    if (err) {
+      hideActivePage();
+      showErrorMessage(err);
+    } else {
+      callback(rows);
+    }
+  });
+}
+
+// Statement which advances the cursor to the given position in the queue
+function advanceRaterQueueCursor(taskType, taskId, queueId) {
+  return `
+    UPDATE RaterQueueCursor SET Position = MAX(Position, ` + (queueId || 0) + `)
+    WHERE RaterId = ` + global.raterId + ` AND TaskType = '` + taskType + `' AND TaskId = ` + taskId + `;
+  `;
+}
+
+// Statement which moves the cursor of each evaluation queue of the rater back
+// before the given screenshot, such that it is offered again after its score
+// was deleted even when the app is closed before it is scored again
+function rewindRaterQueueCursors(screenshotId) {
+  return `
+    UPDATE RaterQueueCursor SET Position = MIN(Position, (
+      SELECT MIN(Q.QueueId) - 1 FROM RaterQueue AS Q
+      WHERE Q.RaterId = RaterQueueCursor.RaterId AND Q.TaskType = RaterQueueCursor.TaskType
+      AND Q.TaskId = RaterQueueCursor.TaskId AND Q.ScreenshotId = ` + screenshotId + `
+    ))
+    WHERE RaterId = ` + global.raterId + ` AND TaskType = 'E' AND TaskId IN (
+      SELECT TaskId FROM RaterQueue
+      WHERE RaterId = ` + global.raterId + ` AND TaskType = 'E' AND ScreenshotId = ` + screenshotId + `
+    );
+  `;
+}
+
+// Fill queues of all tasks, which also initializes the RaterProgress counters
+function fillRaterQueues(callback) {
+  var fills = [];
+  for (var i = 0; i < global.evalTaskIds.length; i++) {
+    fills.push(['E', global.evalTaskIds[i]]);
+  }
+  for (var i = 0; i < global.compTaskIds.length; i++) {
+    fills.push(['C', global.compTaskIds[i]]);
+  }
+  var next = function (i) {
+    if (i < fills.length) {
+      var fill = (fills[i][0] == 'E' ? fillEvalQueue : fillCompQueue);
+      fill(fills[i][1], function (err) {
+        if (err) {
+          callback(err);
+        } else {
+          next(i + 1);
+        }
+      });
+    } else {
+      callback(null);
+    }
+  };
+  next(0);
+}
+
+// ----------------------------------------------------------------------------
+// Look-ahead buffer of next screenshots of each task
+
+function getPrefetchBuffer(taskType, task) {
+  var buffers = (taskType == 'E' ? global.evalPrefetch : global.compPrefetch);
+  if (!buffers[task]) {
+    buffers[task] = { rows: [], pending: false };
+  }
+  return buffers[task];
+}
+
+// Load and decode images of a queued screenshot off-screen such that these
+// are in the image cache when the screenshot is shown. The Image objects are
+// kept in the buffer to keep the decoded images alive until then.
+function preloadImages(row) {
+  var images = [];
+  var columns = ['FileName', 'FileName1', 'FileName2', 'ROIScreenshotName'];
+  for (var i = 0; i < columns.length; i++) {
+    var fileName = row[columns[i]];
+    if (fileName) {
+      var img = new Image();
+      img.src = screenshotUrl(fileName);
+      if (img.decode) {
+        img.decode().catch(function () {});
       }
+      images.push(img);
     }
-  );
+  }
+  return images;
 }
 
-function queryTotalNumberOfComparisonSets(task) {
-  var taskId = task;
-  if (!taskId) taskId = global.activeTask;
-  var overlayIds = global.compOverlayIds[taskId];
-  var id1 = Math.min(overlayIds[0], overlayIds[1]);
-  var id2 = Math.max(overlayIds[0], overlayIds[1]);
-  var query = `
-    SELECT COUNT(DISTINCT(ScreenshotId)) AS N
-    FROM ComparisonScreenshots AS S
-    LEFT JOIN ROIs AS R
-      ON S.ROI_Id = R.ROI_Id
-    WHERE OverlayId1 = $id1 AND OverlayId2 = $id2
-    AND ` + viewIdConstraint(global.compViewIds[taskId]);
-  global.db.get(
-    query,
-    {
-      $id1: id1,
-      $id2: id2
-    },
-    function (err, row) {
-      if (err) {
-        showErrorMessage(err);
+// Top up look-ahead buffer with the screenshots following the current one
+function prefetchScreenshots(taskType, task) {
+  var buffer = getPrefetchBuffer(taskType, task);
+  if (buffer.pending || buffer.rows.length >= global.prefetchSize) return;
+  var queueIds = (taskType == 'E' ? global.evalQueueId : global.compQueueId);
+  var after = Math.max(queueIds[task] || 0, journalQueueId(taskType, task));
+  if (buffer.rows.length > 0) {
+    after = Math.max(after, buffer.rows[buffer.rows.length - 1]['QueueId']);
+  }
+  buffer.pending = true;
+  queryQueuedScreenshots(taskType, parseInt(task), after, global.prefetchSize - buffer.rows.length, function (rows) {
+    buffer.pending = false;
+    var current = Math.max(queueIds[task] || 0, journalQueueId(taskType, task));
+    for (var i = 0; i < rows.length; i++) {
+      if (rows[i]['QueueId'] > current) {
+        rows[i].images = preloadImages(rows[i]);
+        buffer.rows.push(rows[i]);
+      }
+    }
+  });
+}
+
+// Take next screenshot from the look-ahead buffer, or query it when empty
+function nextQueuedScreenshot(taskType, task, callback) {
+  var buffer = getPrefetchBuffer(taskType, task);
+  var queueIds = (taskType == 'E' ? global.evalQueueId : global.compQueueId);
+  var current = Math.max(queueIds[task] || 0, journalQueueId(taskType, task));
+  while (buffer.rows.length > 0) {
+    var row = buffer.rows.shift();
+    if (row['QueueId'] > current) {
+      callback(row);
+      return;
+    }
+  }
+  queryQueuedScreenshots(taskType, parseInt(task), current, 1, function (rows) {
+    callback(rows.length > 0 ? rows[0] : null);
+  });
+}
+
+// Discard buffered screenshots when screenshots other than the current one
+// were scored or unscored. The result of a pending prefetch query is then
+// added to the detached buffer object and thus discarded as well.
+function invalidatePrefetchBuffer(taskType, task) {
+  var buffers = (taskType == 'E' ? global.evalPrefetch : global.compPrefetch);
+  delete buffers[task];
+}
+
+// Discard buffered screenshots of all tasks, including the queued rows of the
+// current screenshots, which are then queried again before these are shown
+function invalidatePrefetchBuffers() {
+  global.evalPrefetch = {};
+  global.compPrefetch = {};
+  global.evalQueuedRow = {};
+  global.compQueuedRow = {};
+}
+
+// ----------------------------------------------------------------------------
+// Write-behind journal of scores and comparison choices
+//
+// Scores are appended to a journal file in the local application data
+// directory before the next screenshot is shown, and written to the database
+// in batches. Entries of a journal file left behind, e.g., when the app
+// crashed, are written to the database when the rater logs in again.
+
+function getJournalFile() {
+  var dir = global.imgBase;
+  if (typeof nw !== 'undefined') dir = nw.App.dataPath;
+  return path.join(dir, 'journal-' + getDatabaseHash() + '-' + global.raterId + '.jsonl');
+}
+
+// Rewrite journal file with entries not yet written to the database
+function writeJournalFile() {
+  var entries = global.journal.flushing.concat(global.journal.entries);
+  var data = '';
+  for (var i = 0; i < entries.length; i++) {
+    data += JSON.stringify(entries[i]) + '\n';
+  }
+  var tmpFile = global.journal.file + '.tmp';
+  var fd = fs.openSync(tmpFile, 'w');
+  try {
+    fs.writeSync(fd, data);
+    fs.fsyncSync(fd);
+  } finally {
+    fs.closeSync(fd);
+  }
+  fs.renameSync(tmpFile, global.journal.file);
+}
+
+function appendJournalEntry(entry) {
+  var fd = fs.openSync(global.journal.file, 'a');
+  try {
+    fs.writeSync(fd, JSON.stringify(entry) + '\n');
+    fs.fsyncSync(fd);
+  } finally {
+    fs.closeSync(fd);
+  }
+  global.journal.entries.push(entry);
+  scheduleJournalFlush();
+}
+
+// Flush journal when batch is complete or after a delay otherwise
+function scheduleJournalFlush() {
+  var journal = global.journal;
+  if (journal.flushing.length > 0 || journal.entries.length == 0) return;
+  if (journal.entries.length >= global.journalBatchSize) {
+    flushScoreJournal();
+  } else if (!journal.timer) {
+    journal.timer = setTimeout(function () {
+      journal.timer = null;
+      flushScoreJournal();
+    }, global.journalDelay);
+  }
+}
+
+// Statements which write a journal entry to the database. These are
+// idempotent such that entries can be replayed after a crash.
+function journalEntrySql(entry) {
+  var query = '';
+  if (entry.type == 'E' && entry.score == 0) {
+    // Discard all screenshots taken from the same ROI
+    query += `
+      INSERT INTO EvaluationScores (ScreenshotId, RaterId, Score)
+      SELECT S.ScreenshotId AS ScreenshotId, ` + entry.raterId + ` AS RaterId, 0 AS Score
+      FROM EvaluationScreenshots AS S
+      LEFT JOIN EvaluationScores AS E
+        ON E.ScreenshotId = S.ScreenshotId AND E.RaterId = ` + entry.raterId + `
+      WHERE E.Score IS NULL AND S.ROIScreenshotId = ` + entry.roiScreenshotId + `;
+    `;
+    // Set choice of all comparisons within discarded ROI as "Neither"
+    query += `
+      INSERT INTO ComparisonChoices (ScreenshotId, RaterId, BestOverlayId)
+      SELECT DISTINCT(S.ScreenshotId) AS ScreenshotId, ` + entry.raterId + ` AS RaterId, 0 AS BestOverlayId
+      FROM ComparisonScreenshots AS S
+      LEFT JOIN ROIScreenshots AS R
+        ON  R.ROI_Id  = S.ROI_Id
+        AND R.CenterI = S.CenterI
+        AND R.CenterJ = S.CenterJ
+        AND R.CenterK = S.CenterK
+        AND R.ViewId  = S.ViewId
+      LEFT JOIN ComparisonChoices AS C
+        ON C.ScreenshotId = S.ScreenshotId AND C.RaterId = ` + entry.raterId + `
+      WHERE C.BestOverlayId IS NULL AND R.ScreenshotId = ` + entry.roiScreenshotId + `;
+    `;
+  } else if (entry.type == 'E') {
+    query += "INSERT OR IGNORE INTO EvaluationScores (ScreenshotId, RaterId, Score)";
+    query += " VALUES (" + entry.screenshotId + ", " + entry.raterId + ", " + entry.score + ");";
+  } else {
+    query += "INSERT OR IGNORE INTO ComparisonChoices (ScreenshotId, RaterId, BestOverlayId)";
+    query += " VALUES (" + entry.screenshotId + ", " + entry.raterId + ", " + entry.bestOverlayId + ");";
+  }
+  query += advanceRaterQueueCursor(entry.type, entry.taskId, entry.queueId);
+  return query;
+}
+
+// Write pending journal entries to the database in a single transaction and
+// call the optional callback with the error, if any, when all are written
+function flushScoreJournal(callback) {
+  var journal = global.journal;
+  if (callback) journal.callbacks.push(callback);
+  if (journal.flushing.length > 0) return;
+  if (journal.timer) {
+    clearTimeout(journal.timer);
+    journal.timer = null;
+  }
+  if (journal.entries.length == 0) {
+    var callbacks = journal.callbacks;
+    journal.callbacks = [];
+    for (var i = 0; i < callbacks.length; i++) {
+      callbacks[i](null);
+    }
+    return;
+  }
+  journal.flushing = journal.entries;
+  journal.entries = [];
+  var query = "";
+  for (var i = 0; i < journal.flushing.length; i++) {
+    query += journalEntrySql(journal.flushing[i]);
+  }
+  dbExec('save-scores', { entries: journal.flushing }, query, function (err) {
+    if (err) {
+      journal.entries = journal.flushing.concat(journal.entries);
+      journal.flushing = [];
+      showErrorMessage(err);
+      var callbacks = journal.callbacks;
+      journal.callbacks = [];
+      for (var i = 0; i < callbacks.length; i++) {
+        callbacks[i](err);
+      }
+    } else {
+      journal.flushing = [];
+      try {
+        writeJournalFile();
+      } catch (e) {
+        showErrorMessage(e);
+      }
+      if (journal.callbacks.length > 0) {
+        flushScoreJournal();
       } else {
-        setTotalNumberOfScreenshots("comp-" + taskId, row['N']);
+        scheduleJournalFlush();
       }
     }
-  );
+  });
+}
+
+// Read journal file of logged in rater and write its entries to the database
+function replayScoreJournal(callback) {
+  global.journal = { file: getJournalFile(), entries: [], flushing: [], callbacks: [], timer: null };
+  if (fs.existsSync(global.journal.file)) {
+    var lines = fs.readFileSync(global.journal.file, 'utf8').split('\n');
+    for (var i = 0; i < lines.length; i++) {
+      try {
+        if (lines[i]) global.journal.entries.push(JSON.parse(lines[i]));
+      } catch (e) {
+        // incomplete last line written when the app was terminated
+      }
+    }
+  }
+  flushScoreJournal(callback);
+}
+
+// Number of journal entries of a task not yet written to the database
+function numPendingJournalEntries(taskType, task) {
+  var entries = global.journal.flushing.concat(global.journal.entries);
+  var n = 0;
+  for (var i = 0; i < entries.length; i++) {
+    if (entries[i].type == taskType && (!task || entries[i].taskId == task)) n += 1;
+  }
+  return n;
+}
+
+// Largest queue position of journal entries of a task, such that the next
+// screenshot in the queue is one which is not yet scored, but pending
+function journalQueueId(taskType, task) {
+  var entries = global.journal.flushing.concat(global.journal.entries);
+  var queueId = 0;
+  for (var i = 0; i < entries.length; i++) {
+    if (entries[i].type == taskType && entries[i].taskId == task) {
+      queueId = Math.max(queueId, entries[i].queueId);
+    }
+  }
+  return queueId;
 }
 
-function queryRemainingNumberOfComparisonSets(task) {
-  var taskId = task;
-  if (!taskId) taskId = global.activeTask;
-  var overlayIds = global.compOverlayIds[taskId];
-  var id1 = Math.min(overlayIds[0], overlayIds[1]);
-  var id2 = Math.max(overlayIds[0], overlayIds[1]);
+// ----------------------------------------------------------------------------
+// Progress for both summary and evaluation pages
+// Query total number of screenshots in queue of rater and number of these
+// rated so far for the given tasks, or the active task if none specified
+function queryRaterProgress(taskType, taskIds) {
+  if (!taskIds) taskIds = [global.activeTask];
+  if (taskIds.length == 0) return;
   var query = `
-    SELECT COUNT(DISTINCT(S.ScreenshotId)) AS N
-    FROM ComparisonScreenshots AS S
-    LEFT JOIN ROIs AS R
-      ON S.ROI_Id = R.ROI_Id
-    LEFT JOIN ComparisonChoices AS C
-      ON S.ScreenshotId = C.ScreenshotId AND RaterId = $raterId
-    WHERE OverlayId1 = $id1 AND OverlayId2 = $id2 AND BestOverlayId IS NULL
-    AND ` + viewIdConstraint(global.compViewIds[taskId]);
-  global.db.get(
-    query,
-    {
-      $raterId: global.raterId,
-      $id1: id1,
-      $id2: id2
-    },
-    function (err, row) {
-      if (err) {
-        showErrorMessage(err);
-      } else {
-        setRemainingNumberOfScreenshots("comp-" + taskId, row['N']);
+    SELECT TaskId, Total, Done FROM RaterProgress
+    WHERE RaterId = $raterId AND TaskType = $taskType
+    AND ` + sqlValueInSet('TaskId', 'IN', taskIds);
+  var args = { taskType: taskType };
+  dbAll('progress', args, query, { $raterId: global.raterId, $taskType: taskType }, function (err, rows) {
+    if (err) {
+      showErrorMessage(err);
+    } else {
+      var prefix = (taskType == 'E' ? "eval-" : "comp-");
+      for (var i = 0; i < rows.length; i++) {
+        var taskName = prefix + rows[i]['TaskId'];
+        var done = rows[i]['Done'] + numPendingJournalEntries(taskType, rows[i]['TaskId']);
+        global.progress[taskName] = {
+          total: rows[i]['Total'],
+          remaining: Math.max(0, rows[i]['Total'] - done)
+        };
+        setTotalNumberOfScreenshots(taskName, global.progress[taskName].total);
+        setRemainingNumberOfScreenshots(taskName, global.progress[taskName].remaining);
       }
+      saveSessionSnapshot();
     }
-  );
+  });
 }
 
 function setTotalNumberOfScreenshots(taskName, num) {
@@ -751,7 +1392,40 @@ function updatePercentageDone(taskName) {
 
 // ----------------------------------------------------------------------------
 // Evaluation of quality of single surface contour
+function fillEvalQueue(task, callback) {
+  var query = `
+    SELECT DISTINCT(S.ScreenshotId) AS ScreenshotId
+    FROM EvaluationScreenshots AS S
+    LEFT JOIN ROIs AS R
+      ON S.ROI_Id = R.ROI_Id
+    WHERE ` + sqlValueInSet('OverlayId', 'IN', global.evalOverlayIds[task]) + `
+    AND ` + viewIdConstraint(global.evalViewIds[task]);
+  fillRaterQueue('E', parseInt(task), query, callback);
+}
+
 function queryNextEvalScreenshot() {
+  var task = global.activeTask;
+  if (!global.evalScreenshotId[task]) {
+    nextQueuedScreenshot('E', task, function (row) {
+      if (row) {
+        global.evalQueueId     [task] = row['QueueId'];
+        global.evalScreenshotId[task] = row['ScreenshotId'];
+        global.evalQueuedRow   [task] = row;
+        queryNextEvalScreenshot();
+      } else {
+        hideActivePage();
+        showDoneMessage();
+      }
+    });
+    return;
+  }
+  // queued rows were not scored when queried, and buffers are invalidated
+  // when other screenshots are scored; scoring it again is otherwise ignored
+  var queued = global.evalQueuedRow[task];
+  if (queued && queued['ScreenshotId'] == global.evalScreenshotId[task]) {
+    showEvalScreenshot(task, queued);
+    return;
+  }
   var query = `
     SELECT S.ScreenshotId AS ScreenshotId, FileName, ROIScreenshotId, ROIScreenshotName
     FROM EvaluationScreenshots AS S
@@ -762,21 +1436,17 @@ function queryNextEvalScreenshot() {
     WHERE Score IS NULL
     AND ` + sqlValueInSet('OverlayId', 'IN', global.evalOverlayIds[global.activeTask]) + `
     AND ` + viewIdConstraint(global.evalViewIds[global.activeTask]);
-  var screenshotId = global.evalScreenshotId[global.activeTask];
-  if (screenshotId) {
-    query += " AND S.ScreenshotId = " + screenshotId;
-  } else {
-    query += " ORDER BY random() LIMIT 1";
-  }
-  global.db.get(query, { $raterId: global.raterId }, function (err, row) {
+  query += " AND S.ScreenshotId = " + global.evalScreenshotId[task];
+  var args = { taskId: parseInt(task), screenshotId: global.evalScreenshotId[task] };
+  dbGet('evaluation-screenshot', args, query, { $raterId: global.raterId }, function (err, row) {
     if (err) {
       showErrorMessage(err);
     } else if (row) {
-      setBoundsScreenshot(row['ROIScreenshotId'], row['ROIScreenshotName']);
-      setZoomedScreenshot(row['ScreenshotId'], row['FileName']);
-      global.evalROIScreenshotId[global.activeTask] = row['ROIScreenshotId'];
-      global.evalScreenshotId   [global.activeTask] = row['ScreenshotId'];
-      showEvalPage();
+      showEvalScreenshot(task, row);
+    } else if (global.evalQueueId[task]) {
+      // queued screenshot was scored in the meantime, skip it
+      global.evalScreenshotId[task] = 0;
+      queryNextEvalScreenshot();
     } else {
       hideActivePage();
       showDoneMessage();
@@ -784,6 +1454,15 @@ function queryNextEvalScreenshot() {
   });
 }
 
+function showEvalScreenshot(task, row) {
+  setBoundsScreenshot(row['ROIScreenshotId'], row['ROIScreenshotName']);
+  setZoomedScreenshot(row['ScreenshotId'], row['FileName']);
+  global.evalROIScreenshotId[task] = row['ROIScreenshotId'];
+  global.evalScreenshotId   [task] = row['ScreenshotId'];
+  showEvalPage();
+  prefetchScreenshots('E', task);
+}
+
 function showEvalPage() {
   $("#scores button").click(function (event) {
     var parts = this.id.split('-');
@@ -826,81 +1505,97 @@ function showEvalPage() {
 function saveQualityScore(score) {
   $("html").off("keyup");
   $("#scores button").off("click");
-  var query = '';
+  var task = global.activeTask;
+  try {
+    appendJournalEntry({
+      type: 'E',
+      raterId: global.raterId,
+      taskId: parseInt(task),
+      queueId: global.evalQueueId[task] || 0,
+      screenshotId: global.evalScreenshotId[task],
+      roiScreenshotId: global.evalROIScreenshotId[task],
+      score: score
+    });
+  } catch (err) {
+    onQualityScoreSaved(err);
+    return;
+  }
   if (score == 0) {
-    var raterId = global.raterId;
-    var roiId = global.evalROIScreenshotId[global.activeTask];
-    query = "BEGIN;";
-    // Discard all screenshots taken from the same ROI
-    query += `
-      INSERT INTO EvaluationScores (ScreenshotId, RaterId, Score)
-      SELECT S.ScreenshotId AS ScreenshotId, ` + raterId + ` AS RaterId, 0 AS Score
-      FROM EvaluationScreenshots AS S
-      LEFT JOIN EvaluationScores AS E
-        ON E.ScreenshotId = S.ScreenshotId AND E.RaterId = ` + raterId + `
-      WHERE E.Score IS NULL AND S.ROIScreenshotId = ` + roiId + `;
-    `;
-    // Set choice of all comparisons within discarded ROI as "Neither"
-    query += `
-      INSERT INTO ComparisonChoices (ScreenshotId, RaterId, BestOverlayId)
-      SELECT DISTINCT(S.ScreenshotId) AS ScreenshotId, ` + raterId + ` AS RaterId, 0 AS BestOverlayId
-      FROM ComparisonScreenshots AS S
-      LEFT JOIN ROIScreenshots AS R
-        ON  R.ROI_Id  = S.ROI_Id
-        AND R.CenterI = S.CenterI
-        AND R.CenterJ = S.CenterJ
-        AND R.CenterK = S.CenterK
-        AND R.ViewId  = S.ViewId
-      LEFT JOIN ComparisonChoices AS C
-        ON C.ScreenshotId = S.ScreenshotId AND C.RaterId = ` + raterId + `
-      WHERE C.BestOverlayId IS NULL AND R.ScreenshotId = ` + roiId + `;
-    `;
-    query += "END;"
+    // buffered screenshots of the discarded ROI of any task are scored
+    // when the journal is flushed, wait for it before showing the next
+    invalidatePrefetchBuffers();
+    flushScoreJournal(onQualityScoreSaved);
   } else {
-    var id = global.evalScreenshotId[global.activeTask];
-    query  = "INSERT INTO EvaluationScores (ScreenshotId, RaterId, Score)";
-    query += " VALUES (" + id + ", " + global.raterId + ", " + score + ")";
+    onQualityScoreSaved(null);
   }
-  global.db.exec(query, onQualityScoreSaved);
 }
 
-function undoLastQualityScore()
-{
-  $("html").off("keyup");
-  $("#scores button").off("click");
-  var query = "SELECT ScreenshotId, Score FROM EvaluationScores WHERE RaterId = ";
-  query += global.raterId + " ORDER BY _rowid_ DESC LIMIT 1";
+// Delete last evaluation score of the rater unless it discarded an ROI, and
+// call the callback with the deleted score and its position in the queue of
+// the given task, or no row when the rater did not score any screenshot yet
+function deleteLastQualityScore(task, callback) {
+  if (global.server) {
+    global.db.call('undo', { taskId: parseInt(task) }, function (err, result) {
+      callback(err, err ? undefined : result.row);
+    });
+    return;
+  }
+  var query = `
+    SELECT E.ScreenshotId AS ScreenshotId, E.Score AS Score, Q.QueueId AS QueueId
+    FROM EvaluationScores AS E
+    LEFT JOIN RaterQueue AS Q
+      ON Q.RaterId = E.RaterId AND Q.TaskType = 'E' AND Q.TaskId = ` + parseInt(task) + `
+      AND Q.ScreenshotId = E.ScreenshotId
+    WHERE E.RaterId = ` + global.raterId + `
+    ORDER BY E._rowid_ DESC LIMIT 1`;
   global.db.get(query, function (err, row) {
-    if (err) {
-      showErrorMessage(err);
+    if (err || !row) {
+      callback(err, row);
     } else if (row['Score'] == 0) {
-      showErrorMessage("Cannot undo Discard operation");
+      callback(new Error("Cannot undo Discard operation"));
     } else {
       var id = row['ScreenshotId'];
-      global.evalScreenshotId[global.activeTask] = id;
-      global.db.run("DELETE FROM EvaluationScores WHERE ScreenshotId = " + id + " AND RaterId = " + global.raterId, function (err) {
-        if (err) {
-          showErrorMessage(err);
-          global.evalScreenshotId[global.activeTask] = 0;
-        } else {
-          clearErrors();
-          $('#container').show();
-        }
-        global.evalROIScreenshotId[global.activeTask] = 0;
-        updateEvalPage();
+      var undo = "DELETE FROM EvaluationScores WHERE ScreenshotId = " + id + " AND RaterId = " + global.raterId + ";";
+      undo += rewindRaterQueueCursors(id);
+      dbExec('undo', null, undo, function (err) {
+        callback(err, row);
       });
     }
   });
 }
 
+function undoLastQualityScore()
+{
+  $("html").off("keyup");
+  $("#scores button").off("click");
+  var task = global.activeTask;
+  // the last score may still be pending in the journal
+  flushScoreJournal(function (err) {
+    if (err) return;
+    deleteLastQualityScore(task, function (err, row) {
+      if (err) {
+        showErrorMessage(err);
+      } else if (row) {
+        global.evalScreenshotId   [task] = row['ScreenshotId'];
+        global.evalQueueId        [task] = row['QueueId'] || 0;
+        global.evalROIScreenshotId[task] = 0;
+        invalidatePrefetchBuffer('E', task);
+        clearErrors();
+        $('#container').show();
+      }
+      updateEvalPage();
+    });
+  });
+}
+
 function onQualityScoreSaved(err) {
   if (err) {
-    global.db.exec('ROLLBACK;');
     hideActivePage();
     showErrorMessage(err);
   } else {
     global.evalScreenshotId   [global.activeTask] = 0;
     global.evalROIScreenshotId[global.activeTask] = 0;
+    global.evalQueueId        [global.activeTask] = 0;
     updateEvalPage();
   }
 }
@@ -925,6 +1620,8 @@ function getScoreButtonLabel(score) {
 function initEvalPage(task) {
   $("#container > div").attr("id", "eval-" + task);
   global.activeTask = task;
+  // screenshots buffered for this task may have been scored in another task
+  invalidatePrefetchBuffers();
   var toolbar = $('#score-buttons');
   for (var i = 0; i < global.evalScores.length; i++) {
     var score = global.evalScores[i];
@@ -942,14 +1639,23 @@ function initEvalPage(task) {
       toolbar.append(btn);
     }
   }
-  updateEvalPage();
+  fillEvalQueue(task, function (err) {
+    if (!err) updateEvalPage();
+  });
 }
 
 function updateUndoLink() {
   $('#nav-undo').off("click");
   $('#nav-undo').hide();
+  if (numPendingJournalEntries('E') > 0) {
+    $('#nav-undo').click(function (event) {
+      undoLastQualityScore();
+    });
+    $('#nav-undo').show();
+    return;
+  }
   var query = "SELECT * FROM EvaluationScores WHERE RaterId = " + global.raterId + " AND NOT Score IS NULL LIMIT 1";
-  global.db.get(query, function (err, row) {
+  dbGet('has-scores', {}, query, {}, function (err, row) {
     if (err) {
       showErrorMessage(err);
     } else if (row) {
@@ -963,8 +1669,7 @@ function updateUndoLink() {
 
 function updateEvalPage() {
   $("#eval-" + global.activeTask).hide();
-  queryTotalNumberOfEvaluationSets();
-  queryRemainingNumberOfEvaluationSets();
+  queryRaterProgress('E');
   queryNextEvalScreenshot();
   updateUndoLink();
 }
@@ -983,12 +1688,12 @@ function queryCompOverlayColors(callback) {
   var query = `
     SELECT DISTINCT(Color) AS Color FROM ScreenshotOverlays
     WHERE ScreenshotId IN (
-      SELECT DISTINCT(ScreenshotId) FROM ComparisonScreenshots
+      SELECT ScreenshotId FROM ComparisonSets
       WHERE OverlayId1 = $id1 AND OverlayId2 = $id2
     )
     ORDER BY Color
   `;
-  global.db.all(query, { $id1: id1, $id2: id2 }, function (err, rows) {
+  dbAll('comparison-colors', { id1: id1, id2: id2 }, query, { $id1: id1, $id2: id2 }, function (err, rows) {
     if (err) {
       showErrorMessage(err);
     } else {
@@ -1001,7 +1706,42 @@ function queryCompOverlayColors(callback) {
   });
 }
 
+function fillCompQueue(task, callback) {
+  var overlayId1 = global.compOverlayIds[task][0];
+  var overlayId2 = global.compOverlayIds[task][1];
+  var id1 = Math.min(overlayId1, overlayId2);
+  var id2 = Math.max(overlayId1, overlayId2);
+  var query = `
+      SELECT S.ScreenshotId AS ScreenshotId
+      FROM ComparisonSets AS S
+      LEFT JOIN ROIs AS R
+        ON S.ROI_Id = R.ROI_Id
+      WHERE S.OverlayId1 = ` + id1 + ` AND S.OverlayId2 = ` + id2 + `
+      AND ` + viewIdConstraint(global.compViewIds[task]);
+  fillRaterQueue('C', parseInt(task), query, callback);
+}
+
 function queryNextCompScreenshot() {
+  var task = global.activeTask;
+  if (!global.compScreenshotId[task]) {
+    nextQueuedScreenshot('C', task, function (row) {
+      if (row) {
+        global.compQueueId     [task] = row['QueueId'];
+        global.compScreenshotId[task] = row['ScreenshotId'];
+        global.compQueuedRow   [task] = row;
+        queryNextCompScreenshot();
+      } else {
+        hideActivePage();
+        showDoneMessage();
+      }
+    });
+    return;
+  }
+  var queued = global.compQueuedRow[task];
+  if (queued && queued['ScreenshotId'] == global.compScreenshotId[task]) {
+    showCompScreenshot(task, queued);
+    return;
+  }
   var overlayId1 = global.compOverlayIds[global.activeTask][0];
   var overlayId2 = global.compOverlayIds[global.activeTask][1];
   var id1 = Math.min(overlayId1, overlayId2);
@@ -1010,104 +1750,42 @@ function queryNextCompScreenshot() {
   var query = `
       SELECT
         S.ScreenshotId AS ScreenshotId,
-        S.FileName AS FileName,
-        A.ScreenshotId AS ScreenshotId1,
+        F.FileName AS FileName,
+        S.ScreenshotId1 AS ScreenshotId1,
         A.FileName AS FileName1,
-        A.OverlayId AS OverlayId1,
-        A.Color AS Color1,
-        B.ScreenshotId AS ScreenshotId2,
+        S.OverlayId1 AS OverlayId1,
+        S.Color1 AS Color1,
+        S.ScreenshotId2 AS ScreenshotId2,
         B.FileName AS FileName2,
-        B.OverlayId AS OverlayId2,
-        B.Color AS Color2,
-        RS.ScreenshotId AS ROIScreenshotId,
+        S.OverlayId2 AS OverlayId2,
+        S.Color2 AS Color2,
+        S.ROIScreenshotId AS ROIScreenshotId,
         RS.FileName AS ROIScreenshotName
-      FROM ComparisonScreenshots AS S
-      LEFT JOIN ROIs AS R
-        ON S.ROI_Id = R.ROI_Id
-      LEFT JOIN ROIScreenshots AS RS
-        ON  RS.ROI_Id  = S.ROI_Id
-        AND RS.CenterI = S.CenterI
-        AND RS.CenterJ = S.CenterJ
-        AND RS.CenterK = S.CenterK
-        AND RS.ViewId  = S.ViewId
-      LEFT JOIN IndividualComparisonScreenshots AS A
-        ON  A.ROIScreenshotId = RS.ScreenshotId
-        AND A.OverlayId       = S.OverlayId1
-        AND A.Color           = S.Color1
-      LEFT JOIN IndividualComparisonScreenshots AS B
-        ON  B.ROIScreenshotId = RS.ScreenshotId
-        AND B.OverlayId       = S.OverlayId2
-        AND B.Color           = S.Color2
+      FROM ComparisonSets AS S
+      INNER JOIN Screenshots AS F
+        ON F.ScreenshotId = S.ScreenshotId
+      INNER JOIN Screenshots AS A
+        ON A.ScreenshotId = S.ScreenshotId1
+      INNER JOIN Screenshots AS B
+        ON B.ScreenshotId = S.ScreenshotId2
+      INNER JOIN Screenshots AS RS
+        ON RS.ScreenshotId = S.ROIScreenshotId
       LEFT JOIN ComparisonChoices AS C
         ON C.ScreenshotId = S.ScreenshotId AND C.RaterId = $raterId
-      WHERE A.OverlayId = $id1 AND B.OverlayId = $id2 AND C.BestOverlayId IS NULL
-      AND ` + viewIdConstraint(global.compViewIds[global.activeTask]);
-  if (screenshotId) {
-    query += " AND S.ScreenshotId = " + screenshotId + " GROUP BY S.ScreenshotId";
-  } else {
-    query += " GROUP BY S.ScreenshotId ORDER BY random() LIMIT 1";
-  }
-  global.db.get(query, { $raterId: global.raterId, $id1: id1, $id2: id2 }, function (err, row) {
+      WHERE S.ScreenshotId = $screenshotId
+      AND S.OverlayId1 = $id1 AND S.OverlayId2 = $id2 AND C.BestOverlayId IS NULL`;
+  var args = { screenshotId: screenshotId, id1: id1, id2: id2 };
+  var params = { $raterId: global.raterId, $screenshotId: screenshotId, $id1: id1, $id2: id2 };
+  dbGet('comparison-screenshot', args, query, params, function (err, row) {
       if (err) {
         hideActivePage();
         showErrorMessage(err);
       } else if (row) {
-        var err = null;
-        var color1 = row['Color1'];
-        var color2 = row['Color2'];
-        var overlay1 = row['OverlayId1'];
-        var overlay2 = row['OverlayId2'];
-        var screenshotId1 = row['ScreenshotId1'];
-        var screenshotId2 = row['ScreenshotId2'];
-        var fileName1 = row['FileName1'];
-        var fileName2 = row['FileName2'];
-        if (global.compColors.length == 2) {
-          setCompButtonColor(0, global.compColors[0]);
-          setCompButtonColor(1, global.compColors[1]);
-          if (global.compColors[0] == color1 && global.compColors[1] == color2) {
-            global.compOverlayIds[global.activeTask] = [overlay1, overlay2];
-            setScreenshot("overlay1-view", screenshotId1, fileName1);
-            setScreenshot("overlay2-view", screenshotId2, fileName2);
-          } else if (global.compColors[0] == color2 && global.compColors[1] == color1) {
-            global.compOverlayIds[global.activeTask] = [overlay2, overlay1];
-            setScreenshot("overlay1-view", screenshotId2, fileName2);
-            setScreenshot("overlay2-view", screenshotId1, fileName1);
-          } else {
-            err = "<strong>Internal error:</strong> Expected overlays to have either color " + global.compColors[0] +
-                  " or color " + global.compColors[1] + ", but actual colors are " + color1 + " and " + color2 + " instead!";
-          }
-        } else {
-          var overlayIds = [
-            global.compOverlayIds[global.activeTask][0],
-            global.compOverlayIds[global.activeTask][1]
-          ];
-          shuffle(overlayIds);
-          if (overlayIds[0] == overlay1 && overlayIds[1] == overlay2) {
-            setCompButtonColor(0, color1);
-            setCompButtonColor(1, color2);
-            setScreenshot("overlay1-view", screenshotId1, fileName1);
-            setScreenshot("overlay2-view", screenshotId2, fileName2);
-          } else if (overlayIds[0] == overlay2 && overlayIds[1] == overlay1) {
-            setCompButtonColor(0, color2);
-            setCompButtonColor(1, color1);
-            setScreenshot("overlay1-view", screenshotId2, fileName2);
-            setScreenshot("overlay2-view", screenshotId1, fileName1);
-            order = [1, 0];
-          } else {
-            err = "<strong>Internal error:</strong> Expected overlays to have either color " + global.compColors[0] +
-                  " or color " + global.compColors[1] + ", but actual colors are " + color1 + " and " + color2 + " instead!";
-          }
-        }
-        if (err) {
-          hideActivePage();
-          showError(err);
-        } else {
-          setBoundsScreenshot(row['ROIScreenshotId'], row['ROIScreenshotName']);
-          setZoomedScreenshot(row['ScreenshotId'], row['FileName']);
-          global.compROIScreenshotId[global.activeTask] = row['ROIScreenshotId'];
-          global.compScreenshotId   [global.activeTask] = row['ScreenshotId'];
-          onCompPageReady();
-        }
+        showCompScreenshot(task, row);
+      } else if (global.compQueueId[task]) {
+        // queued screenshot was compared in the meantime, skip it
+        global.compScreenshotId[task] = 0;
+        queryNextCompScreenshot();
       } else {
         hideActivePage();
         showDoneMessage();
@@ -1115,6 +1793,66 @@ function queryNextCompScreenshot() {
     });
 }
 
+function showCompScreenshot(task, row) {
+  var err = null;
+  var color1 = row['Color1'];
+  var color2 = row['Color2'];
+  var overlay1 = row['OverlayId1'];
+  var overlay2 = row['OverlayId2'];
+  var screenshotId1 = row['ScreenshotId1'];
+  var screenshotId2 = row['ScreenshotId2'];
+  var fileName1 = row['FileName1'];
+  var fileName2 = row['FileName2'];
+  if (global.compColors.length == 2) {
+    setCompButtonColor(0, global.compColors[0]);
+    setCompButtonColor(1, global.compColors[1]);
+    if (global.compColors[0] == color1 && global.compColors[1] == color2) {
+      global.compOverlayIds[task] = [overlay1, overlay2];
+      setScreenshot("overlay1-view", screenshotId1, fileName1);
+      setScreenshot("overlay2-view", screenshotId2, fileName2);
+    } else if (global.compColors[0] == color2 && global.compColors[1] == color1) {
+      global.compOverlayIds[task] = [overlay2, overlay1];
+      setScreenshot("overlay1-view", screenshotId2, fileName2);
+      setScreenshot("overlay2-view", screenshotId1, fileName1);
+    } else {
+      err = "<strong>Internal error:</strong> Expected overlays to have either color " + global.compColors[0] +
+            " or color " + global.compColors[1] + ", but actual colors are " + color1 + " and " + color2 + " instead!";
+    }
+  } else {
+    var overlayIds = [
+      global.compOverlayIds[task][0],
+      global.compOverlayIds[task][1]
+    ];
+    shuffle(overlayIds);
+    if (overlayIds[0] == overlay1 && overlayIds[1] == overlay2) {
+      setCompButtonColor(0, color1);
+      setCompButtonColor(1, color2);
+      setScreenshot("overlay1-view", screenshotId1, fileName1);
+      setScreenshot("overlay2-view", screenshotId2, fileName2);
+    } else if (overlayIds[0] == overlay2 && overlayIds[1] == overlay1) {
+      setCompButtonColor(0, color2);
+      setCompButtonColor(1, color1);
+      setScreenshot("overlay1-view", screenshotId2, fileName2);
+      setScreenshot("overlay2-view", screenshotId1, fileName1);
+      order = [1, 0];
+    } else {
+      err = "<strong>Internal error:</strong> Expected overlays to have either color " + global.compColors[0] +
+            " or color " + global.compColors[1] + ", but actual colors are " + color1 + " and " + color2 + " instead!";
+    }
+  }
+  if (err) {
+    hideActivePage();
+    showError(err);
+  } else {
+    setBoundsScreenshot(row['ROIScreenshotId'], row['ROIScreenshotName']);
+    setZoomedScreenshot(row['ScreenshotId'], row['FileName']);
+    global.compROIScreenshotId[task] = row['ROIScreenshotId'];
+    global.compScreenshotId   [task] = row['ScreenshotId'];
+    onCompPageReady();
+    prefetchScreenshots('C', task);
+  }
+}
+
 function onCompPageReady() {
   $("#choice button").click(function (event) {
     var parts = this.id.split('-');
@@ -1145,23 +1883,25 @@ function onCompPageReady() {
 function saveBestOverlayChoice(choice) {
   $("html").off('keyup');
   $("#choice button").off('click');
+  var task = global.activeTask;
   var bestOverlayId = 0;
-  if (0 <= choice && choice < global.compOverlayIds[global.activeTask].length) {
-    bestOverlayId = global.compOverlayIds[global.activeTask][choice];
+  if (0 <= choice && choice < global.compOverlayIds[task].length) {
+    bestOverlayId = global.compOverlayIds[task][choice];
   }
-  var query = `
-    INSERT INTO ComparisonChoices (ScreenshotId, RaterId, BestOverlayId)
-    VALUES ($screenshotId, $raterId, $bestOverlayId)
-  `;
-  global.db.run(
-    query,
-    {
-      $screenshotId: global.compScreenshotId[global.activeTask],
-      $raterId: global.raterId,
-      $bestOverlayId: bestOverlayId
-    },
-    onBestOverlayChoiceSaved
-  );
+  try {
+    appendJournalEntry({
+      type: 'C',
+      raterId: global.raterId,
+      taskId: parseInt(task),
+      queueId: global.compQueueId[task] || 0,
+      screenshotId: global.compScreenshotId[task],
+      bestOverlayId: bestOverlayId
+    });
+  } catch (err) {
+    onBestOverlayChoiceSaved(err);
+    return;
+  }
+  onBestOverlayChoiceSaved(null);
 }
 
 function onBestOverlayChoiceSaved(err) {
@@ -1171,6 +1911,7 @@ function onBestOverlayChoiceSaved(err) {
   } else {
     global.compScreenshotId   [global.activeTask] = 0;
     global.compROIScreenshotId[global.activeTask] = 0;
+    global.compQueueId        [global.activeTask] = 0;
     updateCompPage();
   }
 }
@@ -1178,13 +1919,18 @@ function onBestOverlayChoiceSaved(err) {
 function initCompPage(task) {
   $("#container > div").attr("id", "comp-" + task);
   global.activeTask = task;
-  queryCompOverlayColors(updateCompPage);
+  // screenshots buffered for this task may have been scored in another task
+  invalidatePrefetchBuffers();
+  queryCompOverlayColors(function () {
+    fillCompQueue(task, function (err) {
+      if (!err) updateCompPage();
+    });
+  });
 }
 
 function updateCompPage() {
   $("#comp-" + global.activeTask).hide();
-  queryTotalNumberOfComparisonSets(global.activeTask);
-  queryRemainingNumberOfComparisonSets(global.activeTask);
+  queryRaterProgress('C');
   queryNextCompScreenshot();
 }
 
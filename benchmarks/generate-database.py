@@ -0,0 +1,182 @@
+#!/usr/bin/python
+
+"""Generate large synthetic evaluation database for benchmarking the app's queries.
+
+The database is initialized with tools/create-tables.py and filled with scans, ROIs,
+and the screenshots taken by bin/eval-db for each ROI and orthogonal view: one
+screenshot with ROI bounding box, one for the evaluation of each of the white matter
+and vol2mesh surfaces, one comparison of both surfaces, and the two individual
+comparison screenshots. Each rater scores and compares a random fraction of these
+screenshots. No image files are written.
+"""
+
+import os
+import sys
+import random
+import sqlite3
+import argparse
+import subprocess
+
+
+tools_dir = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tools'))
+
+# IDs of overlays in Overlays table created by create-tables.sql
+ROI_BOUNDS_ID = 1
+WHITE_MATTER_SURFACE_ID = 3
+VOL2MESH_SURFACE_ID = 4
+
+# colors used by the screenshot tools
+ROI_BOUNDS_COLOR = '#f72039'
+SINGLE_OVERLAY_COLOR = '#fff53d'
+COMPARISON_COLORS = ('#00c278', '#ffc13d')
+
+VIEW_IDS = ('A', 'C', 'S')
+
+
+def create_tables(database):
+    """Create tables, views, and indexes of evaluation database."""
+    subprocess.check_call([sys.executable, os.path.join(tools_dir, 'create-tables.py'), database])
+
+
+def insert_raters(db, num_raters):
+    rater_ids = []
+    for i in range(num_raters):
+        cur = db.execute(
+            "INSERT INTO Raters (Email, Password, FirstName, LastName) VALUES (?, ?, ?, ?)",
+            ('rater{}@example.com'.format(i + 1), 'password', 'Rater', str(i + 1)))
+        rater_ids.append(cur.lastrowid)
+    return rater_ids
+
+
+def insert_scans(db, num_scans):
+    db.executemany("INSERT INTO Scans (SubjectId, SessionId) VALUES (?, ?)",
+                   [('CC{:05d}XX{:02d}'.format(i, i % 100), 1000 + i) for i in range(num_scans)])
+    return db.execute("SELECT ScanId, SubjectId, SessionId FROM Scans").fetchall()
+
+
+class ScreenshotWriter(object):
+    """Insert screenshots of ROIs with consecutive IDs using bulk inserts."""
+
+    def __init__(self, db):
+        self.db = db
+        self.next_id = (db.execute("SELECT MAX(ScreenshotId) FROM Screenshots").fetchone()[0] or 0) + 1
+        self.screenshots = []
+        self.overlays = []
+        self.eval_ids = []
+        self.comp_ids = []
+
+    def add(self, roi_id, index, view_id, path, overlays):
+        screenshot_id = self.next_id
+        self.next_id += 1
+        self.screenshots.append((screenshot_id, roi_id, index[0], index[1], index[2], view_id, path))
+        for overlay_id, color in overlays:
+            self.overlays.append((screenshot_id, overlay_id, color))
+        return screenshot_id
+
+    def flush(self):
+        self.db.executemany("""
+            INSERT INTO Screenshots (ScreenshotId, ROI_Id, CenterI, CenterJ, CenterK, ViewId, FileName)
+            VALUES (?, ?, ?, ?, ?, ?, ?)""", self.screenshots)
+        self.db.executemany("INSERT INTO ScreenshotOverlays (ScreenshotId, OverlayId, Color) VALUES (?, ?, ?)",
+                            self.overlays)
+        self.screenshots = []
+        self.overlays = []
+
+
+def insert_rois_and_screenshots(db, scans, rois_per_scan, rng, verbose=0):
+    """Insert ROIs of each scan and the screenshots taken of them."""
+    writer = ScreenshotWriter(db)
+    for n, scan in enumerate(scans):
+        scan_id, subject_id, session_id = scan
+        prefix = '{}-{}'.format(subject_id, session_id)
+        for i in range(rois_per_scan):
+            cur = db.execute("""
+                INSERT INTO ROIs (ScanId, CenterX, CenterY, CenterZ, Span, BestViewId, CommandId)
+                VALUES (?, ?, ?, ?, ?, ?, 1)""",
+                (scan_id, rng.uniform(-40, 40), rng.uniform(-40, 40), rng.uniform(-40, 40),
+                 50., rng.choice(VIEW_IDS)))
+            roi_id = cur.lastrowid
+            colors = list(COMPARISON_COLORS)
+            rng.shuffle(colors)
+            for n_view, view_id in enumerate(VIEW_IDS):
+                index = (rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255))
+                name = 'roi-{:06d}-{:02d}_idx-{:03d}-{:03d}-{:03d}_{{}}{}.png'.format(
+                    roi_id, n_view, index[0], index[1], index[2], view_id.lower())
+                writer.add(roi_id, index, view_id, os.path.join(prefix, 'roi-bounds', name.format('')),
+                           [(ROI_BOUNDS_ID, ROI_BOUNDS_COLOR)])
+                for overlay_id, subdir in ((WHITE_MATTER_SURFACE_ID, 'roi-white-matter-surface'),
+                                           (VOL2MESH_SURFACE_ID, 'roi-vol2mesh-surface')):
+                    writer.eval_ids.append(writer.add(
+                        roi_id, index, view_id, os.path.join(prefix, subdir, name.format('')),
+                        [(overlay_id, SINGLE_OVERLAY_COLOR)]))
+                subdir = os.path.join(prefix, 'roi-vol2mesh-and-white-matter-surface')
+                writer.comp_ids.append(writer.add(
+                    roi_id, index, view_id, os.path.join(subdir, name.format('')),
+                    [(WHITE_MATTER_SURFACE_ID, colors[0]), (VOL2MESH_SURFACE_ID, colors[1])]))
+                for overlay_id, color in ((WHITE_MATTER_SURFACE_ID, colors[0]), (VOL2MESH_SURFACE_ID, colors[1])):
+                    writer.add(roi_id, index, view_id,
+                               os.path.join(subdir, name.format('{}_'.format(overlay_id))),
+                               [(overlay_id, color)])
+        writer.flush()
+        if verbose > 0 and (n + 1) % 100 == 0:
+            print("Inserted ROIs and screenshots of {} scans".format(n + 1))
+    return writer.eval_ids, writer.comp_ids
+
+
+def insert_comparison_sets(db):
+    """Link screenshots shown together in comparison task as done by take-screenshots.py."""
+    db.execute("""
+        INSERT INTO ComparisonSets (ScreenshotId, ROI_Id, ViewId, ROIScreenshotId,
+                                    OverlayId1, Color1, ScreenshotId1,
+                                    OverlayId2, Color2, ScreenshotId2)
+        SELECT * FROM ComparisonSetScreenshots""")
+
+
+def insert_scores(db, rater_ids, eval_ids, comp_ids, ratio, rng):
+    """Insert random evaluation scores and comparison choices of each rater."""
+    for rater_id in rater_ids:
+        ids = rng.sample(eval_ids, int(ratio * len(eval_ids)))
+        db.executemany("INSERT INTO EvaluationScores (ScreenshotId, RaterId, Score) VALUES (?, ?, ?)",
+                       [(screenshot_id, rater_id, rng.choice((0, 1, 2, 2, 3, 3, 3, 4, 4, 4))) for screenshot_id in ids])
+        ids = rng.sample(comp_ids, int(ratio * len(comp_ids)))
+        db.executemany("INSERT INTO ComparisonChoices (ScreenshotId, RaterId, BestOverlayId) VALUES (?, ?, ?)",
+                       [(screenshot_id, rater_id, rng.choice((0, WHITE_MATTER_SURFACE_ID, VOL2MESH_SURFACE_ID)))
+                        for screenshot_id in ids])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('database', help="Output SQLite database file")
+    parser.add_argument('--scans', default=500, type=int, help="Number of scans")
+    parser.add_argument('--rois-per-scan', default=20, type=int, help="Number of ROIs per scan")
+    parser.add_argument('--raters', default=5, type=int, help="Number of raters")
+    parser.add_argument('--scored-ratio', default=.5, type=float,
+                        help="Fraction of screenshots scored and compared by each rater")
+    parser.add_argument('--seed', default=0, type=int, help="Seed of random number generator")
+    parser.add_argument('-f', '--force', action='store_true', help="Overwrite existing database file")
+    parser.add_argument('-v', '--verbose', default=0, action='count', help="Verbosity of output messages")
+    args = parser.parse_args()
+
+    if os.path.exists(args.database):
+        if not args.force:
+            sys.stderr.write("Database file exists, use --force to overwrite it: {}\n".format(args.database))
+            sys.exit(1)
+        os.remove(args.database)
+    rng = random.Random(args.seed)
+    create_tables(args.database)
+    db = sqlite3.connect(args.database)
+    try:
+        db.execute("INSERT INTO Commands (CommandId, Name, Parameters) VALUES (1, 'generate-database.py', '')")
+        rater_ids = insert_raters(db, args.raters)
+        scans = insert_scans(db, args.scans)
+        eval_ids, comp_ids = insert_rois_and_screenshots(db, scans, args.rois_per_scan, rng, verbose=args.verbose)
+        insert_comparison_sets(db)
+        insert_scores(db, rater_ids, eval_ids, comp_ids, args.scored_ratio, rng)
+        db.commit()
+        db.execute("ANALYZE")
+        if args.verbose > 0:
+            for table in ('Scans', 'ROIs', 'Screenshots', 'ScreenshotOverlays', 'ComparisonSets',
+                          'EvaluationScores', 'ComparisonChoices'):
+                print("{:<20} {:>10d}".format(table, db.execute("SELECT COUNT(*) FROM " + table).fetchone()[0]))
+    finally:
+        db.close()
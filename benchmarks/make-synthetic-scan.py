@@ -0,0 +1,178 @@
+#!/usr/bin/python
+
+"""Generate synthetic brain image, tissue labels, and surface meshes for benchmarking.
+
+The synthetic "brain" is a ball with folded white matter (WM) boundary, surrounded
+by a layer of cortical grey matter (cGM) and cerebrospinal fluid (CSF). The WM/cGM
+boundary is given by a radial function of the direction from the image center,
+which is also used to generate the white matter surface mesh. The reference
+surface deviates from it by random Gaussian bumps, such that select-rois finds
+clusters of points with large distance to the reference. Both meshes have a
+CortexMask cell data array which excludes a band around the medial plane.
+
+The output files follow the directory layout expected by bin/eval-db, i.e.,
+
+    images/t2w/{subject}-{session}.nii.gz
+    labels/tissues/{subject}-{session}.nii.gz
+    meshes/{surfaces}/{subject}-{session}/white+internal.vtp
+    meshes/{vol2mesh}/{subject}-{session}/white+internal.vtp
+"""
+
+import os
+import argparse
+import numpy as np
+
+from vtk import (vtkImageData, vtkMatrix4x4, vtkNIFTIImageWriter, vtkSphereSource,
+                 vtkXMLPolyDataWriter, VTK_SHORT, VTK_UNSIGNED_CHAR)
+from vtk.util.numpy_support import numpy_to_vtk, vtk_to_numpy
+
+
+# dHCP tissue labels
+CSF = 1
+CORTEX = 2
+WHITE_MATTER = 3
+
+# mean T2-weighted intensities of tissue classes
+INTENSITIES = {0: 0., CSF: 180., CORTEX: 60., WHITE_MATTER: 110.}
+
+
+def folding(u, radius, amplitude, frequency):
+    """Radius of folded WM/cGM boundary in direction of unit vectors u."""
+    f = np.sin(frequency * u[:, 0]) * np.sin(frequency * u[:, 1]) * np.sin(frequency * u[:, 2])
+    return radius * (1. + amplitude * f)
+
+
+def bumps(u, centers, height, width):
+    """Radial offset of reference surface in direction of unit vectors u."""
+    offset = np.zeros(u.shape[0])
+    for center in centers:
+        d2 = np.sum(np.square(u - center), axis=1)
+        offset += height * np.exp(-.5 * d2 / (width * width))
+    return offset
+
+
+def random_directions(n, rng):
+    """Draw n uniformly distributed unit vectors."""
+    u = rng.normal(size=(n, 3))
+    return u / np.linalg.norm(u, axis=1)[:, np.newaxis]
+
+
+def write_image(fname, data, spacing, dtype):
+    """Write NIfTI image with qform mapping the center voxel to the world origin."""
+    image = vtkImageData()
+    image.SetDimensions(data.shape)
+    image.SetSpacing(spacing, spacing, spacing)
+    image.SetOrigin(0, 0, 0)
+    scalars = numpy_to_vtk(data.ravel(order='F'), deep=True, array_type=dtype)
+    scalars.SetName('scalars')
+    image.GetPointData().SetScalars(scalars)
+    qform = vtkMatrix4x4()
+    for i in range(3):
+        qform.SetElement(i, 3, -.5 * spacing * (data.shape[i] - 1))
+    writer = vtkNIFTIImageWriter()
+    writer.SetFileName(fname)
+    writer.SetInputData(image)
+    writer.SetQFormMatrix(qform)
+    writer.SetSFormMatrix(qform)
+    writer.Write()
+
+
+def make_image(args, rng):
+    """Generate tissue labels and intensity image."""
+    n = args.size
+    x = (np.arange(n, dtype=np.float64) - .5 * (n - 1)) * args.spacing
+    p = np.stack(np.meshgrid(x, x, x, indexing='ij'), axis=-1).reshape(-1, 3)
+    r = np.linalg.norm(p, axis=1)
+    u = p / np.maximum(r, 1e-6)[:, np.newaxis]
+    wm = folding(u, args.radius, args.amplitude, args.frequency)
+    labels = np.zeros(r.shape, dtype=np.uint8)
+    labels[r < wm + args.cortex_thickness + args.csf_thickness] = CSF
+    labels[r < wm + args.cortex_thickness] = CORTEX
+    labels[r < wm] = WHITE_MATTER
+    image = np.zeros(r.shape, dtype=np.float64)
+    for label, mean in INTENSITIES.items():
+        image[labels == label] = mean
+    image += rng.normal(scale=args.noise, size=image.shape)
+    image = np.clip(image, 0, None).astype(np.int16)
+    return labels.reshape((n, n, n)), image.reshape((n, n, n))
+
+
+def make_surface(args, centers=None):
+    """Generate surface mesh of WM/cGM boundary, optionally with reference bumps."""
+    sphere = vtkSphereSource()
+    sphere.SetRadius(1.)
+    sphere.SetThetaResolution(args.resolution)
+    sphere.SetPhiResolution(args.resolution)
+    sphere.LatLongTessellationOff()
+    sphere.Update()
+    mesh = sphere.GetOutput()
+    mesh.GetPointData().Initialize()
+    points = vtk_to_numpy(mesh.GetPoints().GetData()).astype(np.float64)
+    u = points / np.linalg.norm(points, axis=1)[:, np.newaxis]
+    r = folding(u, args.radius, args.amplitude, args.frequency)
+    if centers is not None:
+        r += bumps(u, centers, args.bump_height, args.bump_width)
+    points = u * r[:, np.newaxis]
+    mesh.GetPoints().SetData(numpy_to_vtk(points, deep=True))
+    # exclude medial wall from cortex mask
+    polys = vtk_to_numpy(mesh.GetPolys().GetData()).reshape(-1, 4)[:, 1:]
+    centroids = points[polys].mean(axis=1)
+    mask = (np.abs(centroids[:, 0]) > .5 * args.medial_band).astype(np.uint8)
+    array = numpy_to_vtk(mask, deep=True, array_type=VTK_UNSIGNED_CHAR)
+    array.SetName('CortexMask')
+    mesh.GetCellData().AddArray(array)
+    return mesh
+
+
+def write_surface(fname, mesh):
+    """Write surface mesh to VTK XML file."""
+    writer = vtkXMLPolyDataWriter()
+    writer.SetFileName(fname)
+    writer.SetInputData(mesh)
+    writer.SetDataModeToAppended()
+    writer.Write()
+
+
+def makedirs(fname):
+    """Create parent directory of output file."""
+    directory = os.path.dirname(fname)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    return fname
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('output', help="Output base directory")
+    parser.add_argument('--subject', default='CC00000XX00', help="Subject ID")
+    parser.add_argument('--session', default='1', help="Session ID")
+    parser.add_argument('--surfaces', default='synthetic', help="Name of meshes subdirectory of white matter surfaces")
+    parser.add_argument('--vol2mesh', default='synthetic-vol2mesh', help="Name of meshes subdirectory of reference surfaces")
+    parser.add_argument('--size', default=128, type=int, help="Number of voxels along each image dimension")
+    parser.add_argument('--spacing', default=.8, type=float, help="Voxel size in mm")
+    parser.add_argument('--resolution', default=200, type=int,
+                        help="Theta and phi resolution of surface meshes, the number of cells is about 2 * resolution^2")
+    parser.add_argument('--radius', default=30., type=float, help="Mean radius of white matter surface in mm")
+    parser.add_argument('--amplitude', default=.08, type=float, help="Relative amplitude of cortical folds")
+    parser.add_argument('--frequency', default=12., type=float, help="Frequency of cortical folds")
+    parser.add_argument('--cortex-thickness', default=3., type=float, help="Thickness of cortex in mm")
+    parser.add_argument('--csf-thickness', default=4., type=float, help="Thickness of CSF layer in mm")
+    parser.add_argument('--medial-band', default=4., type=float, help="Width of band around medial plane excluded from CortexMask")
+    parser.add_argument('--bumps', default=40, type=int, help="Number of deviations of reference surface")
+    parser.add_argument('--bump-height', default=2., type=float, help="Maximum deviation of reference surface in mm")
+    parser.add_argument('--bump-width', default=.05, type=float, help="Width of deviations on unit sphere")
+    parser.add_argument('--noise', default=8., type=float, help="Standard deviation of image noise")
+    parser.add_argument('--seed', default=0, type=int, help="Seed of random number generator")
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    name = '{}-{}'.format(args.subject, args.session)
+    labels, image = make_image(args, rng)
+    write_image(makedirs(os.path.join(args.output, 'labels', 'tissues', name + '.nii.gz')),
+                labels, args.spacing, VTK_UNSIGNED_CHAR)
+    write_image(makedirs(os.path.join(args.output, 'images', 't2w', name + '.nii.gz')),
+                image, args.spacing, VTK_SHORT)
+    write_surface(makedirs(os.path.join(args.output, 'meshes', args.surfaces, name, 'white+internal.vtp')),
+                  make_surface(args))
+    write_surface(makedirs(os.path.join(args.output, 'meshes', args.vol2mesh, name, 'white+internal.vtp')),
+                  make_surface(args, centers=random_directions(args.bumps, rng)))
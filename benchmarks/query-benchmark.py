@@ -0,0 +1,448 @@
+#!/usr/bin/python
+
+"""Measure latency of the SQL queries executed by the evaluation app.
+
+The queries are replayed exactly as composed by the functions of app/app.js
+with the same name for the evaluation and comparison tasks stored in the
+database. Queries which modify the database, e.g., saving a score, are run
+inside a transaction that is rolled back afterwards. Keep these in sync with
+app/app.js when changing the app's queries.
+
+Like the app when a task is opened, the work queues of the rater are filled
+before the next screenshot is queried, which modifies the database.
+
+Use generate-database.py to create a large synthetic database.
+"""
+
+import json
+import time
+import sqlite3
+import argparse
+
+# number of screenshots in look-ahead buffer, i.e., global.prefetchSize of app.js
+PREFETCH_SIZE = 4
+
+# number of journal entries written in one transaction, i.e., global.journalBatchSize of app.js
+JOURNAL_BATCH_SIZE = 20
+
+
+def sql_value_in_set(column, cond, values):
+    """Port of sqlValueInSet function of app.js."""
+    if len(values) == 1 and cond == 'NOT IN':
+        return '{} <> {}'.format(column, values[0])
+    if len(values) == 1 and cond == 'IN':
+        return '{} = {}'.format(column, values[0])
+    return '{} {} ({})'.format(column, cond, ', '.join([str(value) for value in values]))
+
+
+def view_id_constraint(view_ids):
+    """Port of viewIdConstraint function of app.js."""
+    query = ''
+    if 'D' in view_ids:
+        if len(view_ids) > 1:
+            query += '(' + sql_value_in_set('S.ViewId', 'IN', view_ids) + ' OR '
+        query += 'S.ViewId = BestViewId'
+        if len(view_ids) > 1:
+            query += ')'
+    else:
+        query += sql_value_in_set('S.ViewId', 'IN', view_ids)
+    return query
+
+
+class App(object):
+    """Queries of app.js for a given rater and active task."""
+
+    def __init__(self, db, rater_id):
+        self.db = db
+        self.rater_id = rater_id
+        self.eval_overlay_ids = {}
+        self.eval_view_ids = {}
+        self.comp_overlay_ids = {}
+        self.comp_view_ids = {}
+        for task_id, overlay_ids, view_ids in db.execute(*self.load_evaluation_tasks()):
+            self.eval_overlay_ids[task_id] = [int(overlay_id) for overlay_id in (overlay_ids or '').split(',') if overlay_id]
+            self.eval_view_ids[task_id] = [view_id for view_id in (view_ids or '').split(',') if view_id]
+        for task_id, id1, id2, view_ids in db.execute(*self.load_comparison_tasks()):
+            self.comp_overlay_ids[task_id] = [min(id1, id2), max(id1, id2)]
+            self.comp_view_ids[task_id] = [view_id for view_id in (view_ids or '').split(',') if view_id]
+
+    # task metadata loaded at log in
+    def load_evaluation_tasks(self):
+        return """
+    SELECT T.EvaluationTaskId,
+      (SELECT group_concat(O.OverlayId) FROM EvaluationOverlays AS O
+       WHERE O.EvaluationTaskId = T.EvaluationTaskId) AS OverlayIds,
+      (SELECT group_concat(V.ViewId) FROM EvaluationViews AS V
+       WHERE V.EvaluationTaskId = T.EvaluationTaskId) AS ViewIds
+    FROM EvaluationTasks AS T
+  """, {}
+
+    def load_comparison_tasks(self):
+        return """
+    SELECT T.ComparisonTaskId, T.OverlayId1, T.OverlayId2,
+      (SELECT group_concat(V.ViewId) FROM ComparisonViews AS V
+       WHERE V.ComparisonTaskId = T.ComparisonTaskId) AS ViewIds
+    FROM ComparisonTasks AS T
+  """, {}
+
+    # work queue of rater
+    def fill_rater_queue(self, task_type, task_id, query):
+        rater_id = str(self.rater_id)
+        task_type = "'" + task_type + "'"
+        task_id = str(task_id)
+        return """
+    INSERT OR IGNORE INTO RaterQueueCursor (RaterId, TaskType, TaskId, Position)
+    VALUES (""" + rater_id + """, """ + task_type + """, """ + task_id + """, 0);
+  """ + """
+    INSERT INTO RaterQueue (RaterId, TaskType, TaskId, ScreenshotId)
+    SELECT """ + rater_id + """, """ + task_type + """, """ + task_id + """, ScreenshotId
+    FROM (""" + query + """)
+    WHERE ScreenshotId NOT IN (
+      SELECT ScreenshotId FROM RaterQueue
+      WHERE RaterId = """ + rater_id + """ AND TaskType = """ + task_type + """ AND TaskId = """ + task_id + """
+    )
+    ORDER BY random();
+  """, None
+
+    def query_queued_screenshots(self, task_type, task_id, after=0, limit=1):
+        if task_type == 'E':
+            query = """
+    SELECT Q.QueueId AS QueueId, Q.ScreenshotId AS ScreenshotId,
+      S.FileName AS FileName, R.ScreenshotId AS ROIScreenshotId, R.FileName AS ROIScreenshotName
+    FROM RaterQueue AS Q
+    INNER JOIN RaterQueueCursor AS K
+      ON K.RaterId = Q.RaterId AND K.TaskType = Q.TaskType AND K.TaskId = Q.TaskId
+    INNER JOIN Screenshots AS S
+      ON S.ScreenshotId = Q.ScreenshotId
+    LEFT JOIN ScreenshotTypes AS T
+      ON T.ScreenshotId = Q.ScreenshotId
+    LEFT JOIN Screenshots AS R
+      ON R.ScreenshotId = T.ROIScreenshotId
+    LEFT JOIN EvaluationScores AS E
+      ON E.ScreenshotId = Q.ScreenshotId AND E.RaterId = Q.RaterId
+    WHERE E.Score IS NULL"""
+        else:
+            query = """
+    SELECT Q.QueueId AS QueueId, Q.ScreenshotId AS ScreenshotId,
+      F.FileName AS FileName, A.FileName AS FileName1, B.FileName AS FileName2,
+      R.FileName AS ROIScreenshotName, S.ROIScreenshotId AS ROIScreenshotId,
+      S.ScreenshotId1 AS ScreenshotId1, S.OverlayId1 AS OverlayId1, S.Color1 AS Color1,
+      S.ScreenshotId2 AS ScreenshotId2, S.OverlayId2 AS OverlayId2, S.Color2 AS Color2
+    FROM RaterQueue AS Q
+    INNER JOIN RaterQueueCursor AS K
+      ON K.RaterId = Q.RaterId AND K.TaskType = Q.TaskType AND K.TaskId = Q.TaskId
+    INNER JOIN ComparisonSets AS S
+      ON S.ScreenshotId = Q.ScreenshotId
+    INNER JOIN Screenshots AS F
+      ON F.ScreenshotId = S.ScreenshotId
+    INNER JOIN Screenshots AS A
+      ON A.ScreenshotId = S.ScreenshotId1
+    INNER JOIN Screenshots AS B
+      ON B.ScreenshotId = S.ScreenshotId2
+    INNER JOIN Screenshots AS R
+      ON R.ScreenshotId = S.ROIScreenshotId
+    LEFT JOIN ComparisonChoices AS C
+      ON C.ScreenshotId = Q.ScreenshotId AND C.RaterId = Q.RaterId
+    WHERE C.BestOverlayId IS NULL"""
+        query += """
+    AND Q.RaterId = $raterId AND Q.TaskType = $taskType AND Q.TaskId = $taskId
+    AND Q.QueueId > K.Position AND Q.QueueId > $after
+    ORDER BY Q.QueueId LIMIT $limit"""
+        return query, {'raterId': self.rater_id, 'taskType': task_type, 'taskId': task_id,
+                       'after': after, 'limit': limit}
+
+    def advance_rater_queue_cursor(self, task_type, task_id, queue_id):
+        return """
+    UPDATE RaterQueueCursor SET Position = MAX(Position, """ + str(queue_id or 0) + """)
+    WHERE RaterId = """ + str(self.rater_id) + """ AND TaskType = '""" + task_type + """' AND TaskId = """ + str(task_id) + """;
+  """
+
+    # progress for both summary and task pages
+    def query_rater_progress(self, task_type, task_ids):
+        return """
+    SELECT TaskId, Total, Done FROM RaterProgress
+    WHERE RaterId = $raterId AND TaskType = $taskType
+    AND """ + sql_value_in_set('TaskId', 'IN', task_ids), {'raterId': self.rater_id, 'taskType': task_type}
+
+    # evaluation task
+    def fill_eval_queue(self, task_id):
+        query = """
+    SELECT DISTINCT(S.ScreenshotId) AS ScreenshotId
+    FROM EvaluationScreenshots AS S
+    LEFT JOIN ROIs AS R
+      ON S.ROI_Id = R.ROI_Id
+    WHERE """ + sql_value_in_set('OverlayId', 'IN', self.eval_overlay_ids[task_id]) + """
+    AND """ + view_id_constraint(self.eval_view_ids[task_id])
+        return self.fill_rater_queue('E', task_id, query)
+
+    def query_next_eval_screenshot(self, task_id, screenshot_id):
+        query = """
+    SELECT S.ScreenshotId AS ScreenshotId, FileName, ROIScreenshotId, ROIScreenshotName
+    FROM EvaluationScreenshots AS S
+    LEFT JOIN ROIs AS R
+      ON S.ROI_Id = R.ROI_Id
+    LEFT JOIN EvaluationScores AS E
+      ON E.ScreenshotId = S.ScreenshotId AND RaterId = $raterId
+    WHERE Score IS NULL
+    AND """ + sql_value_in_set('OverlayId', 'IN', self.eval_overlay_ids[task_id]) + """
+    AND """ + view_id_constraint(self.eval_view_ids[task_id])
+        query += " AND S.ScreenshotId = " + str(screenshot_id)
+        return query, {'raterId': self.rater_id}
+
+    def update_undo_link(self):
+        return ("SELECT * FROM EvaluationScores WHERE RaterId = " + str(self.rater_id) +
+                " AND NOT Score IS NULL LIMIT 1"), {}
+
+    def undo_last_quality_score(self):
+        return ("SELECT ScreenshotId, Score FROM EvaluationScores WHERE RaterId = " + str(self.rater_id) +
+                " ORDER BY _rowid_ DESC LIMIT 1"), {}
+
+    def save_quality_score(self, task_id, queue_id, screenshot_id, score):
+        return ("INSERT OR IGNORE INTO EvaluationScores (ScreenshotId, RaterId, Score)" +
+                " VALUES (" + str(screenshot_id) + ", " + str(self.rater_id) + ", " + str(score) + ");" +
+                self.advance_rater_queue_cursor('E', task_id, queue_id)), None
+
+    def save_quality_score_discard(self, task_id, queue_id, roi_screenshot_id):
+        rater_id = str(self.rater_id)
+        roi_id = str(roi_screenshot_id)
+        return """
+      INSERT INTO EvaluationScores (ScreenshotId, RaterId, Score)
+      SELECT S.ScreenshotId AS ScreenshotId, """ + rater_id + """ AS RaterId, 0 AS Score
+      FROM EvaluationScreenshots AS S
+      LEFT JOIN EvaluationScores AS E
+        ON E.ScreenshotId = S.ScreenshotId AND E.RaterId = """ + rater_id + """
+      WHERE E.Score IS NULL AND S.ROIScreenshotId = """ + roi_id + """;
+    """ + """
+      INSERT INTO ComparisonChoices (ScreenshotId, RaterId, BestOverlayId)
+      SELECT DISTINCT(S.ScreenshotId) AS ScreenshotId, """ + rater_id + """ AS RaterId, 0 AS BestOverlayId
+      FROM ComparisonScreenshots AS S
+      LEFT JOIN ROIScreenshots AS R
+        ON  R.ROI_Id  = S.ROI_Id
+        AND R.CenterI = S.CenterI
+        AND R.CenterJ = S.CenterJ
+        AND R.CenterK = S.CenterK
+        AND R.ViewId  = S.ViewId
+      LEFT JOIN ComparisonChoices AS C
+        ON C.ScreenshotId = S.ScreenshotId AND C.RaterId = """ + rater_id + """
+      WHERE C.BestOverlayId IS NULL AND R.ScreenshotId = """ + roi_id + """;
+    """ + self.advance_rater_queue_cursor('E', task_id, queue_id), None
+
+    # comparison task
+    def query_comp_overlay_colors(self, task_id):
+        id1, id2 = self.comp_overlay_ids[task_id]
+        return """
+    SELECT DISTINCT(Color) AS Color FROM ScreenshotOverlays
+    WHERE ScreenshotId IN (
+      SELECT ScreenshotId FROM ComparisonSets
+      WHERE OverlayId1 = $id1 AND OverlayId2 = $id2
+    )
+    ORDER BY Color
+  """, {'id1': id1, 'id2': id2}
+
+    def fill_comp_queue(self, task_id):
+        id1, id2 = self.comp_overlay_ids[task_id]
+        query = """
+      SELECT S.ScreenshotId AS ScreenshotId
+      FROM ComparisonSets AS S
+      LEFT JOIN ROIs AS R
+        ON S.ROI_Id = R.ROI_Id
+      WHERE S.OverlayId1 = """ + str(id1) + """ AND S.OverlayId2 = """ + str(id2) + """
+      AND """ + view_id_constraint(self.comp_view_ids[task_id])
+        return self.fill_rater_queue('C', task_id, query)
+
+    def query_next_comp_screenshot(self, task_id, screenshot_id):
+        id1, id2 = self.comp_overlay_ids[task_id]
+        return """
+      SELECT
+        S.ScreenshotId AS ScreenshotId,
+        F.FileName AS FileName,
+        S.ScreenshotId1 AS ScreenshotId1,
+        A.FileName AS FileName1,
+        S.OverlayId1 AS OverlayId1,
+        S.Color1 AS Color1,
+        S.ScreenshotId2 AS ScreenshotId2,
+        B.FileName AS FileName2,
+        S.OverlayId2 AS OverlayId2,
+        S.Color2 AS Color2,
+        S.ROIScreenshotId AS ROIScreenshotId,
+        RS.FileName AS ROIScreenshotName
+      FROM ComparisonSets AS S
+      INNER JOIN Screenshots AS F
+        ON F.ScreenshotId = S.ScreenshotId
+      INNER JOIN Screenshots AS A
+        ON A.ScreenshotId = S.ScreenshotId1
+      INNER JOIN Screenshots AS B
+        ON B.ScreenshotId = S.ScreenshotId2
+      INNER JOIN Screenshots AS RS
+        ON RS.ScreenshotId = S.ROIScreenshotId
+      LEFT JOIN ComparisonChoices AS C
+        ON C.ScreenshotId = S.ScreenshotId AND C.RaterId = $raterId
+      WHERE S.ScreenshotId = $screenshotId
+      AND S.OverlayId1 = $id1 AND S.OverlayId2 = $id2 AND C.BestOverlayId IS NULL""", \
+            {'raterId': self.rater_id, 'screenshotId': screenshot_id, 'id1': id1, 'id2': id2}
+
+    def save_best_overlay_choice(self, task_id, queue_id, screenshot_id, best_overlay_id):
+        return """
+    INSERT OR IGNORE INTO ComparisonChoices (ScreenshotId, RaterId, BestOverlayId)
+    VALUES (""" + str(screenshot_id) + """, """ + str(self.rater_id) + """, """ + str(best_overlay_id) + """);
+  """ + self.advance_rater_queue_cursor('C', task_id, queue_id), None
+
+
+def execute(db, query, params, write=False):
+    """Execute query and fetch all rows, roll back changes made by write queries.
+
+    When params is None, the query consists of multiple statements separated by ';'.
+    """
+    if write:
+        db.execute("SAVEPOINT benchmark")
+    try:
+        if params is None:
+            for sql in query.split(';'):
+                if sql.strip():
+                    db.execute(sql)
+            return []
+        return db.execute(query, params).fetchall()
+    finally:
+        if write:
+            db.execute("ROLLBACK TO benchmark")
+            db.execute("RELEASE benchmark")
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.
+    k = (len(values) - 1) * p / 100.
+    i = int(k)
+    j = min(i + 1, len(values) - 1)
+    return values[i] + (values[j] - values[i]) * (k - i)
+
+
+def benchmark(db, name, make_query, repeat, write=False):
+    """Measure latency of query composed anew for each repetition."""
+    times = []
+    for i in range(repeat):
+        query, params = make_query()
+        start = time.time()
+        execute(db, query, params, write=write)
+        times.append(time.time() - start)
+    return {
+        'query': name,
+        'repeat': repeat,
+        'mean': sum(times) / len(times),
+        'min': min(times),
+        'p50': percentile(times, 50),
+        'p99': percentile(times, 99),
+        'max': max(times)
+    }
+
+
+def run_benchmarks(db, app, repeat, names=None, callback=None):
+    """Benchmark the queries executed by the app for each evaluation and comparison task.
+
+    Args:
+        names: Names of app.js functions whose queries to benchmark, all if None.
+        callback: Function called with the result of each query once it is done.
+    """
+    results = []
+
+    def run(name, make_query, write=False):
+        if names and name.split('/')[-1].split('(')[0] not in names:
+            return
+        result = benchmark(db, name, make_query, repeat, write=write)
+        results.append(result)
+        if callback:
+            callback(result)
+
+    run('loadEvaluationTasks', app.load_evaluation_tasks)
+    run('loadComparisonTasks', app.load_comparison_tasks)
+
+    for task_id in sorted(app.eval_overlay_ids):
+        prefix = 'eval-{}/'.format(task_id)
+        run(prefix + 'fillEvalQueue',
+            lambda: app.fill_eval_queue(task_id), write=True)
+        execute(db, *app.fill_eval_queue(task_id))
+        run(prefix + 'queryRaterProgress',
+            lambda: app.query_rater_progress('E', [task_id]))
+        run(prefix + 'queryQueuedScreenshots',
+            lambda: app.query_queued_screenshots('E', task_id))
+        run(prefix + 'queryQueuedScreenshots(prefetch)',
+            lambda: app.query_queued_screenshots('E', task_id, limit=PREFETCH_SIZE))
+        queued = db.execute(*app.query_queued_screenshots('E', task_id)).fetchone()
+        unscored = None
+        if queued:
+            unscored = db.execute(*app.query_next_eval_screenshot(task_id, queued[1])).fetchone()
+        if unscored:
+            run(prefix + 'queryNextEvalScreenshot(id)',
+                lambda: app.query_next_eval_screenshot(task_id, unscored[0]))
+            run(prefix + 'saveQualityScore',
+                lambda: app.save_quality_score(task_id, queued[0], unscored[0], 3), write=True)
+            if unscored[2]:
+                run(prefix + 'saveQualityScore(discard)',
+                    lambda: app.save_quality_score_discard(task_id, queued[0], unscored[2]), write=True)
+        batch = db.execute(*app.query_queued_screenshots('E', task_id, limit=JOURNAL_BATCH_SIZE)).fetchall()
+        if batch:
+            run(prefix + 'flushScoreJournal',
+                lambda: (''.join([app.save_quality_score(task_id, row[0], row[1], 3)[0] for row in batch]), None),
+                write=True)
+    run('updateUndoLink', app.update_undo_link)
+    run('undoLastQualityScore', app.undo_last_quality_score)
+
+    for task_id in sorted(app.comp_overlay_ids):
+        prefix = 'comp-{}/'.format(task_id)
+        run(prefix + 'queryCompOverlayColors',
+            lambda: app.query_comp_overlay_colors(task_id))
+        run(prefix + 'fillCompQueue',
+            lambda: app.fill_comp_queue(task_id), write=True)
+        execute(db, *app.fill_comp_queue(task_id))
+        run(prefix + 'queryRaterProgress',
+            lambda: app.query_rater_progress('C', [task_id]))
+        run(prefix + 'queryQueuedScreenshots',
+            lambda: app.query_queued_screenshots('C', task_id))
+        run(prefix + 'queryQueuedScreenshots(prefetch)',
+            lambda: app.query_queued_screenshots('C', task_id, limit=PREFETCH_SIZE))
+        queued = db.execute(*app.query_queued_screenshots('C', task_id)).fetchone()
+        unscored = None
+        if queued:
+            unscored = db.execute(*app.query_next_comp_screenshot(task_id, queued[1])).fetchone()
+        if unscored:
+            run(prefix + 'queryNextCompScreenshot(id)',
+                lambda: app.query_next_comp_screenshot(task_id, unscored[0]))
+            run(prefix + 'saveBestOverlayChoice',
+                lambda: app.save_best_overlay_choice(task_id, queued[0], unscored[0], unscored[4]), write=True)
+
+    # summary of all tasks on open page
+    if app.eval_overlay_ids:
+        run('updateSummary(eval)',
+            lambda: app.query_rater_progress('E', sorted(app.eval_overlay_ids)))
+    if app.comp_overlay_ids:
+        run('updateSummary(comp)',
+            lambda: app.query_rater_progress('C', sorted(app.comp_overlay_ids)))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('database', help="SQLite database file")
+    parser.add_argument('--rater', default=1, type=int, help="ID of rater")
+    parser.add_argument('--repeat', default=10, type=int, help="Number of executions of each query")
+    parser.add_argument('--queries', nargs='+', help="Names of app.js functions whose queries to benchmark")
+    parser.add_argument('--output', help="Write results to JSON file")
+    args = parser.parse_args()
+
+    def print_result(result):
+        print("{:<56} {:>6d} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+            result['query'], result['repeat'], 1e3 * result['mean'],
+            1e3 * result['p50'], 1e3 * result['p99'], 1e3 * result['max']))
+
+    print("{:<56} {:>6} {:>10} {:>10} {:>10} {:>10}".format("Query", "Runs", "Mean [ms]", "p50 [ms]", "p99 [ms]", "Max [ms]"))
+    db = sqlite3.connect(args.database, isolation_level=None)
+    try:
+        app = App(db, args.rater)
+        results = run_benchmarks(db, app, args.repeat, names=args.queries, callback=print_result)
+    finally:
+        db.close()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
@@ -0,0 +1,292 @@
+#!/usr/bin/python
+
+"""Time the stages of the evaluation database pipeline on synthetic data.
+
+For each combination of mesh resolution and number of ROIs, a synthetic scan
+is generated with make-synthetic-scan.py and the tools are run in the same
+order as by bin/eval-db, i.e., database ingest, intensity range, ROI selection,
+and each screenshot pass. The wall time and throughput of each stage are
+compared to the stored baselines, and stages whose time increased by more than
+the given tolerance are reported as regressions.
+
+Stages whose prerequisites are missing, e.g., the select-rois binary has not
+been built or the MIRTK is not installed, are reported as failed and skipped.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import sqlite3
+import argparse
+import platform
+import tempfile
+import subprocess
+
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+tools_dir = os.path.normpath(os.path.join(bench_dir, '..', 'tools'))
+
+# IDs of overlays in Overlays table created by create-tables.sql
+ROI_BOUNDS_ID = 1
+WHITE_MATTER_SURFACE_ID = 3
+VOL2MESH_SURFACE_ID = 4
+
+# intensity range of synthetic images used when calculate-intensity-range fails
+DEFAULT_RANGE = (60., 160.)
+
+
+def run(argv, verbose=0):
+    """Execute command and return its wall time and output."""
+    argv = [str(arg) for arg in argv]
+    if verbose > 1:
+        print(' '.join(['"' + arg + '"' if ' ' in arg else arg for arg in argv]))
+    start = time.time()
+    proc = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = proc.communicate()[0]
+    wall_time = time.time() - start
+    if not isinstance(output, str):
+        output = output.decode('utf-8', 'replace')
+    if proc.returncode != 0:
+        raise Exception("Command failed with exit code {}: {}\n{}".format(proc.returncode, ' '.join(argv), output))
+    return wall_time, output
+
+
+def count_rows(database, sql):
+    db = sqlite3.connect(database)
+    try:
+        return db.execute(sql).fetchone()[0]
+    finally:
+        db.close()
+
+
+def count_screenshots(database, overlay_ids):
+    """Count screenshots with the given set of overlays."""
+    return count_rows(database, """
+        SELECT COUNT(*) FROM (
+            SELECT ScreenshotId FROM ScreenshotOverlays
+            GROUP BY ScreenshotId
+            HAVING GROUP_CONCAT(OverlayId) IN ('{0}', '{1}')
+        )""".format(','.join([str(i) for i in overlay_ids]),
+                    ','.join([str(i) for i in reversed(overlay_ids)])))
+
+
+def write_sessions(fname, num_scans, subject, session):
+    """Write CSV file with synthetic scans to be imported into database."""
+    with open(fname, 'w') as f:
+        f.write('SubjectId,SessionId\n')
+        f.write('{},{}\n'.format(subject, session))
+        for i in range(1, num_scans):
+            f.write('CC{:05d}XX{:02d},{}\n'.format(i, i % 100, 1000 + i))
+
+
+class Benchmark(object):
+    """Run stages of the pipeline for one configuration."""
+
+    def __init__(self, args, resolution, num_rois):
+        self.args = args
+        self.resolution = resolution
+        self.num_rois = num_rois
+        self.name = 'mesh-{}_rois-{}'.format(resolution, num_rois)
+        self.work_dir = os.path.join(args.work_dir, self.name)
+        self.subject = 'CC00000XX00'
+        self.session = '1'
+        scan = '{}-{}'.format(self.subject, self.session)
+        self.database = os.path.join(self.work_dir, 'db', 'eval.db')
+        self.image = os.path.join(self.work_dir, 'images', 't2w', scan + '.nii.gz')
+        self.labels = os.path.join(self.work_dir, 'labels', 'tissues', scan + '.nii.gz')
+        self.surface = os.path.join(self.work_dir, 'meshes', 'synthetic', scan, 'white+internal.vtp')
+        self.reference = os.path.join(self.work_dir, 'meshes', 'synthetic-vol2mesh', scan, 'white+internal.vtp')
+        self.screenshots = os.path.join(self.work_dir, 'db', scan)
+        self.range = DEFAULT_RANGE
+        self.results = []
+
+    def stage(self, name, func, unit):
+        """Run stage and record its wall time and number of processed items."""
+        if self.args.verbose > 0:
+            sys.stdout.write("{} {}... ".format(self.name, name))
+            sys.stdout.flush()
+        result = {'config': self.name, 'stage': name, 'unit': unit,
+                  'resolution': self.resolution, 'rois': self.num_rois}
+        try:
+            wall_time, items = func()
+            result['wall_time'] = wall_time
+            result['items'] = items
+            result['throughput'] = items / wall_time if wall_time > 0. else 0.
+            if self.args.verbose > 0:
+                print("{:.2f}s".format(wall_time))
+        except Exception as e:
+            result['error'] = str(e).splitlines()[0]
+            if self.args.verbose > 0:
+                print("failed")
+            if self.args.verbose > 1:
+                print(str(e))
+        self.results.append(result)
+        return result
+
+    def generate(self):
+        if os.path.isdir(self.work_dir):
+            shutil.rmtree(self.work_dir)
+        os.makedirs(os.path.dirname(self.database))
+        run([sys.executable, os.path.join(bench_dir, 'make-synthetic-scan.py'), self.work_dir,
+             '--subject', self.subject, '--session', self.session,
+             '--size', self.args.image_size, '--resolution', self.resolution,
+             '--seed', self.args.seed], verbose=self.args.verbose)
+
+    def ingest(self):
+        csv_name = os.path.join(self.work_dir, 'sessions.csv')
+        write_sessions(csv_name, self.args.num_scans, self.subject, self.session)
+        wall_time, _ = run([os.path.join(tools_dir, 'create-tables.py'), self.database], verbose=self.args.verbose)
+        wall_time += run([os.path.join(tools_dir, 'import-scans.py'), csv_name, self.database],
+                         verbose=self.args.verbose)[0]
+        return wall_time, count_rows(self.database, "SELECT COUNT(*) FROM Scans")
+
+    def intensity_range(self):
+        wall_time, output = run([os.path.join(tools_dir, 'calculate-intensity-range.py'), self.image,
+                                 '-tissues', self.labels, '-lower-sigma', 5, '-upper-sigma', 4],
+                                verbose=self.args.verbose)
+        self.range = tuple([float(x) for x in output.split()[-2:]])
+        return wall_time, 1
+
+    def select_rois(self):
+        wall_time, _ = run([
+            os.path.join(tools_dir, 'select-rois.py'), self.database,
+            '--subject', self.subject, '--session', self.session,
+            '--surface', self.surface, '--reference', self.reference, '--image', self.image,
+            '--cluster-centers', '--mask-name', 'CortexMask', '--mask-erosion', 10,
+            '--roi-span', 50, '--overlap-span', 30, '--max-overlap-ratio', .75,
+            '--random-points-ratio', .25, '-n', self.num_rois
+        ], verbose=self.args.verbose)
+        return wall_time, count_rows(self.database, "SELECT COUNT(*) FROM ROIs")
+
+    def take_screenshots_of_roi_bounds(self):
+        wall_time, _ = run([
+            os.path.join(tools_dir, 'take-screenshots-of-roi-bounds.py'), self.database,
+            '--subject', self.subject, '--session', self.session, '--image', self.image,
+            '--prefix', os.path.join(self.screenshots, 'roi-bounds'),
+            '--range', self.range[0], self.range[1], '--offsets', 0, '--line-width', 3
+        ], verbose=self.args.verbose)
+        return wall_time, count_screenshots(self.database, [ROI_BOUNDS_ID])
+
+    def take_screenshots(self, name, overlays):
+        argv = [
+            os.path.join(tools_dir, 'take-screenshots.py'), self.database,
+            '--subject', self.subject, '--session', self.session, '--image', self.image,
+            '--prefix', os.path.join(self.screenshots, name),
+            '--range', self.range[0], self.range[1], '--offsets', 0, '--line-width', 3
+        ]
+        for overlay in overlays:
+            argv.extend(['--overlay', overlay[0], overlay[1]])
+        if len(overlays) > 1:
+            argv.append('--shuffle-colors')
+        wall_time, _ = run(argv, verbose=self.args.verbose)
+        return wall_time, count_screenshots(self.database, [overlay[0] for overlay in overlays])
+
+    def run(self):
+        self.generate()
+        self.stage('ingest', self.ingest, 'scans')
+        self.stage('calculate-intensity-range', self.intensity_range, 'images')
+        self.stage('select-rois', self.select_rois, 'rois')
+        self.stage('take-screenshots:roi-bounds', self.take_screenshots_of_roi_bounds, 'screenshots')
+        self.stage('take-screenshots:roi-white-matter-surface', lambda: self.take_screenshots(
+            'roi-white-matter-surface', [(WHITE_MATTER_SURFACE_ID, self.surface)]), 'screenshots')
+        self.stage('take-screenshots:roi-vol2mesh-surface', lambda: self.take_screenshots(
+            'roi-vol2mesh-surface', [(VOL2MESH_SURFACE_ID, self.reference)]), 'screenshots')
+        self.stage('take-screenshots:roi-vol2mesh-and-white-matter-surface', lambda: self.take_screenshots(
+            'roi-vol2mesh-and-white-matter-surface', [(WHITE_MATTER_SURFACE_ID, self.surface),
+                                                      (VOL2MESH_SURFACE_ID, self.reference)]), 'screenshots')
+        return self.results
+
+
+def read_baselines(fname):
+    """Read baseline results indexed by (config, stage)."""
+    if not os.path.isfile(fname):
+        return {}
+    with open(fname) as f:
+        info = json.load(f)
+    return dict([((result['config'], result['stage']), result) for result in info['results']])
+
+
+def write_baselines(fname, results):
+    """Write results of successful stages as new baselines."""
+    info = {
+        'host': socket.gethostname(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'results': [result for result in results if 'error' not in result]
+    }
+    with open(fname, 'w') as f:
+        json.dump(info, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def print_report(results, baselines, tolerance):
+    """Print table of results and return number of regressions."""
+    regressions = 0
+    print("\n{:<20} {:<56} {:>10} {:>14} {:>10} {:>8}".format(
+        "Config", "Stage", "Wall [s]", "Throughput", "Baseline", "Change"))
+    for result in results:
+        if 'error' in result:
+            print("{:<20} {:<56} {:>10} {}".format(result['config'], result['stage'], "failed", result['error']))
+            continue
+        throughput = "{:.2f} {}/s".format(result['throughput'], result['unit'])
+        baseline = baselines.get((result['config'], result['stage']))
+        if baseline:
+            change = result['wall_time'] / baseline['wall_time'] - 1. if baseline['wall_time'] > 0. else 0.
+            line = "{:>10.2f} {:>+7.1f}%".format(baseline['wall_time'], 100. * change)
+            if change > tolerance:
+                line += "  REGRESSION"
+                regressions += 1
+        else:
+            line = "{:>10} {:>8}".format("-", "-")
+        print("{:<20} {:<56} {:>10.2f} {:>14} {}".format(
+            result['config'], result['stage'], result['wall_time'], throughput, line))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--work-dir', help="Directory for synthetic data and databases (default: temporary directory)")
+    parser.add_argument('--keep', action='store_true', help="Keep working directory")
+    parser.add_argument('--resolutions', default=[100, 200], nargs='+', type=int,
+                        help="Theta and phi resolutions of synthetic surface meshes")
+    parser.add_argument('--rois', default=[10, 40], nargs='+', type=int,
+                        help="Numbers of ROIs to select")
+    parser.add_argument('--num-scans', default=500, type=int, help="Number of scans imported into database")
+    parser.add_argument('--image-size', default=128, type=int, help="Number of voxels along each image dimension")
+    parser.add_argument('--seed', default=0, type=int, help="Seed of random number generator")
+    parser.add_argument('--baselines', default=os.path.join(bench_dir, 'baselines.json'),
+                        help="JSON file with baseline results")
+    parser.add_argument('--save-baselines', action='store_true', help="Save results as new baselines")
+    parser.add_argument('--tolerance', default=.2, type=float,
+                        help="Relative increase of wall time reported as regression")
+    parser.add_argument('--output', help="Write results to JSON file")
+    parser.add_argument('-v', '--verbose', default=1, action='count', help="Verbosity of output messages")
+    args = parser.parse_args()
+
+    remove_work_dir = False
+    if args.work_dir:
+        args.work_dir = os.path.abspath(args.work_dir)
+    else:
+        args.work_dir = tempfile.mkdtemp(prefix='eval-db-benchmarks-')
+        remove_work_dir = not args.keep
+    try:
+        results = []
+        for resolution in args.resolutions:
+            for num_rois in args.rois:
+                results.extend(Benchmark(args, resolution, num_rois).run())
+    finally:
+        if remove_work_dir:
+            shutil.rmtree(args.work_dir)
+    regressions = print_report(results, read_baselines(args.baselines), args.tolerance)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+    if args.save_baselines:
+        write_baselines(args.baselines, results)
+        print("\nSaved baselines to " + args.baselines)
+    sys.exit(1 if regressions > 0 else 0)
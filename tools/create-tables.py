@@ -1,15 +1,52 @@
 #!/usr/bin/python
 
-"""Initialize SQLite database"""
+"""Initialize SQLite database or upgrade the schema of an existing database
+
+The tables of a new database are created by create-tables.sql. The SQL scripts
+in the migrations directory are then applied in the order of the version number
+at the start of their file name to both new and existing databases. The version
+of the last applied migration is stored as PRAGMA user_version, such that only
+newer migrations are applied to a database which is already in use. The query
+planner statistics are updated by ANALYZE after migrating an existing database."""
 
 import os
+import re
 import sqlite3
 import argparse
 
-script_name = os.path.join(os.path.dirname(__file__), 'create-tables.sql')
+script_dir = os.path.dirname(os.path.abspath(__file__))
+script_name = os.path.join(script_dir, 'create-tables.sql')
+migrations_dir = os.path.join(script_dir, 'migrations')
+
+
+def migrations():
+    """Get list of (version, path) of migration scripts sorted by version."""
+    scripts = []
+    for name in os.listdir(migrations_dir):
+        match = re.match(r'^([0-9]+)-.*\.sql$', name)
+        if match:
+            scripts.append((int(match.group(1)), os.path.join(migrations_dir, name)))
+    return sorted(scripts)
+
+
+def execute_script(cur, path):
+    """Execute statements of SQL script within the current transaction.
+
+    Unlike sqlite3.Cursor.executescript, this does not commit a pending transaction
+    first, such that all scripts are applied atomically."""
+    statement = ''
+    with open(path, 'r') as f:
+        for line in f:
+            statement += line
+            if sqlite3.complete_statement(statement):
+                cur.execute(statement)
+                statement = ''
+
 
 parser = argparse.ArgumentParser(description=__doc__)
 parser.add_argument('database', help="SQLite database file")
+parser.add_argument('--analyze', action='store_true',
+                    help="Update query planner statistics even when no migration was applied")
 args = parser.parse_args()
 
 args.database = os.path.abspath(args.database)
@@ -17,12 +54,34 @@ directory = os.path.dirname(args.database)
 if not os.path.isdir(directory):
     os.makedirs(directory)
 
-con = sqlite3.connect(args.database)
+con = sqlite3.connect(args.database, timeout=600, isolation_level=None)
 cur = con.cursor()
 
-with open(script_name, 'r') as f:
-    cur.executescript(f.read())
+# lock database such that concurrent pipeline jobs do not migrate it twice
+cur.execute("BEGIN IMMEDIATE")
+try:
+    cur.execute("PRAGMA user_version")
+    version = cur.fetchone()[0]
+    cur.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'Scans'")
+    created = (cur.fetchone()[0] == 0)
+    if created:
+        execute_script(cur, script_name)
+    applied = []
+    for migration, path in migrations():
+        if migration > version:
+            execute_script(cur, path)
+            applied.append(migration)
+    if applied:
+        cur.execute("PRAGMA user_version = {:d}".format(applied[-1]))
+    cur.execute("COMMIT")
+except BaseException:
+    cur.execute("ROLLBACK")
+    raise
+
+if applied and not created:
+    print("Migrated database from version {} to {}".format(version, applied[-1]))
+if args.analyze or (applied and not created):
+    cur.execute("ANALYZE")
 
-con.commit()
 cur.close()
 con.close()
@@ -236,62 +236,11 @@ CREATE TABLE ScreenshotOverlays
     FOREIGN KEY (OverlayId) REFERENCES Overlays(OverlayId)
 );
 
--- Table of screenshots with only ROI bounding box overlay
-CREATE VIEW ROIScreenshots AS
-SELECT S.*, O1.OverlayId FROM Screenshots AS S
-LEFT JOIN ScreenshotOverlays AS O1 ON O1.ScreenshotId = S.ScreenshotId
-LEFT JOIN ScreenshotOverlays AS O2 ON O2.ScreenshotId = S.ScreenshotId
-    AND O2.OverlayId <> O1.OverlayId
-WHERE O1.OverlayId = 1 AND O2.OverlayId IS NULL;
-
--- Table of screenshots with exactly one overlay to be evaluated
-CREATE VIEW EvaluationScreenshots AS
-SELECT S.*,
-    O1.OverlayId   AS OverlayId,
-    R.ScreenshotId AS ROIScreenshotId,
-    R.FileName     AS ROIScreenshotName
-FROM Screenshots AS S
-LEFT JOIN ScreenshotOverlays AS O1 ON O1.ScreenshotId = S.ScreenshotId
-LEFT JOIN ScreenshotOverlays AS O2 ON O2.ScreenshotId = S.ScreenshotId
-    AND O2.OverlayId <> O1.OverlayId
-LEFT JOIN ROIScreenshots AS R ON R.ROI_Id = S.ROI_Id
-    AND R.CenterI = S.CenterI
-    AND R.CenterJ = S.CenterJ
-    AND R.CenterK = S.CenterK
-    AND R.ViewId  = S.ViewId
-WHERE O1.OverlayId NOT IN (0, 1) AND O1.Color = '#fff53d' AND O2.OverlayId IS NULL;
-
--- Table of screenshots with exactly one overlay to compare with another
-CREATE VIEW IndividualComparisonScreenshots AS
-SELECT S.*,
-    O1.OverlayId   AS OverlayId,
-    O1.Color       As Color,
-    R.ScreenshotId AS ROIScreenshotId,
-    R.FileName     AS ROIScreenshotName
-FROM Screenshots AS S
-LEFT JOIN ScreenshotOverlays AS O1 ON O1.ScreenshotId = S.ScreenshotId
-LEFT JOIN ScreenshotOverlays AS O2 ON O2.ScreenshotId = S.ScreenshotId
-    AND O2.OverlayId <> O1.OverlayId
-LEFT JOIN ROIScreenshots AS R ON R.ROI_Id = S.ROI_Id
-    AND R.CenterI = S.CenterI
-    AND R.CenterJ = S.CenterJ
-    AND R.CenterK = S.CenterK
-    AND R.ViewId  = S.ViewId
-WHERE O1.OverlayId NOT IN (0, 1) AND O1.Color <> '#fff53d' AND O2.OverlayId IS NULL;
-
--- Table of screenshots with exactly two overlays to compare
-CREATE VIEW ComparisonScreenshots AS
-SELECT S.*,
-    O1.OverlayId AS OverlayId1,
-    O1.Color     AS Color1,
-    O2.OverlayId AS OverlayId2,
-    O2.Color     AS Color2
-FROM Screenshots AS S
-LEFT JOIN ScreenshotOverlays AS O1 ON O1.ScreenshotId = S.ScreenshotId
-LEFT JOIN ScreenshotOverlays AS O2 ON O2.ScreenshotId = S.ScreenshotId
-LEFT JOIN ScreenshotOverlays AS O3 ON O3.ScreenshotId = S.ScreenshotId
-    AND O3.OverlayId NOT IN (O1.OverlayId, O2.OverlayId)
-WHERE O1.OverlayId NOT IN (0, 1) AND O1.OverlayId < O2.OverlayId AND O3.OverlayId IS NULL;
+-- The ROIScreenshots, EvaluationScreenshots, IndividualComparisonScreenshots,
+-- and ComparisonScreenshots views of the different types of screenshots are
+-- defined by migrations/001-screenshot-types.sql, and the secondary indexes
+-- by migrations/002-indexes.sql. These and any other scripts in the
+-- migrations directory are applied by create-tables.py after this script.
 
 ------------------------------------------------------------------------------
 --                         Evaluation tables                                --
@@ -378,4 +327,4 @@ CREATE TABLE ComparisonChoices
     FOREIGN KEY (RaterId) REFERENCES Raters(RaterId),
     FOREIGN KEY (ScreenshotId) REFERENCES ComparisonScreenshots(ScreenshotId),
     FOREIGN KEY (BestOverlayId) REFERENCES Overlays(OverlayId)
-);
\ No newline at end of file
+);
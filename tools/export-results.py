@@ -0,0 +1,205 @@
+#!/usr/bin/python
+
+"""Export evaluation scores and comparison choices as columnar arrays
+
+The EvaluationScores and ComparisonChoices are joined with the ROI, scan, view,
+overlay IDs, and colors of the rated screenshots, and written to the files
+scores.npz and choices.npz, or scores.parquet and choices.parquet, in the
+output directory. Each column of a NumPy .npz archive is an uncompressed .npy
+array with the name of the column, such that it can be loaded with numpy.load
+without parsing. The rows are read in chunks and written to the columns one
+chunk at a time, such that the memory needed does not grow with the number of
+scores. Writing Parquet files requires the pyarrow package."""
+
+import os
+import shutil
+import sqlite3
+import zipfile
+import argparse
+import tempfile
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+scores_query = """
+    SELECT E.ScreenshotId, E.RaterId, E.Score,
+        S.ROI_Id, R.ScanId, X.SubjectId, X.SessionId, S.ViewId,
+        T.OverlayId1 AS OverlayId, T.Color1 AS Color,
+        R.CenterX, R.CenterY, R.CenterZ
+    FROM EvaluationScores AS E
+    INNER JOIN ScreenshotTypes AS T ON T.ScreenshotId = E.ScreenshotId AND T.Type = 'E'
+    INNER JOIN Screenshots AS S ON S.ScreenshotId = E.ScreenshotId
+    INNER JOIN ROIs AS R ON R.ROI_Id = S.ROI_Id
+    INNER JOIN Scans AS X ON X.ScanId = R.ScanId
+"""
+
+choices_query = """
+    SELECT C.ScreenshotId, C.RaterId, C.BestOverlayId,
+        S.ROI_Id, R.ScanId, X.SubjectId, X.SessionId, S.ViewId,
+        T.OverlayId1, T.Color1, T.OverlayId2, T.Color2,
+        R.CenterX, R.CenterY, R.CenterZ,
+        EXISTS (
+            SELECT 1 FROM Screenshots AS A
+            INNER JOIN EvaluationScores AS B ON B.ScreenshotId = A.ScreenshotId AND B.Score = 0
+            WHERE A.ROI_Id = S.ROI_Id
+        ) AS Discarded
+    FROM ComparisonChoices AS C
+    INNER JOIN ScreenshotTypes AS T ON T.ScreenshotId = C.ScreenshotId AND T.Type = 'C'
+    INNER JOIN Screenshots AS S ON S.ScreenshotId = C.ScreenshotId
+    INNER JOIN ROIs AS R ON R.ROI_Id = S.ROI_Id
+    INNER JOIN Scans AS X ON X.ScanId = R.ScanId
+"""
+
+
+def max_length(db, table, column):
+    """Get maximum length of string values, at least one."""
+    row = db.execute("SELECT MAX(LENGTH({})) FROM {}".format(column, table)).fetchone()
+    return max(1, row[0] or 0)
+
+
+def scores_columns(db):
+    subject_id = 'U{:d}'.format(max_length(db, 'Scans', 'SubjectId'))
+    return [
+        ('ScreenshotId', 'i8'),
+        ('RaterId', 'i4'),
+        ('Score', 'i1'),
+        ('ROI_Id', 'i8'),
+        ('ScanId', 'i4'),
+        ('SubjectId', subject_id),
+        ('SessionId', 'i8'),
+        ('ViewId', 'U1'),
+        ('OverlayId', 'i4'),
+        ('Color', 'U7'),
+        ('CenterX', 'f8'),
+        ('CenterY', 'f8'),
+        ('CenterZ', 'f8')
+    ]
+
+
+def choices_columns(db):
+    subject_id = 'U{:d}'.format(max_length(db, 'Scans', 'SubjectId'))
+    return [
+        ('ScreenshotId', 'i8'),
+        ('RaterId', 'i4'),
+        ('BestOverlayId', 'i4'),
+        ('ROI_Id', 'i8'),
+        ('ScanId', 'i4'),
+        ('SubjectId', subject_id),
+        ('SessionId', 'i8'),
+        ('ViewId', 'U1'),
+        ('OverlayId1', 'i4'),
+        ('Color1', 'U7'),
+        ('OverlayId2', 'i4'),
+        ('Color2', 'U7'),
+        ('CenterX', 'f8'),
+        ('CenterY', 'f8'),
+        ('CenterZ', 'f8'),
+        ('Discarded', '?')
+    ]
+
+
+def fetch_chunks(cur, columns, chunk_size):
+    """Iterate over rows of executed query as structured arrays."""
+    while True:
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield np.array(rows, dtype=columns)
+
+
+def write_npz(cur, count, columns, path, chunk_size):
+    """Write rows of executed query to NumPy archive with one array per column.
+
+    The columns are first written to memory-mapped .npy files of the given
+    length, which are then stored uncompressed in the .npz archive."""
+    temp_dir = tempfile.mkdtemp(prefix='.export-', dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        names = [name for name, dtype in columns]
+        files = [os.path.join(temp_dir, name + '.npy') for name in names]
+        arrays = [np.lib.format.open_memmap(f, mode='w+', dtype=dtype, shape=(count,))
+                  for f, (name, dtype) in zip(files, columns)]
+        offset = 0
+        for chunk in fetch_chunks(cur, columns, chunk_size):
+            if offset + len(chunk) > count:
+                raise Exception("Number of rows changed during export")
+            for name, array in zip(names, arrays):
+                array[offset:offset + len(chunk)] = chunk[name]
+            offset += len(chunk)
+        if offset != count:
+            raise Exception("Number of rows changed during export")
+        for array in arrays:
+            array.flush()
+        del arrays
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for name, f in zip(names, files):
+                archive.write(f, arcname=name + '.npy')
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def write_parquet(cur, columns, path, chunk_size):
+    """Write rows of executed query to Parquet file with one row group per chunk."""
+    if pa is None:
+        raise Exception("Export to Parquet file requires the pyarrow package")
+    fields = []
+    for name, dtype in columns:
+        if np.dtype(dtype).kind == 'U':
+            fields.append(pa.field(name, pa.string()))
+        else:
+            fields.append(pa.field(name, pa.from_numpy_dtype(np.dtype(dtype))))
+    schema = pa.schema(fields)
+    writer = pq.ParquetWriter(path, schema)
+    try:
+        for chunk in fetch_chunks(cur, columns, chunk_size):
+            arrays = [pa.array(chunk[name], type=field.type) for (name, dtype), field in zip(columns, fields)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+    finally:
+        writer.close()
+
+
+def export_table(db, query, columns, path, fmt, chunk_size):
+    """Export result of query to columnar file, and return number of rows."""
+    cur = db.cursor()
+    try:
+        cur.execute("SELECT COUNT(*) FROM ({})".format(query))
+        count = cur.fetchone()[0]
+        cur.execute(query)
+        if fmt == 'parquet':
+            write_parquet(cur, columns, path, chunk_size)
+        else:
+            write_npz(cur, count, columns, path, chunk_size)
+    finally:
+        cur.close()
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('database', help="SQLite database with evaluation results")
+    parser.add_argument('output', help="Output directory")
+    parser.add_argument('--format', default='npz', choices=('npz', 'parquet'), help="Output file format")
+    parser.add_argument('--chunk-size', default=10000, type=int, help="Number of rows read and written at once")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.output):
+        os.makedirs(args.output)
+
+    db = sqlite3.connect(args.database, timeout=600)
+    try:
+        # read both tables from the same snapshot of the database
+        db.execute("BEGIN")
+        for name, query, columns in (('scores', scores_query, scores_columns(db)),
+                                     ('choices', choices_query, choices_columns(db))):
+            path = os.path.join(args.output, name + '.' + args.format)
+            count = export_table(db, query, columns, path, args.format, args.chunk_size)
+            print("Exported {} {} to {}".format(count, name, path))
+        db.rollback()
+    finally:
+        db.close()
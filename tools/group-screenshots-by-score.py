@@ -1,14 +1,24 @@
 #!/usr/bin/python
 
-"""Create PDF report with evaluation screenshots grouped by their respective score."""
+"""Create PDF report with evaluation screenshots grouped by their respective score.
+
+The screenshots of each page are read and downscaled to the size of a tile by a
+pool of threads while the previous pages are written. The tiles are copied into
+a single image of the page, which is appended to the PDF file. Only the tiles of
+the pages being written or read ahead are kept in memory. The PDF file is written
+directly instead of using the PDF backend of matplotlib, which keeps the images
+of all pages in memory until the file is closed."""
 
 
 import os
+import math
+import zlib
 import argparse
 import sqlite3
+from collections import deque
+from multiprocessing.pool import ThreadPool
 
-from matplotlib import pyplot as plt
-from matplotlib.backends.backend_pdf import PdfPages
+import numpy as np
 from matplotlib.image import imread
 
 
@@ -36,37 +46,269 @@ def get_overlay_id(db, name):
         cur.close()
 
 
+# Size of page in inches, number of rows and columns of screenshots, and
+# height of title and space between screenshots relative to page height
+page_size = (8.25, 11)
+page_rows = 4
+page_cols = 3
+title_height = .04
+tile_spacing = .005
+
+
+def evaluation_screenshots_query(score, overlay=None, limit=0):
+    sql = """
+        SELECT FileName FROM EvaluationScreenshots AS A
+        LEFT JOIN EvaluationScores AS B
+        ON A.ScreenshotId = B.ScreenshotId
+        WHERE Score = {}
+    """.format(score)
+    if overlay:
+        if isinstance(overlay, int):
+            sql += "AND OverlayId = {}".format(overlay)
+        elif len(overlay) == 1:
+            sql += "AND OverlayId = {}".format(overlay[0])
+        else:
+            sql += "AND OverlayId IN {}".format(tuple(overlay))
+    sql += " GROUP BY ROI_Id "
+    if limit > 0:
+        sql += " LIMIT {}".format(limit)
+    return sql
+
+
+def count_evaluation_screenshots(db, score, overlay=None, limit=0):
+    cur = db.cursor()
+    try:
+        sql = evaluation_screenshots_query(score, overlay=overlay, limit=limit)
+        return cur.execute("SELECT COUNT(*) FROM ({})".format(sql)).fetchone()[0]
+    finally:
+        cur.close()
+
+
 def evaluation_screenshots(db, score, overlay=None, limit=0):
+    """Iterate over file names of screenshots with given score."""
     cur = db.cursor()
     try:
-        sql = """
-            SELECT FileName FROM EvaluationScreenshots AS A
-            LEFT JOIN EvaluationScores AS B
-            ON A.ScreenshotId = B.ScreenshotId
-            WHERE Score = {}
-        """.format(score)
-        if overlay:
-            if isinstance(overlay, int):
-                sql += "AND OverlayId = {}".format(overlay)
-            else:
-                sql += "AND OverlayId IN {}".format(tuple(overlay))
-        sql += " GROUP BY ROI_Id "
-        if limit > 0:
-            sql += " LIMIT {}".format(limit)
-        return [row[0] for row in cur.execute(sql).fetchall()]
+        cur.execute(evaluation_screenshots_query(score, overlay=overlay, limit=limit))
+        for row in cur:
+            yield row[0]
     finally:
         cur.close()
 
 
+def tile_size(dpi):
+    """Get maximum height and width of screenshot on page in pixels."""
+    height = int(page_size[1] * dpi)
+    width = int(page_size[0] * dpi)
+    spacing = int(math.ceil(tile_spacing * height))
+    top = int(title_height * height)
+    return ((height - top - (page_rows + 1) * spacing) // page_rows,
+            (width - (page_cols + 1) * spacing) // page_cols)
+
+
+def read_thumbnail(fname, size):
+    """Read screenshot and downscale it to fit into tile of given size.
+
+    The image is downscaled by averaging blocks of pixels, and converted to
+    8-bit RGB values with transparent pixels blended with a white background."""
+    image = imread(fname)
+    if image.dtype == np.uint8:
+        image = image.astype(np.float32) / 255.
+    if image.ndim == 2:
+        image = np.repeat(image[:, :, np.newaxis], 3, axis=2)
+    if image.shape[2] == 4:
+        alpha = image[:, :, 3:]
+        if alpha.min() < 1.:
+            image = image[:, :, :3] * alpha + (1. - alpha)
+        else:
+            image = image[:, :, :3]
+    factor = int(math.ceil(max(float(image.shape[0]) / size[0], float(image.shape[1]) / size[1])))
+    if factor > 1:
+        rows = image.shape[0] // factor
+        cols = image.shape[1] // factor
+        image = image[:rows * factor, :cols * factor]
+        # sum of strided slices is faster than mean of reshaped image
+        total = image[0::factor].copy()
+        for i in range(1, factor):
+            total += image[i::factor]
+        image = total[:, 0::factor].copy()
+        for j in range(1, factor):
+            image += total[:, j::factor]
+        image /= factor * factor
+    return (np.clip(image, 0., 1.) * 255. + .5).astype(np.uint8)
+
+
+def page_raster(thumbnails, dpi):
+    """Tile screenshots of one page row by row into a white RGB image of the page."""
+    height = int(page_size[1] * dpi)
+    width = int(page_size[0] * dpi)
+    spacing = int(math.ceil(tile_spacing * height))
+    top = int(title_height * height)
+    size = tile_size(dpi)
+    raster = np.full((height, width, 3), 255, dtype=np.uint8)
+    for i, thumbnail in enumerate(thumbnails):
+        h, w = thumbnail.shape[0:2]
+        y = top + spacing + (i // page_cols) * (size[0] + spacing) + (size[0] - h) // 2
+        x = spacing + (i % page_cols) * (size[1] + spacing) + (size[1] - w) // 2
+        raster[y:y + h, x:x + w] = thumbnail
+    return raster
+
+
+def page_title(label, page, npages):
+    if npages > 1:
+        return label + ' ({}/{})'.format(page, npages)
+    return label
+
+
+def report_pages(db, base, scores, labels, overlay=None, limit=0):
+    """Iterate over title and screenshot file paths of each page of the report."""
+    num_tiles = page_rows * page_cols
+    for score in scores:
+        count = count_evaluation_screenshots(db, score=score, overlay=overlay, limit=limit)
+        npages = (count + num_tiles - 1) // num_tiles
+        fnames = []
+        page = 0
+        for fname in evaluation_screenshots(db, score=score, overlay=overlay, limit=limit):
+            fnames.append(os.path.join(base, fname))
+            if len(fnames) == num_tiles:
+                page += 1
+                yield page_title(labels[score], page, npages), fnames
+                fnames = []
+        if fnames:
+            page += 1
+            yield page_title(labels[score], page, npages), fnames
+
+
+class PdfReport(object):
+    """PDF file to which pages with an image and a title are appended one at a time."""
+
+    def __init__(self, path, title=None):
+        self.file = open(path, 'wb')
+        self.title = title
+        self.offsets = {}
+        self.pages = []
+        self.file.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        self.write_object(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+        self.write_object(3, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold >>')
+        self.next_id = 4
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write_object(self, obj_id, content, stream=None):
+        self.offsets[obj_id] = self.file.tell()
+        self.file.write('{} 0 obj\n'.format(obj_id).encode('ascii'))
+        self.file.write(content)
+        if stream is not None:
+            self.file.write(b'\nstream\n')
+            self.file.write(stream)
+            self.file.write(b'\nendstream')
+        self.file.write(b'\nendobj\n')
+
+    def add_page(self, raster, title, size):
+        """Append page with RGB image covering the page and title at its top.
+
+        Args:
+            raster: 8-bit RGB image of page.
+            title: Page title.
+            size: Page (width, height) in inches.
+        """
+        image_id, content_id, page_id = self.next_id, self.next_id + 1, self.next_id + 2
+        self.next_id += 3
+        width, height = size[0] * 72., size[1] * 72.
+        # difference to previous row (PNG filter type 2) compresses large uniform regions better
+        rows = np.empty((raster.shape[0], 1 + 3 * raster.shape[1]), dtype=np.uint8)
+        rows[:, 0] = 2
+        rows[:, 1:] = raster.reshape(raster.shape[0], -1)
+        rows[1:, 1:] -= raster[:-1].reshape(raster.shape[0] - 1, -1)
+        data = zlib.compress(rows.tobytes(), 6)
+        self.write_object(image_id, (
+            '<< /Type /XObject /Subtype /Image /Width {w} /Height {h} /ColorSpace /DeviceRGB'
+            ' /BitsPerComponent 8 /Filter /FlateDecode'
+            ' /DecodeParms << /Predictor 12 /Colors 3 /Columns {w} >> /Length {n} >>'
+        ).format(w=raster.shape[1], h=raster.shape[0], n=len(data)).encode('ascii'), data)
+        text = title.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+        content = (
+            'q {w:.2f} 0 0 {h:.2f} 0 0 cm /Im0 Do Q\n'
+            'BT /F1 12 Tf {x:.2f} {y:.2f} Td ({text}) Tj ET'
+        ).format(w=width, h=height, x=tile_spacing * height, y=height * (1. - title_height / 2.) - 4.,
+                 text=text).encode('latin-1')
+        self.write_object(content_id, '<< /Length {} >>'.format(len(content)).encode('ascii'), content)
+        self.write_object(page_id, (
+            '<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {:.2f} {:.2f}]'
+            ' /Resources << /Font << /F1 3 0 R >> /XObject << /Im0 {} 0 R >> >>'
+            ' /Contents {} 0 R >>'
+        ).format(width, height, image_id, content_id).encode('ascii'))
+        self.pages.append(page_id)
+
+    def close(self):
+        """Write page tree, document information, and cross-reference table."""
+        if self.file.closed:
+            return
+        kids = ' '.join(['{} 0 R'.format(page_id) for page_id in self.pages])
+        self.write_object(2, '<< /Type /Pages /Kids [{}] /Count {} >>'.format(kids, len(self.pages)).encode('ascii'))
+        info_id = self.next_id
+        info = '<< /Producer (group-screenshots-by-score.py)'
+        if self.title:
+            info += ' /Title ({})'.format(self.title)
+        info += ' >>'
+        self.write_object(info_id, info.encode('latin-1'))
+        xref = self.file.tell()
+        self.file.write('xref\n0 {}\n0000000000 65535 f \n'.format(info_id + 1).encode('ascii'))
+        for obj_id in range(1, info_id + 1):
+            self.file.write('{:010d} 00000 n \n'.format(self.offsets[obj_id]).encode('ascii'))
+        self.file.write('trailer\n<< /Size {} /Root 1 0 R /Info {} 0 R >>\nstartxref\n{}\n%%EOF\n'.format(
+            info_id + 1, info_id, xref).encode('ascii'))
+        self.file.close()
+
+
+def write_report(pdf, pages, dpi=120, threads=None, prefetch=2):
+    """Append pages to PDF, while screenshots of next pages are read by thread pool.
+
+    Args:
+        pdf: PdfReport object.
+        pages: Iterable of (title, fnames) of each page.
+        dpi: Resolution of page image.
+        threads: Number of threads reading screenshots, number of CPUs by default.
+        prefetch: Number of pages whose screenshots are read ahead of the page being written.
+    """
+    size = tile_size(dpi)
+    pool = ThreadPool(threads)
+    try:
+        pending = deque()
+        pages = iter(pages)
+        while True:
+            while len(pending) <= prefetch:
+                try:
+                    title, fnames = next(pages)
+                except StopIteration:
+                    break
+                pending.append((title, [pool.apply_async(read_thumbnail, (fname, size)) for fname in fnames]))
+            if not pending:
+                break
+            title, results = pending.popleft()
+            print(title)
+            pdf.add_page(page_raster([result.get() for result in results], dpi), title, page_size)
+    finally:
+        pool.terminate()
+        pool.join()
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument('database', help="Evaluation SQLite database file")
     parser.add_argument('output', help="Output PDF report")
     parser.add_argument('--overlay', default=[3], nargs='+', help="Overlay ID or name")
     parser.add_argument('--limit', default=0, type=int, help="Maximum no. of screenshots per group/score")
+    parser.add_argument('--dpi', default=120, type=int, help="Resolution of pages in dots per inch")
+    parser.add_argument('--threads', default=0, type=int,
+                        help="Number of threads reading screenshots, number of CPUs by default")
+    parser.add_argument('--prefetch', default=2, type=int,
+                        help="Number of pages whose screenshots are read ahead of the page being written")
     args = parser.parse_args()
 
-    screenshots = {}
     labels = {}
 
     db = sqlite3.connect(args.database)
@@ -84,36 +326,12 @@ if __name__ == '__main__':
             overlays.append(o)
         scores = get_scores(db)
         for score in scores:
-            screenshots[score] = evaluation_screenshots(db, score=score, overlay=overlays)
-            labels[score] = label = get_label(db, score)
+            labels[score] = get_label(db, score)
+        pages = report_pages(db, base, scores, labels, overlay=overlays, limit=args.limit)
+        try:
+            with PdfReport(args.output, title='Evaluation screenshots grouped by score') as pdf:
+                write_report(pdf, pages, dpi=args.dpi, threads=(args.threads or None), prefetch=args.prefetch)
+        finally:
+            pages.close()
     finally:
         db.close()
-
-    with PdfPages(args.output) as pdf:
-        for score in scores:
-            fnames = screenshots[score]
-            if args.limit > 0 and len(fnames) > args.limit:
-                fnames = fnames[0:args.limit]
-            npages = (len(fnames) + 11) / 12
-            for page in range(npages):
-                first = page * 12
-                last = min(first + 12, len(fnames))
-                if first >= last:
-                    break
-                title = labels[score]
-                if npages > 1:
-                    title += ' ({}/{})'.format(page + 1, npages)
-                # title = '{}: Screenshots {} to {} out of {}'.format(labels[score], first + 1, last, len(fnames))
-                print(title)
-                fig, axes = plt.subplots(4, 3, figsize=(8.25, 11))
-                plt.subplots_adjust(wspace=.02, hspace=.02)
-                fig.suptitle(title, fontsize=12, fontweight='bold')
-                for i in range(12):
-                    subplt = axes[i / 3][i % 3]
-                    if i < last - first:
-                        subplt.imshow(imread(os.path.join(base, fnames[first + i])))
-                    subplt.axis('off')
-                pdf.savefig(papertype='a4', dpi=120)
-                plt.close()
-        d = pdf.infodict()
-        d['Title'] = 'Evaluation screenshots grouped by score'
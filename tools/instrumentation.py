@@ -0,0 +1,177 @@
+"""Record resources used by the stages of the evaluation database pipeline.
+
+Each stage, e.g., the selection of ROIs from a scan or one pass of the screenshot
+tools for a single ROI, is measured by a Stage context manager and recorded as one
+row of the PipelineRuns table. Rows with ROI_Id set to NULL summarize a stage for
+an entire scan, whereas rows with ROI_Id refer to the worker process of one ROI.
+Phases of a stage are recorded with stage name "<stage>/<phase>".
+"""
+
+import os
+import csv
+import time
+import socket
+import resource
+
+
+def cpu_time():
+    """Get user and system CPU time of this process and its terminated children."""
+    t = os.times()
+    return t[0] + t[1] + t[2] + t[3]
+
+
+def peak_rss():
+    """Get peak resident set size in bytes of this process or any of its terminated children."""
+    rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+              resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    if os.uname()[0] != 'Darwin':
+        rss *= 1024  # ru_maxrss is given in kilobytes on Linux
+    return rss
+
+
+class Stage(object):
+    """Measure wall time, CPU time, peak memory, and files written by a pipeline stage.
+
+    The peak resident set size is the maximum of the process lifetime at the end of
+    the stage, including child processes whose termination was waited for. The CPU
+    time of such child processes, e.g., the select-rois binary, is included as well.
+    """
+
+    def __init__(self, name, scan_id=None, roi_id=None):
+        self.name = name
+        self.scan_id = scan_id
+        self.roi_id = roi_id
+        self.start_time = None
+        self.wall_time = 0.
+        self.cpu_time = 0.
+        self.peak_rss = None
+        self.num_screenshots = 0
+        self.bytes_written = 0
+        self._wall_start = None
+        self._cpu_start = None
+
+    def start(self):
+        self.start_time = time.time()
+        self._wall_start = time.time()
+        self._cpu_start = cpu_time()
+        return self
+
+    def stop(self):
+        if self._wall_start is not None:
+            self.wall_time = time.time() - self._wall_start
+            self.cpu_time = cpu_time() - self._cpu_start
+            self.peak_rss = peak_rss()
+            self._wall_start = None
+        return self
+
+    def add_files(self, paths):
+        """Count screenshot files written during this stage."""
+        for path in paths:
+            if os.path.isfile(path):
+                self.num_screenshots += 1
+                self.bytes_written += os.path.getsize(path)
+
+    def record(self, db):
+        """Insert measurements into PipelineRuns table."""
+        self.stop()
+        return record_run(db, stage=self.name, scan_id=self.scan_id, roi_id=self.roi_id,
+                          start_time=self.start_time, wall_time=self.wall_time,
+                          cpu_time=self.cpu_time, peak_rss=self.peak_rss,
+                          num_screenshots=self.num_screenshots, bytes_written=self.bytes_written)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+
+def require_pipeline_runs(db):
+    """Raise exception if database schema predates the PipelineRuns table."""
+    row = db.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'PipelineRuns'").fetchone()
+    if row[0] == 0:
+        raise Exception("Missing PipelineRuns table, run tools/create-tables.py to upgrade the database")
+
+
+def record_run(db, stage, wall_time, cpu_time, scan_id=None, roi_id=None, start_time=None,
+               peak_rss=None, num_screenshots=0, bytes_written=0):
+    """Insert new PipelineRuns record."""
+    cur = db.cursor()
+    try:
+        cur.execute(
+            """INSERT INTO PipelineRuns (ScanId, ROI_Id, Stage, Host, ProcessId, StartTime,
+                                         WallTime, CPUTime, PeakRSS, NumScreenshots, BytesWritten)
+               VALUES (:scan_id, :roi_id, :stage, :host, :pid, :start_time,
+                       :wall_time, :cpu_time, :peak_rss, :num_screenshots, :bytes_written)
+            """, dict(scan_id=scan_id, roi_id=roi_id, stage=stage,
+                      host=socket.gethostname(), pid=os.getpid(),
+                      start_time=(start_time or time.time()),
+                      wall_time=wall_time, cpu_time=cpu_time, peak_rss=peak_rss,
+                      num_screenshots=num_screenshots, bytes_written=bytes_written))
+        run_id = cur.lastrowid
+    finally:
+        cur.close()
+    return run_id
+
+
+def read_phase_timings(fname):
+    """Read CSV file with 'Phase,WallTime,CPUTime' columns written by select-rois -timings."""
+    timings = []
+    with open(fname) as f:
+        for row in csv.DictReader(f):
+            timings.append((row['Phase'], float(row['WallTime']), float(row['CPUTime'])))
+    return timings
+
+
+def record_phases(db, stage, timings, scan_id=None, roi_id=None):
+    """Insert PipelineRuns records of phases of a stage that ran in a child process."""
+    for phase, wall_time, cpu_time in timings:
+        record_run(db, stage='/'.join([stage, phase]), scan_id=scan_id, roi_id=roi_id,
+                   wall_time=wall_time, cpu_time=cpu_time)
+
+
+def summarize_runs(db, scan_ids=None):
+    """Aggregate PipelineRuns records by stage.
+
+    The time of a stage is taken from the records summarizing entire scans when
+    available, and from the records of individual ROIs otherwise. The number of
+    screenshots and bytes written are summed over all records of a stage.
+
+    Returns:
+        List of dictionaries, one for each stage, ordered by total wall time.
+    """
+    require_pipeline_runs(db)
+    sql = """
+        SELECT Stage, ROI_Id IS NULL AS PerScan, COUNT(*) AS NumRuns,
+            COUNT(DISTINCT ScanId) AS NumScans, SUM(WallTime) AS WallTime,
+            SUM(CPUTime) AS CPUTime, MAX(PeakRSS) AS PeakRSS,
+            SUM(NumScreenshots) AS NumScreenshots, SUM(BytesWritten) AS BytesWritten
+        FROM PipelineRuns
+    """
+    if scan_ids is not None:
+        sql += " WHERE ScanId IN ({})".format(', '.join([str(int(scan_id)) for scan_id in scan_ids]) or 'NULL')
+    sql += " GROUP BY Stage, PerScan"
+    stages = {}
+    for row in db.execute(sql).fetchall():
+        stage = stages.setdefault(row[0], {
+            'stage': row[0], 'scans': 0, 'runs': 0, 'rois': 0,
+            'wall_time': 0., 'cpu_time': 0., 'peak_rss': 0,
+            'screenshots': 0, 'bytes': 0, 'per_scan': False
+        })
+        if row[1]:
+            stage['per_scan'] = True
+            stage['runs'] = row[2]
+            stage['wall_time'] = row[4] or 0.
+            stage['cpu_time'] = row[5] or 0.
+        else:
+            stage['rois'] = row[2]
+            if not stage['per_scan']:
+                stage['runs'] = row[2]
+                stage['wall_time'] = row[4] or 0.
+                stage['cpu_time'] = row[5] or 0.
+        stage['scans'] = max(stage['scans'], row[3])
+        stage['peak_rss'] = max(stage['peak_rss'], row[6] or 0)
+        stage['screenshots'] += row[7] or 0
+        stage['bytes'] += row[8] or 0
+    return sorted(stages.values(), key=lambda stage: stage['wall_time'], reverse=True)
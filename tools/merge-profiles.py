@@ -0,0 +1,92 @@
+#!/usr/bin/python
+
+"""Aggregate profiles written by the tools when run with the --profile option.
+
+The cProfile statistics of all processes matching the given tool, subject, and
+session are merged and the functions with highest cumulative time are printed,
+followed by the summed VTK object timings and select-rois phase timings.
+"""
+
+import os
+import sys
+import csv
+import json
+import glob
+import pstats
+import argparse
+
+
+def find_profiles(profile_dir, tool='*', subject='*', session='*', ext='prof'):
+    """Find profile files written by worker processes."""
+    pattern = '{}_{}-{}_*.{}'.format(tool.replace(':', '.'), subject, session, ext)
+    return sorted(glob.glob(os.path.join(profile_dir, pattern)))
+
+
+def merge_vtk_timings(paths):
+    """Sum VTK timings of multiple processes."""
+    timings = {}
+    for path in paths:
+        with open(path) as f:
+            info = json.load(f)
+        for name, timing in info['timings'].items():
+            total = timings.setdefault(name, [0, 0.])
+            total[0] += timing['count']
+            total[1] += timing['time']
+    return timings
+
+
+def merge_phase_timings(paths):
+    """Sum select-rois phase timings of multiple processes."""
+    phases = []
+    timings = {}
+    for path in paths:
+        with open(path) as f:
+            for row in csv.DictReader(f):
+                name = row['Phase']
+                if name not in timings:
+                    phases.append(name)
+                    timings[name] = [0., 0.]
+                timings[name][0] += float(row['WallTime'])
+                timings[name][1] += float(row['CPUTime'])
+    return [(name, timings[name][0], timings[name][1]) for name in phases]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('profile_dir', help="Directory containing profile files")
+    parser.add_argument('--tool', default='*', help="Name of tool, e.g., take-screenshots.roi-bounds")
+    parser.add_argument('--subject', default='*', help="Subject ID")
+    parser.add_argument('--session', default='*', help="Session ID")
+    parser.add_argument('--sort', default='cumulative', help="pstats sort key")
+    parser.add_argument('-n', default=30, type=int, help="Number of functions to print")
+    parser.add_argument('-o', '--output', help="Write merged cProfile statistics to this file")
+    args = parser.parse_args()
+
+    paths = find_profiles(args.profile_dir, args.tool, args.subject, args.session, 'prof')
+    if not paths:
+        sys.stderr.write("No profiles found in {}\n".format(args.profile_dir))
+        sys.exit(1)
+    stats = pstats.Stats(paths[0])
+    for path in paths[1:]:
+        stats.add(path)
+    if args.output:
+        stats.dump_stats(args.output)
+    print("Merged {} profiles".format(len(paths)))
+    stats.sort_stats(args.sort).print_stats(args.n)
+
+    paths = find_profiles(args.profile_dir, args.tool, args.subject, args.session, 'vtk.json')
+    if paths:
+        print("VTK timings of {} processes\n".format(len(paths)))
+        print("{:<32} {:>10} {:>12} {:>12}".format("Class", "Calls", "Time [s]", "Per call [s]"))
+        timings = merge_vtk_timings(paths)
+        for name in sorted(timings, key=lambda name: timings[name][1], reverse=True):
+            count, total = timings[name]
+            print("{:<32} {:>10d} {:>12.3f} {:>12.5f}".format(name, count, total, total / count if count > 0 else 0.))
+        print("")
+
+    paths = find_profiles(args.profile_dir, args.tool, args.subject, args.session, 'timings.csv')
+    if paths:
+        print("select-rois phase timings of {} processes\n".format(len(paths)))
+        print("{:<32} {:>12} {:>12}".format("Phase", "Wall [s]", "CPU [s]"))
+        for name, wall_time, cpu_time in merge_phase_timings(paths):
+            print("{:<32} {:>12.3f} {:>12.3f}".format(name, wall_time, cpu_time))
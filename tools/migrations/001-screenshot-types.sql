@@ -0,0 +1,245 @@
+------------------------------------------------------------------------------
+--                       Screenshot classification                          --
+------------------------------------------------------------------------------
+
+-- The type of each screenshot is determined by the overlays visible in it.
+-- Instead of evaluating self-joins of the ScreenshotOverlays table for each
+-- query, the type of each screenshot is stored in the ScreenshotTypes table,
+-- which is kept up to date by the triggers below. The ROIScreenshots,
+-- EvaluationScreenshots, IndividualComparisonScreenshots, and
+-- ComparisonScreenshots views are defined on top of this table.
+--
+-- Migration to schema version 1. For databases created before, it replaces
+-- the previous views which self-joined the ScreenshotOverlays table and
+-- classifies all existing screenshots.
+
+DROP VIEW IF EXISTS ROIScreenshots;
+DROP VIEW IF EXISTS EvaluationScreenshots;
+DROP VIEW IF EXISTS IndividualComparisonScreenshots;
+DROP VIEW IF EXISTS ComparisonScreenshots;
+
+-- Table of screenshot types
+--
+-- The Type is one of:
+-- - 'R': Screenshot with only the ROI bounding box overlay.
+-- - 'E': Screenshot with exactly one overlay to be evaluated.
+-- - 'I': Screenshot with exactly one overlay to compare with another.
+-- - 'C': Screenshot with exactly two overlays to compare.
+-- - NULL: Any other screenshot, e.g., one without overlays.
+--
+-- The overlays are ordered by increasing OverlayId. The ROIScreenshotId
+-- is the ID of the screenshot of type 'R' of the same ROI, view, and
+-- voxel indices, i.e., the one showing the outline of the screenshot.
+CREATE TABLE IF NOT EXISTS ScreenshotTypes
+(
+    ScreenshotId INTEGER PRIMARY KEY,
+    Type CHARACTER(1),
+    NumOverlays INTEGER NOT NULL,
+    OverlayId1 INTEGER,
+    Color1 CHARACTER(7),
+    OverlayId2 INTEGER,
+    Color2 CHARACTER(7),
+    ROIScreenshotId INTEGER,
+    FOREIGN KEY (ScreenshotId) REFERENCES Screenshots(ScreenshotId)
+    FOREIGN KEY (ROIScreenshotId) REFERENCES Screenshots(ScreenshotId)
+);
+
+CREATE INDEX IF NOT EXISTS ScreenshotTypesByType ON ScreenshotTypes (Type, ScreenshotId);
+
+-- Index used to find the screenshots of the same ROI, view, and voxel
+CREATE INDEX IF NOT EXISTS ScreenshotsByROIView
+ON Screenshots (ROI_Id, ViewId, CenterI, CenterJ, CenterK);
+
+-- Type of each screenshot computed from the ScreenshotOverlays table
+DROP VIEW IF EXISTS ScreenshotClassification;
+CREATE VIEW ScreenshotClassification AS
+SELECT ScreenshotId,
+    CASE
+        WHEN NumOverlays = 1 AND OverlayId1 = 1 THEN 'R'
+        WHEN NumOverlays = 1 AND OverlayId1 NOT IN (0, 1) AND Color1 = '#fff53d' THEN 'E'
+        WHEN NumOverlays = 1 AND OverlayId1 NOT IN (0, 1) AND Color1 <> '#fff53d' THEN 'I'
+        WHEN NumOverlays = 2 AND OverlayId1 NOT IN (0, 1) THEN 'C'
+    END AS Type,
+    NumOverlays, OverlayId1, Color1, OverlayId2, Color2
+FROM (
+    SELECT S.ScreenshotId,
+        (SELECT COUNT(*) FROM ScreenshotOverlays AS O WHERE O.ScreenshotId = S.ScreenshotId) AS NumOverlays,
+        O1.OverlayId AS OverlayId1,
+        O1.Color     AS Color1,
+        O2.OverlayId AS OverlayId2,
+        O2.Color     AS Color2
+    FROM Screenshots AS S
+    LEFT JOIN ScreenshotOverlays AS O1 ON O1.ScreenshotId = S.ScreenshotId
+        AND O1.OverlayId = (SELECT MIN(OverlayId) FROM ScreenshotOverlays AS O
+                            WHERE O.ScreenshotId = S.ScreenshotId)
+    LEFT JOIN ScreenshotOverlays AS O2 ON O2.ScreenshotId = S.ScreenshotId
+        AND O2.OverlayId = (SELECT MIN(OverlayId) FROM ScreenshotOverlays AS O
+                            WHERE O.ScreenshotId = S.ScreenshotId AND O.OverlayId > O1.OverlayId)
+);
+
+-- ID of the ROI bounding box screenshot of each screenshot
+DROP VIEW IF EXISTS ScreenshotROIScreenshots;
+CREATE VIEW ScreenshotROIScreenshots AS
+SELECT S.ScreenshotId,
+    (SELECT MIN(R.ScreenshotId) FROM Screenshots AS R
+     INNER JOIN ScreenshotTypes AS T ON T.ScreenshotId = R.ScreenshotId
+     WHERE T.Type = 'R'
+        AND R.ROI_Id  = S.ROI_Id
+        AND R.ViewId  = S.ViewId
+        AND R.CenterI = S.CenterI
+        AND R.CenterJ = S.CenterJ
+        AND R.CenterK = S.CenterK) AS ROIScreenshotId
+FROM Screenshots AS S;
+
+-- Classify screenshots of existing database
+DELETE FROM ScreenshotTypes;
+INSERT INTO ScreenshotTypes (ScreenshotId, Type, NumOverlays, OverlayId1, Color1, OverlayId2, Color2)
+SELECT * FROM ScreenshotClassification;
+
+UPDATE ScreenshotTypes SET ROIScreenshotId = (
+    SELECT L.ROIScreenshotId FROM ScreenshotROIScreenshots AS L
+    WHERE L.ScreenshotId = ScreenshotTypes.ScreenshotId
+);
+
+-- Triggers which keep the ScreenshotTypes up to date
+--
+-- Each trigger first (re-)classifies the modified screenshots and then
+-- updates the ROIScreenshotId of all screenshots of the same ROI, view,
+-- and voxel indices, because the ROI bounding box screenshot of these may
+-- have been inserted, removed, or modified.
+DROP TRIGGER IF EXISTS ScreenshotInserted;
+CREATE TRIGGER ScreenshotInserted AFTER INSERT ON Screenshots
+BEGIN
+    DELETE FROM ScreenshotTypes WHERE ScreenshotId = NEW.ScreenshotId;
+    INSERT INTO ScreenshotTypes (ScreenshotId, Type, NumOverlays, OverlayId1, Color1, OverlayId2, Color2)
+    SELECT * FROM ScreenshotClassification WHERE ScreenshotId = NEW.ScreenshotId;
+    UPDATE ScreenshotTypes SET ROIScreenshotId = (
+        SELECT L.ROIScreenshotId FROM ScreenshotROIScreenshots AS L
+        WHERE L.ScreenshotId = ScreenshotTypes.ScreenshotId
+    ) WHERE ScreenshotId = NEW.ScreenshotId;
+END;
+
+DROP TRIGGER IF EXISTS ScreenshotUpdated;
+CREATE TRIGGER ScreenshotUpdated
+AFTER UPDATE OF ScreenshotId, ROI_Id, ViewId, CenterI, CenterJ, CenterK ON Screenshots
+BEGIN
+    DELETE FROM ScreenshotTypes WHERE ScreenshotId IN (OLD.ScreenshotId, NEW.ScreenshotId);
+    INSERT INTO ScreenshotTypes (ScreenshotId, Type, NumOverlays, OverlayId1, Color1, OverlayId2, Color2)
+    SELECT * FROM ScreenshotClassification WHERE ScreenshotId = NEW.ScreenshotId;
+    UPDATE ScreenshotTypes SET ROIScreenshotId = (
+        SELECT L.ROIScreenshotId FROM ScreenshotROIScreenshots AS L
+        WHERE L.ScreenshotId = ScreenshotTypes.ScreenshotId
+    ) WHERE ScreenshotId IN (
+        SELECT ScreenshotId FROM Screenshots
+        WHERE (ROI_Id = OLD.ROI_Id AND ViewId = OLD.ViewId
+               AND CenterI = OLD.CenterI AND CenterJ = OLD.CenterJ AND CenterK = OLD.CenterK)
+           OR (ROI_Id = NEW.ROI_Id AND ViewId = NEW.ViewId
+               AND CenterI = NEW.CenterI AND CenterJ = NEW.CenterJ AND CenterK = NEW.CenterK)
+    );
+END;
+
+DROP TRIGGER IF EXISTS ScreenshotDeleted;
+CREATE TRIGGER ScreenshotDeleted AFTER DELETE ON Screenshots
+BEGIN
+    DELETE FROM ScreenshotTypes WHERE ScreenshotId = OLD.ScreenshotId;
+    UPDATE ScreenshotTypes SET ROIScreenshotId = (
+        SELECT L.ROIScreenshotId FROM ScreenshotROIScreenshots AS L
+        WHERE L.ScreenshotId = ScreenshotTypes.ScreenshotId
+    ) WHERE ScreenshotId IN (
+        SELECT ScreenshotId FROM Screenshots
+        WHERE ROI_Id = OLD.ROI_Id AND ViewId = OLD.ViewId
+            AND CenterI = OLD.CenterI AND CenterJ = OLD.CenterJ AND CenterK = OLD.CenterK
+    );
+END;
+
+DROP TRIGGER IF EXISTS ScreenshotOverlayInserted;
+CREATE TRIGGER ScreenshotOverlayInserted AFTER INSERT ON ScreenshotOverlays
+BEGIN
+    DELETE FROM ScreenshotTypes WHERE ScreenshotId = NEW.ScreenshotId;
+    INSERT INTO ScreenshotTypes (ScreenshotId, Type, NumOverlays, OverlayId1, Color1, OverlayId2, Color2)
+    SELECT * FROM ScreenshotClassification WHERE ScreenshotId = NEW.ScreenshotId;
+    UPDATE ScreenshotTypes SET ROIScreenshotId = (
+        SELECT L.ROIScreenshotId FROM ScreenshotROIScreenshots AS L
+        WHERE L.ScreenshotId = ScreenshotTypes.ScreenshotId
+    ) WHERE ScreenshotId IN (
+        SELECT B.ScreenshotId FROM Screenshots AS A
+        INNER JOIN Screenshots AS B ON B.ROI_Id = A.ROI_Id AND B.ViewId = A.ViewId
+            AND B.CenterI = A.CenterI AND B.CenterJ = A.CenterJ AND B.CenterK = A.CenterK
+        WHERE A.ScreenshotId = NEW.ScreenshotId
+    );
+END;
+
+DROP TRIGGER IF EXISTS ScreenshotOverlayUpdated;
+CREATE TRIGGER ScreenshotOverlayUpdated AFTER UPDATE ON ScreenshotOverlays
+BEGIN
+    DELETE FROM ScreenshotTypes WHERE ScreenshotId IN (OLD.ScreenshotId, NEW.ScreenshotId);
+    INSERT INTO ScreenshotTypes (ScreenshotId, Type, NumOverlays, OverlayId1, Color1, OverlayId2, Color2)
+    SELECT * FROM ScreenshotClassification WHERE ScreenshotId IN (OLD.ScreenshotId, NEW.ScreenshotId);
+    UPDATE ScreenshotTypes SET ROIScreenshotId = (
+        SELECT L.ROIScreenshotId FROM ScreenshotROIScreenshots AS L
+        WHERE L.ScreenshotId = ScreenshotTypes.ScreenshotId
+    ) WHERE ScreenshotId IN (
+        SELECT B.ScreenshotId FROM Screenshots AS A
+        INNER JOIN Screenshots AS B ON B.ROI_Id = A.ROI_Id AND B.ViewId = A.ViewId
+            AND B.CenterI = A.CenterI AND B.CenterJ = A.CenterJ AND B.CenterK = A.CenterK
+        WHERE A.ScreenshotId IN (OLD.ScreenshotId, NEW.ScreenshotId)
+    );
+END;
+
+DROP TRIGGER IF EXISTS ScreenshotOverlayDeleted;
+CREATE TRIGGER ScreenshotOverlayDeleted AFTER DELETE ON ScreenshotOverlays
+BEGIN
+    DELETE FROM ScreenshotTypes WHERE ScreenshotId = OLD.ScreenshotId;
+    INSERT INTO ScreenshotTypes (ScreenshotId, Type, NumOverlays, OverlayId1, Color1, OverlayId2, Color2)
+    SELECT * FROM ScreenshotClassification WHERE ScreenshotId = OLD.ScreenshotId;
+    UPDATE ScreenshotTypes SET ROIScreenshotId = (
+        SELECT L.ROIScreenshotId FROM ScreenshotROIScreenshots AS L
+        WHERE L.ScreenshotId = ScreenshotTypes.ScreenshotId
+    ) WHERE ScreenshotId IN (
+        SELECT B.ScreenshotId FROM Screenshots AS A
+        INNER JOIN Screenshots AS B ON B.ROI_Id = A.ROI_Id AND B.ViewId = A.ViewId
+            AND B.CenterI = A.CenterI AND B.CenterJ = A.CenterJ AND B.CenterK = A.CenterK
+        WHERE A.ScreenshotId = OLD.ScreenshotId
+    );
+END;
+
+-- Table of screenshots with only ROI bounding box overlay
+CREATE VIEW ROIScreenshots AS
+SELECT S.*, T.OverlayId1 AS OverlayId
+FROM ScreenshotTypes AS T
+INNER JOIN Screenshots AS S ON S.ScreenshotId = T.ScreenshotId
+WHERE T.Type = 'R';
+
+-- Table of screenshots with exactly one overlay to be evaluated
+CREATE VIEW EvaluationScreenshots AS
+SELECT S.*,
+    T.OverlayId1   AS OverlayId,
+    R.ScreenshotId AS ROIScreenshotId,
+    R.FileName     AS ROIScreenshotName
+FROM ScreenshotTypes AS T
+INNER JOIN Screenshots AS S ON S.ScreenshotId = T.ScreenshotId
+LEFT JOIN Screenshots AS R ON R.ScreenshotId = T.ROIScreenshotId
+WHERE T.Type = 'E';
+
+-- Table of screenshots with exactly one overlay to compare with another
+CREATE VIEW IndividualComparisonScreenshots AS
+SELECT S.*,
+    T.OverlayId1   AS OverlayId,
+    T.Color1       AS Color,
+    R.ScreenshotId AS ROIScreenshotId,
+    R.FileName     AS ROIScreenshotName
+FROM ScreenshotTypes AS T
+INNER JOIN Screenshots AS S ON S.ScreenshotId = T.ScreenshotId
+LEFT JOIN Screenshots AS R ON R.ScreenshotId = T.ROIScreenshotId
+WHERE T.Type = 'I';
+
+-- Table of screenshots with exactly two overlays to compare
+CREATE VIEW ComparisonScreenshots AS
+SELECT S.*,
+    T.OverlayId1 AS OverlayId1,
+    T.Color1     AS Color1,
+    T.OverlayId2 AS OverlayId2,
+    T.Color2     AS Color2
+FROM ScreenshotTypes AS T
+INNER JOIN Screenshots AS S ON S.ScreenshotId = T.ScreenshotId
+WHERE T.Type = 'C';
@@ -0,0 +1,23 @@
+------------------------------------------------------------------------------
+--                           Secondary indexes                              --
+------------------------------------------------------------------------------
+
+-- Migration to schema version 2, which adds covering indexes for the
+-- queries of the app, the bin/eval-db pipeline, and the analysis tools.
+-- The index of screenshots by ROI, view, and voxel indices used to find
+-- the ROI bounds screenshot of a given screenshot is created by migration 1.
+
+-- Find ROIs of a scan
+CREATE INDEX IF NOT EXISTS ROIsByScan ON ROIs (ScanId, ROI_Id);
+
+-- Find screenshots with given overlay and color
+CREATE INDEX IF NOT EXISTS ScreenshotOverlaysByOverlay
+ON ScreenshotOverlays (OverlayId, Color, ScreenshotId);
+
+-- Find screenshots scored by a rater, including the score
+CREATE INDEX IF NOT EXISTS EvaluationScoresByRater
+ON EvaluationScores (RaterId, ScreenshotId, Score);
+
+-- Find screenshots compared by a rater, including the choice
+CREATE INDEX IF NOT EXISTS ComparisonChoicesByRater
+ON ComparisonChoices (RaterId, ScreenshotId, BestOverlayId);
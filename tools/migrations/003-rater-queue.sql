@@ -0,0 +1,42 @@
+------------------------------------------------------------------------------
+--                            Rater work queues                             --
+------------------------------------------------------------------------------
+
+-- Migration to schema version 3, which adds a work queue for each rater and
+-- task to replace the selection of the next screenshot by ORDER BY random().
+
+-- Table of screenshots to be rated by a rater as part of a task
+--
+-- The queue of a rater is filled by the app with a random permutation of
+-- the screenshots of a task when the task is opened. Screenshots added to
+-- the database afterwards are appended the next time the task is opened.
+-- The TaskType is 'E' for an evaluation task and 'C' for a comparison task.
+-- The order of the screenshots in the queue is given by the QueueId.
+CREATE TABLE IF NOT EXISTS RaterQueue
+(
+    QueueId INTEGER PRIMARY KEY,
+    RaterId INTEGER NOT NULL,
+    TaskType CHARACTER(1) NOT NULL,
+    TaskId INTEGER NOT NULL,
+    ScreenshotId INTEGER NOT NULL,
+    FOREIGN KEY (RaterId) REFERENCES Raters(RaterId),
+    FOREIGN KEY (ScreenshotId) REFERENCES Screenshots(ScreenshotId),
+    UNIQUE (RaterId, TaskType, TaskId, ScreenshotId)
+);
+
+CREATE INDEX IF NOT EXISTS RaterQueueOrder ON RaterQueue (RaterId, TaskType, TaskId, QueueId);
+
+-- Table with position of each rater in the queue of a task
+--
+-- The Position is the QueueId of the last screenshot scored by the rater,
+-- such that the next screenshot is the first unscored screenshot in the
+-- queue after it. It is advanced in the transaction that saves the score.
+CREATE TABLE IF NOT EXISTS RaterQueueCursor
+(
+    RaterId INTEGER NOT NULL,
+    TaskType CHARACTER(1) NOT NULL,
+    TaskId INTEGER NOT NULL,
+    Position INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (RaterId, TaskType, TaskId),
+    FOREIGN KEY (RaterId) REFERENCES Raters(RaterId)
+);
@@ -0,0 +1,73 @@
+------------------------------------------------------------------------------
+--                            Comparison sets                               --
+------------------------------------------------------------------------------
+
+-- Migration to schema version 4, which adds a table of the screenshots shown
+-- together in a comparison task. The app previously found these by joining
+-- the ComparisonScreenshots, ROIScreenshots, and IndividualComparisonScreenshots
+-- views for each comparison.
+
+-- Index used to find the individual comparison screenshots of a location
+CREATE INDEX IF NOT EXISTS ScreenshotTypesByROIScreenshot
+ON ScreenshotTypes (ROIScreenshotId, Type, OverlayId1, Color1, ScreenshotId);
+
+-- Table of screenshots shown together in a comparison task
+--
+-- The ScreenshotId is the ID of the screenshot with both overlays. The
+-- ScreenshotId1 and ScreenshotId2 are the IDs of the screenshots with only
+-- the overlay with OverlayId1 and OverlayId2, respectively, in the same
+-- color, and ROIScreenshotId is the ID of the ROI bounding box screenshot.
+-- Overlays are ordered by increasing OverlayId as in ScreenshotTypes.
+--
+-- The rows of a ROI are written by tools/take-screenshots.py and
+-- tools/take-screenshots-of-roi-bounds.py after inserting its screenshots.
+-- Only complete sets for which all four screenshots exist are inserted.
+CREATE TABLE IF NOT EXISTS ComparisonSets
+(
+    ScreenshotId INTEGER PRIMARY KEY,
+    ROI_Id INTEGER NOT NULL,
+    ViewId CHARACTER(1) NOT NULL,
+    ROIScreenshotId INTEGER NOT NULL,
+    OverlayId1 INTEGER NOT NULL,
+    Color1 CHARACTER(7) NOT NULL,
+    ScreenshotId1 INTEGER NOT NULL,
+    OverlayId2 INTEGER NOT NULL,
+    Color2 CHARACTER(7) NOT NULL,
+    ScreenshotId2 INTEGER NOT NULL,
+    FOREIGN KEY (ScreenshotId) REFERENCES Screenshots(ScreenshotId),
+    FOREIGN KEY (ROI_Id) REFERENCES ROIs(ROI_Id),
+    FOREIGN KEY (ROIScreenshotId) REFERENCES Screenshots(ScreenshotId),
+    FOREIGN KEY (ScreenshotId1) REFERENCES Screenshots(ScreenshotId),
+    FOREIGN KEY (ScreenshotId2) REFERENCES Screenshots(ScreenshotId)
+);
+
+CREATE INDEX IF NOT EXISTS ComparisonSetsByOverlays
+ON ComparisonSets (OverlayId1, OverlayId2, ViewId, ScreenshotId);
+
+CREATE INDEX IF NOT EXISTS ComparisonSetsByROI ON ComparisonSets (ROI_Id);
+
+-- Comparison sets computed from the ScreenshotTypes table
+DROP VIEW IF EXISTS ComparisonSetScreenshots;
+CREATE VIEW ComparisonSetScreenshots AS
+SELECT * FROM (
+    SELECT S.ScreenshotId, S.ROI_Id, S.ViewId, T.ROIScreenshotId,
+        T.OverlayId1, T.Color1,
+        (SELECT MIN(A.ScreenshotId) FROM ScreenshotTypes AS A
+         WHERE A.ROIScreenshotId = T.ROIScreenshotId AND A.Type = 'I'
+            AND A.OverlayId1 = T.OverlayId1 AND A.Color1 = T.Color1) AS ScreenshotId1,
+        T.OverlayId2, T.Color2,
+        (SELECT MIN(B.ScreenshotId) FROM ScreenshotTypes AS B
+         WHERE B.ROIScreenshotId = T.ROIScreenshotId AND B.Type = 'I'
+            AND B.OverlayId1 = T.OverlayId2 AND B.Color1 = T.Color2) AS ScreenshotId2
+    FROM ScreenshotTypes AS T
+    INNER JOIN Screenshots AS S ON S.ScreenshotId = T.ScreenshotId
+    WHERE T.Type = 'C' AND T.ROIScreenshotId IS NOT NULL
+)
+WHERE ScreenshotId1 IS NOT NULL AND ScreenshotId2 IS NOT NULL;
+
+-- Comparison sets of existing database
+DELETE FROM ComparisonSets;
+INSERT INTO ComparisonSets (ScreenshotId, ROI_Id, ViewId, ROIScreenshotId,
+                            OverlayId1, Color1, ScreenshotId1,
+                            OverlayId2, Color2, ScreenshotId2)
+SELECT * FROM ComparisonSetScreenshots;
@@ -0,0 +1,132 @@
+------------------------------------------------------------------------------
+--                             Rater progress                               --
+------------------------------------------------------------------------------
+
+-- Migration to schema version 5, which adds counters of the total number of
+-- screenshots of each task and the number of these rated by each rater.
+-- The summary of the app previously counted the distinct screenshots of
+-- each task and the rated screenshots using the screenshot views.
+
+-- Index used to find the tasks whose queue contains a rated screenshot
+CREATE INDEX IF NOT EXISTS RaterQueueByScreenshot
+ON RaterQueue (RaterId, ScreenshotId, TaskType, TaskId);
+
+-- Table of number of screenshots in the queue of a rater for each task
+--
+-- The Total is the number of screenshots in the RaterQueue of the task and
+-- Done the number of these which were scored or compared by the rater.
+-- The counters are updated by the triggers below in the same transaction
+-- which fills the queue, saves a score or choice, or undoes a score.
+CREATE TABLE IF NOT EXISTS RaterProgress
+(
+    RaterId INTEGER NOT NULL,
+    TaskType CHARACTER(1) NOT NULL,
+    TaskId INTEGER NOT NULL,
+    Total INTEGER NOT NULL DEFAULT 0,
+    Done INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (RaterId, TaskType, TaskId),
+    FOREIGN KEY (RaterId) REFERENCES Raters(RaterId)
+);
+
+-- Counters of existing queues
+DELETE FROM RaterProgress;
+INSERT INTO RaterProgress (RaterId, TaskType, TaskId, Total, Done)
+SELECT Q.RaterId, Q.TaskType, Q.TaskId, COUNT(*),
+    SUM(CASE
+        WHEN Q.TaskType = 'E' THEN EXISTS (SELECT 1 FROM EvaluationScores AS E
+                                           WHERE E.ScreenshotId = Q.ScreenshotId AND E.RaterId = Q.RaterId)
+        ELSE EXISTS (SELECT 1 FROM ComparisonChoices AS C
+                     WHERE C.ScreenshotId = Q.ScreenshotId AND C.RaterId = Q.RaterId)
+    END)
+FROM RaterQueue AS Q
+GROUP BY Q.RaterId, Q.TaskType, Q.TaskId;
+
+-- Triggers which keep the RaterProgress up to date
+--
+-- A screenshot may be in the queues of more than one task of the same type
+-- when the tasks share an overlay, in which case all these are updated.
+DROP TRIGGER IF EXISTS RaterQueueInserted;
+CREATE TRIGGER RaterQueueInserted AFTER INSERT ON RaterQueue
+BEGIN
+    INSERT OR IGNORE INTO RaterProgress (RaterId, TaskType, TaskId)
+    VALUES (NEW.RaterId, NEW.TaskType, NEW.TaskId);
+    UPDATE RaterProgress SET
+        Total = Total + 1,
+        Done = Done + CASE
+            WHEN NEW.TaskType = 'E' THEN EXISTS (SELECT 1 FROM EvaluationScores AS E
+                                                 WHERE E.ScreenshotId = NEW.ScreenshotId AND E.RaterId = NEW.RaterId)
+            ELSE EXISTS (SELECT 1 FROM ComparisonChoices AS C
+                         WHERE C.ScreenshotId = NEW.ScreenshotId AND C.RaterId = NEW.RaterId)
+        END
+    WHERE RaterId = NEW.RaterId AND TaskType = NEW.TaskType AND TaskId = NEW.TaskId;
+END;
+
+DROP TRIGGER IF EXISTS EvaluationScoreInserted;
+CREATE TRIGGER EvaluationScoreInserted AFTER INSERT ON EvaluationScores
+BEGIN
+    UPDATE RaterProgress SET Done = Done + 1
+    WHERE RaterId = NEW.RaterId AND TaskType = 'E' AND TaskId IN (
+        SELECT TaskId FROM RaterQueue
+        WHERE RaterId = NEW.RaterId AND ScreenshotId = NEW.ScreenshotId AND TaskType = 'E'
+    );
+END;
+
+DROP TRIGGER IF EXISTS EvaluationScoreUpdated;
+CREATE TRIGGER EvaluationScoreUpdated AFTER UPDATE OF ScreenshotId, RaterId ON EvaluationScores
+BEGIN
+    UPDATE RaterProgress SET Done = Done - 1
+    WHERE RaterId = OLD.RaterId AND TaskType = 'E' AND TaskId IN (
+        SELECT TaskId FROM RaterQueue
+        WHERE RaterId = OLD.RaterId AND ScreenshotId = OLD.ScreenshotId AND TaskType = 'E'
+    );
+    UPDATE RaterProgress SET Done = Done + 1
+    WHERE RaterId = NEW.RaterId AND TaskType = 'E' AND TaskId IN (
+        SELECT TaskId FROM RaterQueue
+        WHERE RaterId = NEW.RaterId AND ScreenshotId = NEW.ScreenshotId AND TaskType = 'E'
+    );
+END;
+
+DROP TRIGGER IF EXISTS EvaluationScoreDeleted;
+CREATE TRIGGER EvaluationScoreDeleted AFTER DELETE ON EvaluationScores
+BEGIN
+    UPDATE RaterProgress SET Done = Done - 1
+    WHERE RaterId = OLD.RaterId AND TaskType = 'E' AND TaskId IN (
+        SELECT TaskId FROM RaterQueue
+        WHERE RaterId = OLD.RaterId AND ScreenshotId = OLD.ScreenshotId AND TaskType = 'E'
+    );
+END;
+
+DROP TRIGGER IF EXISTS ComparisonChoiceInserted;
+CREATE TRIGGER ComparisonChoiceInserted AFTER INSERT ON ComparisonChoices
+BEGIN
+    UPDATE RaterProgress SET Done = Done + 1
+    WHERE RaterId = NEW.RaterId AND TaskType = 'C' AND TaskId IN (
+        SELECT TaskId FROM RaterQueue
+        WHERE RaterId = NEW.RaterId AND ScreenshotId = NEW.ScreenshotId AND TaskType = 'C'
+    );
+END;
+
+DROP TRIGGER IF EXISTS ComparisonChoiceUpdated;
+CREATE TRIGGER ComparisonChoiceUpdated AFTER UPDATE OF ScreenshotId, RaterId ON ComparisonChoices
+BEGIN
+    UPDATE RaterProgress SET Done = Done - 1
+    WHERE RaterId = OLD.RaterId AND TaskType = 'C' AND TaskId IN (
+        SELECT TaskId FROM RaterQueue
+        WHERE RaterId = OLD.RaterId AND ScreenshotId = OLD.ScreenshotId AND TaskType = 'C'
+    );
+    UPDATE RaterProgress SET Done = Done + 1
+    WHERE RaterId = NEW.RaterId AND TaskType = 'C' AND TaskId IN (
+        SELECT TaskId FROM RaterQueue
+        WHERE RaterId = NEW.RaterId AND ScreenshotId = NEW.ScreenshotId AND TaskType = 'C'
+    );
+END;
+
+DROP TRIGGER IF EXISTS ComparisonChoiceDeleted;
+CREATE TRIGGER ComparisonChoiceDeleted AFTER DELETE ON ComparisonChoices
+BEGIN
+    UPDATE RaterProgress SET Done = Done - 1
+    WHERE RaterId = OLD.RaterId AND TaskType = 'C' AND TaskId IN (
+        SELECT TaskId FROM RaterQueue
+        WHERE RaterId = OLD.RaterId AND ScreenshotId = OLD.ScreenshotId AND TaskType = 'C'
+    );
+END;
@@ -0,0 +1,125 @@
+------------------------------------------------------------------------------
+--                              Results cube                                --
+------------------------------------------------------------------------------
+
+-- Migration to schema version 6, which adds a table of the number of scores
+-- and comparison choices aggregated by rater, overlay(s), value, view, and
+-- scan. The tools/plot-results.py script previously counted the scores and
+-- choices for each figure using the screenshot views.
+
+-- Number of scores and choices computed from the EvaluationScores and
+-- ComparisonChoices tables
+--
+-- Evaluation scores have TaskType 'E', the evaluated overlay as OverlayId1,
+-- an OverlayId2 of zero, and the Score as Value. Comparison choices have
+-- TaskType 'C', the two overlays ordered by increasing OverlayId, and the
+-- BestOverlayId as Value, which is zero for the choice 'Neither'. Choices
+-- of a ROI for which a rater discarded a screenshot (Score 0) are excluded.
+DROP VIEW IF EXISTS ResultsCubeRows;
+CREATE VIEW ResultsCubeRows AS
+SELECT R.ScanId, 'E' AS TaskType, E.RaterId,
+    T.OverlayId1, 0 AS OverlayId2, E.Score AS Value, S.ViewId,
+    COUNT(*) AS Count
+FROM EvaluationScores AS E
+INNER JOIN ScreenshotTypes AS T ON T.ScreenshotId = E.ScreenshotId AND T.Type = 'E'
+INNER JOIN Screenshots AS S ON S.ScreenshotId = E.ScreenshotId
+INNER JOIN ROIs AS R ON R.ROI_Id = S.ROI_Id
+GROUP BY R.ScanId, E.RaterId, T.OverlayId1, E.Score, S.ViewId
+UNION ALL
+SELECT R.ScanId, 'C' AS TaskType, C.RaterId,
+    T.OverlayId1, T.OverlayId2, C.BestOverlayId AS Value, S.ViewId,
+    COUNT(*) AS Count
+FROM ComparisonChoices AS C
+INNER JOIN ScreenshotTypes AS T ON T.ScreenshotId = C.ScreenshotId AND T.Type = 'C'
+INNER JOIN Screenshots AS S ON S.ScreenshotId = C.ScreenshotId
+INNER JOIN ROIs AS R ON R.ROI_Id = S.ROI_Id
+WHERE NOT EXISTS (
+    SELECT 1 FROM Screenshots AS A
+    INNER JOIN EvaluationScores AS B ON B.ScreenshotId = A.ScreenshotId AND B.Score = 0
+    WHERE A.ROI_Id = S.ROI_Id
+)
+GROUP BY R.ScanId, C.RaterId, T.OverlayId1, T.OverlayId2, C.BestOverlayId, S.ViewId;
+
+-- Table of aggregated results
+--
+-- The rows of each scan listed in StaleResults are recomputed from the
+-- ResultsCubeRows view by the tools reading this table before they do so.
+CREATE TABLE IF NOT EXISTS ResultsCube
+(
+    ScanId INTEGER NOT NULL,
+    TaskType CHARACTER(1) NOT NULL,
+    RaterId INTEGER NOT NULL,
+    OverlayId1 INTEGER NOT NULL,
+    OverlayId2 INTEGER NOT NULL,
+    Value INTEGER NOT NULL,
+    ViewId CHARACTER(1) NOT NULL,
+    Count INTEGER NOT NULL,
+    PRIMARY KEY (ScanId, TaskType, RaterId, OverlayId1, OverlayId2, Value, ViewId),
+    FOREIGN KEY (ScanId) REFERENCES Scans(ScanId),
+    FOREIGN KEY (RaterId) REFERENCES Raters(RaterId)
+);
+
+-- Table of scans whose scores or choices changed since the last refresh
+CREATE TABLE IF NOT EXISTS StaleResults
+(
+    ScanId INTEGER PRIMARY KEY,
+    FOREIGN KEY (ScanId) REFERENCES Scans(ScanId)
+);
+
+-- Results of existing database
+DELETE FROM StaleResults;
+DELETE FROM ResultsCube;
+INSERT INTO ResultsCube (ScanId, TaskType, RaterId, OverlayId1, OverlayId2, Value, ViewId, Count)
+SELECT * FROM ResultsCubeRows;
+
+-- Triggers which mark the scan of a changed score or choice as stale
+--
+-- A discarded screenshot (Score 0) also changes the comparison choices
+-- counted for its ROI, which belong to the same scan.
+DROP TRIGGER IF EXISTS StaleResultsScoreInserted;
+CREATE TRIGGER StaleResultsScoreInserted AFTER INSERT ON EvaluationScores
+BEGIN
+    INSERT OR IGNORE INTO StaleResults (ScanId)
+    SELECT R.ScanId FROM Screenshots AS S INNER JOIN ROIs AS R ON R.ROI_Id = S.ROI_Id
+    WHERE S.ScreenshotId = NEW.ScreenshotId;
+END;
+
+DROP TRIGGER IF EXISTS StaleResultsScoreUpdated;
+CREATE TRIGGER StaleResultsScoreUpdated AFTER UPDATE ON EvaluationScores
+BEGIN
+    INSERT OR IGNORE INTO StaleResults (ScanId)
+    SELECT R.ScanId FROM Screenshots AS S INNER JOIN ROIs AS R ON R.ROI_Id = S.ROI_Id
+    WHERE S.ScreenshotId IN (OLD.ScreenshotId, NEW.ScreenshotId);
+END;
+
+DROP TRIGGER IF EXISTS StaleResultsScoreDeleted;
+CREATE TRIGGER StaleResultsScoreDeleted AFTER DELETE ON EvaluationScores
+BEGIN
+    INSERT OR IGNORE INTO StaleResults (ScanId)
+    SELECT R.ScanId FROM Screenshots AS S INNER JOIN ROIs AS R ON R.ROI_Id = S.ROI_Id
+    WHERE S.ScreenshotId = OLD.ScreenshotId;
+END;
+
+DROP TRIGGER IF EXISTS StaleResultsChoiceInserted;
+CREATE TRIGGER StaleResultsChoiceInserted AFTER INSERT ON ComparisonChoices
+BEGIN
+    INSERT OR IGNORE INTO StaleResults (ScanId)
+    SELECT R.ScanId FROM Screenshots AS S INNER JOIN ROIs AS R ON R.ROI_Id = S.ROI_Id
+    WHERE S.ScreenshotId = NEW.ScreenshotId;
+END;
+
+DROP TRIGGER IF EXISTS StaleResultsChoiceUpdated;
+CREATE TRIGGER StaleResultsChoiceUpdated AFTER UPDATE ON ComparisonChoices
+BEGIN
+    INSERT OR IGNORE INTO StaleResults (ScanId)
+    SELECT R.ScanId FROM Screenshots AS S INNER JOIN ROIs AS R ON R.ROI_Id = S.ROI_Id
+    WHERE S.ScreenshotId IN (OLD.ScreenshotId, NEW.ScreenshotId);
+END;
+
+DROP TRIGGER IF EXISTS StaleResultsChoiceDeleted;
+CREATE TRIGGER StaleResultsChoiceDeleted AFTER DELETE ON ComparisonChoices
+BEGIN
+    INSERT OR IGNORE INTO StaleResults (ScanId)
+    SELECT R.ScanId FROM Screenshots AS S INNER JOIN ROIs AS R ON R.ROI_Id = S.ROI_Id
+    WHERE S.ScreenshotId = OLD.ScreenshotId;
+END;
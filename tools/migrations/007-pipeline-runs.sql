@@ -0,0 +1,32 @@
+------------------------------------------------------------------------------
+--                         Instrumentation tables                           --
+------------------------------------------------------------------------------
+
+-- Migration to schema version 7, which adds a table of the resources used by
+-- the pipeline. The tools previously created this table on first use.
+
+-- Table of resources used by the stages of the bin/eval-db pipeline
+--
+-- Each row records one execution of a stage such as the selection of ROIs
+-- or a screenshot pass for a given scan. Rows with a ROI_Id were recorded by
+-- the worker process of an individual ROI, whereas rows without summarize the
+-- stage for the entire scan. Phases of a stage are named "<stage>/<phase>",
+-- e.g., "select-rois/distances". The PeakRSS is given in bytes and includes
+-- child processes, the StartTime is in seconds since the epoch.
+CREATE TABLE IF NOT EXISTS PipelineRuns
+(
+    RunId INTEGER PRIMARY KEY AUTOINCREMENT,
+    ScanId INTEGER,
+    ROI_Id INTEGER,
+    Stage VARCHAR(64) NOT NULL,
+    Host VARCHAR(255),
+    ProcessId INTEGER,
+    StartTime REAL NOT NULL,
+    WallTime REAL NOT NULL,
+    CPUTime REAL NOT NULL,
+    PeakRSS INTEGER,
+    NumScreenshots INTEGER DEFAULT 0,
+    BytesWritten INTEGER DEFAULT 0,
+    FOREIGN KEY (ScanId) REFERENCES Scans(ScanId)
+    FOREIGN KEY (ROI_Id) REFERENCES ROIs(ROI_Id)
+);
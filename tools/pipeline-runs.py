@@ -0,0 +1,124 @@
+#!/usr/bin/python
+
+"""Record resources used by a pipeline command or report hot spots of the pipeline."""
+
+import sys
+import csv
+import sqlite3
+import argparse
+import subprocess
+
+from instrumentation import Stage, summarize_runs
+
+
+def get_scan_id(db, subject_id, session_id):
+    """Get ScanId corresponding to given pair of subject and session IDs."""
+    res = db.execute("SELECT ScanId FROM Scans WHERE SubjectId = :subject_id AND SessionId = :session_id",
+                     dict(subject_id=subject_id, session_id=session_id)).fetchone()
+    if res:
+        return res[0]
+    else:
+        raise Exception("ScanId not found for SubjectId={} and SessionId={}".format(subject_id, session_id))
+
+
+def read_sessions(csv_name):
+    """Read list of (SubjectId, SessionId) pairs from CSV file."""
+    sessions = []
+    with open(csv_name) as f:
+        for row in csv.reader(f):
+            if len(row) < 2 or not row[0].startswith('CC'):
+                continue
+            sessions.append((row[0], row[1]))
+    return sessions
+
+
+def exec_command(args):
+    """Execute command and record its resource usage."""
+    stage = Stage(args.stage).start()
+    status = subprocess.call(args.command)
+    stage.stop()
+    if status == 0:
+        db = sqlite3.connect(args.database, timeout=60)
+        try:
+            if args.subject and args.session:
+                stage.scan_id = get_scan_id(db, args.subject, args.session)
+            stage.record(db)
+            db.commit()
+        finally:
+            db.close()
+    return status
+
+
+def format_bytes(n):
+    """Format number of bytes with binary unit prefix."""
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if n < 1024. or unit == 'GiB':
+            break
+        n /= 1024.
+    return "{:.1f} {}".format(n, unit)
+
+
+def print_report(args):
+    """Print summary of pipeline stages ordered by total wall time."""
+    db = sqlite3.connect(args.database)
+    try:
+        scan_ids = None
+        sessions = []
+        if args.csv:
+            sessions.extend(read_sessions(args.csv))
+        for session in args.sessions:
+            sessions.append(tuple(session.split('-', 1)))
+        if sessions:
+            scan_ids = [get_scan_id(db, subject_id, session_id) for subject_id, session_id in sessions]
+        stages = summarize_runs(db, scan_ids=scan_ids)
+    finally:
+        db.close()
+    total = sum([stage['wall_time'] for stage in stages if '/' not in stage['stage']])
+    print("{:<48} {:>5} {:>6} {:>10} {:>10} {:>6} {:>10} {:>11} {:>11} {:>8} {:>11}".format(
+        "Stage", "Scans", "ROIs", "Wall [s]", "CPU [s]", "%", "Peak RSS",
+        "Screenshots", "Written", "Shots/s", "Written/s"))
+    for stage in stages:
+        name = stage['stage']
+        if '/' in name:
+            parent = [other for other in stages if other['stage'] == name.rsplit('/', 1)[0]]
+            reference = parent[0]['wall_time'] if parent else 0.
+            name = '  ' + name
+        else:
+            reference = total
+        wall_time = stage['wall_time']
+        print("{:<48} {:>5d} {:>6d} {:>10.1f} {:>10.1f} {:>6.1f} {:>10} {:>11d} {:>11} {:>8.2f} {:>11}".format(
+            name, stage['scans'], stage['rois'], wall_time, stage['cpu_time'],
+            100. * wall_time / reference if reference > 0. else 0.,
+            format_bytes(stage['peak_rss']), stage['screenshots'], format_bytes(stage['bytes']),
+            stage['screenshots'] / wall_time if wall_time > 0. else 0.,
+            format_bytes(stage['bytes'] / wall_time if wall_time > 0. else 0.) + '/s'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest='action')
+
+    subparser = subparsers.add_parser('exec', help="Execute command and record its resource usage")
+    subparser.add_argument('database', help="SQLite database file")
+    subparser.add_argument('--stage', required=True, help="Name of pipeline stage")
+    subparser.add_argument('--subject', help="Subject ID")
+    subparser.add_argument('--session', help="Session ID")
+    subparser.add_argument('command', nargs=argparse.REMAINDER, help="Command to execute")
+
+    subparser = subparsers.add_parser('report', help="Summarize hot spots and throughput per stage")
+    subparser.add_argument('database', help="SQLite database file")
+    subparser.add_argument('--csv', help="CSV file with 'SubjectId,SessionId' of cohort")
+    subparser.add_argument('--sessions', default=[], nargs='+', help="List of {SubjectId}-{SessionId} strings")
+
+    args = parser.parse_args()
+    if args.action == 'exec':
+        if args.command and args.command[0] == '--':
+            args.command = args.command[1:]
+        if not args.command:
+            parser.error("exec requires a command")
+        sys.exit(exec_command(args))
+    elif args.action == 'report':
+        print_report(args)
+    else:
+        parser.print_usage()
+        sys.exit(1)
@@ -8,71 +8,88 @@ import sqlite3
 import numpy as np
 from matplotlib import pyplot as plt, ticker
 
+from results_analysis import bootstrap_percentages
+
 
 max_score = 4
 
 
-def evaluation_scores(db, overlay, rater=None):
+def refresh_results_cube(db):
+    """Recompute aggregated results of scans whose scores or choices changed."""
+    c = db.cursor()
+    try:
+        c.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'ResultsCube'")
+        if c.fetchone()[0] == 0:
+            raise Exception("Missing ResultsCube table, run tools/create-tables.py to upgrade the database")
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            c.execute("SELECT ScanId FROM StaleResults")
+            for scan_id in [row[0] for row in c.fetchall()]:
+                c.execute("DELETE FROM ResultsCube WHERE ScanId = ?", (scan_id,))
+                c.execute("""
+                    INSERT INTO ResultsCube (ScanId, TaskType, RaterId, OverlayId1, OverlayId2, Value, ViewId, Count)
+                    SELECT * FROM ResultsCubeRows WHERE ScanId = ?
+                """, (scan_id,))
+            c.execute("DELETE FROM StaleResults")
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+    finally:
+        c.close()
+
+
+def query_results(db, rater=None):
+    """Get number of scores and choices for each scan, overlay(s), and value."""
     c = db.cursor()
     try:
         query = """
-            SELECT Score FROM EvaluationScreenshots AS A
-            INNER JOIN EvaluationScores AS B
-            ON A.ScreenshotId = B.ScreenshotId AND Score > 0 AND OverlayId = {}
-        """.format(overlay)
+            SELECT ScanId, TaskType, OverlayId1, OverlayId2, Value, SUM(Count) FROM ResultsCube
+        """
         if rater:
-            query += " AND RaterId = {}".format(rater)
+            query += " WHERE RaterId = {}".format(rater)
+        query += " GROUP BY ScanId, TaskType, OverlayId1, OverlayId2, Value"
         c.execute(query)
-        arr = np.fromiter(c.fetchall(), dtype=[('scores', 'u1')])['scores']
+        results = np.array(c.fetchall(), dtype=[('scan', 'i4'), ('type', 'U1'), ('overlay1', 'i4'),
+                                                 ('overlay2', 'i4'), ('value', 'i4'), ('count', 'u4')])
     finally:
         c.close()
-    scores, counts = np.unique(arr, return_counts=True)
-    if max(scores) > max_score:
+    return results
+
+
+def evaluation_scores_by_scan(results, overlay):
+    """Get number of scores 1 to max_score of each scan with scores of the overlay."""
+    select = (results['type'] == 'E') & (results['overlay1'] == overlay) & (results['value'] > 0)
+    scores = results['value'][select]
+    if len(scores) > 0 and max(scores) > max_score:
         raise Exception("Expected scores in the interval [0, {}]".format(max_score))
-    result = np.zeros(max_score, dtype=np.uint32)
-    for score, count in zip(scores, counts):
-        result[score - 1] = count
-    return result
+    scans, index = np.unique(results['scan'][select], return_inverse=True)
+    counts = np.zeros((len(scans), max_score), dtype=np.uint32)
+    np.add.at(counts, (index.reshape(-1), scores - 1), results['count'][select])
+    return counts
+
+
+def evaluation_scores(results, overlay):
+    return evaluation_scores_by_scan(results, overlay).sum(axis=0, dtype=np.uint32)
 
 
-def comparison_choices(db, overlay1, overlay2, rater=None):
+def comparison_choices(results, overlay1, overlay2):
+    """Get number of choices 'Neither', overlay1, and overlay2, in this order."""
     if overlay1 > overlay2:
         id1, id2 = overlay2, overlay1
     else:
         id1, id2 = overlay1, overlay2
-    c = db.cursor()
-    try:
-        query = """
-            SELECT BestOverlayId FROM ComparisonScreenshots AS A
-            INNER JOIN ComparisonChoices AS B
-            ON A.ScreenshotId = B.ScreenshotId
-            AND OverlayId1 = {id1}
-            AND OverlayId2 = {id2}
-            AND ROI_Id NOT IN (
-              SELECT ROI_Id FROM Screenshots AS A
-              INNER JOIN EvaluationScores AS B
-              ON A.ScreenshotId = B.ScreenshotId AND Score = 0
-              GROUP BY ROI_Id
-            )
-        """.format(id1=id1, id2=id2)
-        if rater:
-            query += " AND RaterId = {}".format(rater)
-        c.execute(query)
-        arr = np.fromiter(c.fetchall(), dtype=[('overlay', 'u1')])['overlay']
-    finally:
-        c.close()
-    ids, counts = np.unique(arr, return_counts=True)
-    if len(ids) == 0:
-        return np.zeros(1)
-    elif len(ids) == 2:
-        ids = [0] + ids
-        np.insert(ids, obj=0, values=0)
-        np.insert(counts, obj=0, values=0)
-    elif ids[0] != 0:
-        raise Exception("Expected first overlay ID to be 0, i.e., choice 'Neither'")
-    if ids[1] == overlay2:
-        ids[1], ids[2] = ids[2], ids[1]
-        counts[1], counts[2] = counts[2], counts[1]
+    select = (results['type'] == 'C') & (results['overlay1'] == id1) & (results['overlay2'] == id2)
+    counts = np.zeros(3, dtype=np.uint32)
+    for overlay, count in zip(results['value'][select], results['count'][select]):
+        if overlay == 0:
+            counts[0] += count
+        elif overlay == overlay1:
+            counts[1] += count
+        elif overlay == overlay2:
+            counts[2] += count
+        else:
+            raise Exception("Expected best overlay ID to be 0, {}, or {}".format(overlay1, overlay2))
     return counts
 
 
@@ -90,7 +107,18 @@ def topct(counts, i=-1):
         return 100. * counts.astype(np.float) / counts.sum()
 
 
-def plot_evaluation_scores_grouped_hbars(db, rater=0, fname=None, dpi=1200):
+def scores_percentages(results, overlay, ci=None, replicates=10000):
+    """Get percentages of scores of overlay and error bars of confidence interval.
+
+    The confidence interval is obtained by a cluster bootstrap over scans."""
+    counts = evaluation_scores_by_scan(results, overlay)
+    if not ci:
+        return topct(counts.sum(axis=0)), None
+    width, lower, upper = bootstrap_percentages(counts, replicates=replicates, confidence=ci)
+    return width, np.array([width - lower, upper - width])
+
+
+def plot_evaluation_scores_grouped_hbars(results, ci=None, replicates=10000, fname=None, dpi=1200):
     fontname = 'Arial'
 
     fig, ax = plt.subplots(figsize=(10, 4), facecolor='white')
@@ -98,15 +126,15 @@ def plot_evaluation_scores_grouped_hbars(db, rater=0, fname=None, dpi=1200):
     bottom = np.arange(0, max_score, dtype=np.float)[::-1]
     height = .4
 
-    count = evaluation_scores(db, overlay=4, rater=rater)
-    width = 100 * (count.astype(np.float) / float(count.sum()))
-    max_width = width.max()
-    rects1 = ax.barh(bottom + height, width=width, height=height, facecolor='#e85f5f', edgecolor='white')
+    width, xerr = scores_percentages(results, overlay=4, ci=ci, replicates=replicates)
+    max_width = width.max() if xerr is None else (width + xerr[1]).max()
+    rects1 = ax.barh(bottom + height, width=width, xerr=xerr, height=height,
+                     facecolor='#e85f5f', edgecolor='white', ecolor='black', capsize=3)
 
-    count = evaluation_scores(db, overlay=3, rater=rater)
-    width = 100 * (count.astype(np.float) / float(count.sum()))
-    max_width = max(max_width, width.max())
-    rects2 = ax.barh(bottom, width=width, height=height, facecolor='#4682b4', edgecolor='white')
+    width, xerr = scores_percentages(results, overlay=3, ci=ci, replicates=replicates)
+    max_width = max(max_width, width.max() if xerr is None else (width + xerr[1]).max())
+    rects2 = ax.barh(bottom, width=width, xerr=xerr, height=height,
+                     facecolor='#4682b4', edgecolor='white', ecolor='black', capsize=3)
 
     ax.set_xlabel('Percentage of samples with assigned score', fontname=fontname, size=16, labelpad=10)
     ax.xaxis.set_ticks(np.arange(0, max_width + 6, 5))
@@ -122,9 +150,9 @@ def plot_evaluation_scores_grouped_hbars(db, rater=0, fname=None, dpi=1200):
     render(fname=fname, dpi=dpi)
 
 
-def plot_evaluation_scores_stacked_hbars(db, rater=0, fname=None, dpi=1200):
-    counts_proposed = evaluation_scores(db, overlay=3, rater=rater)
-    counts_vol2mesh = evaluation_scores(db, overlay=4, rater=rater)
+def plot_evaluation_scores_stacked_hbars(results, fname=None, dpi=1200):
+    counts_proposed = evaluation_scores(results, overlay=3)
+    counts_vol2mesh = evaluation_scores(results, overlay=4)
 
     fontname = 'Arial'
     height = .6
@@ -162,10 +190,10 @@ def plot_evaluation_scores_stacked_hbars(db, rater=0, fname=None, dpi=1200):
     render(fname=fname, dpi=dpi)
 
 
-def plot_evaluation_scores_pie(db, overlay, rater=0, fname=None, dpi=1200):
+def plot_evaluation_scores_pie(results, overlay, fname=None, dpi=1200):
     fig = plt.figure(figsize=(6.5, 5), facecolor='white')
     axes = fig.gca()
-    wedges, labels, texts = axes.pie(evaluation_scores(db, overlay=overlay, rater=rater),
+    wedges, labels, texts = axes.pie(evaluation_scores(results, overlay=overlay),
                                      labels=('Poor', 'Fair', 'Good', 'Excellent'),
                                      colors=('#e85f5f', '#f0ad4e', '#0275d8', '#5cb85c'),
                                      autopct='%1.0f%%', startangle=90, counterclock=False)
@@ -182,13 +210,13 @@ def plot_evaluation_scores_pie(db, overlay, rater=0, fname=None, dpi=1200):
     render(fname=fname, dpi=dpi)
 
 
-def plot_comparison_choices_pie(db, overlays,
+def plot_comparison_choices_pie(results, overlays,
                                 labels=('reference', 'proposed'),
                                 colors=('#e85f5f', '#4682b4'),
-                                rater=0, fname=None, dpi=1200):
+                                fname=None, dpi=1200):
     fig = plt.figure(figsize=(6.5, 5), facecolor='white')
     axes = fig.gca()
-    wedges, labels, texts = axes.pie(comparison_choices(db, overlay1=overlays[0], overlay2=overlays[1], rater=rater),
+    wedges, labels, texts = axes.pie(comparison_choices(results, overlay1=overlays[0], overlay2=overlays[1]),
                                      labels=('neither', labels[0], labels[1]),
                                      colors=('lightgrey', colors[0], colors[1]),
                                      autopct='%1.0f%%', startangle=180, counterclock=False)
@@ -225,39 +253,47 @@ if __name__ == '__main__':
                         help="Plot comparison choices between vol2mesh and white matter surface")
     parser.add_argument('--rater', default=0, type=int,
                         help="ID of rater whose results should be plotted, zero for any rater")
+    parser.add_argument('--ci', nargs='?', const=95., type=float,
+                        help="Draw error bars of confidence interval in percent, obtained by resampling scans")
+    parser.add_argument('--bootstrap', default=10000, type=int,
+                        help="Number of bootstrap replicates used to estimate the confidence interval")
     args = parser.parse_args()
     args.database = os.path.abspath(args.database)
 
     db = sqlite3.connect(args.database)
     try:
-        if (not args.scores_grouped_bars and not args.scores_stacked_bars and
-                not args.scores_pie_vol2mesh and not args.scores_pie_proposed and
-                not args.compare_initial and not args.compare_vol2mesh):
-            nscores_proposed = evaluation_scores(db, overlay=3, rater=args.rater).sum()
-            nscores_vol2mesh = evaluation_scores(db, overlay=4, rater=args.rater).sum()
-            if nscores_vol2mesh > 0:
-                args.scores_pie_vol2mesh = 'show'
-            if nscores_proposed > 0:
-                args.scores_pie_proposed = 'show'
-            if nscores_vol2mesh > 0 and nscores_proposed > 0:
-                args.scores_stacked_bars = 'show'
-            if comparison_choices(db, overlay1=2, overlay2=3, rater=args.rater).sum() > 0:
-                args.compare_initial = 'show'
-            if comparison_choices(db, overlay1=3, overlay2=4, rater=args.rater).sum() > 0:
-                args.plot_comparison_with_vol2mesh = 'show'
-        if args.scores_grouped_bars:
-            plot_evaluation_scores_grouped_hbars(db, fname=args.scores_grouped_bars, rater=args.rater, dpi=args.dpi)
-        if args.scores_stacked_bars:
-            plot_evaluation_scores_stacked_hbars(db, fname=args.scores_stacked_bars, rater=args.rater, dpi=args.dpi)
-        if args.scores_pie_vol2mesh:
-            plot_evaluation_scores_pie(db, fname=args.scores_pie_vol2mesh, overlay=3, rater=args.rater, dpi=args.dpi)
-        if args.scores_pie_proposed:
-            plot_evaluation_scores_pie(db, fname=args.scores_pie_proposed, overlay=4, rater=args.rater, dpi=args.dpi)
-        if args.compare_initial:
-            plot_comparison_choices_pie(db, fname=args.compare_initial, rater=args.rater,
-                                        overlays=(2, 3), labels=('initial', 'proposed'), dpi=args.dpi)
-        if args.compare_vol2mesh:
-            plot_comparison_choices_pie(db, fname=args.compare_vol2mesh, rater=args.rater,
-                                        overlays=(4, 3), labels=('vol2mesh', 'proposed'), dpi=args.dpi)
+        refresh_results_cube(db)
+        results = query_results(db, rater=args.rater)
     finally:
         db.close()
+
+    if (not args.scores_grouped_bars and not args.scores_stacked_bars and
+            not args.scores_pie_vol2mesh and not args.scores_pie_proposed and
+            not args.compare_initial and not args.compare_vol2mesh):
+        nscores_proposed = evaluation_scores(results, overlay=3).sum()
+        nscores_vol2mesh = evaluation_scores(results, overlay=4).sum()
+        if nscores_vol2mesh > 0:
+            args.scores_pie_vol2mesh = 'show'
+        if nscores_proposed > 0:
+            args.scores_pie_proposed = 'show'
+        if nscores_vol2mesh > 0 and nscores_proposed > 0:
+            args.scores_stacked_bars = 'show'
+        if comparison_choices(results, overlay1=2, overlay2=3).sum() > 0:
+            args.compare_initial = 'show'
+        if comparison_choices(results, overlay1=3, overlay2=4).sum() > 0:
+            args.compare_vol2mesh = 'show'
+    if args.scores_grouped_bars:
+        plot_evaluation_scores_grouped_hbars(results, ci=args.ci, replicates=args.bootstrap,
+                                             fname=args.scores_grouped_bars, dpi=args.dpi)
+    if args.scores_stacked_bars:
+        plot_evaluation_scores_stacked_hbars(results, fname=args.scores_stacked_bars, dpi=args.dpi)
+    if args.scores_pie_vol2mesh:
+        plot_evaluation_scores_pie(results, fname=args.scores_pie_vol2mesh, overlay=3, dpi=args.dpi)
+    if args.scores_pie_proposed:
+        plot_evaluation_scores_pie(results, fname=args.scores_pie_proposed, overlay=4, dpi=args.dpi)
+    if args.compare_initial:
+        plot_comparison_choices_pie(results, fname=args.compare_initial,
+                                    overlays=(2, 3), labels=('initial', 'proposed'), dpi=args.dpi)
+    if args.compare_vol2mesh:
+        plot_comparison_choices_pie(results, fname=args.compare_vol2mesh,
+                                    overlays=(4, 3), labels=('vol2mesh', 'proposed'), dpi=args.dpi)
@@ -0,0 +1,181 @@
+"""Opt-in profiling of the screenshot and ROI selection tools.
+
+A Profiler writes the cProfile statistics of one process to a file in the
+profile directory, and the accumulated execution times of the instrumented
+VTK readers, filters, and render windows to a JSON file next to it. The
+file names encode tool, scan, ROI, and process ID, i.e.,
+
+    {tool}_{subject}-{session}[_roi-{roi:06d}]_pid-{pid}.{prof|vtk.json|timings.csv}
+
+such that the profiles of the separate worker processes of each ROI can be
+aggregated afterwards, e.g., using the merge-profiles.py script. When the scan
+is identified by its ID only, "{subject}-{session}" is replaced by
+"scan-{scan:06d}".
+"""
+
+import os
+import sys
+import json
+import time
+import cProfile
+
+
+# Names of modules whose VTK classes are replaced by instrumented factories
+VTK_MODULES = ('vtk', 'mirtk.rendering.screenshots', '__main__')
+
+# Names of VTK classes whose execution time is measured
+VTK_CLASSES = (
+    'vtkNIFTIImageReader',
+    'vtkXMLPolyDataReader',
+    'vtkImageReslice',
+    'vtkCutter',
+    'vtkRenderWindow',
+    'vtkWindowToImageFilter',
+    'vtkPNGWriter'
+)
+
+
+def profile_name(tool, subject, session, roi=None, pid=None, scan=None):
+    """Get base name of profile output files without extension."""
+    name = tool.replace(':', '.').replace(os.sep, '.')
+    if subject and session:
+        name += '_{}-{}'.format(subject, session)
+    elif scan:
+        name += '_scan-{:06d}'.format(scan)
+    else:
+        name += '_unknown-unknown'
+    if roi:
+        name += '_roi-{:06d}'.format(roi)
+    if pid is None:
+        pid = os.getpid()
+    return name + '_pid-{}'.format(pid)
+
+
+def profile_path(profile_dir, tool, subject, session, roi=None, ext='prof', scan=None):
+    """Get path of profile output file of this process."""
+    return os.path.join(profile_dir, '.'.join([profile_name(tool, subject, session, roi=roi, scan=scan), ext]))
+
+
+class VTKTimings(object):
+    """Accumulate execution times of VTK objects using StartEvent/EndEvent observers."""
+
+    def __init__(self):
+        self.timings = {}
+        self.patched = []
+
+    def observe(self, obj, name=None):
+        """Add observers which measure the time between start and end event of a VTK object."""
+        if name is None:
+            name = obj.GetClassName()
+        start = [None]
+
+        def on_start(caller, event):
+            start[0] = time.time()
+
+        def on_end(caller, event):
+            if start[0] is not None:
+                timing = self.timings.setdefault(name, [0, 0.])
+                timing[0] += 1
+                timing[1] += time.time() - start[0]
+                start[0] = None
+
+        obj.AddObserver('StartEvent', on_start)
+        obj.AddObserver('EndEvent', on_end)
+        return obj
+
+    def factory(self, cls, name):
+        """Create function which instantiates a VTK class and observes the new object."""
+        def new(*args, **kwargs):
+            return self.observe(cls(*args, **kwargs), name)
+        new.instrumented_class = cls
+        return new
+
+    def instrument(self, modules=VTK_MODULES, classes=VTK_CLASSES):
+        """Replace VTK classes in already imported modules by instrumented factories.
+
+        Only objects created after this call are observed. Modules which have not
+        been imported, or do not reference a given class, are left unchanged.
+        The original classes are restored by restore().
+        """
+        for module_name in modules:
+            module = sys.modules.get(module_name)
+            if module is None:
+                continue
+            for name in classes:
+                cls = getattr(module, name, None)
+                if cls is None or hasattr(cls, 'instrumented_class'):
+                    continue
+                setattr(module, name, self.factory(cls, name))
+                self.patched.append((module, name, cls))
+
+    def restore(self):
+        """Restore VTK classes replaced by instrument()."""
+        while self.patched:
+            module, name, cls = self.patched.pop()
+            setattr(module, name, cls)
+
+    def as_dict(self):
+        return dict([(name, {'count': timing[0], 'time': timing[1]})
+                     for name, timing in self.timings.items()])
+
+
+class Profiler(object):
+    """Profile this process with cProfile and measure time spent in VTK objects."""
+
+    def __init__(self, profile_dir, tool, subject, session, roi=None, scan=None):
+        self.profile_dir = os.path.abspath(profile_dir)
+        self.tool = tool
+        self.subject = subject
+        self.session = session
+        self.roi = roi
+        self.scan = scan
+        self.profile = None
+        self.vtk = VTKTimings()
+        self.start_time = None
+
+    def path(self, ext):
+        """Get path of output file of this process with given extension."""
+        return profile_path(self.profile_dir, self.tool, self.subject, self.session,
+                            roi=self.roi, ext=ext, scan=self.scan)
+
+    def start(self):
+        if not os.path.isdir(self.profile_dir):
+            try:
+                os.makedirs(self.profile_dir)
+            except OSError:
+                if not os.path.isdir(self.profile_dir):
+                    raise
+        self.vtk.instrument()
+        self.start_time = time.time()
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        return self
+
+    def stop(self):
+        """Stop profiling and write output files."""
+        if self.profile is None:
+            return
+        self.profile.disable()
+        self.vtk.restore()
+        self.profile.dump_stats(self.path('prof'))
+        self.profile = None
+        if self.vtk.timings:
+            info = {
+                'tool': self.tool,
+                'subject': self.subject,
+                'session': self.session,
+                'roi': self.roi,
+                'scan': self.scan,
+                'pid': os.getpid(),
+                'wall_time': time.time() - self.start_time,
+                'timings': self.vtk.as_dict()
+            }
+            with open(self.path('vtk.json'), 'w') as f:
+                json.dump(info, f, indent=2, sort_keys=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
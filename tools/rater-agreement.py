@@ -0,0 +1,102 @@
+#!/usr/bin/python
+
+"""Print inter-rater agreement of evaluation scores and comparison choices
+
+For each evaluated overlay and each compared pair of overlays, the weighted
+Fleiss' kappa of all raters and the weighted Cohen's kappa of each pair of raters
+are printed together with the number of screenshots rated by at least two raters,
+respectively, by both raters of a pair. The confidence intervals are obtained by
+a cluster bootstrap, which resamples scans with replacement. Discarded screenshots
+(score 0) are excluded, as are the comparison choices of ROIs with a discarded
+screenshot. The scores and choices are read either from the SQLite database or
+from the scores.npz and choices.npz files written by export-results.py."""
+
+import os
+import argparse
+import sqlite3
+import itertools
+
+import numpy as np
+
+import results_analysis as ra
+
+
+max_score = 4
+
+
+def read_results(path):
+    """Read scores and choices from database or directory with exported .npz files."""
+    if os.path.isdir(path):
+        return ra.load_npz(os.path.join(path, 'scores.npz')), ra.load_npz(os.path.join(path, 'choices.npz'))
+    db = sqlite3.connect(path)
+    try:
+        db.execute("BEGIN")
+        scores = ra.read_scores(db)
+        choices = ra.read_choices(db)
+        db.rollback()
+    finally:
+        db.close()
+    return scores, choices
+
+
+def format_agreement(agreement):
+    text = "{:6.3f}".format(agreement.kappa)
+    if not np.isnan(agreement.lower):
+        text += " [{:6.3f}, {:6.3f}]".format(agreement.lower, agreement.upper)
+    return text + " (n={:d})".format(agreement.items)
+
+
+def print_agreement(table, column, categories, weights, args):
+    for label, mask in ra.breakdown(table, args.by):
+        group = ra.select(table, mask)
+        if args.by and args.by != 'none':
+            print("  {} {}".format(args.by, label))
+        raters = np.unique(group['RaterId'])
+        if args.raters:
+            raters = [rater for rater in raters if rater in args.raters]
+            group = ra.select(group, np.isin(group['RaterId'], raters))
+        if len(raters) < 2:
+            print("    Less than two raters")
+            continue
+        fleiss = ra.fleiss_agreement(group, column, categories, weights=weights, replicates=args.bootstrap,
+                                     confidence=args.confidence, seed=args.seed)
+        print("    Fleiss' kappa            " + format_agreement(fleiss))
+        for rater1, rater2 in itertools.combinations(raters, 2):
+            cohen = ra.cohen_agreement(group, column, categories, rater1, rater2, weights=weights,
+                                       replicates=args.bootstrap, confidence=args.confidence, seed=args.seed)
+            if cohen.items > 0:
+                print("    Cohen's kappa {:>3d} vs {:>3d} ".format(rater1, rater2) + format_agreement(cohen))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('database', help="SQLite database with evaluation results or directory with exported results")
+    parser.add_argument('--raters', nargs='+', type=int, help="IDs of raters whose agreement should be computed")
+    parser.add_argument('--weights', default='linear', choices=('none', 'linear', 'quadratic'),
+                        help="Agreement weights of evaluation scores, comparison choices are unweighted")
+    parser.add_argument('--by', default='none', choices=('none', 'view', 'scan'),
+                        help="Compute agreement separately for each view or scan")
+    parser.add_argument('--bootstrap', default=10000, type=int,
+                        help="Number of bootstrap replicates, zero to omit confidence intervals")
+    parser.add_argument('--confidence', default=95., type=float, help="Confidence level in percent")
+    parser.add_argument('--seed', default=0, type=int, help="Seed of random number generator")
+    args = parser.parse_args()
+
+    scores, choices = read_results(args.database)
+
+    for overlay in np.unique(scores['OverlayId']):
+        table = ra.evaluation_scores(scores, overlay)
+        if len(table['Score']) == 0:
+            continue
+        categories = np.arange(1, max_score + 1)
+        print("Evaluation scores of overlay {:d}".format(overlay))
+        print_agreement(table, 'Score', categories, ra.kappa_weights(len(categories), args.weights), args)
+
+    pairs = set(zip(choices['OverlayId1'], choices['OverlayId2']))
+    for overlay1, overlay2 in sorted(pairs):
+        table = ra.comparison_choices(choices, overlay1, overlay2)
+        if len(table['BestOverlayId']) == 0:
+            continue
+        categories = np.array([0, overlay1, overlay2])
+        print("Comparison choices of overlays {:d} and {:d}".format(overlay1, overlay2))
+        print_agreement(table, 'BestOverlayId', categories, ra.kappa_weights(len(categories)), args)
@@ -0,0 +1,346 @@
+"""Inter-rater agreement and bootstrap confidence intervals of evaluation results.
+
+This module loads the evaluation scores and comparison choices as NumPy arrays,
+either from the SQLite database or from the .npz archives written by the
+export-results tool, and computes
+
+1. weighted Cohen's kappa of each pair of raters,
+2. weighted Fleiss' kappa of all raters,
+3. percentages of the scores and choices of an overlay,
+
+overall and broken down by scan or view. Confidence intervals are obtained by
+a cluster bootstrap, which resamples scans with replacement, because the
+screenshots of the ROIs of one scan are not independent of each other.
+
+Each statistic is computed from sufficient statistics summed over the rated
+screenshots of each scan. A bootstrap replicate is then the sum of these
+per-scan statistics weighted by the number of times each scan was drawn, and
+the replicates are computed for many draws at once by a matrix product.
+"""
+
+import numpy as np
+
+
+# =============================================================================
+# Input
+# =============================================================================
+
+scores_query = """
+    SELECT E.ScreenshotId, E.RaterId, E.Score, R.ScanId, S.ViewId, T.OverlayId1 AS OverlayId
+    FROM EvaluationScores AS E
+    INNER JOIN ScreenshotTypes AS T ON T.ScreenshotId = E.ScreenshotId AND T.Type = 'E'
+    INNER JOIN Screenshots AS S ON S.ScreenshotId = E.ScreenshotId
+    INNER JOIN ROIs AS R ON R.ROI_Id = S.ROI_Id
+"""
+
+choices_query = """
+    SELECT C.ScreenshotId, C.RaterId, C.BestOverlayId, R.ScanId, S.ViewId,
+        T.OverlayId1, T.OverlayId2,
+        EXISTS (
+            SELECT 1 FROM Screenshots AS A
+            INNER JOIN EvaluationScores AS B ON B.ScreenshotId = A.ScreenshotId AND B.Score = 0
+            WHERE A.ROI_Id = S.ROI_Id
+        ) AS Discarded
+    FROM ComparisonChoices AS C
+    INNER JOIN ScreenshotTypes AS T ON T.ScreenshotId = C.ScreenshotId AND T.Type = 'C'
+    INNER JOIN Screenshots AS S ON S.ScreenshotId = C.ScreenshotId
+    INNER JOIN ROIs AS R ON R.ROI_Id = S.ROI_Id
+"""
+
+scores_columns = [
+    ('ScreenshotId', 'i8'),
+    ('RaterId', 'i4'),
+    ('Score', 'i4'),
+    ('ScanId', 'i4'),
+    ('ViewId', 'U1'),
+    ('OverlayId', 'i4')
+]
+
+choices_columns = [
+    ('ScreenshotId', 'i8'),
+    ('RaterId', 'i4'),
+    ('BestOverlayId', 'i4'),
+    ('ScanId', 'i4'),
+    ('ViewId', 'U1'),
+    ('OverlayId1', 'i4'),
+    ('OverlayId2', 'i4'),
+    ('Discarded', '?')
+]
+
+
+def read_table(db, query, columns, chunk_size=100000):
+    """Read result of query into dictionary of column arrays."""
+    cur = db.cursor()
+    try:
+        cur.execute(query)
+        chunks = []
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=columns))
+    finally:
+        cur.close()
+    if chunks:
+        table = np.concatenate(chunks)
+    else:
+        table = np.zeros(0, dtype=columns)
+    return dict([(name, table[name]) for name, dtype in columns])
+
+
+def read_scores(db):
+    """Read evaluation scores with scan, view, and overlay of each screenshot."""
+    return read_table(db, scores_query, scores_columns)
+
+
+def read_choices(db):
+    """Read comparison choices with scan, view, and overlays of each screenshot."""
+    return read_table(db, choices_query, choices_columns)
+
+
+def load_npz(path):
+    """Load table exported by export-results into dictionary of column arrays."""
+    with np.load(path) as archive:
+        return dict([(name, archive[name]) for name in archive.files])
+
+
+def select(table, mask):
+    """Get rows of table for which mask is True."""
+    return dict([(name, values[mask]) for name, values in table.items()])
+
+
+# =============================================================================
+# Sufficient statistics
+# =============================================================================
+
+def kappa_weights(num_categories, kind=None):
+    """Agreement weights of ordered categories.
+
+    Args:
+        num_categories: Number of categories.
+        kind: None or 'none' for unweighted kappa, 'linear' or 'quadratic'.
+    """
+    if kind is None or kind == 'none' or num_categories < 2:
+        return np.eye(num_categories)
+    d = np.abs(np.subtract.outer(np.arange(num_categories), np.arange(num_categories))) / float(num_categories - 1)
+    if kind == 'linear':
+        return 1. - d
+    if kind == 'quadratic':
+        return 1. - d ** 2
+    raise Exception("Invalid kappa weights: " + kind)
+
+
+def group_index(values):
+    """Get unique values and index of the group of each value."""
+    groups, index = np.unique(values, return_inverse=True)
+    return groups, index.reshape(-1)
+
+
+def category_index(categories, values):
+    """Get index of the category of each rating value."""
+    index = np.searchsorted(categories, values)
+    valid = (index < len(categories))
+    valid[valid] = (np.asarray(categories)[index[valid]] == values[valid])
+    if not np.all(valid):
+        raise Exception("Rating values must be one of {}".format(list(categories)))
+    return index
+
+
+def rating_counts(items, categories, values):
+    """Count ratings of each item in each category.
+
+    Returns:
+        ids: Sorted unique item IDs.
+        first: Index of first rating of each item.
+        counts: Matrix of number of ratings of each item (row) in each category (column).
+    """
+    ids, first, index = np.unique(items, return_index=True, return_inverse=True)
+    category = category_index(categories, values)
+    counts = np.zeros((len(ids), len(categories)))
+    np.add.at(counts, (index.reshape(-1), category), 1)
+    return ids, first, counts
+
+
+def fleiss_statistics(counts, groups, num_groups, weights):
+    """Sum statistics of weighted Fleiss' kappa over the items of each group.
+
+    Only items rated at least twice are considered.
+
+    Returns:
+        Tuple of arrays with one row per group: sum of observed agreement of
+        items, number of items, number of ratings in each category, and total
+        number of ratings.
+    """
+    n = counts.sum(axis=1)
+    rated = (n > 1)
+    counts, n, groups = counts[rated], n[rated], groups[rated]
+    # exclude pairs of a rating with itself, whose weight is one
+    agreement = (np.dot(counts, weights) * counts).sum(axis=1) - n
+    agreement /= n * (n - 1)
+    a = np.bincount(groups, weights=agreement, minlength=num_groups)
+    m = np.bincount(groups, minlength=num_groups).astype(float)
+    t = np.zeros((num_groups, counts.shape[1]))
+    np.add.at(t, groups, counts)
+    r = np.bincount(groups, weights=n, minlength=num_groups)
+    return a, m, t, r
+
+
+def fleiss_kappa(a, m, t, r, weights):
+    """Weighted Fleiss' kappa from statistics summed over groups.
+
+    The statistics may have additional leading dimensions, e.g., of bootstrap
+    replicates, in which case an array of kappa values is returned."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        observed = a / m
+        p = t / r[..., np.newaxis]
+        expected = np.einsum('...j,jk,...k->...', p, weights, p)
+        return (observed - expected) / (1. - expected)
+
+
+def cohen_statistics(items, raters, values, categories, rater1, rater2, groups, num_groups):
+    """Sum confusion matrices of two raters over the items of each group.
+
+    Args:
+        groups: Group index of each rating.
+
+    Returns:
+        Array of shape (num_groups, K, K), where K is the number of categories,
+        of number of items rated by both raters with each pair of categories.
+    """
+    k = len(categories)
+    mask1 = (raters == rater1)
+    mask2 = (raters == rater2)
+    common, i1, i2 = np.intersect1d(items[mask1], items[mask2], assume_unique=True, return_indices=True)
+    c1 = category_index(categories, values[mask1][i1])
+    c2 = category_index(categories, values[mask2][i2])
+    confusion = np.zeros((num_groups, k, k))
+    np.add.at(confusion, (groups[mask1][i1], c1, c2), 1)
+    return confusion
+
+
+def cohen_kappa(confusion, weights):
+    """Weighted Cohen's kappa from confusion matrix summed over groups.
+
+    The confusion matrix may have additional leading dimensions."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        n = confusion.sum(axis=(-2, -1))
+        observed = (confusion * weights).sum(axis=(-2, -1)) / n
+        row = confusion.sum(axis=-1) / n[..., np.newaxis]
+        col = confusion.sum(axis=-2) / n[..., np.newaxis]
+        expected = np.einsum('...j,jk,...k->...', row, weights, col)
+        return (observed - expected) / (1. - expected)
+
+
+def category_percentages(counts):
+    """Percentage of ratings in each category from counts summed over groups."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return 100. * counts / counts.sum(axis=-1)[..., np.newaxis]
+
+
+# =============================================================================
+# Cluster bootstrap
+# =============================================================================
+
+def cluster_bootstrap(statistic, stats, replicates=10000, confidence=95., seed=0, chunk_size=1000):
+    """Estimate statistic and confidence interval by resampling clusters.
+
+    Args:
+        statistic: Function of statistics summed over clusters.
+        stats: Tuple of arrays of statistics of each cluster along first dimension.
+        replicates: Number of bootstrap replicates.
+        confidence: Confidence level in percent.
+        seed: Seed of random number generator.
+        chunk_size: Maximum number of replicates computed at once.
+
+    Returns:
+        Tuple of estimate, lower, and upper bound of the confidence interval.
+    """
+    estimate = statistic(*[s.sum(axis=0) for s in stats])
+    num_clusters = stats[0].shape[0]
+    if replicates < 1 or num_clusters < 2:
+        nan = np.full(np.shape(estimate), np.nan)
+        return estimate, nan, nan
+    rng = np.random.RandomState(seed)
+    pvals = np.full(num_clusters, 1. / num_clusters)
+    values = []
+    for start in range(0, replicates, chunk_size):
+        size = min(chunk_size, replicates - start)
+        draws = rng.multinomial(num_clusters, pvals, size=size).astype(float)
+        values.append(statistic(*[np.tensordot(draws, s, axes=(1, 0)) for s in stats]))
+    values = np.concatenate(values)
+    alpha = (100. - confidence) / 2.
+    lower, upper = np.nanpercentile(values, [alpha, 100. - alpha], axis=0)
+    return estimate, lower, upper
+
+
+def bootstrap_percentages(counts, replicates=10000, confidence=95., seed=0):
+    """Estimate percentages and confidence intervals from counts of each scan (row) and category (column)."""
+    return cluster_bootstrap(category_percentages, (np.asarray(counts, dtype=float),),
+                             replicates=replicates, confidence=confidence, seed=seed)
+
+
+# =============================================================================
+# Agreement of raters and results of overlays
+# =============================================================================
+
+class Agreement(object):
+    """Kappa value with confidence interval and number of rated items."""
+
+    def __init__(self, kappa, lower, upper, items):
+        self.kappa = kappa
+        self.lower = lower
+        self.upper = upper
+        self.items = items
+
+
+def breakdown(table, by):
+    """Get list of (label, mask) of rows of each group."""
+    if not by or by == 'none':
+        return [('all', np.ones(len(table['ScanId']), dtype=bool))]
+    column = {'scan': 'ScanId', 'view': 'ViewId'}[by]
+    return [(str(value), table[column] == value) for value in np.unique(table[column])]
+
+
+def fleiss_agreement(table, column, categories, weights=None, replicates=10000, confidence=95., seed=0):
+    """Weighted Fleiss' kappa of all raters with cluster bootstrap over scans."""
+    scans, groups = group_index(table['ScanId'])
+    ids, first, counts = rating_counts(table['ScreenshotId'], categories, table[column])
+    stats = fleiss_statistics(counts, groups[first], len(scans), weights)
+    kappa, lower, upper = cluster_bootstrap(lambda *s: fleiss_kappa(*(s + (weights,))), stats,
+                                            replicates=replicates, confidence=confidence, seed=seed)
+    return Agreement(kappa, lower, upper, int(stats[1].sum()))
+
+
+def cohen_agreement(table, column, categories, rater1, rater2, weights=None,
+                    replicates=10000, confidence=95., seed=0):
+    """Weighted Cohen's kappa of two raters with cluster bootstrap over scans."""
+    scans, groups = group_index(table['ScanId'])
+    confusion = cohen_statistics(table['ScreenshotId'], table['RaterId'], table[column], categories,
+                                 rater1, rater2, groups, len(scans))
+    kappa, lower, upper = cluster_bootstrap(lambda c: cohen_kappa(c, weights), (confusion,),
+                                            replicates=replicates, confidence=confidence, seed=seed)
+    return Agreement(kappa, lower, upper, int(confusion.sum()))
+
+
+def percentages(table, column, categories, replicates=10000, confidence=95., seed=0):
+    """Percentage of ratings in each category with cluster bootstrap over scans.
+
+    Returns:
+        Tuple of estimate, lower, and upper bound of percentages of each category.
+    """
+    scans, groups = group_index(table['ScanId'])
+    category = category_index(categories, table[column])
+    counts = np.zeros((len(scans), len(categories)))
+    np.add.at(counts, (groups, category), 1)
+    return bootstrap_percentages(counts, replicates=replicates, confidence=confidence, seed=seed)
+
+
+def evaluation_scores(scores, overlay):
+    """Get scores of an overlay, excluding discarded screenshots."""
+    return select(scores, (scores['OverlayId'] == overlay) & (scores['Score'] > 0))
+
+
+def comparison_choices(choices, overlay1, overlay2):
+    """Get choices between two overlays, excluding ROIs with discarded screenshots."""
+    id1, id2 = min(overlay1, overlay2), max(overlay1, overlay2)
+    return select(choices, (choices['OverlayId1'] == id1) & (choices['OverlayId2'] == id2) & ~choices['Discarded'])
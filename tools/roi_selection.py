@@ -0,0 +1,972 @@
+"""Select regions of interest centered at surface points with large distance to a reference surface.
+
+This module implements the same stages as the select-rois command built from
+select-rois.cc using NumPy arrays and SciPy KD-trees, i.e.,
+
+1. point mask from point or cell data array, optionally eroded,
+2. point-to-surface distances of unmasked points,
+3. clusters of (mutually) distant points grown from seeds ordered by distance,
+4. reduction of clusters whose ROI bounding boxes overlap too much,
+5. stratified random samples of surface points,
+6. best orthogonal viewing direction of each ROI.
+
+Surfaces already loaded into memory can be reused, and select_rois_parallel
+processes multiple scans in a pool of worker processes. The records returned
+by select_rois have the same columns as the CSV table printed by select-rois.
+
+The point-to-surface distances are computed for the triangles adjacent to the
+k nearest reference vertices of each point, which is exact unless the closest
+triangle has none of its corners among these k vertices.
+"""
+
+import os
+import time
+import hashlib
+
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+
+
+# =============================================================================
+# Surface meshes
+# =============================================================================
+
+class Surface(object):
+    """Triangulated surface mesh with point and cell data given by NumPy arrays."""
+
+    def __init__(self, points, triangles, point_data=None, cell_data=None):
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        self.triangles = np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+        self.point_data = dict(point_data or {})
+        self.cell_data = dict(cell_data or {})
+        self._tree = None
+        self._edges = None
+        self._vertex_triangles = None
+
+    @property
+    def num_points(self):
+        return self.points.shape[0]
+
+    @property
+    def tree(self):
+        """KD-tree of surface points."""
+        if self._tree is None:
+            self._tree = cKDTree(self.points)
+        return self._tree
+
+    @property
+    def edges(self):
+        """Unique undirected edges of triangles as (n, 2) array with i < j."""
+        if self._edges is None:
+            edges = np.concatenate([self.triangles[:, [0, 1]],
+                                    self.triangles[:, [1, 2]],
+                                    self.triangles[:, [2, 0]]])
+            edges.sort(axis=1)
+            keys = np.unique(edges[:, 0] * self.num_points + edges[:, 1])
+            self._edges = np.column_stack([keys // self.num_points, keys % self.num_points])
+        return self._edges
+
+    @property
+    def vertex_triangles(self):
+        """Triangles adjacent to each vertex in compressed sparse row format (indptr, indices)."""
+        if self._vertex_triangles is None:
+            corners = self.triangles.ravel()
+            order = np.argsort(corners, kind='mergesort')
+            counts = np.bincount(corners, minlength=self.num_points)
+            indptr = np.zeros(self.num_points + 1, dtype=np.int64)
+            np.cumsum(counts, out=indptr[1:])
+            self._vertex_triangles = (indptr, order // 3)
+        return self._vertex_triangles
+
+
+def read_surface(fname):
+    """Read surface mesh from VTK XML file, polygons are triangulated."""
+    from vtk import vtkXMLPolyDataReader
+    from vtk.util.numpy_support import vtk_to_numpy
+    reader = vtkXMLPolyDataReader()
+    reader.SetFileName(fname)
+    reader.UpdateWholeExtent()
+    mesh = reader.GetOutput()
+    points = vtk_to_numpy(mesh.GetPoints().GetData()).astype(np.float64)
+    polys = vtk_to_numpy(mesh.GetPolys().GetData()).astype(np.int64)
+    npolys = mesh.GetNumberOfPolys()
+    if polys.size == 4 * npolys and np.all(polys[0::4] == 3):
+        triangles = polys.reshape(-1, 4)[:, 1:]
+        poly_ids = np.arange(npolys)
+    else:
+        triangles = []
+        poly_ids = []
+        pos = 0
+        for poly_id in range(npolys):
+            npts = polys[pos]
+            pts = polys[pos + 1:pos + 1 + npts]
+            for i in range(1, npts - 1):
+                triangles.append((pts[0], pts[i], pts[i + 1]))
+                poly_ids.append(poly_id)
+            pos += npts + 1
+        triangles = np.array(triangles, dtype=np.int64).reshape(-1, 3)
+        poly_ids = np.array(poly_ids, dtype=np.int64)
+    point_data = {}
+    pd = mesh.GetPointData()
+    for i in range(pd.GetNumberOfArrays()):
+        array = pd.GetArray(i)
+        if array is not None and array.GetName():
+            point_data[array.GetName()] = vtk_to_numpy(array)
+    cell_data = {}
+    cd = mesh.GetCellData()
+    offset = mesh.GetNumberOfVerts() + mesh.GetNumberOfLines()
+    for i in range(cd.GetNumberOfArrays()):
+        array = cd.GetArray(i)
+        if array is not None and array.GetName():
+            cell_data[array.GetName()] = vtk_to_numpy(array)[offset:offset + npolys][poly_ids]
+    return Surface(points, triangles, point_data, cell_data)
+
+
+def read_image_to_world(fname):
+    """Read NIfTI image header and get 4x4 matrix mapping voxel indices to world coordinates."""
+    from vtk import vtkNIFTIImageReader
+    reader = vtkNIFTIImageReader()
+    reader.SetFileName(fname)
+    reader.UpdateInformation()
+    qform = reader.GetQFormMatrix()
+    matrix = np.eye(4)
+    if qform is not None:
+        for i in range(4):
+            for j in range(4):
+                matrix[i, j] = qform.GetElement(i, j)
+    spacing = np.ones(4)
+    spacing[:3] = reader.GetDataSpacing()
+    return matrix.dot(np.diag(spacing))
+
+
+# =============================================================================
+# Timing
+# =============================================================================
+
+class PhaseTimer(object):
+    """Measure wall and CPU time of named phases, accumulated in a list of (phase, wall, cpu) tuples."""
+
+    def __init__(self, timings, name=None):
+        self.timings = timings
+        self.name = None
+        if name:
+            self.start(name)
+
+    def start(self, name):
+        self.name = name
+        self._wall = time.time()
+        t = os.times()
+        self._cpu = t[0] + t[1]
+
+    def stop(self):
+        if self.name is None:
+            return
+        wall = time.time() - self._wall
+        t = os.times()
+        cpu = t[0] + t[1] - self._cpu
+        if self.timings is not None:
+            for i, timing in enumerate(self.timings):
+                if timing[0] == self.name:
+                    self.timings[i] = (self.name, timing[1] + wall, timing[2] + cpu)
+                    break
+            else:
+                self.timings.append((self.name, wall, cpu))
+        self.name = None
+
+    def next(self, name):
+        self.stop()
+        self.start(name)
+
+
+# =============================================================================
+# Point distances
+# =============================================================================
+
+def point_adjacency(num_points, edges):
+    """Symmetric sparse adjacency matrix of points connected by edges."""
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    rows = np.concatenate([edges[:, 0], edges[:, 1]])
+    cols = np.concatenate([edges[:, 1], edges[:, 0]])
+    data = np.ones(rows.size, dtype=np.int8)
+    return csr_matrix((data, (rows, cols)), shape=(num_points, num_points))
+
+
+def cell_mask_to_point_data(surface, mask):
+    """Point mask which is non-zero when any adjacent cell is non-zero."""
+    output = np.zeros(surface.num_points, dtype=np.uint8)
+    cells = np.flatnonzero(np.asarray(mask).reshape(len(surface.triangles), -1)[:, 0] != 0)
+    output[surface.triangles[cells].ravel()] = 1
+    return output
+
+
+def erode_point_mask(surface, mask, niter):
+    """Erode point mask by setting points with a masked out neighbor to zero.
+
+    Like ErodePointMask of select-rois.cc, the mask is only eroded when niter > 1,
+    and points without adjacent cells are set to one.
+    """
+    if mask is None or niter <= 1:
+        return mask
+    adjacency = point_adjacency(surface.num_points, surface.edges)
+    has_cells = np.zeros(surface.num_points, dtype=bool)
+    has_cells[surface.triangles.ravel()] = True
+    output = mask
+    for i in range(niter):
+        zero = (output == 0)
+        excluded = has_cells & (zero | (adjacency.dot(zero.astype(np.int32)) > 0))
+        output = np.where(excluded, 0, 1).astype(np.uint8)
+    return output
+
+
+def mask_data(surface, name):
+    """Get point or cell data array of given name, and whether it is point data."""
+    if name in surface.point_data:
+        return np.asarray(surface.point_data[name]), True
+    if name in surface.cell_data:
+        return np.asarray(surface.cell_data[name]), False
+    raise Exception("Input surface mesh has no point/cell data array named " + name)
+
+
+def point_mask(surface, name, erosion=0):
+    """Get point mask from point or cell data array of given name."""
+    if not name:
+        return None
+    data, is_point_data = mask_data(surface, name)
+    if is_point_data:
+        mask = (data.reshape(surface.num_points, -1)[:, 0] != 0).astype(np.uint8)
+    else:
+        mask = cell_mask_to_point_data(surface, data)
+    return erode_point_mask(surface, mask, erosion)
+
+
+def closest_points_on_triangles(p, a, b, c):
+    """Closest points on triangles (a, b, c) to points p, all given as (n, 3) arrays."""
+    def dot(u, v):
+        return np.einsum('ij,ij->i', u, v)
+
+    ab = b - a
+    ac = c - a
+    ap = p - a
+    bp = p - b
+    cp = p - c
+    d1 = dot(ab, ap)
+    d2 = dot(ac, ap)
+    d3 = dot(ab, bp)
+    d4 = dot(ac, bp)
+    d5 = dot(ab, cp)
+    d6 = dot(ac, cp)
+    va = d3 * d6 - d5 * d4
+    vb = d5 * d2 - d1 * d6
+    vc = d1 * d4 - d3 * d2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denom = 1. / (va + vb + vc)
+        v = vb * denom
+        w = vc * denom
+        q = a + ab * v[:, np.newaxis] + ac * w[:, np.newaxis]
+        # regions are tested in reverse order such that earlier ones take precedence
+        t = (d4 - d3) / ((d4 - d3) + (d5 - d6))
+        region = (va <= 0) & (d4 - d3 >= 0) & (d5 - d6 >= 0)
+        q[region] = (b + (c - b) * t[:, np.newaxis])[region]
+        t = d2 / (d2 - d6)
+        region = (vb <= 0) & (d2 >= 0) & (d6 <= 0)
+        q[region] = (a + ac * t[:, np.newaxis])[region]
+        region = (d6 >= 0) & (d5 <= d6)
+        q[region] = c[region]
+        t = d1 / (d1 - d3)
+        region = (vc <= 0) & (d1 >= 0) & (d3 <= 0)
+        q[region] = (a + ab * t[:, np.newaxis])[region]
+        region = (d3 >= 0) & (d4 <= d3)
+        q[region] = b[region]
+        region = (d1 <= 0) & (d2 <= 0)
+        q[region] = a[region]
+    invalid = ~np.all(np.isfinite(q), axis=1)
+    q[invalid] = a[invalid]
+    return q
+
+
+def point_to_surface_distances(points, reference, mask=None, k=8, chunk_size=20000):
+    """Distances of points to the triangles of the reference surface, zero for masked out points."""
+    points = np.asarray(points, dtype=np.float64)
+    dists = np.zeros(points.shape[0], dtype=np.float32)
+    ids = np.arange(points.shape[0]) if mask is None else np.flatnonzero(mask)
+    if ids.size == 0 or reference.num_points == 0:
+        return dists
+    k = min(k, reference.num_points)
+    indptr, tri_ids = reference.vertex_triangles
+    for start in range(0, ids.size, chunk_size):
+        chunk = ids[start:start + chunk_size]
+        p = points[chunk]
+        dist, nbrs = reference.tree.query(p, k=k)
+        dist = np.asarray(dist, dtype=np.float64).reshape(len(chunk), -1)
+        nbrs = np.asarray(nbrs).reshape(len(chunk), -1)
+        # distance to nearest vertex is an upper bound of the distance to its adjacent triangles
+        best = np.square(dist[:, 0])
+        counts = (indptr[nbrs + 1] - indptr[nbrs]).ravel()
+        total = counts.sum()
+        if total > 0:
+            firsts = np.repeat(indptr[nbrs.ravel()] - np.cumsum(counts) + counts, counts)
+            cand = tri_ids[firsts + np.arange(total)]
+            owner = np.repeat(np.repeat(np.arange(len(chunk)), nbrs.shape[1]), counts)
+            tri = reference.triangles[cand]
+            q = closest_points_on_triangles(p[owner], reference.points[tri[:, 0]],
+                                            reference.points[tri[:, 1]], reference.points[tri[:, 2]])
+            d2 = np.sum(np.square(p[owner] - q), axis=1)
+            np.minimum.at(best, owner, d2)
+        dists[chunk] = np.sqrt(best).astype(np.float32)
+    return dists
+
+
+# =============================================================================
+# Distance cache
+# =============================================================================
+
+def cache_file_name(cache_dir, surface, reference, mask_name=None, mask_erosion=0, k=8, joint=True):
+    """Name of cache file of point masks and distances keyed by mesh and mask content hash.
+
+    The mask of the reference surface is only used, and hence only hashed, for joint clustering.
+    """
+    sha = hashlib.sha1()
+    for mesh in (surface, reference):
+        sha.update(np.ascontiguousarray(mesh.points, dtype=np.float32).tobytes())
+        sha.update(np.ascontiguousarray(mesh.triangles, dtype=np.int64).tobytes())
+    if mask_name:
+        sha.update('{}:{}'.format(mask_name, mask_erosion).encode('utf-8'))
+        # mask may be edited or regenerated for the same mesh, e.g., by add-cortex-mask.py
+        for mesh in ((surface, reference) if joint else (surface,)):
+            data, is_point_data = mask_data(mesh, mask_name)
+            sha.update('{}:{}:{}'.format('point' if is_point_data else 'cell', data.dtype.str, data.shape).encode('utf-8'))
+            sha.update(np.ascontiguousarray(data).tobytes())
+    sha.update('k={}'.format(k).encode('utf-8'))
+    return os.path.join(cache_dir, 'roi-selection-{}.npz'.format(sha.hexdigest()))
+
+
+def read_cache(fname, n1, n2):
+    """Read point masks and distances from cache file, None if missing or invalid."""
+    if not os.path.isfile(fname):
+        return None
+    try:
+        with np.load(fname) as data:
+            cache = dict((name, data[name]) for name in data.files)
+    except (IOError, ValueError):
+        return None
+    if cache.get('dist12') is None or cache['dist12'].size != n1:
+        return None
+    if 'dist21' in cache and cache['dist21'].size != n2:
+        return None
+    return cache
+
+
+def write_cache(fname, **arrays):
+    """Write point masks and distances to cache file, replacing it atomically."""
+    directory = os.path.dirname(fname)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp_name = '{}.{}.tmp.npz'.format(fname[:-4], os.getpid())
+    np.savez(tmp_name, **dict((name, array) for name, array in arrays.items() if array is not None))
+    os.rename(tmp_name, fname)
+
+
+# =============================================================================
+# Clustering
+# =============================================================================
+
+class Cluster(object):
+    """Cluster of distant points or random sample point."""
+
+    __slots__ = ('label', 'seed', 'size', 'center', 'total', 'view')
+
+    def __init__(self, label=-1, seed=-1, size=0, center=(0., 0., 0.), total=0., view=None):
+        self.label = label
+        self.seed = seed
+        self.size = size
+        self.center = np.asarray(center, dtype=np.float64)
+        self.total = total
+        self.view = view
+
+    def copy(self):
+        return Cluster(self.label, self.seed, self.size, self.center.copy(), self.total, self.view)
+
+
+def distance_threshold(dists, percentile):
+    """Interpolated distance percentile as computed by DistantClusters of select-rois.cc."""
+    n = dists.size
+    if n == 0:
+        return 0.
+    rank = (float(percentile) / 100.) * float(n + 1)
+    k = int(rank)
+    if k == 0:
+        return float(dists.min())
+    if k >= n:
+        return float(dists.max())
+    values = np.partition(dists, (k - 1, k))
+    return float(values[k - 1] + (rank - k) * (values[k] - values[k - 1]))
+
+
+def distant_clusters(points, adjacency, dists, min_size, min_seed_dist, min_threshold,
+                     percentile=0, start_label=1, verbose=0):
+    """Grow clusters of points whose distance is at least a threshold.
+
+    Each cluster is the connected component of the subgraph of points with distance
+    above the threshold, seeded at its point with maximum distance. Only components
+    whose seed distance is at least min_seed_dist are considered. Components with
+    less than min_size points are discarded and their points labeled zero, whereas
+    points of unvisited components remain labeled -1.
+
+    Returns:
+        clusters: List of Cluster objects in order of decreasing seed distance.
+        labels: Cluster label of each point.
+    """
+    dists = np.asarray(dists, dtype=np.float64)
+    threshold = 0.
+    if percentile > 0:
+        threshold = distance_threshold(dists, percentile)
+    threshold = max(threshold, min_threshold)
+    min_seed_dist = max(min_seed_dist, threshold)
+    if verbose > 0:
+        print("Distance: threshold = {}, min. seed distance = {}".format(threshold, min_seed_dist))
+    labels = np.full(dists.size, -1, dtype=np.int64)
+    clusters = []
+    ids = np.flatnonzero(dists >= threshold)
+    if ids.size == 0:
+        return clusters, labels
+    subgraph = adjacency[ids][:, ids]
+    ncomps, comps = connected_components(subgraph, directed=False)
+    d = dists[ids]
+    order = np.lexsort((ids, d, comps))
+    last = np.concatenate([np.flatnonzero(np.diff(comps[order])), [order.size - 1]])
+    seeds = order[last]  # position of point with maximum distance in each component
+    sizes = np.bincount(comps, minlength=ncomps)
+    totals = np.bincount(comps, weights=d, minlength=ncomps)
+    centers = np.column_stack([np.bincount(comps, weights=points[ids, i], minlength=ncomps) for i in range(3)])
+    centers /= np.maximum(sizes, 1)[:, np.newaxis]
+    comp_labels = np.full(ncomps, -1, dtype=np.int64)
+    label = start_label
+    for comp in np.lexsort((ids[seeds], d[seeds]))[::-1]:
+        if d[seeds[comp]] < min_seed_dist:
+            break
+        if sizes[comp] < min_size:
+            comp_labels[comp] = 0
+        else:
+            comp_labels[comp] = label
+            clusters.append(Cluster(label=label, seed=int(ids[seeds[comp]]), size=int(sizes[comp]),
+                                    center=centers[comp], total=float(totals[comp])))
+            label += 1
+    labels[ids] = comp_labels[comps]
+    return clusters, labels
+
+
+class ClusterResult(object):
+    """Distances and clusters computed once, shared by the subsequent selection stages.
+
+    For joint clustering, the points of the reference surface follow those of the
+    surface, i.e., their indices are offset by the number of surface points.
+    """
+
+    def __init__(self, surface, reference, points, dists, mask, labels, clusters,
+                 dist12=None, dist21=None, mask1=None, mask2=None):
+        self.surface = surface
+        self.reference = reference
+        self.points = points
+        self.dists = dists
+        self.mask = mask
+        self.labels = labels
+        self.clusters = clusters
+        self.dist12 = dist12
+        self.dist21 = dist21
+        self.mask1 = mask1
+        self.mask2 = mask2
+
+
+def compute_clusters(surface, reference, mask_name=None, mask_erosion=0,
+                     min_seed_dist=2., min_threshold=None, percentile=0, min_size=10,
+                     joint=True, dist12=None, dist21=None, mask1=None, mask2=None,
+                     k=8, cache_dir=None, timings=None, verbose=0):
+    """Compute point distances and clusters of (mutually) distant points sorted by total distance.
+
+    Precomputed point masks and distances can be passed as arguments, in which case
+    these are not computed again. When a cache directory is given, these arrays are
+    read from a cache file keyed by the mesh contents and mask parameters if present,
+    and the cache file is written otherwise.
+    """
+    if min_threshold is None or min_threshold < 0:
+        min_threshold = (.1 if percentile > 0 else .5) * min_seed_dist
+    timer = PhaseTimer(timings, 'cache')
+    cache_name = None
+    if cache_dir and dist12 is None:
+        cache_name = cache_file_name(cache_dir, surface, reference, mask_name, mask_erosion, k=k, joint=joint)
+        cache = read_cache(cache_name, surface.num_points, reference.num_points)
+        if cache is not None and (not joint or ('dist21' in cache and (not mask_name or 'mask2' in cache))):
+            if verbose > 0:
+                print("Read point masks and distances from " + cache_name)
+            dist12 = cache['dist12']
+            dist21 = cache.get('dist21')
+            mask1 = cache.get('mask1')
+            mask2 = cache.get('mask2')
+            cache_name = None
+    timer.next('mask')
+    if mask1 is None:
+        mask1 = point_mask(surface, mask_name, mask_erosion)
+    if joint and mask2 is None:
+        mask2 = point_mask(reference, mask_name, mask_erosion)
+    timer.next('distances')
+    if dist12 is None:
+        dist12 = point_to_surface_distances(surface.points, reference, mask1, k=k)
+    if joint and dist21 is None:
+        dist21 = point_to_surface_distances(reference.points, surface, mask2, k=k)
+    if cache_name:
+        timer.next('cache')
+        write_cache(cache_name, dist12=dist12, dist21=dist21, mask1=mask1, mask2=mask2)
+    if joint:
+        timer.next('joint-mesh')
+        n1 = surface.num_points
+        points = np.concatenate([surface.points, reference.points])
+        dists = np.concatenate([dist12, dist21])
+        mask = None
+        if mask1 is not None:
+            mask = np.concatenate([mask1, mask2])
+        ids1 = np.flatnonzero(dist12 >= min_threshold)
+        ids2 = np.flatnonzero(dist21 >= min_threshold)
+        lines = [
+            np.column_stack([ids1, reference.tree.query(surface.points[ids1])[1] + n1]),
+            np.column_stack([ids2 + n1, surface.tree.query(reference.points[ids2])[1]])
+        ]
+        edges = np.concatenate([surface.edges, reference.edges + n1] + [line.reshape(-1, 2) for line in lines])
+    else:
+        points = surface.points
+        dists = dist12
+        mask = mask1
+        edges = surface.edges
+    timer.next('clustering')
+    adjacency = point_adjacency(points.shape[0], edges)
+    clusters, labels = distant_clusters(points, adjacency, dists, min_size, min_seed_dist,
+                                        min_threshold, percentile, verbose=verbose)
+    # sort clusters by total distance, largest first
+    clusters.sort(key=lambda cluster: cluster.total, reverse=True)
+    timer.stop()
+    return ClusterResult(surface, reference, points, dists, mask, labels, clusters,
+                         dist12=dist12, dist21=dist21, mask1=mask1, mask2=mask2)
+
+
+# =============================================================================
+# Sub-sampling
+# =============================================================================
+
+def bounds(center, span):
+    """Bounding box (lower, upper) of cube with given center and side length."""
+    half_span = max(0., .5 * span)
+    center = np.asarray(center, dtype=np.float64)
+    return center - half_span, center + half_span
+
+
+def union_volume(lower, upper, box_lower, box_upper):
+    """Volume of union of boxes clipped to the given box."""
+    lower = np.maximum(lower, box_lower)
+    upper = np.minimum(upper, box_upper)
+    valid = np.all(lower < upper, axis=1)
+    lower = lower[valid]
+    upper = upper[valid]
+    if lower.shape[0] == 0:
+        return 0.
+    if lower.shape[0] == 1:
+        return float(np.prod(upper[0] - lower[0]))
+    inside = []
+    widths = []
+    for dim in range(3):
+        coords = np.unique(np.concatenate([lower[:, dim], upper[:, dim]]))
+        mids = .5 * (coords[1:] + coords[:-1])
+        widths.append(np.diff(coords))
+        inside.append((lower[:, dim, np.newaxis] < mids) & (mids < upper[:, dim, np.newaxis]))
+    covered = np.einsum('mi,mj,mk->ijk', *[x.astype(np.int32) for x in inside]) > 0
+    return float(np.einsum('ijk,i,j,k->', covered.astype(np.float64), *widths))
+
+
+def overlap_ratio(centers, span, center):
+    """Fraction of ROI bounding box at center covered by the ROIs at the given centers."""
+    if span <= 0. or len(centers) == 0:
+        return 0.
+    box_lower, box_upper = bounds(center, span)
+    centers = np.asarray(centers, dtype=np.float64).reshape(-1, 3)
+    near = np.all(np.abs(centers - np.asarray(center)) < span, axis=1)
+    if not np.any(near):
+        return 0.
+    lower, upper = bounds(centers[near], span)
+    return union_volume(lower, upper, box_lower, box_upper) / np.prod(box_upper - box_lower)
+
+
+def reduce_clusters(clusters, span, max_overlap):
+    """Select clusters in order whose ROI does not overlap the previously selected ROIs too much."""
+    selection = []
+    centers = []
+    for cluster in clusters:
+        if overlap_ratio(centers, span, cluster.center) <= max_overlap:
+            selection.append(cluster)
+            centers.append(cluster.center)
+    return selection
+
+
+# =============================================================================
+# Random sampling
+# =============================================================================
+
+def random_sample(points, n, stratified, rng):
+    """Draw up to n indices of points, optionally using spatially stratified sampling."""
+    m = points.shape[0]
+    perm = rng.permutation(m)
+    if not stratified or n >= m:
+        return perm[:n]
+    # distribute samples evenly among cells of a regular grid with about n cells
+    lower = points.min(axis=0)
+    extent = np.maximum(points.max(axis=0) - lower, 1e-6)
+    size = (np.prod(extent) / n) ** (1. / 3.)
+    dims = np.maximum(np.ceil(extent / size), 1).astype(np.int64)
+    index = np.minimum(((points[perm] - lower) / size).astype(np.int64), dims - 1)
+    cells = (index[:, 0] * dims[1] + index[:, 1]) * dims[2] + index[:, 2]
+    order = np.argsort(cells, kind='mergesort')
+    sorted_cells = cells[order]
+    first = np.concatenate([[0], np.flatnonzero(np.diff(sorted_cells)) + 1])
+    rank = np.empty(m, dtype=np.int64)
+    rank[order] = np.arange(m) - np.repeat(first, np.diff(np.concatenate([first, [m]])))
+    cell_key = rng.permutation(int(sorted_cells[-1]) + 1)[cells]
+    return perm[np.lexsort((cell_key, rank))[:n]]
+
+
+def append_random_samples(clusters, surface, n, dists=None, mask=None, stratified=True,
+                          span=0., max_overlap=1., rng=None):
+    """Append randomly sampled surface points whose ROI does not overlap existing ROIs too much.
+
+    When no sample satisfies the overlap constraint, the maximum overlap ratio is
+    increased by 20% as done by AppendRandomSamples of select-rois.cc.
+    """
+    if rng is None:
+        rng = np.random
+    ids = np.arange(surface.num_points)
+    if mask is not None:
+        ids = ids[mask[:surface.num_points] != 0]
+    if n <= 0 or ids.size == 0:
+        return clusters
+    centers = [cluster.center for cluster in clusters]
+    m = 0
+    while m < n:
+        k = 0
+        for ptId in ids[random_sample(surface.points[ids], n, stratified, rng)]:
+            center = surface.points[ptId]
+            if span > 0. and max_overlap < 1.:
+                if overlap_ratio(centers, span, center) > max_overlap:
+                    continue
+            total = float(dists[ptId]) if dists is not None else 0.
+            clusters.append(Cluster(label=0, seed=int(ptId), size=1, center=center, total=total))
+            centers.append(center)
+            k += 1
+            if m + k >= n:
+                break
+        if k == 0:
+            max_overlap *= 1.2
+        else:
+            m += k
+    return clusters
+
+
+def sample_rois(result, span=40., max_overlap=1., num_points=0, max_points=0, random_ratio=0.,
+                stratified=True, rng=None, timings=None, verbose=0):
+    """Reduce clusters, truncate their number, and append random samples.
+
+    Returns:
+        List of copies of selected Cluster objects, relabeled with increasing ID.
+    """
+    timer = PhaseTimer(timings, 'reduction')
+    clusters = [cluster.copy() for cluster in result.clusters]
+    if num_points > 0:
+        max_points = num_points
+    if max_overlap < 1.:
+        clusters = reduce_clusters(clusters, span, max_overlap)
+    if verbose > 0:
+        print("Found {} distant clusters".format(len(clusters)))
+    if max_points > 0 and len(clusters) > max_points:
+        clusters = clusters[:max_points]
+    timer.next('sampling')
+    if random_ratio > 0.:
+        k = max_points if max_points > 0 else len(clusters)
+        n = int(round(random_ratio * k))
+        if max_points > 0:
+            clusters = clusters[:max(0, max_points - n)]
+        append_random_samples(clusters, result.surface, n, result.dists, result.mask,
+                              stratified=stratified, span=span, max_overlap=max_overlap, rng=rng)
+        if verbose > 0:
+            print("Appended {} random clusters".format(n))
+    if num_points > 0:
+        n = num_points - len(clusters)
+        if n > 0:
+            append_random_samples(clusters, result.surface, n, result.dists, result.mask,
+                                  stratified=stratified, span=span, max_overlap=max_overlap, rng=rng)
+            if verbose > 0:
+                print("Appended {} random clusters".format(n))
+    for label, cluster in enumerate(clusters):
+        cluster.label = label + 1
+    timer.stop()
+    return clusters
+
+
+# =============================================================================
+# Cutting plane
+# =============================================================================
+
+def crop(surface, p, radius):
+    """Extract triangles whose points are all within radius of point p."""
+    ids = np.asarray(surface.tree.query_ball_point(p, radius), dtype=np.int64)
+    near = np.zeros(surface.num_points, dtype=bool)
+    near[ids] = True
+    indptr, tri_ids = surface.vertex_triangles
+    counts = indptr[ids + 1] - indptr[ids]
+    firsts = np.repeat(indptr[ids] - np.cumsum(counts) + counts, counts)
+    cells = np.unique(tri_ids[firsts + np.arange(counts.sum())])
+    triangles = surface.triangles[cells]
+    triangles = triangles[np.all(near[triangles], axis=1)]
+    ids, triangles = np.unique(triangles, return_inverse=True)
+    return Surface(surface.points[ids], triangles.reshape(-1, 3))
+
+
+def cut(surface, p, n, radius):
+    """Intersect surface near point p with plane through p with normal n.
+
+    Returns:
+        points: Intersection points of triangle edges within twice the radius.
+        lines: Line segments whose end points are within radius of p.
+    """
+    near = np.sum(np.square(surface.points - p), axis=1) <= 4. * radius * radius
+    triangles = surface.triangles[np.all(near[surface.triangles], axis=1)]
+    if triangles.shape[0] == 0:
+        return np.zeros((0, 3)), np.zeros((0, 2), dtype=np.int64)
+    s = (surface.points - p).dot(n)
+    above = s[triangles] > 0.
+    crossing = np.any(above, axis=1) & ~np.all(above, axis=1)
+    triangles = triangles[crossing]
+    above = above[crossing]
+    if triangles.shape[0] == 0:
+        return np.zeros((0, 3)), np.zeros((0, 2), dtype=np.int64)
+    edges = np.stack([triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]], axis=1)
+    cut_edges = np.stack([above[:, 0] != above[:, 1], above[:, 1] != above[:, 2], above[:, 2] != above[:, 0]], axis=1)
+    edges = np.sort(edges[cut_edges].reshape(-1, 2), axis=1)  # two cut edges per triangle
+    keys, inverse = np.unique(edges[:, 0] * surface.num_points + edges[:, 1], return_inverse=True)
+    a = keys // surface.num_points
+    b = keys % surface.num_points
+    t = s[a] / (s[a] - s[b])
+    points = surface.points[a] + t[:, np.newaxis] * (surface.points[b] - surface.points[a])
+    lines = inverse.reshape(-1, 2)
+    far = np.sum(np.square(points - p), axis=1) > radius * radius
+    lines = lines[~np.any(far[lines], axis=1)]
+    return points, lines
+
+
+def point_in_polygon(p, polygon, normal):
+    """Whether point p lies inside planar polygon with given normal."""
+    drop = int(np.argmax(np.abs(normal)))
+    axes = [i for i in range(3) if i != drop]
+    x = polygon[:, axes[0]]
+    y = polygon[:, axes[1]]
+    px, py = p[axes[0]], p[axes[1]]
+    x2 = np.roll(x, -1)
+    y2 = np.roll(y, -1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        crosses = ((y > py) != (y2 > py)) & (px < (x2 - x) * (py - y) / (y2 - y) + x)
+    return bool(np.count_nonzero(crosses) % 2 == 1)
+
+
+def loops(points, lines, p, normal):
+    """Extract closed loops of cut lines as list of (center, length, size, inside) tuples."""
+    result = []
+    if lines.shape[0] == 0:
+        return result
+    point_lines = [[] for _ in range(points.shape[0])]
+    for line_id, line in enumerate(lines):
+        point_lines[line[0]].append(line_id)
+        point_lines[line[1]].append(line_id)
+    visited = np.zeros(lines.shape[0], dtype=bool)
+    for first in range(lines.shape[0]):
+        if visited[first]:
+            continue
+        start = front = lines[first][0]
+        vertices = [start]
+        length = 0.
+        valid = True
+        while True:
+            adjacent = point_lines[front]
+            unvisited = [line_id for line_id in adjacent if not visited[line_id]]
+            if len(adjacent) != 2 or not unvisited:
+                if unvisited:
+                    visited[unvisited[0]] = True
+                valid = False
+                break
+            line_id = unvisited[0]
+            visited[line_id] = True
+            line = lines[line_id]
+            nxt = line[0] if line[1] == front else line[1]
+            length += np.linalg.norm(points[nxt] - points[front])
+            front = nxt
+            if front == start:
+                break
+            vertices.append(front)
+        if valid and len(vertices) > 1:
+            polygon = points[vertices]
+            center = (polygon.sum(axis=0) + points[start]) / (len(vertices) + 1)
+            result.append((center, length, len(vertices) + 1, point_in_polygon(p, polygon, normal)))
+    return result
+
+
+def hausdorff_distance(a, b):
+    """Hausdorff distance of two point sets."""
+    return max(cKDTree(b).query(a)[0].max(), cKDTree(a).query(b)[0].max())
+
+
+def best_slice_view(image_to_world, surface, reference, cluster):
+    """Determine orthogonal image slice in which the two surfaces differ the most.
+
+    Returns:
+        Index of image dimension orthogonal to best slice, i.e., 2: axial, 1: coronal, 0: sagittal.
+    """
+    world_to_image = np.linalg.inv(image_to_world)
+    p = world_to_image.dot(np.append(cluster.center, 1.))
+    p[:3] = np.round(p[:3])
+    p = image_to_world.dot(p)[:3]
+
+    maxdist = 1.
+    radius = 5.
+    lrange = (1., 10.)
+
+    # crop meshes once for all three cutting planes
+    crops = [crop(surface, p, 2. * radius), crop(reference, p, 2. * radius)]
+
+    d = [0., 0., 0.]
+    nloops = [0, 0, 0]
+    for i in (2, 1, 0):
+        n = image_to_world[:3, i] / np.linalg.norm(image_to_world[:3, i])
+        cuts = [cut(crops[0], p, n, radius), cut(crops[1], p, n, radius)]
+        if cuts[0][0].shape[0] > 0 and cuts[1][0].shape[0] > 0:
+            for points, lines in cuts:
+                nloops[i] = 0
+                for center, length, size, inside in loops(points, lines, p, n):
+                    if size > 2 and (inside or np.linalg.norm(center - p) < maxdist) and lrange[0] <= length <= lrange[1]:
+                        nloops[i] += 1
+                if nloops[i] == 1:
+                    break
+            d[i] = hausdorff_distance(cuts[0][0], cuts[1][0])
+
+    maxd = 0.
+    zdir = -1
+    for i in (2, 1, 0):
+        if nloops[i] != 1 and d[i] > maxd:
+            maxd = d[i]
+            zdir = i
+    if zdir == -1:
+        zdir = 2
+        for i in (2, 1, 0):
+            if d[i] > maxd:
+                maxd = d[i]
+                zdir = i
+    return zdir
+
+
+def best_views(clusters, image_to_world, surface, reference, timings=None):
+    """Set view attribute of clusters to best orthogonal viewing direction, 'A', 'C', or 'S'."""
+    timer = PhaseTimer(timings, 'best-view')
+    for cluster in clusters:
+        zdir = best_slice_view(image_to_world, surface, reference, cluster)
+        cluster.view = 'A' if zdir == 2 else ('C' if zdir == 1 else 'S')
+    timer.stop()
+    return clusters
+
+
+# =============================================================================
+# Selection
+# =============================================================================
+
+def roi_records(clusters, surface, reference, timings=None):
+    """Convert clusters to records with the columns of the table printed by select-rois."""
+    timer = PhaseTimer(timings, 'output')
+    offset = surface.num_points
+    records = []
+    for cluster in clusters:
+        if cluster.seed >= offset:
+            p = reference.points[cluster.seed - offset]
+            q = surface.points[surface.tree.query(p)[1]]
+        else:
+            p = surface.points[cluster.seed]
+            q = reference.points[reference.tree.query(p)[1]]
+        p = [float(x) for x in p]
+        q = [float(x) for x in q]
+        c = [float(x) for x in cluster.center]
+        records.append({
+            'ClusterId': cluster.label,
+            'ClusterSize': cluster.size,
+            'AvgDistance': float(cluster.total) / cluster.size if cluster.size > 0 else 0.,
+            'SeedId': cluster.seed,
+            'SeedX': p[0], 'SeedY': p[1], 'SeedZ': p[2],
+            'CenterX': c[0], 'CenterY': c[1], 'CenterZ': c[2],
+            'MiddleX': .5 * (p[0] + q[0]), 'MiddleY': .5 * (p[1] + q[1]), 'MiddleZ': .5 * (p[2] + q[2]),
+            'View': cluster.view
+        })
+    timer.stop()
+    return records
+
+
+def select_rois(surface, reference, image_to_world=None, mask_name=None, mask_erosion=0,
+                min_seed_dist=2., min_threshold=None, percentile=0, min_size=10, joint=True,
+                span=40., max_overlap=1., num_points=0, max_points=0, random_ratio=0.,
+                stratified=True, seed=None, k=8, cache_dir=None, timings=None, verbose=0):
+    """Select ROIs centered at clusters of distant points and random surface points.
+
+    Args:
+        surface: Surface object or file name of surface mesh.
+        reference: Surface object or file name of reference surface mesh.
+        image_to_world: 4x4 matrix mapping voxel indices to world coordinates or file
+            name of NIfTI image used to determine best viewing direction of each ROI.
+        cache_dir: Directory of cache files with point masks and distances.
+
+    Returns:
+        List of ROI records with same columns as the CSV table printed by select-rois.
+    """
+    timer = PhaseTimer(timings, 'read')
+    if not isinstance(surface, Surface):
+        surface = read_surface(surface)
+    if not isinstance(reference, Surface):
+        reference = read_surface(reference)
+    if image_to_world is not None and not isinstance(image_to_world, np.ndarray):
+        image_to_world = read_image_to_world(image_to_world)
+    timer.stop()
+    result = compute_clusters(surface, reference, mask_name=mask_name, mask_erosion=mask_erosion,
+                              min_seed_dist=min_seed_dist, min_threshold=min_threshold,
+                              percentile=percentile, min_size=min_size, joint=joint,
+                              k=k, cache_dir=cache_dir, timings=timings, verbose=verbose)
+    clusters = sample_rois(result, span=span, max_overlap=max_overlap, num_points=num_points,
+                           max_points=max_points, random_ratio=random_ratio, stratified=stratified,
+                           rng=np.random.RandomState(seed), timings=timings, verbose=verbose)
+    if image_to_world is not None:
+        best_views(clusters, image_to_world, surface, reference, timings=timings)
+    return roi_records(clusters, surface, reference, timings=timings)
+
+
+def _select_rois_job(kwargs):
+    """Worker function of select_rois_parallel."""
+    timings = []
+    records = select_rois(timings=timings, **kwargs)
+    return records, timings
+
+
+def select_rois_parallel(jobs, processes=None):
+    """Select ROIs of multiple scans in a pool of worker processes.
+
+    Args:
+        jobs: List of dictionaries with keyword arguments of select_rois.
+        processes: Number of worker processes, number of CPUs by default.
+
+    Returns:
+        List of (records, timings) tuples in order of jobs.
+    """
+    from multiprocessing import Pool
+    pool = Pool(processes)
+    try:
+        return pool.map(_select_rois_job, jobs)
+    finally:
+        pool.close()
+        pool.join()
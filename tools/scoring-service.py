@@ -0,0 +1,815 @@
+#!/usr/bin/python
+
+"""Serve database and screenshots to multiple instances of the evaluation app
+
+Instead of opening the SQLite database file directly, which makes concurrent
+raters contend on the file lock, in particular on a shared network file system,
+the app is started with the --server URL and --token options and requests the
+operations of a rater from this service running on the host where the database
+file is stored, e.g., the next screenshots of a task, saving scores, undoing the
+last score, and the progress of a rater. The SQL statements of these operations
+are part of the service and the app only sends their parameters. Operations
+which read the database use a pool of connections to the database in WAL mode,
+and writes of all raters are executed by a single writer thread which commits
+the requests received within a short delay in a single transaction. The
+screenshots are served with caching headers such that these are loaded only
+once by the app.
+
+Each request must include the access token of the service, which is given to
+the raters together with the URL of the service. When a rater logs in with
+email address and password, the service returns a session token. The requests
+of the rater include this token and the service executes these operations for
+the rater of the session, not for a rater ID sent by the app. Sessions are only
+kept in memory, such that raters log in again after a restart of the service.
+By default, the service listens only for connections from the local host."""
+
+import os
+import sys
+import re
+import hmac
+import json
+import time
+import shutil
+import sqlite3
+import subprocess
+import binascii
+import argparse
+import tempfile
+import threading
+import mimetypes
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import unquote, urlsplit, parse_qs
+    import queue
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+    from urlparse import urlsplit, parse_qs
+    import Queue as queue
+
+
+def connect(database, readonly=False):
+    """Open database connection, which may be used by different threads."""
+    con = sqlite3.connect(database, timeout=600, isolation_level=None, check_same_thread=False)
+    if readonly:
+        con.execute("PRAGMA query_only = 1")
+    else:
+        # in WAL mode, a commit is durable after the next checkpoint
+        con.execute("PRAGMA synchronous = NORMAL")
+    return con
+
+
+# ----------------------------------------------------------------------------
+# Operations requested by the app
+#
+# Each operation is a function of a database cursor and the JSON object of
+# arguments sent by the app, which returns the JSON object sent back, i.e.,
+# either the "row" or the "rows" selected by the operation. The arguments
+# are validated and only bound as parameters of the SQL statements. The
+# "raterId" argument of the operations of a rater is set by the service to
+# the rater of the session.
+
+# range of SQLite INTEGER values
+MIN_INTEGER = -2 ** 63
+MAX_INTEGER = 2 ** 63 - 1
+
+
+def int_arg(args, name, default=None):
+    """Get integer argument of operation."""
+    value = args.get(name, default)
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError("Argument '{}' must be an integer".format(name))
+    if value < MIN_INTEGER or value > MAX_INTEGER:
+        raise ValueError("Argument '{}' must be a 64-bit integer".format(name))
+    return value
+
+
+def task_type_arg(args, name='taskType'):
+    """Get type of task, i.e., 'E' for evaluation and 'C' for comparison."""
+    value = args.get(name)
+    if value not in ('E', 'C'):
+        raise ValueError("Argument '{}' must be either 'E' or 'C'".format(name))
+    return value
+
+
+def fetch_one(cur, sql, params={}):
+    cur.execute(sql, params)
+    names = [column[0] for column in cur.description or []]
+    row = cur.fetchone()
+    return None if row is None else dict(zip(names, row))
+
+
+def fetch_all(cur, sql, params={}):
+    cur.execute(sql, params)
+    names = [column[0] for column in cur.description or []]
+    return [dict(zip(names, row)) for row in cur.fetchall()]
+
+
+# constraint on view of screenshot or ROI, where view 'D' is the best view of the ROI
+VIEW_ID_CONSTRAINT = """(
+      S.ViewId IN (SELECT ViewId FROM {table} WHERE {column} = :taskId)
+      OR (S.ViewId = BestViewId AND 'D' IN (SELECT ViewId FROM {table} WHERE {column} = :taskId))
+    )"""
+
+EVALUATION_VIEW_ID_CONSTRAINT = VIEW_ID_CONSTRAINT.format(table='EvaluationViews', column='EvaluationTaskId')
+COMPARISON_VIEW_ID_CONSTRAINT = VIEW_ID_CONSTRAINT.format(table='ComparisonViews', column='ComparisonTaskId')
+
+
+def login(cur, args):
+    return {'row': fetch_one(cur, """
+    SELECT RaterId, ShowHelp FROM Raters WHERE Email = :email AND Password = :password
+    """, {'email': args.get('email'), 'password': args.get('password')})}
+
+
+def hide_help(cur, args):
+    cur.execute("UPDATE Raters SET ShowHelp = 0 WHERE RaterId = :raterId", {'raterId': int_arg(args, 'raterId')})
+    return {}
+
+
+def contact(cur, args):
+    return {'row': fetch_one(cur, "SELECT * FROM Contacts")}
+
+
+def roi_bounds_overlay(cur, args):
+    return {'row': fetch_one(cur, "SELECT OverlayId FROM Overlays WHERE Name = 'ROI Bounds'")}
+
+
+def scores(cur, args):
+    return {'rows': fetch_all(cur, "SELECT * FROM Scores ORDER BY Value")}
+
+
+def evaluation_tasks(cur, args):
+    return {'rows': fetch_all(cur, """
+    SELECT T.EvaluationTaskId,
+      (SELECT group_concat(O.OverlayId) FROM EvaluationOverlays AS O
+       WHERE O.EvaluationTaskId = T.EvaluationTaskId) AS OverlayIds,
+      (SELECT group_concat(V.ViewId) FROM EvaluationViews AS V
+       WHERE V.EvaluationTaskId = T.EvaluationTaskId) AS ViewIds
+    FROM EvaluationTasks AS T
+    """)}
+
+
+def comparison_tasks(cur, args):
+    return {'rows': fetch_all(cur, """
+    SELECT T.ComparisonTaskId, T.OverlayId1, T.OverlayId2,
+      (SELECT group_concat(V.ViewId) FROM ComparisonViews AS V
+       WHERE V.ComparisonTaskId = T.ComparisonTaskId) AS ViewIds
+    FROM ComparisonTasks AS T
+    """)}
+
+
+def fill_queue(cur, args):
+    """Append screenshots of task not yet in the queue of the rater in random order."""
+    params = {
+        'raterId': int_arg(args, 'raterId'),
+        'taskType': task_type_arg(args),
+        'taskId': int_arg(args, 'taskId')
+    }
+    if params['taskType'] == 'E':
+        query = """
+      SELECT DISTINCT(S.ScreenshotId) AS ScreenshotId
+      FROM EvaluationScreenshots AS S
+      LEFT JOIN ROIs AS R
+        ON S.ROI_Id = R.ROI_Id
+      WHERE OverlayId IN (SELECT OverlayId FROM EvaluationOverlays WHERE EvaluationTaskId = :taskId)
+      AND """ + EVALUATION_VIEW_ID_CONSTRAINT
+    else:
+        query = """
+      SELECT S.ScreenshotId AS ScreenshotId
+      FROM ComparisonSets AS S
+      LEFT JOIN ROIs AS R
+        ON S.ROI_Id = R.ROI_Id
+      INNER JOIN ComparisonTasks AS T
+        ON T.ComparisonTaskId = :taskId
+      WHERE S.OverlayId1 = min(T.OverlayId1, T.OverlayId2) AND S.OverlayId2 = max(T.OverlayId1, T.OverlayId2)
+      AND """ + COMPARISON_VIEW_ID_CONSTRAINT
+    cur.execute("""
+    INSERT OR IGNORE INTO RaterQueueCursor (RaterId, TaskType, TaskId, Position)
+    VALUES (:raterId, :taskType, :taskId, 0)
+    """, params)
+    cur.execute("""
+    INSERT INTO RaterQueue (RaterId, TaskType, TaskId, ScreenshotId)
+    SELECT :raterId, :taskType, :taskId, ScreenshotId
+    FROM (""" + query + """)
+    WHERE ScreenshotId NOT IN (
+      SELECT ScreenshotId FROM RaterQueue
+      WHERE RaterId = :raterId AND TaskType = :taskType AND TaskId = :taskId
+    )
+    ORDER BY random()
+    """, params)
+    return {}
+
+
+def next_screenshots(cur, args):
+    """Get next screenshots in the queue after the cursor and the given position which were not yet scored."""
+    params = {
+        'raterId': int_arg(args, 'raterId'),
+        'taskType': task_type_arg(args),
+        'taskId': int_arg(args, 'taskId'),
+        'after': int_arg(args, 'after', 0),
+        'limit': int_arg(args, 'limit', 1)
+    }
+    if params['taskType'] == 'E':
+        query = """
+    SELECT Q.QueueId AS QueueId, Q.ScreenshotId AS ScreenshotId,
+      S.FileName AS FileName, R.ScreenshotId AS ROIScreenshotId, R.FileName AS ROIScreenshotName
+    FROM RaterQueue AS Q
+    INNER JOIN RaterQueueCursor AS K
+      ON K.RaterId = Q.RaterId AND K.TaskType = Q.TaskType AND K.TaskId = Q.TaskId
+    INNER JOIN Screenshots AS S
+      ON S.ScreenshotId = Q.ScreenshotId
+    LEFT JOIN ScreenshotTypes AS T
+      ON T.ScreenshotId = Q.ScreenshotId
+    LEFT JOIN Screenshots AS R
+      ON R.ScreenshotId = T.ROIScreenshotId
+    LEFT JOIN EvaluationScores AS E
+      ON E.ScreenshotId = Q.ScreenshotId AND E.RaterId = Q.RaterId
+    WHERE E.Score IS NULL"""
+    else:
+        query = """
+    SELECT Q.QueueId AS QueueId, Q.ScreenshotId AS ScreenshotId,
+      F.FileName AS FileName, A.FileName AS FileName1, B.FileName AS FileName2,
+      R.FileName AS ROIScreenshotName, S.ROIScreenshotId AS ROIScreenshotId,
+      S.ScreenshotId1 AS ScreenshotId1, S.OverlayId1 AS OverlayId1, S.Color1 AS Color1,
+      S.ScreenshotId2 AS ScreenshotId2, S.OverlayId2 AS OverlayId2, S.Color2 AS Color2
+    FROM RaterQueue AS Q
+    INNER JOIN RaterQueueCursor AS K
+      ON K.RaterId = Q.RaterId AND K.TaskType = Q.TaskType AND K.TaskId = Q.TaskId
+    INNER JOIN ComparisonSets AS S
+      ON S.ScreenshotId = Q.ScreenshotId
+    INNER JOIN Screenshots AS F
+      ON F.ScreenshotId = S.ScreenshotId
+    INNER JOIN Screenshots AS A
+      ON A.ScreenshotId = S.ScreenshotId1
+    INNER JOIN Screenshots AS B
+      ON B.ScreenshotId = S.ScreenshotId2
+    INNER JOIN Screenshots AS R
+      ON R.ScreenshotId = S.ROIScreenshotId
+    LEFT JOIN ComparisonChoices AS C
+      ON C.ScreenshotId = Q.ScreenshotId AND C.RaterId = Q.RaterId
+    WHERE C.BestOverlayId IS NULL"""
+    query += """
+    AND Q.RaterId = :raterId AND Q.TaskType = :taskType AND Q.TaskId = :taskId
+    AND Q.QueueId > K.Position AND Q.QueueId > :after
+    ORDER BY Q.QueueId LIMIT :limit"""
+    return {'rows': fetch_all(cur, query, params)}
+
+
+def evaluation_screenshot(cur, args):
+    """Get screenshot of evaluation task unless it was scored by the rater."""
+    return {'row': fetch_one(cur, """
+    SELECT S.ScreenshotId AS ScreenshotId, FileName, ROIScreenshotId, ROIScreenshotName
+    FROM EvaluationScreenshots AS S
+    LEFT JOIN ROIs AS R
+      ON S.ROI_Id = R.ROI_Id
+    LEFT JOIN EvaluationScores AS E
+      ON E.ScreenshotId = S.ScreenshotId AND RaterId = :raterId
+    WHERE Score IS NULL AND S.ScreenshotId = :screenshotId
+    AND OverlayId IN (SELECT OverlayId FROM EvaluationOverlays WHERE EvaluationTaskId = :taskId)
+    AND """ + EVALUATION_VIEW_ID_CONSTRAINT, {
+        'raterId': int_arg(args, 'raterId'),
+        'taskId': int_arg(args, 'taskId'),
+        'screenshotId': int_arg(args, 'screenshotId')
+    })}
+
+
+def comparison_colors(cur, args):
+    return {'rows': fetch_all(cur, """
+    SELECT DISTINCT(Color) AS Color FROM ScreenshotOverlays
+    WHERE ScreenshotId IN (
+      SELECT ScreenshotId FROM ComparisonSets
+      WHERE OverlayId1 = :id1 AND OverlayId2 = :id2
+    )
+    ORDER BY Color
+    """, {'id1': int_arg(args, 'id1'), 'id2': int_arg(args, 'id2')})}
+
+
+def comparison_screenshot(cur, args):
+    """Get comparison set of screenshots unless the rater made a choice."""
+    return {'row': fetch_one(cur, """
+    SELECT
+      S.ScreenshotId AS ScreenshotId,
+      F.FileName AS FileName,
+      S.ScreenshotId1 AS ScreenshotId1,
+      A.FileName AS FileName1,
+      S.OverlayId1 AS OverlayId1,
+      S.Color1 AS Color1,
+      S.ScreenshotId2 AS ScreenshotId2,
+      B.FileName AS FileName2,
+      S.OverlayId2 AS OverlayId2,
+      S.Color2 AS Color2,
+      S.ROIScreenshotId AS ROIScreenshotId,
+      RS.FileName AS ROIScreenshotName
+    FROM ComparisonSets AS S
+    INNER JOIN Screenshots AS F
+      ON F.ScreenshotId = S.ScreenshotId
+    INNER JOIN Screenshots AS A
+      ON A.ScreenshotId = S.ScreenshotId1
+    INNER JOIN Screenshots AS B
+      ON B.ScreenshotId = S.ScreenshotId2
+    INNER JOIN Screenshots AS RS
+      ON RS.ScreenshotId = S.ROIScreenshotId
+    LEFT JOIN ComparisonChoices AS C
+      ON C.ScreenshotId = S.ScreenshotId AND C.RaterId = :raterId
+    WHERE S.ScreenshotId = :screenshotId
+    AND S.OverlayId1 = :id1 AND S.OverlayId2 = :id2 AND C.BestOverlayId IS NULL
+    """, {
+        'raterId': int_arg(args, 'raterId'),
+        'screenshotId': int_arg(args, 'screenshotId'),
+        'id1': int_arg(args, 'id1'),
+        'id2': int_arg(args, 'id2')
+    })}
+
+
+def progress(cur, args):
+    """Get total number of screenshots in the queues of the rater and number of these rated."""
+    return {'rows': fetch_all(cur, """
+    SELECT TaskId, Total, Done FROM RaterProgress
+    WHERE RaterId = :raterId AND TaskType = :taskType
+    """, {'raterId': int_arg(args, 'raterId'), 'taskType': task_type_arg(args)})}
+
+
+def has_scores(cur, args):
+    return {'row': fetch_one(cur, """
+    SELECT ScreenshotId FROM EvaluationScores WHERE RaterId = :raterId AND NOT Score IS NULL LIMIT 1
+    """, {'raterId': int_arg(args, 'raterId')})}
+
+
+def save_score(cur, rater_id, entry):
+    """Write journal entry of app, which may be replayed after a crash."""
+    params = {
+        'type': task_type_arg(entry, 'type'),
+        'raterId': rater_id,
+        'taskId': int_arg(entry, 'taskId'),
+        'queueId': int_arg(entry, 'queueId', 0),
+        'screenshotId': int_arg(entry, 'screenshotId')
+    }
+    if params['type'] == 'E':
+        params['score'] = int_arg(entry, 'score')
+    else:
+        params['bestOverlayId'] = int_arg(entry, 'bestOverlayId')
+    if params['type'] == 'E' and params['score'] == 0:
+        params['roiScreenshotId'] = int_arg(entry, 'roiScreenshotId')
+        # discard all screenshots taken from the same ROI
+        cur.execute("""
+      INSERT INTO EvaluationScores (ScreenshotId, RaterId, Score)
+      SELECT S.ScreenshotId AS ScreenshotId, :raterId AS RaterId, 0 AS Score
+      FROM EvaluationScreenshots AS S
+      LEFT JOIN EvaluationScores AS E
+        ON E.ScreenshotId = S.ScreenshotId AND E.RaterId = :raterId
+      WHERE E.Score IS NULL AND S.ROIScreenshotId = :roiScreenshotId
+        """, params)
+        # set choice of all comparisons within discarded ROI as "Neither"
+        cur.execute("""
+      INSERT INTO ComparisonChoices (ScreenshotId, RaterId, BestOverlayId)
+      SELECT DISTINCT(S.ScreenshotId) AS ScreenshotId, :raterId AS RaterId, 0 AS BestOverlayId
+      FROM ComparisonScreenshots AS S
+      LEFT JOIN ROIScreenshots AS R
+        ON  R.ROI_Id  = S.ROI_Id
+        AND R.CenterI = S.CenterI
+        AND R.CenterJ = S.CenterJ
+        AND R.CenterK = S.CenterK
+        AND R.ViewId  = S.ViewId
+      LEFT JOIN ComparisonChoices AS C
+        ON C.ScreenshotId = S.ScreenshotId AND C.RaterId = :raterId
+      WHERE C.BestOverlayId IS NULL AND R.ScreenshotId = :roiScreenshotId
+        """, params)
+    elif params['type'] == 'E':
+        cur.execute("""
+      INSERT OR IGNORE INTO EvaluationScores (ScreenshotId, RaterId, Score)
+      VALUES (:screenshotId, :raterId, :score)
+        """, params)
+    else:
+        cur.execute("""
+      INSERT OR IGNORE INTO ComparisonChoices (ScreenshotId, RaterId, BestOverlayId)
+      VALUES (:screenshotId, :raterId, :bestOverlayId)
+        """, params)
+    cur.execute("""
+    UPDATE RaterQueueCursor SET Position = MAX(Position, :queueId)
+    WHERE RaterId = :raterId AND TaskType = :type AND TaskId = :taskId
+    """, params)
+
+
+def save_scores(cur, args):
+    """Write batch of journal entries of the rater."""
+    rater_id = int_arg(args, 'raterId')
+    entries = args.get('entries')
+    if not isinstance(entries, list) or not all([isinstance(entry, dict) for entry in entries]):
+        raise ValueError("Argument 'entries' must be a list of objects")
+    for entry in entries:
+        save_score(cur, rater_id, entry)
+    return {}
+
+
+def undo(cur, args):
+    """Delete last evaluation score of the rater unless it discarded an ROI.
+
+    The cursor of each evaluation queue of the rater is moved back before the
+    screenshot, such that it is offered again even when the app is closed before
+    it is scored again. Returns the deleted score and position of the screenshot
+    in the queue of the given task."""
+    params = {'raterId': int_arg(args, 'raterId'), 'taskId': int_arg(args, 'taskId')}
+    row = fetch_one(cur, """
+    SELECT E.ScreenshotId AS ScreenshotId, E.Score AS Score, Q.QueueId AS QueueId
+    FROM EvaluationScores AS E
+    LEFT JOIN RaterQueue AS Q
+      ON Q.RaterId = E.RaterId AND Q.TaskType = 'E' AND Q.TaskId = :taskId
+      AND Q.ScreenshotId = E.ScreenshotId
+    WHERE E.RaterId = :raterId
+    ORDER BY E._rowid_ DESC LIMIT 1
+    """, params)
+    if row is None:
+        return {'row': None}
+    if row['Score'] == 0:
+        raise ValueError("Cannot undo Discard operation")
+    params['screenshotId'] = row['ScreenshotId']
+    cur.execute("DELETE FROM EvaluationScores WHERE ScreenshotId = :screenshotId AND RaterId = :raterId", params)
+    cur.execute("""
+    UPDATE RaterQueueCursor SET Position = MIN(Position, (
+      SELECT MIN(Q.QueueId) - 1 FROM RaterQueue AS Q
+      WHERE Q.RaterId = RaterQueueCursor.RaterId AND Q.TaskType = RaterQueueCursor.TaskType
+      AND Q.TaskId = RaterQueueCursor.TaskId AND Q.ScreenshotId = :screenshotId
+    ))
+    WHERE RaterId = :raterId AND TaskType = 'E' AND TaskId IN (
+      SELECT TaskId FROM RaterQueue
+      WHERE RaterId = :raterId AND TaskType = 'E' AND ScreenshotId = :screenshotId
+    )
+    """, params)
+    return {'row': row}
+
+
+# operations which only read the database
+READ_OPERATIONS = {
+    'login': login,
+    'contact': contact,
+    'roi-bounds-overlay': roi_bounds_overlay,
+    'scores': scores,
+    'evaluation-tasks': evaluation_tasks,
+    'comparison-tasks': comparison_tasks,
+    'next-screenshots': next_screenshots,
+    'evaluation-screenshot': evaluation_screenshot,
+    'comparison-colors': comparison_colors,
+    'comparison-screenshot': comparison_screenshot,
+    'progress': progress,
+    'has-scores': has_scores
+}
+
+# operations of the rater of a session
+RATER_OPERATIONS = set([
+    'next-screenshots',
+    'evaluation-screenshot',
+    'comparison-screenshot',
+    'progress',
+    'has-scores',
+    'hide-help',
+    'fill-queue',
+    'save-scores',
+    'undo'
+])
+
+# operations executed by the writer thread
+WRITE_OPERATIONS = {
+    'hide-help': hide_help,
+    'fill-queue': fill_queue,
+    'save-scores': save_scores,
+    'undo': undo
+}
+
+
+# ----------------------------------------------------------------------------
+# Database access
+
+class Sessions(object):
+    """Sessions of raters who logged in, identified by a random token."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.raters = {}
+
+    def create(self, rater_id):
+        token = binascii.hexlify(os.urandom(16)).decode('ascii')
+        with self.lock:
+            self.raters[token] = rater_id
+        return token
+
+    def rater(self, token):
+        """Get ID of rater of session, or None if the token is unknown."""
+        with self.lock:
+            return self.raters.get(token)
+
+
+class ConnectionPool(object):
+    """Pool of read-only database connections."""
+
+    def __init__(self, database, size):
+        self.connections = queue.Queue()
+        for i in range(size):
+            self.connections.put(connect(database, readonly=True))
+
+    def read(self, operation, args):
+        """Execute read-only operation."""
+        con = self.connections.get()
+        try:
+            return operation(con.cursor(), args)
+        finally:
+            self.connections.put(con)
+
+
+class Writer(threading.Thread):
+    """Thread which executes the write requests of all clients.
+
+    The requests received while a transaction is committed are executed in the
+    next transaction, each within its own savepoint such that a failing request
+    does not roll back the others. A transaction is committed at the latest after
+    the given delay (in seconds) after its first request or when the batch size
+    is reached."""
+
+    def __init__(self, database, delay=.01, batch_size=100, verbose=0):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.database = database
+        self.delay = delay
+        self.batch_size = batch_size
+        self.verbose = verbose
+        self.requests = queue.Queue()
+
+    def write(self, operation, args):
+        """Execute write operation and wait for it to be committed."""
+        request = {
+            'operation': operation,
+            'args': args,
+            'done': threading.Event(),
+            'result': None,
+            'error': None
+        }
+        self.requests.put(request)
+        request['done'].wait()
+        if request['error']:
+            raise sqlite3.Error(request['error'])
+        return request['result']
+
+    def run(self):
+        con = connect(self.database)
+        cur = con.cursor()
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.time() + self.delay
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            # any error must be reported to the waiting request handlers instead
+            # of terminating this thread, which would block all later writes
+            try:
+                cur.execute("BEGIN IMMEDIATE")
+                for request in batch:
+                    cur.execute("SAVEPOINT request")
+                    try:
+                        request['result'] = request['operation'](cur, request['args'])
+                        cur.execute("RELEASE request")
+                    except Exception as e:
+                        cur.execute("ROLLBACK TO request")
+                        cur.execute("RELEASE request")
+                        request['error'] = str(e) or e.__class__.__name__
+                cur.execute("COMMIT")
+                if self.verbose > 1:
+                    print("Committed {} write requests".format(len(batch)))
+            except Exception as e:
+                try:
+                    cur.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+                for request in batch:
+                    request['error'] = str(e) or e.__class__.__name__
+            finally:
+                for request in batch:
+                    request['done'].set()
+
+
+def create_database(database):
+    """Create database using tools/create-tables.py."""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'create-tables.py')
+    subprocess.check_call([sys.executable, script, database])
+
+
+def check_writer(verbose=0):
+    """Write scores and undo the last one like the app on a temporary database."""
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        database = os.path.join(tmp_dir, 'check.db')
+        create_database(database)
+        con = connect(database)
+        if con.execute("PRAGMA user_version").fetchone()[0] == 0:
+            raise Exception("Schema version of database created by create-tables.py not set")
+        for task_type in ('E', 'C'):
+            fill_queue(con.cursor(), {'raterId': 1, 'taskType': task_type, 'taskId': 1})
+        for queue_id, task_type, screenshot_id in [(1, 'E', 1), (2, 'E', 2), (3, 'E', 3), (4, 'C', 4)]:
+            con.execute("INSERT INTO RaterQueue (QueueId, RaterId, TaskType, TaskId, ScreenshotId)"
+                        " VALUES (?, 1, ?, 1, ?)", (queue_id, task_type, screenshot_id))
+        writer = Writer(database, verbose=verbose)
+        writer.start()
+        entries = [
+            {'type': 'E', 'raterId': 1, 'taskId': 1, 'queueId': 1, 'screenshotId': 1, 'score': 3},
+            {'type': 'E', 'raterId': 1, 'taskId': 1, 'queueId': 2, 'screenshotId': 2, 'score': 0,
+             'roiScreenshotId': 5},
+            {'type': 'E', 'raterId': 1, 'taskId': 1, 'queueId': 3, 'screenshotId': 3, 'score': 2},
+            {'type': 'C', 'raterId': 1, 'taskId': 1, 'queueId': 4, 'screenshotId': 4, 'bestOverlayId': 3}
+        ]
+        writer.write(save_scores, {'raterId': 1, 'entries': entries})
+        rows = con.execute("SELECT ScreenshotId, Score FROM EvaluationScores ORDER BY ScreenshotId").fetchall()
+        if rows != [(1, 3), (3, 2)]:
+            raise Exception("Unexpected evaluation scores after saving scores: {}".format(rows))
+        if con.execute("SELECT COUNT(*) FROM ComparisonChoices").fetchone()[0] != 1:
+            raise Exception("Comparison choice not saved")
+        try:
+            writer.write(save_scores, {'raterId': 1, 'entries': [{'type': 'E', 'screenshotId': '1; DROP TABLE Raters'}]})
+            raise Exception("Invalid journal entry was not rejected")
+        except sqlite3.Error:
+            pass
+        result = writer.write(undo, {'raterId': 1, 'taskId': 1})
+        if result['row']['ScreenshotId'] != 3 or result['row']['QueueId'] != 3:
+            raise Exception("Unexpected result of undo: {}".format(result))
+        rows = con.execute("SELECT ScreenshotId FROM EvaluationScores").fetchall()
+        if rows != [(1,)]:
+            raise Exception("Unexpected evaluation scores after undo: {}".format(rows))
+        position = con.execute("SELECT Position FROM RaterQueueCursor WHERE TaskType = 'E'").fetchone()[0]
+        if position != 2:
+            raise Exception("Expected queue cursor to be rewound to 2 after undo, but it is {}".format(position))
+        con.close()
+    finally:
+        shutil.rmtree(tmp_dir)
+    print("Scores were saved and undone successfully")
+
+
+# ----------------------------------------------------------------------------
+# HTTP interface
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """Handle requests of evaluation app.
+
+    - POST /api/<operation>: Execute named operation with the arguments given
+      by a JSON object. Returns JSON object with either an "error" message or
+      the result of the operation. The access token must be given by header
+      "Authorization: Bearer <token>". The operations of a rater require the
+      session token returned by the "login" operation in header "X-Rater-Session".
+    - GET /screenshots/<path>?token=<token>: Image file with path relative to database.
+
+    No CORS headers are sent, such that web pages opened in a browser cannot
+    send requests with the access token header or read the responses.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose > 1:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def authorized(self, token):
+        return token is not None and hmac.compare_digest(token.encode('utf-8'), self.server.token.encode('utf-8'))
+
+    def send_json(self, obj, status=200):
+        data = json.dumps(obj).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        authorization = self.headers.get('Authorization', '')
+        if not authorization.startswith('Bearer ') or not self.authorized(authorization[7:]):
+            self.send_json({'error': "Missing or invalid access token"}, status=401)
+            return
+        if self.headers.get('Content-Type', '').split(';')[0].strip() != 'application/json':
+            self.send_json({'error': "Content-Type must be application/json"}, status=415)
+            return
+        match = re.match(r'^/api/([a-z-]+)$', self.path)
+        name = match.group(1) if match else None
+        if name not in READ_OPERATIONS and name not in WRITE_OPERATIONS:
+            self.send_json({'error': "Not found: " + self.path}, status=404)
+            return
+        rater_id = None
+        if name in RATER_OPERATIONS:
+            rater_id = self.server.sessions.rater(self.headers.get('X-Rater-Session', ''))
+            if rater_id is None:
+                self.send_json({'error': "Missing or expired session, please log in again"}, status=401)
+                return
+        try:
+            args = json.loads(body.decode('utf-8'))
+            if not isinstance(args, dict):
+                raise ValueError("Arguments must be a JSON object")
+            if name in RATER_OPERATIONS:
+                args['raterId'] = rater_id
+            if name in READ_OPERATIONS:
+                result = self.server.pool.read(READ_OPERATIONS[name], args)
+            else:
+                result = self.server.writer.write(WRITE_OPERATIONS[name], args)
+            if name == 'login' and result['row']:
+                result['session'] = self.server.sessions.create(result['row']['RaterId'])
+            self.send_json(result)
+        except (ValueError, sqlite3.Error) as e:
+            self.send_json({'error': str(e)})
+
+    def do_GET(self):
+        prefix = '/screenshots/'
+        url = urlsplit(self.path)
+        if not url.path.startswith(prefix):
+            self.send_error(404)
+            return
+        if not self.authorized(parse_qs(url.query).get('token', [None])[0]):
+            self.send_error(401)
+            return
+        base = self.server.base_dir
+        path = os.path.realpath(os.path.join(base, unquote(url.path[len(prefix):])))
+        if not path.startswith(base + os.sep) or not os.path.isfile(path):
+            self.send_error(404)
+            return
+        stat = os.stat(path)
+        etag = '"{:x}-{:x}"'.format(int(stat.st_mtime), stat.st_size)
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.send_response(200)
+        self.send_header('Content-Type', mimetypes.guess_type(path)[0] or 'application/octet-stream')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Cache-Control', 'private, max-age={:d}'.format(self.server.max_age))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class ScoringServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('database', nargs='?', help="SQLite database file")
+parser.add_argument('--host', default='127.0.0.1',
+                    help="Address to listen on, use 0.0.0.0 to accept connections from other hosts")
+parser.add_argument('--port', default=8080, type=int, help="Port to listen on")
+parser.add_argument('--token', default=os.environ.get('SCORING_SERVICE_TOKEN'),
+                    help="Access token of raters, a random token is generated and printed when not"
+                         " given by this option or the SCORING_SERVICE_TOKEN environment variable")
+parser.add_argument('--connections', default=4, type=int, help="Number of read-only database connections")
+parser.add_argument('--delay', default=10, type=int,
+                    help="Maximum time in ms to wait for more write requests before commit")
+parser.add_argument('--batch-size', default=100, type=int,
+                    help="Maximum number of write requests committed in one transaction")
+parser.add_argument('--max-age', default=86400, type=int, help="Time in s for which clients may cache screenshots")
+parser.add_argument('--check', action='store_true',
+                    help="Write scores and undo the last one like the app on a temporary database and exit")
+parser.add_argument('-v', '--verbose', default=0, action='count', help="Verbosity of output messages")
+args = parser.parse_args()
+
+if args.check:
+    check_writer(verbose=args.verbose)
+    sys.exit(0)
+if not args.database:
+    parser.error("the database argument is required")
+
+args.database = os.path.abspath(args.database)
+if not os.path.isfile(args.database):
+    raise Exception("Database file does not exist: " + args.database)
+
+if not args.token:
+    args.token = binascii.hexlify(os.urandom(16)).decode('ascii')
+    print("Access token: " + args.token)
+
+# concurrent readers and writer require write-ahead log
+con = connect(args.database)
+mode = con.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+if mode.lower() != 'wal':
+    raise Exception("Failed to enable WAL mode of database, journal mode is " + mode)
+con.close()
+
+writer = Writer(args.database, delay=(args.delay / 1000.), batch_size=args.batch_size, verbose=args.verbose)
+writer.start()
+
+server = ScoringServer((args.host, args.port), RequestHandler)
+server.pool = ConnectionPool(args.database, args.connections)
+server.writer = writer
+server.token = args.token
+server.sessions = Sessions()
+server.base_dir = os.path.realpath(os.path.dirname(args.database))
+server.max_age = args.max_age
+server.verbose = args.verbose
+if args.verbose > 0:
+    print("Serving {} at http://{}:{:d}".format(args.database, args.host, args.port))
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    pass
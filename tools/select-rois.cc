@@ -14,8 +14,17 @@
 #include <sstream>
 #include <cstdlib>
 #include <ctime>
+#include <chrono>
+#include <fstream>
 #include <unordered_set>
-
+#include <cstdio>
+#include <cstdint>
+#include <cstring>
+#include <unistd.h>
+#include <thread>
+#include <atomic>
+
+#include <vtkVersionMacros.h>
 #include <vtkNew.h>
 #include <vtkSmartPointer.h>
 #include <vtkAppendPolyData.h>
@@ -24,7 +33,13 @@
 #include <vtkXMLPolyDataWriter.h>
 #include <vtkPolyData.h>
 #include <vtkCellLocator.h>
+#if VTK_MAJOR_VERSION > 9 || (VTK_MAJOR_VERSION == 9 && VTK_MINOR_VERSION >= 2)
+#  define HAVE_THREAD_SAFE_CELL_LOCATOR 1
+#  include <vtkStaticCellLocator.h>
+#endif
 #include <vtkPointLocator.h>
+#include <vtkStaticPointLocator.h>
+#include <vtkIdList.h>
 #include <vtkDataArray.h>
 #include <vtkFloatArray.h>
 #include <vtkIdTypeArray.h>
@@ -67,6 +82,146 @@ void PrintHelp(const char *name)
 
 int g_verbose = 0;
 
+/// Number of threads used for parallel loops, hardware concurrency if zero
+int g_threads = 0;
+
+// =============================================================================
+// Threading
+// =============================================================================
+
+// -----------------------------------------------------------------------------
+/// Consecutive blocks of index range [0, n) handed out to threads on demand
+///
+/// Threads whose blocks require less work, e.g., because points are masked
+/// out, thereby take more blocks than others.
+class BlockedRange
+{
+  atomic<vtkIdType> _next;
+  vtkIdType         _size;
+  vtkIdType         _block_size;
+
+public:
+
+  BlockedRange(vtkIdType n, vtkIdType block_size = 1024)
+  :
+    _next(0), _size(n), _block_size(max(block_size, vtkIdType(1)))
+  {}
+
+  vtkIdType NumberOfBlocks() const
+  {
+    return (_size + _block_size - 1) / _block_size;
+  }
+
+  bool Next(vtkIdType &begin, vtkIdType &end)
+  {
+    const vtkIdType block = _next++;
+    begin = block * _block_size;
+    end   = min(_size, begin + _block_size);
+    return begin < end;
+  }
+};
+
+// -----------------------------------------------------------------------------
+/// Number of threads to use for given number of work items
+int NumberOfThreads(vtkIdType n)
+{
+  int nthreads = g_threads;
+  if (nthreads <= 0) nthreads = static_cast<int>(thread::hardware_concurrency());
+  if (nthreads <= 0) nthreads = 1;
+  if (static_cast<vtkIdType>(nthreads) > n) nthreads = static_cast<int>(max(n, vtkIdType(1)));
+  return nthreads;
+}
+
+// -----------------------------------------------------------------------------
+/// Execute body() in the given number of threads, in the calling thread if one
+template <class Body>
+void RunThreads(int nthreads, Body body)
+{
+  if (nthreads <= 1) {
+    body();
+    return;
+  }
+  Array<thread> threads;
+  threads.reserve(nthreads);
+  for (int t = 0; t < nthreads; ++t) {
+    threads.emplace_back(body);
+  }
+  for (auto &t : threads) {
+    t.join();
+  }
+}
+
+// =============================================================================
+// Timing
+// =============================================================================
+
+// -----------------------------------------------------------------------------
+struct PhaseTiming
+{
+  string name;
+  double wall; // seconds
+  double cpu;  // seconds
+};
+
+Array<PhaseTiming> g_timings;
+
+// -----------------------------------------------------------------------------
+/// Measure wall and CPU time of a named phase, accumulated in g_timings
+class PhaseTimer
+{
+  string                           _name;
+  chrono::steady_clock::time_point _wall;
+  clock_t                          _cpu;
+  bool                             _active;
+
+public:
+
+  PhaseTimer(const char *name) : _active(false) { Start(name); }
+  ~PhaseTimer() { Stop(); }
+
+  void Start(const char *name)
+  {
+    _name   = name;
+    _wall   = chrono::steady_clock::now();
+    _cpu    = clock();
+    _active = true;
+  }
+
+  void Stop()
+  {
+    if (!_active) return;
+    const double wall = chrono::duration<double>(chrono::steady_clock::now() - _wall).count();
+    const double cpu  = static_cast<double>(clock() - _cpu) / CLOCKS_PER_SEC;
+    _active = false;
+    for (auto &timing : g_timings) {
+      if (timing.name == _name) {
+        timing.wall += wall;
+        timing.cpu  += cpu;
+        return;
+      }
+    }
+    g_timings.push_back(PhaseTiming{_name, wall, cpu});
+  }
+
+  void Next(const char *name)
+  {
+    Stop();
+    Start(name);
+  }
+};
+
+// -----------------------------------------------------------------------------
+bool WriteTimings(const char *name)
+{
+  ofstream ofs(name);
+  if (!ofs) return false;
+  ofs << "Phase,WallTime,CPUTime\n";
+  for (const auto &timing : g_timings) {
+    ofs << timing.name << "," << timing.wall << "," << timing.cpu << "\n";
+  }
+  return !ofs.fail();
+}
+
 // =============================================================================
 // Auxiliaries
 // =============================================================================
@@ -80,8 +235,9 @@ struct Cluster
   float     center[3];
   float     total;
   char      view; // 'A': axial, 'C': coronal, 'S': sagittal
+  vtkIdType first;  // position of first member in ClusterMembers, -1 if none
 
-  Cluster() : label(-1), seed(-1), size(0), center{0.f, 0.f, 0.f}, total(0.f), view(0) {}
+  Cluster() : label(-1), seed(-1), size(0), center{0.f, 0.f, 0.f}, total(0.f), view(0), first(-1) {}
 
   bool operator <(const Cluster &rhs) const
   {
@@ -154,24 +310,109 @@ void Print(vtkPolyData *surface, vtkPolyData *reference,
 // Point distances
 // =============================================================================
 
+// -----------------------------------------------------------------------------
+/// Compressed sparse row (CSR) representation of the point adjacency of a mesh
+///
+/// The neighbors of a point are the points of all cells it belongs to,
+/// including the point itself. Points which are not part of any cell have no
+/// neighbors. The neighbors of point ptId are indices[offsets[ptId]] up to,
+/// but excluding, indices[offsets[ptId + 1]].
+struct PointAdjacency
+{
+  Array<vtkIdType> offsets;
+  Array<vtkIdType> indices;
+
+  bool Empty() const
+  {
+    return offsets.empty();
+  }
+
+  vtkIdType Begin(vtkIdType ptId) const
+  {
+    return offsets[ptId];
+  }
+
+  vtkIdType End(vtkIdType ptId) const
+  {
+    return offsets[ptId + 1];
+  }
+
+  /// Build point adjacency from the vertices, lines, polygons, and strips of
+  /// the mesh. The cell arrays are traversed directly, such that cells which
+  /// were added after the links were built are included as well.
+  void Initialize(vtkPolyData *mesh)
+  {
+    vtkCellArray * const cells[4] = {
+      mesh->GetVerts(), mesh->GetLines(), mesh->GetPolys(), mesh->GetStrips()
+    };
+    const vtkIdType n = mesh->GetNumberOfPoints();
+    vtkIdType npts, *pts;
+
+    // Count (possibly duplicate) neighbors of each point
+    offsets.assign(static_cast<size_t>(n + 1), 0);
+    for (auto arr : cells) {
+      if (arr == nullptr) continue;
+      arr->InitTraversal();
+      while (arr->GetNextCell(npts, pts)) {
+        for (vtkIdType i = 0; i < npts; ++i) {
+          offsets[pts[i] + 1] += npts;
+        }
+      }
+    }
+    for (vtkIdType ptId = 0; ptId < n; ++ptId) {
+      offsets[ptId + 1] += offsets[ptId];
+    }
+
+    // Insert points of each cell into the rows of its points
+    Array<vtkIdType> next(offsets.begin(), offsets.end() - 1);
+    indices.resize(static_cast<size_t>(offsets[n]));
+    for (auto arr : cells) {
+      if (arr == nullptr) continue;
+      arr->InitTraversal();
+      while (arr->GetNextCell(npts, pts)) {
+        for (vtkIdType i = 0; i < npts; ++i) {
+          for (vtkIdType j = 0; j < npts; ++j) {
+            indices[next[pts[i]]++] = pts[j];
+          }
+        }
+      }
+    }
+
+    // Remove duplicate neighbors and compact rows
+    vtkIdType pos = 0;
+    for (vtkIdType ptId = 0; ptId < n; ++ptId) {
+      const auto begin = indices.begin() + offsets[ptId];
+      auto end = indices.begin() + offsets[ptId + 1];
+      sort(begin, end);
+      end = unique(begin, end);
+      offsets[ptId] = pos;
+      for (auto it = begin; it != end; ++it, ++pos) {
+        indices[pos] = *it;
+      }
+    }
+    offsets[n] = pos;
+    indices.resize(static_cast<size_t>(pos));
+    indices.shrink_to_fit();
+  }
+};
+
+
 // -----------------------------------------------------------------------------
 vtkSmartPointer<vtkDataArray>
 CellMaskToPointData(vtkPolyData *mesh, vtkSmartPointer<vtkDataArray> mask)
 {
-  unsigned short ncells;
-  vtkIdType *cells;
+  vtkIdType npts, *pts;
   vtkSmartPointer<vtkDataArray> output;
   output.TakeReference(mask->NewInstance());
   output->SetName(mask->GetName());
   output->SetNumberOfComponents(1);
   output->SetNumberOfTuples(mesh->GetNumberOfPoints());
-  for (vtkIdType ptId = 0; ptId < mesh->GetNumberOfPoints(); ++ptId) {
-    mesh->GetPointCells(ptId, ncells, cells);
-    output->SetComponent(ptId, 0, 0.);
-    for (unsigned short i = 0; i < ncells; ++i) {
-      if (mask->GetComponent(cells[i], 0) != 0.) {
-        output->SetComponent(ptId, 0, 1.);
-        break;
+  output->FillComponent(0, 0.);
+  for (vtkIdType cellId = 0; cellId < mesh->GetNumberOfCells(); ++cellId) {
+    if (mask->GetComponent(cellId, 0) != 0.) {
+      mesh->GetCellPoints(cellId, npts, pts);
+      for (vtkIdType i = 0; i < npts; ++i) {
+        output->SetComponent(pts[i], 0, 1.);
       }
     }
   }
@@ -180,44 +421,46 @@ CellMaskToPointData(vtkPolyData *mesh, vtkSmartPointer<vtkDataArray> mask)
 
 
 // -----------------------------------------------------------------------------
+/// Erode point mask by setting points with a masked out neighbor to zero
+///
+/// The first iteration visits all points, and sets points without adjacent
+/// cells to one. Subsequent iterations only visit the neighbors of the points
+/// which were set to zero by the previous iteration.
 vtkSmartPointer<vtkUnsignedCharArray>
-ErodePointMask(vtkPolyData *mesh, vtkSmartPointer<vtkUnsignedCharArray> mask, int niter)
+ErodePointMask(const PointAdjacency &adjacency, vtkSmartPointer<vtkUnsignedCharArray> mask, int niter)
 {
   vtkSmartPointer<vtkUnsignedCharArray> output = mask;
   if (mask && niter > 1) {
-    unsigned short ncells;
-    vtkIdType npts, *pts, *cells;
-    vtkSmartPointer<vtkUnsignedCharArray> input = mask;
+    const vtkIdType n = mask->GetNumberOfTuples();
     output.TakeReference(mask->NewInstance());
     output->SetNumberOfComponents(1);
-    output->SetNumberOfTuples(mask->GetNumberOfTuples());
+    output->SetNumberOfTuples(n);
     output->SetName(mask->GetName());
-    for (int iter = 0; iter < niter; ++iter) {
-      if (iter == 1) {
-        input = output;
-        output.TakeReference(input->NewInstance());
-        output->SetNumberOfComponents(1);
-        output->SetNumberOfTuples(input->GetNumberOfTuples());
-        output->SetName(input->GetName());
-      } else if (iter > 1) {
-        vtkSmartPointer<vtkUnsignedCharArray> buffer = input;
-        input  = output;
-        output = buffer;
+    const unsigned char * const input = mask->GetPointer(0);
+    unsigned char * const value = output->GetPointer(0);
+    Array<vtkIdType> front, next;
+    for (vtkIdType ptId = 0; ptId < n; ++ptId) {
+      value[ptId] = 1;
+      for (vtkIdType i = adjacency.Begin(ptId); i < adjacency.End(ptId); ++i) {
+        if (input[adjacency.indices[i]] == 0) {
+          value[ptId] = 0;
+          if (input[ptId] != 0) front.push_back(ptId);
+          break;
+        }
       }
-      for (vtkIdType ptId = 0; ptId < mesh->GetNumberOfPoints(); ++ptId) {
-        output->SetValue(ptId, 1);
-        mesh->GetPointCells(ptId, ncells, cells);
-        for (unsigned short i = 0; i < ncells; ++i) {
-          mesh->GetCellPoints(cells[i], npts, pts);
-          for (vtkIdType j = 0; j < npts; ++j) {
-            if (input->GetValue(pts[j]) == 0) {
-              output->SetValue(ptId, 0);
-              i = ncells;
-              break;
-            }
+    }
+    for (int iter = 1; iter < niter && !front.empty(); ++iter) {
+      next.clear();
+      for (auto ptId : front) {
+        for (vtkIdType i = adjacency.Begin(ptId); i < adjacency.End(ptId); ++i) {
+          const vtkIdType nbrId = adjacency.indices[i];
+          if (value[nbrId] != 0) {
+            value[nbrId] = 0;
+            next.push_back(nbrId);
           }
         }
       }
+      front.swap(next);
     }
   }
   return output;
@@ -225,7 +468,8 @@ ErodePointMask(vtkPolyData *mesh, vtkSmartPointer<vtkUnsignedCharArray> mask, in
 
 
 // -----------------------------------------------------------------------------
-vtkSmartPointer<vtkUnsignedCharArray> PointMask(vtkPolyData *mesh, const char *name, int erode = 0)
+vtkSmartPointer<vtkUnsignedCharArray> PointMask(vtkPolyData *mesh, const char *name, int erode = 0,
+                                                PointAdjacency *adjacency = nullptr)
 {
   vtkSmartPointer<vtkDataArray> mask;
   if (name) {
@@ -246,7 +490,13 @@ vtkSmartPointer<vtkUnsignedCharArray> PointMask(vtkPolyData *mesh, const char *n
     output->CopyComponentNames(mask);
     output->SetName(mask->GetName());
   }
-  return ErodePointMask(mesh, output, erode);
+  if (output && erode > 1) {
+    PointAdjacency local;
+    if (adjacency == nullptr) adjacency = &local;
+    if (adjacency->Empty()) adjacency->Initialize(mesh);
+    output = ErodePointMask(*adjacency, output, erode);
+  }
+  return output;
 }
 
 
@@ -262,34 +512,259 @@ PointToSurfaceDistances(vtkSmartPointer<vtkPolyData>  surface,
   dists->SetNumberOfComponents(1);
   dists->SetNumberOfTuples(surface->GetNumberOfPoints());
 
-  vtkNew<vtkCellLocator> locator;
-  locator->SetDataSet(reference);
-  locator->SetNumberOfCellsPerBucket(10);
-  locator->BuildLocator();
-
-  double p[3], q[3], dist2;
-  vtkNew<vtkGenericCell> cell;
-  vtkIdType cellId;
-  int subId;
-
+  // Skip masked out points before any locator query
+  float * const d = dists->GetPointer(0);
+  Array<vtkIdType> ptIds;
+  ptIds.reserve(surface->GetNumberOfPoints());
   for (vtkIdType ptId = 0; ptId < surface->GetNumberOfPoints(); ++ptId) {
     if (mask && mask->GetValue(ptId) == 0) {
-      dists->SetValue(ptId, 0.f);
+      d[ptId] = 0.f;
     } else {
-      surface->GetPoint(ptId, p);
-      locator->FindClosestPoint(p, q, cell.GetPointer(), cellId, subId, dist2);
-      dists->SetValue(ptId, static_cast<float>(sqrt(dist2)));
+      ptIds.push_back(ptId);
     }
   }
 
+  // The cells and links of the reference mesh are built in main before, and
+  // its bounds here, such that concurrent GetCell and GetBounds calls only read.
+  reference->ComputeBounds();
+
+  // Since VTK 9.2, FindClosestPoint of a static cell locator is thread-safe
+  // when each thread uses its own generic cell. Before, it is not thread-safe,
+  // and each thread builds its own locator instead.
+#if HAVE_THREAD_SAFE_CELL_LOCATOR
+  vtkNew<vtkStaticCellLocator> locator;
+  locator->SetDataSet(reference);
+  locator->SetNumberOfCellsPerBucket(10);
+  locator->BuildLocator();
+#endif
+
+  BlockedRange range(static_cast<vtkIdType>(ptIds.size()));
+  RunThreads(NumberOfThreads(range.NumberOfBlocks()), [&]() {
+#if !HAVE_THREAD_SAFE_CELL_LOCATOR
+    vtkNew<vtkCellLocator> locator;
+    locator->SetDataSet(reference);
+    locator->SetNumberOfCellsPerBucket(10);
+    locator->BuildLocator();
+#endif
+
+    double p[3], q[3], dist2;
+    vtkNew<vtkGenericCell> cell;
+    vtkIdType begin, end, cellId;
+    int subId;
+
+    while (range.Next(begin, end)) {
+      for (vtkIdType i = begin; i < end; ++i) {
+        surface->GetPoint(ptIds[i], p);
+        locator->FindClosestPoint(p, q, cell.GetPointer(), cellId, subId, dist2);
+        d[ptIds[i]] = static_cast<float>(sqrt(dist2));
+      }
+    }
+  });
+
   return dists;
 }
 
 
+// =============================================================================
+// Distance cache
+// =============================================================================
+
+/// Point masks and point-to-surface distances of a pair of surfaces
+///
+/// The mask of the second surface and its distances to the first surface are
+/// only computed and cached for the joint clustering of both surfaces.
+struct DistanceCache
+{
+  vtkSmartPointer<vtkUnsignedCharArray> mask1;
+  vtkSmartPointer<vtkUnsignedCharArray> mask2;
+  vtkSmartPointer<vtkFloatArray>        dist12;
+  vtkSmartPointer<vtkFloatArray>        dist21;
+};
+
+const char     CACHE_MAGIC[8] = {'S', 'R', 'D', 'C', 'A', 'C', 'H', 'E'};
+const uint32_t CACHE_VERSION  = 2;
+const uint32_t CACHE_MASK1    = 1;
+const uint32_t CACHE_DIST21   = 2;
+const uint32_t CACHE_MASK2    = 4;
+
+// -----------------------------------------------------------------------------
+/// 64-bit FNV-1a hash of a sequence of bytes
+uint64_t FNV1a(const void *data, size_t size, uint64_t hash = 14695981039346656037ULL)
+{
+  const unsigned char *bytes = static_cast<const unsigned char *>(data);
+  for (size_t i = 0; i < size; ++i) {
+    hash ^= bytes[i];
+    hash *= 1099511628211ULL;
+  }
+  return hash;
+}
+
+// -----------------------------------------------------------------------------
+/// Hash of point coordinates and polygon connectivity of a surface mesh
+uint64_t MeshHash(vtkPolyData *mesh, uint64_t hash = 14695981039346656037ULL)
+{
+  vtkDataArray * const points = mesh->GetPoints()->GetData();
+  const int type = points->GetDataType();
+  hash = FNV1a(&type, sizeof(type), hash);
+  hash = FNV1a(points->GetVoidPointer(0), points->GetNumberOfTuples() * points->GetNumberOfComponents() * points->GetDataTypeSize(), hash);
+  vtkIdTypeArray * const polys = mesh->GetPolys()->GetData();
+  hash = FNV1a(polys->GetVoidPointer(0), polys->GetNumberOfTuples() * sizeof(vtkIdType), hash);
+  return hash;
+}
+
+// -----------------------------------------------------------------------------
+/// Hash of values of point or cell data array of mask with given name
+uint64_t MaskHash(vtkPolyData *mesh, const char *name, uint64_t hash)
+{
+  int location = 0;
+  vtkDataArray *mask = mesh->GetPointData()->GetArray(name);
+  if (mask == nullptr) {
+    mask = mesh->GetCellData()->GetArray(name);
+    location = 1;
+  }
+  if (mask == nullptr) return hash;
+  const int type = mask->GetDataType();
+  const vtkIdType n = mask->GetNumberOfTuples();
+  const int m = mask->GetNumberOfComponents();
+  hash = FNV1a(&location, sizeof(location), hash);
+  hash = FNV1a(&type, sizeof(type), hash);
+  hash = FNV1a(&n, sizeof(n), hash);
+  hash = FNV1a(&m, sizeof(m), hash);
+  return FNV1a(mask->GetVoidPointer(0), n * m * mask->GetDataTypeSize(), hash);
+}
+
+// -----------------------------------------------------------------------------
+/// Name of cache file of given surfaces and point mask parameters
+///
+/// The hash includes the mask values, because the mask of a surface mesh may be
+/// edited or regenerated, e.g., by tools/add-cortex-mask.py. The mask of the
+/// second surface is only used, and hence only hashed, for joint clustering.
+string CacheFileName(const char *dir, vtkPolyData *surface1, vtkPolyData *surface2,
+                     const char *mask_name, int erode_mask, bool jointly)
+{
+  uint64_t hash = MeshHash(surface1);
+  hash = MeshHash(surface2, hash);
+  if (mask_name) {
+    hash = FNV1a(mask_name, strlen(mask_name), hash);
+    hash = FNV1a(&erode_mask, sizeof(erode_mask), hash);
+    hash = MaskHash(surface1, mask_name, hash);
+    if (jointly) hash = MaskHash(surface2, mask_name, hash);
+  }
+  ostringstream name;
+  name << dir << "/select-rois-";
+  name.fill('0');
+  name.width(16);
+  name << hex << hash << ".bin";
+  return name.str();
+}
+
+// -----------------------------------------------------------------------------
+/// Read point masks and distances from cache file
+///
+/// \returns Whether cache file exists and matches the given number of points.
+///           On success, mask2 and dist21 are only set when stored in the cache file.
+bool ReadCache(const string &name, vtkIdType n1, vtkIdType n2, const char *mask_name, DistanceCache &cache)
+{
+  ifstream ifs(name.c_str(), ios::binary);
+  if (!ifs) return false;
+  char magic[8];
+  uint32_t version, flags;
+  int64_t npts1, npts2;
+  ifs.read(magic, sizeof(magic));
+  ifs.read(reinterpret_cast<char *>(&version), sizeof(version));
+  ifs.read(reinterpret_cast<char *>(&flags), sizeof(flags));
+  ifs.read(reinterpret_cast<char *>(&npts1), sizeof(npts1));
+  ifs.read(reinterpret_cast<char *>(&npts2), sizeof(npts2));
+  if (!ifs || !equal(magic, magic + 8, CACHE_MAGIC) || version != CACHE_VERSION) return false;
+  if (npts1 != n1 || npts2 != n2) return false;
+  if (((flags & CACHE_MASK1) != 0) != (mask_name != nullptr)) return false;
+  DistanceCache result;
+  if (flags & CACHE_MASK1) {
+    result.mask1 = vtkSmartPointer<vtkUnsignedCharArray>::New();
+    result.mask1->SetName(mask_name);
+    result.mask1->SetNumberOfComponents(1);
+    result.mask1->SetNumberOfTuples(n1);
+    ifs.read(reinterpret_cast<char *>(result.mask1->GetPointer(0)), n1);
+  }
+  if (flags & CACHE_MASK2) {
+    result.mask2 = vtkSmartPointer<vtkUnsignedCharArray>::New();
+    result.mask2->SetName(mask_name);
+    result.mask2->SetNumberOfComponents(1);
+    result.mask2->SetNumberOfTuples(n2);
+    ifs.read(reinterpret_cast<char *>(result.mask2->GetPointer(0)), n2);
+  }
+  result.dist12 = vtkSmartPointer<vtkFloatArray>::New();
+  result.dist12->SetName("Distance");
+  result.dist12->SetNumberOfComponents(1);
+  result.dist12->SetNumberOfTuples(n1);
+  ifs.read(reinterpret_cast<char *>(result.dist12->GetPointer(0)), n1 * sizeof(float));
+  if (flags & CACHE_DIST21) {
+    result.dist21 = vtkSmartPointer<vtkFloatArray>::New();
+    result.dist21->SetName("Distance");
+    result.dist21->SetNumberOfComponents(1);
+    result.dist21->SetNumberOfTuples(n2);
+    ifs.read(reinterpret_cast<char *>(result.dist21->GetPointer(0)), n2 * sizeof(float));
+  }
+  if (!ifs) return false;
+  cache = result;
+  return true;
+}
+
+// -----------------------------------------------------------------------------
+/// Write point masks and distances to cache file
+///
+/// The file is first written to a temporary file which is then renamed, such
+/// that concurrent processes never read an incomplete cache file.
+bool WriteCache(const string &name, vtkIdType n1, vtkIdType n2, const DistanceCache &cache)
+{
+  uint32_t flags = 0;
+  if (cache.mask1) flags |= CACHE_MASK1;
+  if (cache.mask2) flags |= CACHE_MASK2;
+  if (cache.dist21) flags |= CACHE_DIST21;
+  const int64_t npts1 = n1, npts2 = n2;
+  ostringstream tmp_name;
+  tmp_name << name << "." << getpid() << ".tmp";
+  {
+    ofstream ofs(tmp_name.str().c_str(), ios::binary);
+    if (!ofs) return false;
+    ofs.write(CACHE_MAGIC, sizeof(CACHE_MAGIC));
+    ofs.write(reinterpret_cast<const char *>(&CACHE_VERSION), sizeof(CACHE_VERSION));
+    ofs.write(reinterpret_cast<const char *>(&flags), sizeof(flags));
+    ofs.write(reinterpret_cast<const char *>(&npts1), sizeof(npts1));
+    ofs.write(reinterpret_cast<const char *>(&npts2), sizeof(npts2));
+    if (flags & CACHE_MASK1) {
+      ofs.write(reinterpret_cast<const char *>(cache.mask1->GetPointer(0)), n1);
+    }
+    if (flags & CACHE_MASK2) {
+      ofs.write(reinterpret_cast<const char *>(cache.mask2->GetPointer(0)), n2);
+    }
+    ofs.write(reinterpret_cast<const char *>(cache.dist12->GetPointer(0)), n1 * sizeof(float));
+    if (flags & CACHE_DIST21) {
+      ofs.write(reinterpret_cast<const char *>(cache.dist21->GetPointer(0)), n2 * sizeof(float));
+    }
+    if (!ofs) {
+      ofs.close();
+      remove(tmp_name.str().c_str());
+      return false;
+    }
+  }
+  if (rename(tmp_name.str().c_str(), name.c_str()) != 0) {
+    remove(tmp_name.str().c_str());
+    return false;
+  }
+  return true;
+}
+
+
 // =============================================================================
 // Clustering
 // =============================================================================
 
+// -----------------------------------------------------------------------------
+/// IDs of the points of each cluster, where the cluster.size members of a
+/// cluster are stored contiguously starting at position cluster.first
+typedef Array<vtkIdType> ClusterMembers;
+
 // -----------------------------------------------------------------------------
 struct CompareDistances
 {
@@ -336,14 +811,13 @@ vtkIdType NextSeed(Array<vtkIdType> &seeds, vtkFloatArray *dists, vtkIdTypeArray
 
 
 // -----------------------------------------------------------------------------
-vtkIdType GrowCluster(vtkPolyData *mesh, vtkIdType seed,
+vtkIdType GrowCluster(vtkPolyData *mesh, const PointAdjacency &adjacency, vtkIdType seed,
                       vtkIdType label, float center[3], float &total,
                       vtkFloatArray *dists, vtkIdTypeArray *labels,
-                      float threshold)
+                      float threshold, ClusterMembers &members)
 {
   double p[3];
-  unsigned short ncells;
-  vtkIdType ptId, npts, *pts, *cells, size = 0;
+  vtkIdType ptId, nbrId, size = 0;
   Queue<vtkIdType> active;
   active.push(seed);
   center[0] = center[1] = center[2] = total = 0.f;
@@ -353,18 +827,16 @@ vtkIdType GrowCluster(vtkPolyData *mesh, vtkIdType seed,
     if (labels->GetValue(ptId) != label) {
       ++size;
       labels->SetValue(ptId, label);
+      members.push_back(ptId);
       mesh->GetPoint(ptId, p);
       center[0] += static_cast<float>(p[0]);
       center[1] += static_cast<float>(p[1]);
       center[2] += static_cast<float>(p[2]);
       total += dists->GetValue(ptId);
-      mesh->GetPointCells(ptId, ncells, cells);
-      for (unsigned short i = 0; i < ncells; ++i) {
-        mesh->GetCellPoints(cells[i], npts, pts);
-        for (vtkIdType j = 0; j < npts; ++j) {
-          if (labels->GetValue(pts[j]) == -1 && dists->GetValue(pts[j]) >= threshold) {
-            active.push(pts[j]);
-          }
+      for (vtkIdType i = adjacency.Begin(ptId); i < adjacency.End(ptId); ++i) {
+        nbrId = adjacency.indices[i];
+        if (labels->GetValue(nbrId) == -1 && dists->GetValue(nbrId) >= threshold) {
+          active.push(nbrId);
         }
       }
     }
@@ -379,18 +851,20 @@ vtkIdType GrowCluster(vtkPolyData *mesh, vtkIdType seed,
 
 
 // -----------------------------------------------------------------------------
-void DiscardCluster(vtkIdTypeArray *labels, vtkIdType label)
+void DiscardCluster(vtkIdTypeArray *labels, const ClusterMembers &members, const Cluster &cluster)
 {
-  if (label != 0) {
-    for (vtkIdType i = 0; i < labels->GetNumberOfTuples(); ++i) {
-      if (labels->GetValue(i) == label) labels->SetValue(i, 0);
+  if (cluster.first >= 0) {
+    for (vtkIdType i = cluster.first; i < cluster.first + cluster.size; ++i) {
+      labels->SetValue(members[i], 0);
     }
   }
 }
 
 
 // -----------------------------------------------------------------------------
-Array<Cluster> DistantClusters(vtkSmartPointer<vtkPolyData> surface,
+Array<Cluster> DistantClusters(ClusterMembers &members,
+                               vtkSmartPointer<vtkPolyData> surface,
+                               const PointAdjacency &adjacency,
                                vtkSmartPointer<vtkFloatArray> dists,
                                vtkSmartPointer<vtkIdTypeArray> labels,
                                vtkIdType min_size, float min_seed_dist,
@@ -443,10 +917,13 @@ Array<Cluster> DistantClusters(vtkSmartPointer<vtkPolyData> surface,
   Array<Cluster> clusters;
   Cluster cluster;
   cluster.label = start_label;
+  members.clear();
   while ((cluster.seed = NextSeed(seeds, dists, labels, min_seed_dist)) != -1) {
-    cluster.size = GrowCluster(surface, cluster.seed, cluster.label, cluster.center, cluster.total, dists, labels, threshold);
+    cluster.first = static_cast<vtkIdType>(members.size());
+    cluster.size = GrowCluster(surface, adjacency, cluster.seed, cluster.label, cluster.center, cluster.total, dists, labels, threshold, members);
     if (cluster.size < min_size) {
-      DiscardCluster(labels, cluster.label);
+      DiscardCluster(labels, members, cluster);
+      members.resize(static_cast<size_t>(cluster.first));
     } else {
       clusters.push_back(move(cluster));
       ++cluster.label;
@@ -459,17 +936,41 @@ Array<Cluster> DistantClusters(vtkSmartPointer<vtkPolyData> surface,
 
 // -----------------------------------------------------------------------------
 vtkSmartPointer<vtkPolyData>
-FirstClusters(Array<Cluster> &clusters,
+FirstClusters(Array<Cluster> &clusters, ClusterMembers &members,
               vtkSmartPointer<vtkPolyData> surface,
               vtkSmartPointer<vtkPolyData> reference,
               vtkIdType min_size, float min_seed_dist,
               float min_threshold, int dists_percentile = 0,
               const char *mask_name = nullptr,
               int erode_mask = 0,
+              const char *cache_dir = nullptr,
               vtkIdType start_label = 1)
 {
-  vtkSmartPointer<vtkUnsignedCharArray> mask = PointMask(surface, mask_name, erode_mask);
-  vtkSmartPointer<vtkFloatArray> dists = PointToSurfaceDistances(surface, reference, mask);
+  PhaseTimer timer("cache");
+  PointAdjacency adjacency;
+  DistanceCache cache;
+  string cache_name;
+  if (cache_dir) {
+    cache_name = CacheFileName(cache_dir, surface, reference, mask_name, erode_mask, false);
+    ReadCache(cache_name, surface->GetNumberOfPoints(), reference->GetNumberOfPoints(), mask_name, cache);
+  }
+  if (!cache.dist12) {
+    timer.Next("mask");
+    cache.mask1 = PointMask(surface, mask_name, erode_mask, &adjacency);
+    timer.Next("distances");
+    cache.dist12 = PointToSurfaceDistances(surface, reference, cache.mask1);
+    if (cache_dir) {
+      timer.Next("cache");
+      if (!WriteCache(cache_name, surface->GetNumberOfPoints(), reference->GetNumberOfPoints(), cache)) {
+        cerr << "Warning: Failed to write distance cache file " << cache_name << endl;
+      }
+    }
+  } else if (g_verbose) {
+    cerr << "Read point masks and distances from " << cache_name << endl;
+  }
+  vtkSmartPointer<vtkUnsignedCharArray> mask = cache.mask1;
+  vtkSmartPointer<vtkFloatArray> dists = cache.dist12;
+  timer.Next("clustering");
 
   vtkSmartPointer<vtkIdTypeArray> labels;
   labels = vtkSmartPointer<vtkIdTypeArray>::New();
@@ -480,27 +981,55 @@ FirstClusters(Array<Cluster> &clusters,
   pd->AddArray(labels);
   if (mask && !pd->HasArray(mask_name)) pd->AddArray(mask);
 
-  clusters = DistantClusters(surface, dists, labels, min_size, min_seed_dist, min_threshold, dists_percentile, start_label);
+  if (adjacency.Empty()) adjacency.Initialize(surface);
+  clusters = DistantClusters(members, surface, adjacency, dists, labels, min_size, min_seed_dist, min_threshold, dists_percentile, start_label);
   return surface;
 }
 
 
 // -----------------------------------------------------------------------------
 vtkSmartPointer<vtkPolyData>
-JointClusters(Array<Cluster> &clusters,
+JointClusters(Array<Cluster> &clusters, ClusterMembers &members,
               vtkSmartPointer<vtkPolyData> surface1,
               vtkSmartPointer<vtkPolyData> surface2,
               vtkIdType min_size, float min_seed_dist,
               float min_threshold, int dists_percentile = 0,
               const char *mask_name = nullptr,
               int erode_mask = 0,
+              const char *cache_dir = nullptr,
               vtkIdType start_label = 1)
 {
-  vtkSmartPointer<vtkUnsignedCharArray> mask1 = PointMask(surface1, mask_name, erode_mask);
-  vtkSmartPointer<vtkUnsignedCharArray> mask2 = PointMask(surface2, mask_name, erode_mask);
+  PhaseTimer timer("cache");
+  DistanceCache cache;
+  string cache_name;
+  if (cache_dir) {
+    cache_name = CacheFileName(cache_dir, surface1, surface2, mask_name, erode_mask, true);
+    ReadCache(cache_name, surface1->GetNumberOfPoints(), surface2->GetNumberOfPoints(), mask_name, cache);
+  }
+  if (!cache.dist12 || !cache.dist21 || (mask_name && !cache.mask2)) {
+    timer.Next("mask");
+    cache.mask1 = PointMask(surface1, mask_name, erode_mask);
+    cache.mask2 = PointMask(surface2, mask_name, erode_mask);
+
+    timer.Next("distances");
+    cache.dist12 = PointToSurfaceDistances(surface1, surface2, cache.mask1);
+    cache.dist21 = PointToSurfaceDistances(surface2, surface1, cache.mask2);
+
+    if (cache_dir) {
+      timer.Next("cache");
+      if (!WriteCache(cache_name, surface1->GetNumberOfPoints(), surface2->GetNumberOfPoints(), cache)) {
+        cerr << "Warning: Failed to write distance cache file " << cache_name << endl;
+      }
+    }
+  } else if (g_verbose) {
+    cerr << "Read point masks and distances from " << cache_name << endl;
+  }
+  vtkSmartPointer<vtkUnsignedCharArray> mask1 = cache.mask1;
+  vtkSmartPointer<vtkUnsignedCharArray> mask2 = cache.mask2;
+  vtkSmartPointer<vtkFloatArray> dist12 = cache.dist12;
+  vtkSmartPointer<vtkFloatArray> dist21 = cache.dist21;
 
-  vtkSmartPointer<vtkFloatArray> dist12 = PointToSurfaceDistances(surface1, surface2, mask1);
-  vtkSmartPointer<vtkFloatArray> dist21 = PointToSurfaceDistances(surface2, surface1, mask2);
+  timer.Next("joint-mesh");
 
   vtkSmartPointer<vtkPolyData> submesh1;
   submesh1 = vtkSmartPointer<vtkPolyData>::New();
@@ -570,29 +1099,29 @@ JointClusters(Array<Cluster> &clusters,
   }
   lines->Squeeze();
 
+  timer.Next("clustering");
   vtkSmartPointer<vtkIdTypeArray> labels;
   labels = vtkSmartPointer<vtkIdTypeArray>::New();
   labels->SetName("ClusterId");
   mesh->GetPointData()->AddArray(labels);
 
-  clusters = DistantClusters(mesh, dists, labels, min_size, min_seed_dist,
+  PointAdjacency adjacency;
+  adjacency.Initialize(mesh);
+  clusters = DistantClusters(members, mesh, adjacency, dists, labels, min_size, min_seed_dist,
                              min_threshold, dists_percentile, start_label);
   return mesh;
 }
 
 
 // -----------------------------------------------------------------------------
-void Relabel(Array<Cluster> &clusters, vtkIdTypeArray *labels)
+void Relabel(Array<Cluster> &clusters, const ClusterMembers &members, vtkIdTypeArray *labels)
 {
-  vtkNew<vtkIdTypeArray> old_labels;
-  old_labels->DeepCopy(labels);
   vtkIdType new_label = 0;
   for (auto &&cluster : clusters) {
-    const auto old_label = cluster.label;
     cluster.label = ++new_label;
-    for (vtkIdType ptId = 0; ptId < labels->GetNumberOfTuples(); ++ptId) {
-      if (old_labels->GetValue(ptId) == old_label) {
-        labels->SetValue(ptId, new_label);
+    if (cluster.first >= 0) {
+      for (vtkIdType i = cluster.first; i < cluster.first + cluster.size; ++i) {
+        labels->SetValue(members[i], new_label);
       }
     }
   }
@@ -759,13 +1288,81 @@ float OverlapRatio(const Array<Cluster> &clusters, float span, float box[6])
 
 
 // -----------------------------------------------------------------------------
-Array<Cluster> ReduceClusters(const Array<Cluster> &clusters, float span, float max_overlap)
+/// Uniform grid of ROI centers used to find the ROIs which may overlap a box
+///
+/// The side length of the grid cells equals the ROI span. The bounding boxes
+/// of two ROIs can thus only intersect when their centers are in the same or
+/// in adjacent grid cells.
+class BoxGrid
+{
+  float                                     _span;
+  UnorderedMap<int64_t, Array<size_t> > _cells;
+
+  int64_t Index(float x) const
+  {
+    return static_cast<int64_t>(floor(x / _span));
+  }
+
+  int64_t Key(int64_t i, int64_t j, int64_t k) const
+  {
+    const int64_t mask = (int64_t(1) << 21) - 1;
+    return ((i & mask) << 42) | ((j & mask) << 21) | (k & mask);
+  }
+
+public:
+
+  BoxGrid(float span) : _span(span) {}
+
+  /// Insert index of ROI at given center point
+  void Insert(size_t index, const float center[3])
+  {
+    if (_span <= 0.f) return;
+    _cells[Key(Index(center[0]), Index(center[1]), Index(center[2]))].push_back(index);
+  }
+
+  /// Get ROIs whose bounding box may intersect the box at given center point
+  Array<Cluster> Neighbors(const Array<Cluster> &clusters, const float center[3]) const
+  {
+    Array<Cluster> neighbors;
+    if (_span <= 0.f) return neighbors;
+    const int64_t i = Index(center[0]);
+    const int64_t j = Index(center[1]);
+    const int64_t k = Index(center[2]);
+    for (int64_t di = -1; di <= 1; ++di)
+    for (int64_t dj = -1; dj <= 1; ++dj)
+    for (int64_t dk = -1; dk <= 1; ++dk) {
+      const auto cell = _cells.find(Key(i + di, j + dj, k + dk));
+      if (cell != _cells.end()) {
+        for (auto index : cell->second) {
+          neighbors.push_back(clusters[index]);
+        }
+      }
+    }
+    return neighbors;
+  }
+};
+
+
+// -----------------------------------------------------------------------------
+/// Overlap ratio of ROI at given center point with neighboring ROIs only
+float OverlapRatio(const Array<Cluster> &clusters, const BoxGrid &grid, float span, float center[3])
 {
   float box[6];
+  Bounds(center, span, box);
+  const Array<Cluster> neighbors = grid.Neighbors(clusters, center);
+  if (neighbors.empty()) return 0.f;
+  return OverlapRatio(neighbors, span, box);
+}
+
+
+// -----------------------------------------------------------------------------
+Array<Cluster> ReduceClusters(const Array<Cluster> &clusters, float span, float max_overlap)
+{
+  BoxGrid grid(span);
   Array<Cluster> selection;
   for (auto cluster : clusters) {
-    Bounds(cluster.center, span, box);
-    if (OverlapRatio(selection, span, box) <= max_overlap) {
+    if (OverlapRatio(selection, grid, span, cluster.center) <= max_overlap) {
+      grid.Insert(selection.size(), cluster.center);
       selection.push_back(move(cluster));
     }
   }
@@ -785,7 +1382,6 @@ void AppendRandomSamples(Array<Cluster> &clusters, vtkPolyData *mesh, int n,
                          float span = 0.f, float max_overlap = 1.f)
 {
   double p[3];
-  float roi[6];
 
   Cluster cluster;
   cluster.label = 0;
@@ -820,6 +1416,11 @@ void AppendRandomSamples(Array<Cluster> &clusters, vtkPolyData *mesh, int n,
   locator->SetNumberOfPointsPerBucket(10);
   locator->BuildLocator();
 
+  BoxGrid grid(span);
+  for (size_t i = 0; i < clusters.size(); ++i) {
+    grid.Insert(i, clusters[i].center);
+  }
+
   int m = 0;
   while (m < n) {
     sampler->Modified();
@@ -835,12 +1436,12 @@ void AppendRandomSamples(Array<Cluster> &clusters, vtkPolyData *mesh, int n,
         cluster.total = dists->GetValue(ptId + offset);
       }
       if (span > 0.f && max_overlap < 1.f) {
-        Bounds(cluster.center, span, roi);
-        if (OverlapRatio(clusters, span, roi) > max_overlap) {
+        if (OverlapRatio(clusters, grid, span, cluster.center) > max_overlap) {
           continue;
         }
       }
       cluster.seed = locator->FindClosestPoint(p) + offset;
+      grid.Insert(clusters.size(), cluster.center);
       clusters.push_back(cluster);
       ++k;
       if (m + k >= n) break;
@@ -885,16 +1486,19 @@ void RemoveDistantPoints(vtkPolyData *cut, mirtk::Point p, double maxd)
 {
   const double maxSqDist = maxd * maxd;
   mirtk::Point q;
-  cut->BuildCells();
-  cut->BuildLinks();
-  unsigned short ncells;
-  vtkIdType *cells;
+  Array<bool> distant(static_cast<size_t>(cut->GetNumberOfPoints()));
   for (vtkIdType ptId = 0; ptId < cut->GetNumberOfPoints(); ++ptId) {
     cut->GetPoint(ptId, q);
-    if (p.SquaredDistance(q) > maxSqDist) {
-      cut->GetPointCells(ptId, ncells, cells);
-      for (unsigned short i = 0; i < ncells; ++i) {
-        cut->DeleteCell(cells[i]);
+    distant[ptId] = (p.SquaredDistance(q) > maxSqDist);
+  }
+  cut->BuildCells();
+  vtkIdType npts, *pts;
+  for (vtkIdType cellId = 0; cellId < cut->GetNumberOfCells(); ++cellId) {
+    cut->GetCellPoints(cellId, npts, pts);
+    for (vtkIdType i = 0; i < npts; ++i) {
+      if (distant[pts[i]]) {
+        cut->DeleteCell(cellId);
+        break;
       }
     }
   }
@@ -902,6 +1506,63 @@ void RemoveDistantPoints(vtkPolyData *cut, mirtk::Point p, double maxd)
 }
 
 
+// -----------------------------------------------------------------------------
+/// Extract triangles whose points are all within distance maxd of point p
+///
+/// Unlike RemoveDistantPoints, this function only visits the cells of points
+/// found by the given locator of the surface points, and it does not modify
+/// the surface mesh. It can thus be called concurrently given that the links
+/// of the surface mesh were built before.
+vtkSmartPointer<vtkPolyData> Crop(vtkPolyData *surface, vtkStaticPointLocator *locator,
+                                  mirtk::Point p, double maxd)
+{
+  vtkNew<vtkIdList> ptIds;
+  locator->FindPointsWithinRadius(maxd, p, ptIds.GetPointer());
+
+  UnorderedMap<vtkIdType, vtkIdType> ptMap;
+  for (vtkIdType i = 0; i < ptIds->GetNumberOfIds(); ++i) {
+    ptMap[ptIds->GetId(i)] = -1;
+  }
+
+  vtkSmartPointer<vtkPoints> points = vtkSmartPointer<vtkPoints>::New();
+  vtkSmartPointer<vtkCellArray> polys = vtkSmartPointer<vtkCellArray>::New();
+  UnorderedSet<vtkIdType> visited;
+  unsigned short ncells;
+  vtkIdType npts, *pts, *cells, newPts[3];
+  double x[3];
+  for (vtkIdType i = 0; i < ptIds->GetNumberOfIds(); ++i) {
+    surface->GetPointCells(ptIds->GetId(i), ncells, cells);
+    for (unsigned short j = 0; j < ncells; ++j) {
+      if (!visited.insert(cells[j]).second) continue;
+      surface->GetCellPoints(cells[j], npts, pts);
+      if (npts != 3) continue;
+      bool inside = true;
+      for (vtkIdType k = 0; k < npts; ++k) {
+        if (ptMap.find(pts[k]) == ptMap.end()) {
+          inside = false;
+          break;
+        }
+      }
+      if (!inside) continue;
+      for (vtkIdType k = 0; k < npts; ++k) {
+        vtkIdType &ptId = ptMap[pts[k]];
+        if (ptId == -1) {
+          surface->GetPoint(pts[k], x);
+          ptId = points->InsertNextPoint(x);
+        }
+        newPts[k] = ptId;
+      }
+      polys->InsertNextCell(3, newPts);
+    }
+  }
+
+  vtkSmartPointer<vtkPolyData> output = vtkSmartPointer<vtkPolyData>::New();
+  output->SetPoints(points);
+  output->SetPolys(polys);
+  return output;
+}
+
+
 // -----------------------------------------------------------------------------
 vtkSmartPointer<vtkPolyData> Cut(vtkPolyData *surface, mirtk::Point p, mirtk::Vector3 n, double maxd = 0.)
 {
@@ -971,20 +1632,24 @@ vtkSmartPointer<vtkPolyData> Closed(vtkSmartPointer<vtkPolyData> cut)
 
 
 // -----------------------------------------------------------------------------
+/// Maximum distance of points of a to their closest point of b
+///
+/// The cuts of the surfaces near a cluster have few points only, such that an
+/// exhaustive search is faster than building a point locator for each cut.
 double MaxClosestPointDistance(vtkPolyData *a, vtkPolyData *b)
 {
-  double d = 0.;
+  double d = 0., dmin;
   mirtk::Point p, q;
-  vtkNew<vtkPointLocator> loc;
-  loc->SetDataSet(b);
-  loc->BuildLocator();
-  for (vtkIdType ptId = 0, otherId; ptId < a->GetNumberOfPoints(); ++ptId) {
+  for (vtkIdType ptId = 0; ptId < a->GetNumberOfPoints(); ++ptId) {
     a->GetPoint(ptId, p);
-    otherId = loc->FindClosestPoint(p);
-    b->GetPoint(otherId, q);
-    d = max(d, p.Distance(q));
+    dmin = inf;
+    for (vtkIdType otherId = 0; otherId < b->GetNumberOfPoints(); ++otherId) {
+      b->GetPoint(otherId, q);
+      dmin = min(dmin, p.SquaredDistance(q));
+    }
+    if (dmin < inf) d = max(d, dmin);
   }
-  return d;
+  return sqrt(d);
 }
 
 
@@ -1099,9 +1764,12 @@ Array<Loop> Loops(vtkPolyData *cut, Point p)
 
 
 // -----------------------------------------------------------------------------
-int BestSliceView(mirtk::Image &image, vtkPolyData *surface, vtkPolyData *reference, const Cluster &cluster)
+int BestSliceView(mirtk::Image &image,
+                  vtkPolyData *surface,   vtkStaticPointLocator *surface_locator,
+                  vtkPolyData *reference, vtkStaticPointLocator *reference_locator,
+                  const Cluster &cluster)
 {
-  vtkSmartPointer<vtkPolyData> cut[2];
+  vtkSmartPointer<vtkPolyData> crop[2], cut[2];
   Point p(cluster.center[0], cluster.center[1], cluster.center[2]);
   Vector3 n;
 
@@ -1115,13 +1783,19 @@ int BestSliceView(mirtk::Image &image, vtkPolyData *surface, vtkPolyData *refere
   const double radius = 5.;
   const double lrange[2] = {1., 10.};
 
+  // Crop meshes once for all three cutting planes
+  crop[0] = Crop(surface,   surface_locator,   p, 2. * radius);
+  crop[1] = Crop(reference, reference_locator, p, 2. * radius);
+
   double d[3];
   int nloops[3];
   for (int i = 2; i >= 0; --i) {
     n = 0., n[i] = 1;
     image.ImageToWorld(n);
-    cut[0] = Cut(surface,   p, n, radius);
-    cut[1] = Cut(reference, p, n, radius);
+    for (int j = 0; j < 2; ++j) {
+      cut[j] = Cut(crop[j], p, n);
+      RemoveDistantPoints(cut[j], p, radius);
+    }
     if (cut[0]->GetNumberOfPoints() > 0 && cut[1]->GetNumberOfPoints() > 0) {
       for (int j = 0; j < 2; ++j) {
         nloops[i] = 0;
@@ -1161,6 +1835,37 @@ int BestSliceView(mirtk::Image &image, vtkPolyData *surface, vtkPolyData *refere
 }
 
 
+// -----------------------------------------------------------------------------
+/// Determine best orthogonal viewing direction of each cluster in parallel
+///
+/// The links of the surface meshes must have been built before, such that
+/// the cells of the meshes are only read by the concurrent threads.
+void BestSliceViews(mirtk::Image &image, vtkPolyData *surface, vtkPolyData *reference,
+                    Array<Cluster> &clusters)
+{
+  vtkNew<vtkStaticPointLocator> surface_locator;
+  surface_locator->SetDataSet(surface);
+  surface_locator->BuildLocator();
+
+  vtkNew<vtkStaticPointLocator> reference_locator;
+  reference_locator->SetDataSet(reference);
+  reference_locator->BuildLocator();
+
+  BlockedRange range(static_cast<vtkIdType>(clusters.size()), 1);
+  RunThreads(NumberOfThreads(range.NumberOfBlocks()), [&]() {
+    vtkIdType begin, end;
+    while (range.Next(begin, end)) {
+      for (vtkIdType i = begin; i < end; ++i) {
+        Cluster &cluster = clusters[i];
+        int zdir = BestSliceView(image, surface,   surface_locator.GetPointer(),
+                                        reference, reference_locator.GetPointer(), cluster);
+        cluster.view = (zdir == 2 ? 'A' : (zdir == 1 ? 'C' : 'S'));
+      }
+    }
+  });
+}
+
+
 
 // =============================================================================
 // Main
@@ -1186,6 +1891,8 @@ int main(int argc, char *argv[])
   const char *pset_name        = nullptr;
   const char *mask_name        = nullptr;
   const char *image_name       = nullptr;
+  const char *timings_name     = nullptr;
+  const char *cache_dir        = nullptr;
   int         erode_mask       = 0;
   int         dist_percentile  = 0;
   float       min_seed_dist    = 2.f;
@@ -1334,6 +2041,26 @@ int main(int argc, char *argv[])
         exit(1);
       }
     }
+    else if (opt == "-timings") {
+      timings_name = argv[++i];
+      if (!timings_name) {
+        cerr << "Option " << opt << " requires an argument!" << endl;
+        exit(1);
+      }
+    }
+    else if (opt == "-cache") {
+      cache_dir = argv[++i];
+      if (!cache_dir) {
+        cerr << "Option " << opt << " requires an argument!" << endl;
+        exit(1);
+      }
+    }
+    else if (opt == "-threads") {
+      if (!FromString(argv[++i], g_threads) || g_threads < 0) {
+        cerr << "Option " << opt << " requires a non-negative integral number as argument!" << endl;
+        exit(1);
+      }
+    }
     else if (opt == "-v" || opt == "-verbose") {
       ++g_verbose;
     }
@@ -1361,21 +2088,24 @@ int main(int argc, char *argv[])
   }
 
   // Read input surfaces
+  PhaseTimer timer("read");
   vtkSmartPointer<vtkPolyData> surface   = Surface(surface_name);
   vtkSmartPointer<vtkPolyData> reference = Surface(reference_name);
 
   surface  ->BuildLinks();
   reference->BuildLinks();
+  timer.Stop();
 
   // Compute clusters of (mutually) distant points
   vtkSmartPointer<vtkPolyData> output;
   Array<Cluster> clusters;
+  ClusterMembers members;
   if (jointly) {
-    output = JointClusters(clusters, surface, reference, min_size, min_seed_dist,
-                           min_threshold, dist_percentile, mask_name, erode_mask);
+    output = JointClusters(clusters, members, surface, reference, min_size, min_seed_dist,
+                           min_threshold, dist_percentile, mask_name, erode_mask, cache_dir);
   } else {
-    output = FirstClusters(clusters, surface, reference, min_size, min_seed_dist,
-                           min_threshold, dist_percentile, mask_name, erode_mask);
+    output = FirstClusters(clusters, members, surface, reference, min_size, min_seed_dist,
+                           min_threshold, dist_percentile, mask_name, erode_mask, cache_dir);
   }
 
   // Sort clusters by size
@@ -1388,6 +2118,7 @@ int main(int argc, char *argv[])
   vtkFloatArray *dists = vtkFloatArray::SafeDownCast(output->GetPointData()->GetArray("Distance"));
 
   // Reduce number of clusters
+  timer.Start("reduction");
   if (max_overlap < 1.f) {
     clusters = ReduceClusters(clusters, roi_span, max_overlap);
   }
@@ -1403,13 +2134,14 @@ int main(int argc, char *argv[])
         cerr << "Discarded " << clusters.size() - n << " clusters" << endl;
       }
       for (size_t i = n; i < clusters.size(); ++i) {
-        DiscardCluster(labels, clusters[i].label);
+        DiscardCluster(labels, members, clusters[i]);
       }
       clusters.resize(n);
     }
   }
 
   // Ensure that a certain ratio of points is randomly selected
+  timer.Next("sampling");
   if (random_ratio > 0.f) {
     int k = (max_points > 0 ? max_points : static_cast<int>(clusters.size()));
     int n = static_cast<int>(round(random_ratio * k));
@@ -1420,7 +2152,7 @@ int main(int argc, char *argv[])
           cerr << "Discarded " << clusters.size() - m << " clusters" << endl;
         }
         for (size_t i = m; i < clusters.size(); ++i) {
-          DiscardCluster(labels, clusters[i].label);
+          DiscardCluster(labels, members, clusters[i]);
         }
         clusters.resize(m);
       }
@@ -1443,19 +2175,20 @@ int main(int argc, char *argv[])
   }
 
   // Relabel clusters such that label is increasing cluster ID
-  Relabel(clusters, labels);
+  Relabel(clusters, members, labels);
+  timer.Stop();
 
   // Determine best orthogonal viewing direction
   if (image_name) {
+    timer.Start("best-view");
     InitializeIOLibrary();
     UniquePtr<BaseImage> image(BaseImage::New(image_name));
-    for (auto &cluster : clusters) {
-      int i = BestSliceView(*image, surface, reference, cluster);
-      cluster.view = (i == 2 ? 'A' : (i == 1 ? 'C' : 'S'));
-    }
+    BestSliceViews(*image, surface, reference, clusters);
+    timer.Stop();
   }
 
   // Print selected clusters
+  timer.Start("output");
   if (delim != nullptr) {
     Print(surface, reference, clusters, delim);
   }
@@ -1505,6 +2238,15 @@ int main(int argc, char *argv[])
       exit(1);
     }
   }
+  timer.Stop();
+
+  // Write timings of the individual phases
+  if (timings_name) {
+    if (!WriteTimings(timings_name)) {
+      cerr << "Failed to write -timings to " << timings_name << endl;
+      exit(1);
+    }
+  }
 
   return 0;
 }
@@ -1,19 +1,36 @@
 #!/usr/bin/python
 
-"""Select regions of interest centered at surface points with minimum distance to reference surface."""
+"""Select regions of interest centered at surface points with minimum distance to reference surface.
+
+When multiple values are given for --roi-span, --overlap-span, --max-overlap-ratio,
+or --random-points-ratio, the ROIs of each combination of parameter values are
+inserted with their own CommandId and summary statistics of each combination are
+printed. With --engine python, the point distances and clusters are computed only
+once in this case. The select-rois binary is instead run for each combination,
+where only the point masks and distances are shared via a cache directory.
+"""
 
 import os
 import sys
 import csv
 import sqlite3
 import argparse
+import shutil
+import tempfile
+import itertools
 
 from subprocess import check_output
 
+from instrumentation import Stage, read_phase_timings, record_phases
+from profiling import Profiler
+
 
 # Path of select-rois binary built from C++ source file
 bindir = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', 'bin'))
 
+# Parameters of ROI reduction and sampling for which multiple values can be given
+SWEEP_PARAMETERS = ('span', 'overlap_span', 'max_overlap_ratio', 'random_points_ratio')
+
 
 def get_scan_id(db, subject_id, session_id):
     """Get ScanId corresponding to given pair of subject and session IDs."""
@@ -82,6 +99,145 @@ def insert_roi(db, scan_id, center, span, view=None, cmd_id=0, print_sql=False):
     return db.lastrowid
 
 
+def run_select_rois_binary(args, timings_name):
+    """Select centers of ROIs using select-rois binary and parse its CSV output."""
+    cmd = [
+        os.path.join(bindir, 'select-rois'),
+        args.surface, args.reference,
+        '-min-distance', args.min_seed_distance,
+        '-distance-threshold', args.min_distance_threshold,
+        '-distance-threshold-percentile', args.distance_threshold_percentile,
+        '-joined-clustering', True,
+        '-cluster-centers', args.cluster_centers,
+        '-min-cluster-size', args.min_cluster_size,
+        '-span', args.overlap_span,
+        '-max-overlap-ratio', args.max_overlap_ratio,
+        '-num-points', args.n,
+        '-max-points', args.max,
+        '-random-points-ratio', args.random_points_ratio,
+        '-stratified', True,
+        '-delim', ',',
+        '-timings', timings_name,
+        '-threads', args.threads
+    ]
+    if args.image:
+        cmd.extend(['-image', os.path.abspath(args.image)])
+    if args.mask_name:
+        cmd.extend(['-mask-name', args.mask_name, '-mask-erosion', args.mask_erosion])
+    if args.cache_dir:
+        cmd.extend(['-cache', os.path.abspath(args.cache_dir)])
+    if args.verbose > 1:
+        cmd.append('-v')
+    cmd = [str(arg) for arg in cmd]
+    if args.verbose > 1:
+        for arg in cmd:
+            arg = arg.replace('"', '\\"')
+            arg = arg.replace("'", "\\'")
+            if ' ' in arg:
+                arg = '"' + arg + '"'
+            sys.stdout.write(arg)
+            sys.stdout.write(' ')
+        sys.stdout.write('\n\n')
+    table = check_output(cmd)
+    if args.verbose > 1:
+        sys.stdout.write('\n')
+        sys.stdout.write(table)
+        sys.stdout.write('\n')
+    return list(csv.DictReader(table.splitlines()))
+
+
+class InProcessSelection(object):
+    """Select centers of ROIs in this process using the roi_selection module.
+
+    The surfaces are read and the point distances and clusters computed once, such
+    that subsequent calls for different reduction and sampling parameters only
+    repeat these steps. The best viewing direction of a cluster is also reused.
+    """
+
+    def __init__(self, args, timings):
+        from roi_selection import PhaseTimer, compute_clusters, read_surface, read_image_to_world
+        self.timings = timings
+        self.verbose = args.verbose - 1
+        timer = PhaseTimer(timings, 'read')
+        self.surface = read_surface(os.path.abspath(args.surface))
+        self.reference = read_surface(os.path.abspath(args.reference))
+        self.image_to_world = None
+        if args.image:
+            self.image_to_world = read_image_to_world(os.path.abspath(args.image))
+        timer.stop()
+        self.result = compute_clusters(
+            self.surface, self.reference,
+            mask_name=args.mask_name, mask_erosion=int(args.mask_erosion),
+            min_seed_dist=args.min_seed_distance,
+            min_threshold=args.min_distance_threshold,
+            percentile=args.distance_threshold_percentile,
+            min_size=args.min_cluster_size, joint=True,
+            cache_dir=os.path.abspath(args.cache_dir) if args.cache_dir else None,
+            timings=timings, verbose=self.verbose
+        )
+        self.views = {}
+
+    def __call__(self, args):
+        from roi_selection import best_views, roi_records, sample_rois
+        clusters = sample_rois(
+            self.result, span=args.overlap_span, max_overlap=args.max_overlap_ratio,
+            num_points=args.n, max_points=args.max, random_ratio=args.random_points_ratio,
+            stratified=True, timings=self.timings, verbose=self.verbose
+        )
+        if self.image_to_world is not None:
+            missing = []
+            for cluster in clusters:
+                key = (cluster.seed, cluster.size)
+                if key in self.views:
+                    cluster.view = self.views[key]
+                else:
+                    missing.append(cluster)
+            best_views(missing, self.image_to_world, self.surface, self.reference, timings=self.timings)
+            for cluster in missing:
+                self.views[(cluster.seed, cluster.size)] = cluster.view
+        return roi_records(clusters, self.surface, self.reference, timings=self.timings)
+
+
+def sweep_arguments(args):
+    """Arguments for each combination of the given reduction and sampling parameter values."""
+    values = []
+    for name in SWEEP_PARAMETERS:
+        value = getattr(args, name)
+        values.append(value if isinstance(value, list) else [value])
+    for combination in itertools.product(*values):
+        sweep_args = argparse.Namespace(**vars(args))
+        for name, value in zip(SWEEP_PARAMETERS, combination):
+            setattr(sweep_args, name, value)
+        if sweep_args.overlap_span <= 0.:
+            sweep_args.overlap_span = sweep_args.span
+        yield sweep_args
+
+
+def add_phase_timings(timings, other):
+    """Accumulate (phase, wall time, CPU time) tuples of phases with same name."""
+    for phase, wall_time, cpu_time in other:
+        for i, timing in enumerate(timings):
+            if timing[0] == phase:
+                timings[i] = (phase, timing[1] + wall_time, timing[2] + cpu_time)
+                break
+        else:
+            timings.append((phase, wall_time, cpu_time))
+    return timings
+
+
+def summarize_rois(rows):
+    """Summary statistics of selected ROIs."""
+    dists = [float(row['AvgDistance']) for row in rows if int(row['ClusterSize']) > 1]
+    return dict(
+        NumROIs=len(rows),
+        NumClusters=len(dists),
+        NumRandom=len(rows) - len(dists),
+        MinDistance=min(dists) if dists else 0.,
+        AvgDistance=sum(dists) / len(dists) if dists else 0.,
+        MaxDistance=max(dists) if dists else 0.
+    )
+
+
 if __name__ == '__main__':
     # parse arguments
     parser = argparse.ArgumentParser(description=__doc__)
@@ -111,108 +267,135 @@ if __name__ == '__main__':
                         help="Minimum number of points per surface cluster")
     parser.add_argument('--cluster-centers', action='store_true',
                         help="Use cluster centroids as ROI center points")
-    parser.add_argument('--roi-span', '--roi-size', '--span', dest='span', default=40., type=float,
+    parser.add_argument('--roi-span', '--roi-size', '--span', dest='span', default=40., type=float, nargs='+',
                         help="Length of each side of a ROI in mm")
-    parser.add_argument('--overlap-span', default=0., type=float,
+    parser.add_argument('--overlap-span', default=0., type=float, nargs='+',
                         help="Length of each bounding box side used for overlap check in mm")
-    parser.add_argument('--max-overlap-ratio', default=.99, type=float,
+    parser.add_argument('--max-overlap-ratio', default=.99, type=float, nargs='+',
                         help="Maximum overlap between ROIs at cluster centers")
-    parser.add_argument('--random-points-ratio', default=0, type=float,
+    parser.add_argument('--random-points-ratio', default=0, type=float, nargs='+',
                         help="Ratio of randomly sampled surface points")
     parser.add_argument('-n', default=0, type=int,
                         help="Number of ROIs to select")
     parser.add_argument('--max', default=0, type=int,
                         help="Maximum number of ROIs to select")
+    parser.add_argument('--cache-dir',
+                        help="Directory of cached point masks and distances, reused when only clustering parameters change")
+    parser.add_argument('--threads', default=0, type=int,
+                        help="Number of threads used by select-rois binary, all available cores if zero")
+    parser.add_argument('--engine', choices=('binary', 'python'), default='binary',
+                        help="Use select-rois binary or in-process NumPy/SciPy implementation")
     parser.add_argument('--print-sql', action='store_true',
                         help="Do not insert regions into database, just print SQL statements")
+    parser.add_argument('--profile', metavar='DIR',
+                        help="Write cProfile statistics and phase timings of ROI selection to this directory")
     parser.add_argument('-v', '--verbose', default=0, action='count',
                         help="Verbosity of output messages")
     args = parser.parse_args()
-    if args.overlap_span <= 0.:
-        args.overlap_span = args.span
     if args.n > 0 and args.max == 0:
         args.max = args.n
+    # when multiple values of reduction and sampling parameters are given, the
+    # ROIs of each combination are recorded with their own CommandId
+    sweep = list(sweep_arguments(args))
+    cache_dir = None
+    if len(sweep) > 1 and args.engine == 'binary' and not args.cache_dir:
+        cache_dir = tempfile.mkdtemp(prefix='select-rois-')
+        for sweep_args in sweep:
+            sweep_args.cache_dir = cache_dir
+    elif args.cache_dir and not os.path.isdir(args.cache_dir):
+        os.makedirs(args.cache_dir)
+    profiler = None
+    if args.profile:
+        profiler = Profiler(args.profile, 'select-rois', args.subject, args.session).start()
     # open database
     db = sqlite3.connect(args.database)
     try:
         # get foreign keys from database
         scan_id = get_scan_id(db, args.subject, args.session)
-        cmd_id = get_or_insert_command_id(
-            db, name=os.path.basename(__file__), params=options(args, exclude=[
-                'database', 'output', 'subject', 'session', 'print_sql', 'verbose'
-            ]),
-            print_sql=args.print_sql
-        )
         # select centers of ROIs
-        cmd = [
-            os.path.join(bindir, 'select-rois'),
-            args.surface, args.reference,
-            '-min-distance', args.min_seed_distance,
-            '-distance-threshold', args.min_distance_threshold,
-            '-distance-threshold-percentile', args.distance_threshold_percentile,
-            '-joined-clustering', True,
-            '-cluster-centers', args.cluster_centers,
-            '-min-cluster-size', args.min_cluster_size,
-            '-span', args.overlap_span,
-            '-max-overlap-ratio', args.max_overlap_ratio,
-            '-num-points', args.n,
-            '-max-points', args.max,
-            '-random-points-ratio', args.random_points_ratio,
-            '-stratified', True,
-            '-delim', ','
-        ]
-        if args.image:
-            cmd.extend(['-image', os.path.abspath(args.image)])
-        if args.mask_name:
-            cmd.extend(['-mask-name', args.mask_name, '-mask-erosion', args.mask_erosion])
-        if args.verbose > 1:
-            cmd.append('-v')
-        cmd = [str(arg) for arg in cmd]
-        if args.verbose > 1:
-            for arg in cmd:
-                arg = arg.replace('"', '\\"')
-                arg = arg.replace("'", "\\'")
-                if ' ' in arg:
-                    arg = '"' + arg + '"'
-                sys.stdout.write(arg)
-                sys.stdout.write(' ')
-            sys.stdout.write('\n\n')
-        table = check_output(cmd)
-        if args.verbose > 1:
-            sys.stdout.write('\n')
-            sys.stdout.write(table)
-            sys.stdout.write('\n')
-        reader = csv.DictReader(table.splitlines())
-        points = []
-        views = []
-        nrandom = 0
-        for row in reader:
-            if args.cluster_centers:
-                x = float(row['CenterX'])
-                y = float(row['CenterY'])
-                z = float(row['CenterZ'])
+        stage = Stage('select-rois', scan_id=scan_id).start()
+        timings = []
+        selection = None
+        if args.engine == 'python':
+            selection = InProcessSelection(args, timings)
+        summaries = []
+        exclude = ['database', 'output', 'subject', 'session', 'print_sql', 'profile', 'cache_dir', 'threads', 'verbose']
+        # the in-process engine may select different ROIs, e.g., due to its own random number
+        # generator, but parameters of the default engine must match previously recorded commands
+        if args.engine == 'binary':
+            exclude.append('engine')
+        for sweep_args in sweep:
+            cmd_id = get_or_insert_command_id(
+                db, name=os.path.basename(__file__), params=options(sweep_args, exclude=exclude),
+                print_sql=args.print_sql
+            )
+            if selection:
+                rows = selection(sweep_args)
             else:
-                x = float(row['SeedX'])
-                y = float(row['SeedY'])
-                z = float(row['SeedZ'])
-            points.append((x, y, z))
+                fd, timings_name = tempfile.mkstemp(prefix='select-rois-', suffix='.csv')
+                os.close(fd)
+                try:
+                    rows = run_select_rois_binary(sweep_args, timings_name)
+                    add_phase_timings(timings, read_phase_timings(timings_name))
+                finally:
+                    if os.path.isfile(timings_name):
+                        os.remove(timings_name)
+            points = []
+            views = []
+            nrandom = 0
+            for row in rows:
+                if args.cluster_centers:
+                    x = float(row['CenterX'])
+                    y = float(row['CenterY'])
+                    z = float(row['CenterZ'])
+                else:
+                    x = float(row['SeedX'])
+                    y = float(row['SeedY'])
+                    z = float(row['SeedZ'])
+                points.append((x, y, z))
+                try:
+                    views.append(row['View'])
+                except KeyError:
+                    views.append(None)
+                if int(row['ClusterSize']) <= 1:
+                    nrandom += 1
+            if args.verbose > 0:
+                print("Selected {} regions of interest, {} randomly".format(len(points), nrandom))
+            # write selected regions of interest to database
+            cur = db.cursor()
             try:
-                views.append(row['View'])
-            except KeyError:
-                views.append(None)
-            if int(row['ClusterSize']) <= 1:
-                nrandom += 1
-        if args.verbose > 0:
-            print("Selected {} regions of interest, {} randomly".format(len(points), nrandom))
-        # write selected regions of interest to database
-        cur = db.cursor()
-        try:
-            for point, view in zip(points, views):
-                insert_roi(cur, scan_id=scan_id,
-                           center=point, span=args.span, view=view,
-                           cmd_id=cmd_id, print_sql=args.print_sql)
-            db.commit()
-        finally:
-            cur.close()
+                for point, view in zip(points, views):
+                    insert_roi(cur, scan_id=scan_id,
+                               center=point, span=sweep_args.span, view=view,
+                               cmd_id=cmd_id, print_sql=args.print_sql)
+            finally:
+                cur.close()
+            summary = summarize_rois(rows)
+            summary['CommandId'] = cmd_id
+            for name in SWEEP_PARAMETERS:
+                summary[name] = getattr(sweep_args, name)
+            summaries.append(summary)
+        if profiler:
+            with open(profiler.path('timings.csv'), 'w') as f:
+                f.write('Phase,WallTime,CPUTime\n')
+                for timing in timings:
+                    f.write('{},{},{}\n'.format(*timing))
+        if not args.print_sql:
+            stage.record(db)
+            record_phases(db, stage.name, timings, scan_id=scan_id)
+        db.commit()
+        # print summary of each parameter combination
+        if len(sweep) > 1:
+            print("{:>9} {:>8} {:>8} {:>8} {:>8} {:>7} {:>8} {:>7} {:>8} {:>8} {:>8}".format(
+                'CommandId', 'Span', 'Overlap', 'MaxRatio', 'Random', 'ROIs', 'Clusters', 'Randoms',
+                'MinDist', 'AvgDist', 'MaxDist'))
+            for summary in summaries:
+                print("{CommandId:>9} {span:>8.1f} {overlap_span:>8.1f} {max_overlap_ratio:>8.2f}"
+                      " {random_points_ratio:>8.2f} {NumROIs:>7d} {NumClusters:>8d} {NumRandom:>7d}"
+                      " {MinDistance:>8.2f} {AvgDistance:>8.2f} {MaxDistance:>8.2f}".format(**summary))
     finally:
         db.close()
+        if cache_dir:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+        if profiler:
+            profiler.stop()
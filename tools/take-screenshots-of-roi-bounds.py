@@ -20,6 +20,9 @@ from vtk import (vtkImageData, vtkPolyData, vtkCubeSource,
 
 from mirtk.rendering.screenshots import take_orthogonal_screenshots, range_to_level_window
 
+from instrumentation import Stage
+from profiling import Profiler
+
 
 def rgb(r, g, b):
     """Convert RGB byte value in [0, 255] to float in [0, 1]."""
@@ -50,6 +53,14 @@ def partial_format(format_string, **kwargs):
     return formatter.vformat(format_string, (), mapping)
 
 
+def get_stage_name(args):
+    """Get name of pipeline stage used to record resources in PipelineRuns table."""
+    name = os.path.splitext(os.path.basename(__file__))[0]
+    if args.prefix:
+        name += ':' + os.path.basename(os.path.normpath(args.prefix))
+    return name
+
+
 def get_scan_id(db, subject_id, session_id):
     """Get ScanId corresponding to given pair of subject and session IDs."""
     res = db.execute("SELECT ScanId FROM Scans WHERE SubjectId = :subject_id AND SessionId = :session_id",
@@ -189,7 +200,24 @@ def insert_screenshots(db, roi_id, base, screenshots, overlays=[], colors=[], ve
     return screenshot_ids
 
 
+def insert_comparison_sets(db, roi_id):
+    """Update comparison sets of ROI screenshots in database."""
+    cur = db.cursor()
+    try:
+        cur.execute("DELETE FROM ComparisonSets WHERE ROI_Id = :roi", {'roi': roi_id})
+        cur.execute("""
+            INSERT INTO ComparisonSets (ScreenshotId, ROI_Id, ViewId, ROIScreenshotId,
+                                        OverlayId1, Color1, ScreenshotId1,
+                                        OverlayId2, Color2, ScreenshotId2)
+            SELECT * FROM ComparisonSetScreenshots WHERE ROI_Id = :roi
+            """, {'roi': roi_id})
+    finally:
+        cur.close()
+    db.commit()
+
+
 def take_screenshots_of_single_roi(args):
+    stage = Stage(get_stage_name(args), roi_id=args.roi).start()
     color = rgb(*args.color)
     args.database = os.path.abspath(args.database)
     base_dir = os.path.dirname(args.database)
@@ -206,6 +234,7 @@ def take_screenshots_of_single_roi(args):
         scan_id = args.scan
     else:
         scan_id = get_scan_id(db, args.subject, args.session)
+    stage.scan_id = scan_id
 
     if args.prefix:
         prefix = os.path.abspath(args.prefix)
@@ -258,6 +287,10 @@ def take_screenshots_of_single_roi(args):
             raise(e)
         if args.verbose > 0:
             print("Saved screenshots of bounding boxes of ROI {roi}".format(roi=args.roi))
+        insert_comparison_sets(db, args.roi)
+        stage.add_files([screenshot[0] for screenshot in screenshots if screenshot[5]])
+        stage.record(db)
+        db.commit()
     finally:
         db.close()
 
@@ -269,6 +302,7 @@ def call_this_script_for_each_roi(args):
         rows = db.execute("SELECT ROI_Id FROM ROIs WHERE ScanId = {}".format(scan_id)).fetchall()
     finally:
         db.close()
+    stage = Stage(get_stage_name(args), scan_id=scan_id).start()
     for row in rows:
         argv = [
             os.path.abspath(__file__),
@@ -299,6 +333,8 @@ def call_this_script_for_each_roi(args):
             argv.extend(['--size', args.size[0], args.size[1]])
         if args.use_all_colors:
             argv.append('--use-all-colors')
+        if args.profile:
+            argv.extend(['--profile', os.path.abspath(args.profile)])
         for i in range(args.verbose):
             argv.append('-v')
         argv = [str(arg) for arg in argv]
@@ -307,6 +343,12 @@ def call_this_script_for_each_roi(args):
         if args.verbose > 2:
             print(' '.join(['"' + arg + '"' if ' ' in arg else arg for arg in argv]))
         subprocess.check_call(argv)
+    db = sqlite3.connect(args.database)
+    try:
+        stage.record(db)
+        db.commit()
+    finally:
+        db.close()
 
 
 if __name__ == '__main__':
@@ -329,9 +371,18 @@ if __name__ == '__main__':
     parser.add_argument('--color', default=(247, 32, 57), nargs=3, type=int, help="Color of bounding box")
     parser.add_argument('--line-width', default=4, type=int, help="Width of bounding box outline")
     parser.add_argument('--use-all-colors', action='store_true', help="Use all available colors for comparison, not only two")
+    parser.add_argument('--profile', metavar='DIR', help="Write cProfile statistics and VTK timings of each process to this directory")
     parser.add_argument('-v', '--verbose', default=0, action='count', help="Verbosity of output messages")
     args = parser.parse_args()
-    if args.roi > 0:
-        take_screenshots_of_single_roi(args)
-    else:
-        call_this_script_for_each_roi(args)
+    profiler = None
+    if args.profile:
+        profiler = Profiler(args.profile, get_stage_name(args), args.subject, args.session,
+                            roi=args.roi, scan=args.scan).start()
+    try:
+        if args.roi > 0:
+            take_screenshots_of_single_roi(args)
+        else:
+            call_this_script_for_each_roi(args)
+    finally:
+        if profiler:
+            profiler.stop()
@@ -20,6 +20,9 @@ from vtk import (vtkImageData, vtkPolyData, vtkMatrix4x4, vtkMatrixToLinearTrans
 
 from mirtk.rendering.screenshots import take_orthogonal_screenshots, range_to_level_window
 
+from instrumentation import Stage
+from profiling import Profiler
+
 
 def rgb(r, g, b):
     """Convert RGB byte value in [0, 255] to float in [0, 1]."""
@@ -77,6 +80,14 @@ def partial_format(format_string, **kwargs):
     return formatter.vformat(format_string, (), mapping)
 
 
+def get_stage_name(args):
+    """Get name of pipeline stage used to record resources in PipelineRuns table."""
+    name = os.path.splitext(os.path.basename(__file__))[0]
+    if args.prefix:
+        name += ':' + os.path.basename(os.path.normpath(args.prefix))
+    return name
+
+
 def get_scan_id(db, subject_id, session_id):
     """Get ScanId corresponding to given pair of subject and session IDs."""
     res = db.execute("SELECT ScanId FROM Scans WHERE SubjectId = :subject_id AND SessionId = :session_id",
@@ -199,7 +210,26 @@ def insert_screenshots(db, roi_id, base, screenshots, overlays=[], colors=[], ve
     return screenshot_ids
 
 
+def insert_comparison_sets(db, roi_id):
+    """Update comparison sets of ROI screenshots in database."""
+    cur = db.cursor()
+    try:
+        cur.execute("DELETE FROM ComparisonSets WHERE ROI_Id = :roi", {'roi': roi_id})
+        cur.execute("""
+            INSERT INTO ComparisonSets (ScreenshotId, ROI_Id, ViewId, ROIScreenshotId,
+                                        OverlayId1, Color1, ScreenshotId1,
+                                        OverlayId2, Color2, ScreenshotId2)
+            SELECT * FROM ComparisonSetScreenshots WHERE ROI_Id = :roi
+            """, {'roi': roi_id})
+    finally:
+        cur.close()
+    db.commit()
+
+
 def take_screenshots_of_single_roi(args):
+    stage = Stage(get_stage_name(args), roi_id=args.roi).start()
+    written = []
+
     # arguments
     args.database = os.path.abspath(args.database)
     base_dir = os.path.dirname(args.database)
@@ -290,6 +320,7 @@ def take_screenshots_of_single_roi(args):
                     center=center, length=span, offsets=offsets,
                     polydata=[x[2] for x in overlays], colors=colors, line_width=args.line_width,
                     size=args.size, overwrite=False)
+                written.extend([screenshot[0] for screenshot in screenshots if screenshot[5]])
                 insert_screenshots(db, roi_id=args.roi, base=base_dir, screenshots=screenshots,
                                    overlays=[x[0] for x in overlays], colors=colors, verbose=(args.verbose - 1))
             except BaseException as e:
@@ -324,6 +355,7 @@ def take_screenshots_of_single_roi(args):
                         center=center, length=span, offsets=offsets,
                         polydata=[overlays[i][2]], colors=[colors[i]], line_width=line_width,
                         size=args.size, overwrite=False)
+                    written.extend([screenshot[0] for screenshot in screenshots if screenshot[5]])
                     insert_screenshots(db, roi_id=args.roi, base=base_dir, screenshots=screenshots,
                                        overlays=[overlays[i][0]], colors=[colors[i]], verbose=(args.verbose - 1))
             except BaseException as e:
@@ -336,6 +368,16 @@ def take_screenshots_of_single_roi(args):
                 raise(e)
             if args.verbose > 0:
                 print("Saved screenshots of orthogonal slices of ROI volume {} with all overlays".format(args.roi))
+
+        # link screenshots shown together in comparison task
+        if len(overlays) > 1 and (args.all_overlays or args.individual_overlays):
+            insert_comparison_sets(db, args.roi)
+
+        # record resources used to take screenshots of this ROI
+        stage.scan_id = scan_id
+        stage.add_files(written)
+        stage.record(db)
+        db.commit()
     finally:
         db.close()
 
@@ -347,6 +389,7 @@ def call_this_script_for_each_roi(args):
         rows = db.execute("SELECT ROI_Id FROM ROIs WHERE ScanId = {}".format(scan_id)).fetchall()
     finally:
         db.close()
+    stage = Stage(get_stage_name(args), scan_id=scan_id).start()
     for row in rows:
         argv = [
             os.path.abspath(__file__),
@@ -398,6 +441,8 @@ def call_this_script_for_each_roi(args):
             argv.append('--all-overlays')
         if args.individual_overlays:
             argv.append('--individual-overlays')
+        if args.profile:
+            argv.extend(['--profile', os.path.abspath(args.profile)])
         for i in range(args.verbose):
             argv.append('-v')
         argv = [str(arg) for arg in argv]
@@ -406,6 +451,12 @@ def call_this_script_for_each_roi(args):
         if args.verbose > 2:
             print(' '.join(['"' + arg + '"' if ' ' in arg else arg for arg in argv]))
         subprocess.check_call(argv)
+    db = sqlite3.connect(args.database)
+    try:
+        stage.record(db)
+        db.commit()
+    finally:
+        db.close()
 
 
 if __name__ == '__main__':
@@ -452,6 +503,8 @@ if __name__ == '__main__':
                         help="Take screenshots with all overlays")
     parser.add_argument('--individual-overlays', action='store_true',
                         help="Take screenshots with individual overlays")
+    parser.add_argument('--profile', metavar='DIR',
+                        help="Write cProfile statistics and VTK timings of each process to this directory")
     parser.add_argument('-v', '--verbose', default=0, action='count',
                         help="Verbosity of output messages")
     args = parser.parse_args()
@@ -460,7 +513,15 @@ if __name__ == '__main__':
         args.all_overlays = True
         args.individual_overlays = True
 
-    if args.roi > 0:
-        take_screenshots_of_single_roi(args)
-    else:
-        call_this_script_for_each_roi(args)
+    profiler = None
+    if args.profile:
+        profiler = Profiler(args.profile, get_stage_name(args), args.subject, args.session,
+                            roi=args.roi, scan=args.scan).start()
+    try:
+        if args.roi > 0:
+            take_screenshots_of_single_roi(args)
+        else:
+            call_this_script_for_each_roi(args)
+    finally:
+        if profiler:
+            profiler.stop()